@@ -7,6 +7,7 @@ from io import BytesIO
 from PIL import Image
 import toml
 import os
+import time
 from typing import Optional, Dict, Any, List
 
 # Try to import openai, but make it optional
@@ -17,20 +18,33 @@ except ImportError:
     openai = None
 
 # Import modules
-from src.utils.ingredient_parser import parse_ingredients, create_lookup_table, check_halal_status
-from src.utils.data_handler import load_ingredients_data
-from src.api.openai_handler import extract_ingredients_from_image, query_openai_about_ingredients
+from src.utils.analysis import analyze_image, analyze_ingredients_text, explain_deferred
+from src.utils.call_planner import DETAIL_FULL
+from src.utils.kb_reloader import get_kb_reloader
+from src.utils.knowledge_base import KnowledgeBase
+from src.utils.session_memory import format_bytes, session_memory_report
+from src.utils.chat_turns import ChatTurnLog, PENDING
+from src.utils.results_sink import analysis_record, export_summary, get_results_sink
+from src.utils.history_store import get_history_store
+from src.utils.image_hash import get_image_index
+from src.utils.ingredient_classifier import get_local_classifier
+from src.utils.local_ocr import ocr_stats
 from src.ui.components import (
     setup_page, display_halal_status, display_unknown_ingredients, 
     display_ingredients_text, create_export_button, display_custom_warning,
     display_footer, display_ingredients_comparison
 )
-from src.api.llama_index_handler import load_index_and_context, get_chat_engine
+from src.ui.app_resources import QUERY_ENGINE, get_app_warmup, get_shared_query_engine
+from src.api.llama_index_handler import chat_with_rate_limit, SessionChatEngine, format_turn_report
+from src.utils.context_packer import format_pack_report
+from src.utils.warmup import PENDING as WARMUP_PENDING, WARMING, Warmup
 from config.settings import (
     APP_TITLE, APP_CAPTION, APP_DISCLAIMER, BACKGROUND_IMAGE,
-    DEFAULT_MODEL, VISION_MODEL, CONTEXT_WINDOW, TEMPERATURE, MAX_TOKENS,
-    OPENAI_API_ENDPOINT, INGREDIENTS_DATASET, SYSTEM_PROMPT,
-    STORAGE_DIR, load_api_config
+    VISION_MODEL, CONTEXT_WINDOW, MAX_TOKENS,
+    OPENAI_API_ENDPOINT, INGREDIENTS_DATASET, MAX_CHAT_HISTORY,
+    CHAT_MEMORY_TOKENS, CHAT_SUMMARY_WORDS, CHAT_SKIP_STANDALONE_CONDENSE, CHAT_SPECULATIVE_RETRIEVAL,
+    HISTORY_INSTANT_ANSWERS, IMAGE_REUSE_EXTRACTIONS, LOCAL_OCR_ENABLED, LOCAL_CLASSIFIER_ENABLED,
+    VISION_STRUCTURED_OUTPUT, load_api_config
 )
 
 
@@ -59,12 +73,144 @@ def initialize_api_key() -> bool:
         return False
 
 
-def process_image(image_bytes: bytes) -> Dict[str, Any]:
+def get_knowledge_base(dataset_path: str) -> KnowledgeBase:
+    """
+    Return the current version of the ingredients knowledge base, shared by all sessions.
+    
+    The dataset is loaded once per process and reloaded in the background
+    when it changes; each script run keeps the version it started with.
+    
+    Args:
+        dataset_path (str): Path to the ingredients dataset
+        
+    Returns:
+        KnowledgeBase: Shared, versioned knowledge base
+    """
+    return get_kb_reloader(dataset_path).current()
+
+
+def get_session_chat_engine() -> SessionChatEngine:
+    """
+    Return this session's chat engine, creating it on the session's first question.
+    
+    Returns:
+        SessionChatEngine: Chat engine with this session's conversation memory
+    """
+    if "chat_engine" not in st.session_state:
+        query_engine, llm = get_shared_query_engine()
+        st.session_state.chat_engine = SessionChatEngine(
+            query_engine, llm, memory_tokens=CHAT_MEMORY_TOKENS, summary_words=CHAT_SUMMARY_WORDS,
+            skip_standalone=CHAT_SKIP_STANDALONE_CONDENSE, speculative_retrieval=CHAT_SPECULATIVE_RETRIEVAL
+        )
+    return st.session_state.chat_engine
+
+
+def submit_question() -> None:
+    """
+    Record the question typed in the chat input as a new turn.
+    
+    Runs as the input's on_change callback, i.e. once per submission rather
+    than on every rerun, and clears the input afterwards.
+    """
+    st.session_state.chat_turns.submit(st.session_state.text_input)
+    st.session_state.text_input = ""
+
+
+def explain_deferred_unknowns() -> None:
+    """
+    Fetch the explanation of unknown ingredients that was deferred because
+    the dataset had already decided the product.
+
+    Runs as the button's on_click callback; the stored results are shown
+    again on the rerun it triggers.
+    """
+    results = st.session_state.get("analysis_results")
+    if results:
+        try:
+            explain_deferred(results, openai.api_key, OPENAI_API_ENDPOINT)
+        except Exception as e:
+            st.error(f"Error explaining unknown ingredients: {e}")
+    st.session_state.show_previous_results = True
+
+
+def wait_for_chat(warmup: Warmup) -> None:
+    """
+    Wait for the retrieval index to finish warming up, showing how long it's been.
+
+    The page above the chat has already been drawn and stays usable; any
+    interaction reruns the script and the question is answered on a later run.
+
+    Args:
+        warmup (Warmup): The app's warm-up
+    """
+    placeholder = st.empty()
+    started = time.monotonic()
+    while not warmup.wait(QUERY_ENGINE, timeout=1.0) and warmup.state(QUERY_ENGINE) in (WARMUP_PENDING, WARMING):
+        placeholder.info(
+            f"The ingredient index is still loading ({time.monotonic() - started:.0f} s); this takes 1-2 minutes "
+            "after a restart. You can analyse products meanwhile, and your question will be answered when it's ready."
+        )
+    placeholder.empty()
+
+
+def answer_turn(turn: Dict[str, Any]) -> None:
+    """
+    Execute a pending chat turn once and store its answer on the turn.
+    
+    Args:
+        turn (Dict[str, Any]): Pending turn from the session's ChatTurnLog
+    """
+    chat_turns = st.session_state.chat_turns
+    warmup = get_app_warmup()
+    with st.chat_message("assistant"):
+        try:
+            if warmup is not None and not warmup.is_ready(QUERY_ENGINE):
+                wait_for_chat(warmup)
+            with st.spinner("Thinking..."):
+                chat_engine = get_session_chat_engine()
+                response = chat_with_rate_limit(chat_engine, turn["question"], CONTEXT_WINDOW)
+                notes = [format_turn_report(chat_engine.last_turn_report)]
+                if chat_engine.context_packing is not None:
+                    notes.append(format_pack_report(chat_engine.context_packing.last_report))
+                chat_turns.complete(turn["id"], str(response.response), notes)
+        except ImportError:
+            display_custom_warning("LlamaIndex is not installed. Please install it using: pip install llama-index", "Module Missing")
+            chat_turns.fail(
+                turn["id"],
+                "I'm sorry, but I can't access the knowledge base right now. Please make sure LlamaIndex is installed."
+            )
+        except Exception as e:
+            display_custom_warning(f"Error in chat: {e}", "Error")
+            chat_turns.fail(turn["id"], "I'm sorry, but I encountered an error. Please try again later.")
+        st.write(turn["answer"])
+        for note in turn["notes"]:
+            st.caption(note)
+
+
+def previous_lookup(kb: KnowledgeBase) -> Optional[Any]:
+    """
+    Lookup of earlier results for the same ingredients and dataset version.
+
+    Args:
+        kb (KnowledgeBase): Knowledge base in use
+
+    Returns:
+        Optional[Any]: Callable for the analysis pipeline, or None if instant
+            answers are disabled
+    """
+    if not HISTORY_INSTANT_ANSWERS:
+        return None
+    history = get_history_store()
+    return lambda ingredients_text: history.find_previous(ingredients_text, kb.version)
+
+
+def process_image(image_bytes: bytes, kb: KnowledgeBase) -> Dict[str, Any]:
     """
     Process an uploaded image to extract and analyze ingredients.
     
     Args:
         image_bytes (bytes): Raw image bytes
+        kb (KnowledgeBase): Shared knowledge base to classify against
         
     Returns:
         Dict[str, Any]: Results of the analysis
@@ -74,44 +220,22 @@ def process_image(image_bytes: bytes) -> Dict[str, Any]:
         return {}
         
     try:
-        # Extract ingredients from image using GPT-4 Vision
-        ingredients_text = extract_ingredients_from_image(
+        # Extract ingredients with GPT-4 Vision, classify them and query OpenAI about unknowns
+        results = analyze_image(
             image_bytes, 
+            kb.lookup_table, 
             openai.api_key, 
             OPENAI_API_ENDPOINT, 
             VISION_MODEL, 
-            MAX_TOKENS
+            MAX_TOKENS,
+            previous_lookup=previous_lookup(kb),
+            image_index=get_image_index() if IMAGE_REUSE_EXTRACTIONS else None,
+            local_ocr=LOCAL_OCR_ENABLED,
+            classifier=get_local_classifier() if LOCAL_CLASSIFIER_ENABLED else None,
+            structured=VISION_STRUCTURED_OUTPUT
         )
-        
-        # Parse the ingredients text
-        ingredients_list = parse_ingredients(ingredients_text)
-        
-        # Load ingredients data
-        df = load_ingredients_data(INGREDIENTS_DATASET)
-        
-        # Create lookup table
-        lookup_table = create_lookup_table(df)
-        
-        # Check halal status
-        product_status, unknown_ingredients = check_halal_status(ingredients_list, lookup_table)
-        
-        # If there are unknown ingredients, query OpenAI
-        halal_status_response = None
-        if unknown_ingredients and openai is not None:
-            halal_status_response = query_openai_about_ingredients(
-                unknown_ingredients, 
-                openai.api_key, 
-                OPENAI_API_ENDPOINT
-            )
-        
-        return {
-            "ingredients_text": ingredients_text,
-            "ingredients_list": ingredients_list,
-            "product_status": product_status,
-            "unknown_ingredients": unknown_ingredients,
-            "halal_status_response": halal_status_response,
-            "lookup_table": lookup_table  # Include the lookup table for comparison
-        }
+        results["kb_version"] = kb.version  # Reference the shared table instead of copying it
+        return results
     except Exception as e:
         st.error(f"Error processing image: {e}")
         return {}
@@ -121,6 +245,8 @@ def main():
     """Main application function."""
     # Initialize API key and get status
     openai_available = initialize_api_key()
+    # Starts loading the knowledge base and chat index in the background, unless already started
+    warmup = get_app_warmup()
     
     # Setup the page (only title and background)
     setup_page(APP_TITLE, APP_CAPTION, APP_DISCLAIMER, BACKGROUND_IMAGE)
@@ -205,11 +331,13 @@ def main():
         """, unsafe_allow_html=True)
 
     # Session state initialization
-    if "messages" not in st.session_state:
-        st.session_state.messages = []  # Remove welcome message from chat history as it's displayed separately
+    if "chat_turns" not in st.session_state:
+        st.session_state.chat_turns = ChatTurnLog(limit=MAX_CHAT_HISTORY // 2)
         
     if "analysis_results" not in st.session_state:
         st.session_state.analysis_results = None
+
+    kb = get_knowledge_base(str(INGREDIENTS_DATASET))
     
     # User input section
 
@@ -273,6 +401,12 @@ def main():
             """
         )
 
+    product_name = st.text_input(
+        "Product name (optional)",
+        placeholder="e.g., Brand chocolate wafer 150g",
+        help="Stored with the analysis so past results can be searched by product"
+    )
+
     # Optional: image enhancement toggle (only when uploading)
     enhance_image = False
     if input_method == "Upload Image" and uploaded_image is not None:
@@ -286,6 +420,10 @@ def main():
 
     # === ANALYSIS FLOW (unchanged logic, just gated by the button) ===
     analysis_results = None
+    # Results shown again after a deferred explanation was fetched are not recorded twice
+    showing_previous = not run_analysis and st.session_state.pop("show_previous_results", False)
+    if showing_previous:
+        analysis_results = st.session_state.get("analysis_results")
 
     if run_analysis:
         if input_method == "Upload Image" and uploaded_image and openai_available:
@@ -300,105 +438,127 @@ def main():
                 buf = BytesIO(); enhanced_image.save(buf, format="JPEG"); image_bytes = buf.getvalue()
 
             with st.spinner("Analyzing image..."):
-                analysis_results = process_image(image_bytes)
+                analysis_results = process_image(image_bytes, kb)
                 st.session_state.analysis_results = analysis_results
 
         elif input_method == "Paste Ingredient List" and manual_ingredients and openai_available:
             with st.spinner("Analyzing ingredients..."):
-                ingredients_list = parse_ingredients(manual_ingredients)
-                df = load_ingredients_data(INGREDIENTS_DATASET)
-                lookup_table = create_lookup_table(df)
-                product_status, unknown_ingredients = check_halal_status(ingredients_list, lookup_table)
-
-                halal_status_response = None
-                if unknown_ingredients and openai is not None:
-                    halal_status_response = query_openai_about_ingredients(
-                        unknown_ingredients, openai.api_key, OPENAI_API_ENDPOINT
-                    )
-
-                analysis_results = {
-                    "ingredients_text": manual_ingredients,
-                    "ingredients_list": ingredients_list,
-                    "product_status": product_status,
-                    "unknown_ingredients": unknown_ingredients,
-                    "halal_status_response": halal_status_response,
-                    "lookup_table": lookup_table
-                }
+                analysis_results = analyze_ingredients_text(
+                    manual_ingredients, kb.lookup_table, openai.api_key, OPENAI_API_ENDPOINT,
+                    detail=DETAIL_FULL, previous_lookup=previous_lookup(kb),
+                    classifier=get_local_classifier() if LOCAL_CLASSIFIER_ENABLED else None
+                )
+                analysis_results["kb_version"] = kb.version
                 st.session_state.analysis_results = analysis_results
 
-        # --- RESULTS RENDERING (reuse your components) ---
-        if analysis_results:
-            with results_container:
-                display_ingredients_text(analysis_results.get("ingredients_text", ""))
-
-                ingredients_list = analysis_results.get("ingredients_list", [])
-                lookup_table = analysis_results.get("lookup_table", {})
-                if not lookup_table:
-                    df = load_ingredients_data(INGREDIENTS_DATASET)
-                    lookup_table = create_lookup_table(df)
-
-                if ingredients_list:
-                    display_ingredients_comparison(ingredients_list, lookup_table)
-
-                display_halal_status(analysis_results.get("product_status", "Unknown"))
-
-                unknown_ingredients = analysis_results.get("unknown_ingredients", [])
-                if unknown_ingredients:
-                    display_unknown_ingredients(unknown_ingredients)
-                    halal_status_response = analysis_results.get("halal_status_response")
-                    if halal_status_response:
-                        st.write("Analysis of unknown ingredients:")
-                        st.write(halal_status_response)
-                    else:
-                        display_custom_warning("Detailed analysis of unknown ingredients requires OpenAI API.", "API Required")
-
-                if st.button("Export Results"):
-                    export_data = {
-                        "Product Status": analysis_results.get("product_status", "Unknown"),
-                        "Ingredients": ", ".join(analysis_results.get("ingredients_list", [])),
-                        "Unknown Ingredients": ", ".join(unknown_ingredients) if unknown_ingredients else "None",
-                        "Analysis": analysis_results.get("halal_status_response", "No detailed analysis available")
-                    }
-                    create_export_button(export_data)
+    # --- RESULTS RENDERING (reuse your components) ---
+    if analysis_results:
+        # Buffered append to the results log; written by a background thread
+        record = analysis_record(analysis_results, source="app", product_name=product_name)
+        if not showing_previous:
+            get_results_sink().append(record)
+            get_history_store().record(record)
+        with results_container:
+            previously_analysed_at = analysis_results.get("previously_analysed_at")
+            if previously_analysed_at:
+                st.info(f"Previously analysed on {previously_analysed_at}; showing the stored result.")
+            image_match = analysis_results.get("image_match")
+            if image_match:
+                confirmed = (
+                    "the same photo" if image_match["confirmed_by"] == "content_hash"
+                    else f"similarity {image_match['similarity']:.1%}, same ingredients read by local OCR"
+                )
+                st.caption(
+                    f"Ingredients read from an earlier scan of this label on {image_match['extracted_at']} "
+                    f"({confirmed}). Check them against your label."
+                )
+            local_read = analysis_results.get("local_ocr")
+            if local_read:
+                local_stats = ocr_stats.stats()
+                st.caption(
+                    f"Read on this device by OCR (confidence {local_read['confidence']:.0f}%, "
+                    f"{local_read['match_rate']:.0%} of ingredients found in the dataset); "
+                    f"{local_stats['served_fraction']:.0%} of {local_stats['scans']} scans were read locally."
+                )
+            display_ingredients_text(analysis_results.get("ingredients_text", ""))
+
+            ingredients_list = analysis_results.get("ingredients_list", [])
+            if ingredients_list:
+                display_ingredients_comparison(
+                    ingredients_list, analysis_results.get("ingredient_statuses", {})
+                )
+
+            display_halal_status(analysis_results.get("product_status", "Unknown"))
+
+            unknown_ingredients = analysis_results.get("unknown_ingredients", [])
+            if unknown_ingredients:
+                display_unknown_ingredients(unknown_ingredients)
+                predicted_unknowns = analysis_results.get("predicted_unknowns") or []
+                if predicted_unknowns:
+                    st.write("Predicted from similar ingredients in the dataset:")
+                    for prediction in predicted_unknowns:
+                        st.write(
+                            f"- **{prediction['ingredient']}**: likely {prediction['status']} "
+                            f"({prediction['confidence']:.0%} confidence)"
+                        )
+                halal_status_response = analysis_results.get("halal_status_response")
+                if halal_status_response:
+                    st.write("Analysis of unknown ingredients:")
+                    st.write(halal_status_response)
+                elif analysis_results.get("deferred_unknowns"):
+                    st.caption("The dataset already decides this product, so the unknown ingredients "
+                               "were not looked up.")
+                    st.button("Explain the unknown ingredients", on_click=explain_deferred_unknowns)
+                elif len(predicted_unknowns) < len(unknown_ingredients):
+                    display_custom_warning("Detailed analysis of unknown ingredients requires OpenAI API.", "API Required")
+
+            create_export_button(export_summary(record))
 
     # --- SEPARATE CHAT / Q&A SECTION ---
     st.divider()
     st.markdown("### 💬 Ask about ingredients (optional)")
     st.caption("Use this to ask about E-numbers, emulsifiers, or follow-ups after analysis.")
-    text_prompt = st.text_input("Type your question…", key="text_input")
-
-    if text_prompt:
-        st.session_state.messages.append({"role": "user", "content": text_prompt})
-        try:
-            with st.spinner("Loading knowledge base..."):
-                try:
-                    index, gpt_context = load_index_and_context(
-                        str(STORAGE_DIR), DEFAULT_MODEL, TEMPERATURE, CONTEXT_WINDOW, SYSTEM_PROMPT
-                    )
-                    chat_engine = get_chat_engine(index, gpt_context)
-                    for message in st.session_state.messages:
-                        with st.chat_message(message["role"]):
-                            st.write(message["content"])
-                    if st.session_state.messages[-1]["role"] != "assistant":
-                        with st.chat_message("assistant"):
-                            with st.spinner("Thinking..."):
-                                response = chat_engine.chat(text_prompt)
-                                st.write(response.response)
-                                st.session_state.messages.append({"role": "assistant", "content": response.response})
-                except ImportError:
-                    display_custom_warning("LlamaIndex is not installed. Please install it using: pip install llama-index", "Module Missing")
-                    with st.chat_message("assistant"):
-                        fallback_response = "I'm sorry, but I can't access the knowledge base right now. Please make sure LlamaIndex is installed."
-                        st.write(fallback_response)
-                        st.session_state.messages.append({"role": "assistant", "content": fallback_response})
-        except Exception as e:
-            display_custom_warning(f"Error in chat: {e}", "Error")
+    if warmup is not None and warmup.state(QUERY_ENGINE) in (WARMUP_PENDING, WARMING):
+        st.caption("Chat is still starting up; questions are answered as soon as the ingredient index is loaded.")
+    st.text_input("Type your question…", key="text_input", on_change=submit_question)
+
+    chat_turns = st.session_state.chat_turns
+    for turn in chat_turns:
+        with st.chat_message("user"):
+            st.write(turn["question"])
+        if turn["status"] == PENDING:
+            answer_turn(turn)
+        else:
+            # Answered on an earlier run: replay without calling the model
             with st.chat_message("assistant"):
-                fallback_response = "I'm sorry, but I encountered an error. Please try again later."
-                st.write(fallback_response)
-                st.session_state.messages.append({"role": "assistant", "content": fallback_response})
+                st.write(turn["answer"])
+                for note in turn["notes"]:
+                    st.caption(note)
+
+    # --- SESSION MEMORY REPORT ---
+    with st.expander("Session memory"):
+        shared = [kb]
+        if "chat_engine" in st.session_state:
+            shared.extend(st.session_state.chat_engine.shared_resources())
+        report = session_memory_report(
+            {key: st.session_state[key] for key in st.session_state.keys()}, shared=shared
+        )
+        st.caption(
+            f"This session holds {format_bytes(report['total_bytes'])}. "
+            f"The shared knowledge base (version {kb.version}, {len(kb)} ingredients) and "
+            "retrieval index are not counted."
+        )
+        st.table([{"key": key, "size": format_bytes(size)} for key, size in report["keys"].items()])
+
+    # --- ANALYSIS HISTORY (local SQLite indexes, no model calls) ---
+    with st.expander("Analysis history"):
+        history = get_history_store()
+        history_ingredient = st.text_input("Products containing (ingredient or e-number)", key="history_ingredient")
+        if history_ingredient:
+            st.table(history.products_with_ingredient(history_ingredient, limit=20))
+        st.caption("Most frequent unknown ingredients")
+        st.table(history.top_unknown_ingredients(limit=10))
 
-        
     # --- FOOTER (outside main container) ---
     display_footer(APP_CAPTION, APP_DISCLAIMER)
 
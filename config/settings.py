@@ -68,6 +68,11 @@ def load_api_config():
 APP_TITLE = "🍦Halal Ingredients Scanner 🥨"
 APP_CAPTION = "powered by LlamaIndex, finetuned GPT3.5turbo and GPT-Vision preview"
 APP_DISCLAIMER = "Disclaimer: I was created by a being who isn't from MUIS for pure experimental use."
+MAX_CHAT_HISTORY = 20  # Chat messages kept in each session's state
+CHAT_MEMORY_TOKENS = 512  # Verbatim turns kept for condensing follow-ups; older turns are summarised
+CHAT_SUMMARY_WORDS = 120
+CHAT_SKIP_STANDALONE_CONDENSE = True  # No condense call for first turns and self-contained questions
+CHAT_SPECULATIVE_RETRIEVAL = True  # Retrieve on the raw question while a follow-up is condensed
 
 # Model settings
 DEFAULT_MODEL = "gpt-3.5-turbo-0125"  # Using standard GPT-3.5 Turbo model
@@ -75,12 +80,119 @@ VISION_MODEL = "gpt-4o"  # Using latest GPT-4o model which has vision capabiliti
 CONTEXT_WINDOW = 2048
 TEMPERATURE = 0
 MAX_TOKENS = 800
+# Ask the vision model for the ingredients as JSON matching a strict schema
+# instead of free text; "false" restores the free-text extraction and parser
+VISION_STRUCTURED_OUTPUT = os.environ.get("VISION_STRUCTURED_OUTPUT", "true").lower() == "true"
+VISION_STRUCTURED_MAX_TOKENS = 600  # No preamble to pay for; a truncated answer falls back to free text
 
 # API endpoints
 OPENAI_API_ENDPOINT = "https://api.openai.com/v1/chat/completions"
 
+# OpenAI rate limits shared by every call in the process (match your account tier)
+OPENAI_RPM_LIMIT = int(os.environ.get("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.environ.get("OPENAI_TPM_LIMIT", "200000"))
+OPENAI_MAX_QUEUE_WAIT = float(os.environ.get("OPENAI_MAX_QUEUE_WAIT", "120"))  # Seconds
+OPENAI_MAX_RATE_LIMIT_RETRIES = 3
+UNKNOWN_QUERY_COMPLETION_ESTIMATE = 500  # Expected completion tokens when explaining unknowns
+
+# On-demand profiling: share of analyses and chat turns profiled (0 disables it
+# with no overhead), "sampling" (collapsed stacks for flamegraphs) or "cprofile"
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_MODE = os.environ.get("PROFILE_MODE", "sampling")
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", STORAGE_DIR / "profiles"))
+PROFILE_INTERVAL = 0.005  # Seconds between stack samples
+PROFILE_TOP_N = 20  # Functions listed in each summary
+
+# Warm-up at process start: slow components (the retrieval index and chat model
+# context) are loaded in the background, and health checks report the process
+# ready once the components listed here are loaded
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_READY_COMPONENTS = [
+    name.strip() for name in os.environ.get("WARMUP_READY_COMPONENTS", "knowledge_base,query_engine").split(",")
+    if name.strip()
+]
+WARMUP_STATUS_FILE = Path(os.environ.get("WARMUP_STATUS_FILE", STORAGE_DIR / "warmup_status.json"))
+
+# HTTP classification service settings
+SERVICE_HOST = os.environ.get("SERVICE_HOST", "0.0.0.0")
+SERVICE_PORT = int(os.environ.get("SERVICE_PORT", "8000"))
+SERVICE_WORKERS = int(os.environ.get("SERVICE_WORKERS", "8"))  # Threads for blocking OpenAI calls
+SERVICE_MAX_TEXT_BYTES = 16 * 1024
+SERVICE_MAX_IMAGE_BYTES = 8 * 1024 * 1024
+
 # Dataset paths
 INGREDIENTS_DATASET = DATA_DIR / "halal_non_halal_ingred.csv"
+KB_SNAPSHOT_DIR = STORAGE_DIR / "snapshots"  # Compiled, memory-mapped copies of the dataset
+# Seconds between checks of the dataset for changes, which are loaded without a restart; 0 disables
+KB_RELOAD_INTERVAL = float(os.environ.get("KB_RELOAD_INTERVAL", "5"))
+
+# Local classifier for unknown ingredients (train it with
+# python -m src.utils.ingredient_classifier train); unknowns it predicts with at
+# least this calibrated probability are not sent to OpenAI
+LOCAL_CLASSIFIER_ENABLED = os.environ.get("LOCAL_CLASSIFIER_ENABLED", "true").lower() == "true"
+LOCAL_CLASSIFIER_MODEL = Path(os.environ.get("LOCAL_CLASSIFIER_MODEL", STORAGE_DIR / "models" / "ingredient_classifier.json"))
+LOCAL_CLASSIFIER_MIN_CONFIDENCE = float(os.environ.get("LOCAL_CLASSIFIER_MIN_CONFIDENCE", "0.9"))
+
+# Ingredient parsing: classify bracketed sub-ingredients and roll them up to the
+# compound ingredient; "false" restores the flat, whole-entry lookup
+NESTED_INGREDIENTS = os.environ.get("NESTED_INGREDIENTS", "true").lower() == "true"
+
+# Local OCR first pass (needs pytesseract and the tesseract binary); the vision
+# model is only called when the OCR result falls below these thresholds
+LOCAL_OCR_ENABLED = os.environ.get("LOCAL_OCR_ENABLED", "true").lower() == "true"
+LOCAL_OCR_LANG = os.environ.get("LOCAL_OCR_LANG", "eng")
+LOCAL_OCR_MIN_CONFIDENCE = 85.0  # Mean Tesseract word confidence (0-100) in the ingredients block
+LOCAL_OCR_MIN_MATCH_RATE = 0.7  # Share of ingredients found in the dataset
+LOCAL_OCR_MIN_INGREDIENTS = 3
+
+# Near-duplicate photo detection: reuse the extraction of an earlier photo of the same
+# label (identical bytes, or a near-identical photo local OCR reads the same ingredients from)
+IMAGE_REUSE_EXTRACTIONS = os.environ.get("IMAGE_REUSE_EXTRACTIONS", "false").lower() == "true"
+IMAGE_INDEX_FILE = STORAGE_DIR / "image_index.jsonl"
+NEAR_DUPLICATE_MIN_SIMILARITY = 0.95  # 1 - Hamming distance / hash bits, weaker hash of two
+
+# Analysis results log settings
+RESULTS_DIR = DATA_DIR / "results"
+RESULTS_SEGMENT_BYTES = 8 * 1024 * 1024  # Rotate JSONL segments at this size
+RESULTS_FLUSH_INTERVAL = 2.0  # Seconds between background flushes
+RESULTS_BUFFER_SIZE = 256  # Buffered records that trigger an early flush
+
+# Analysis history store settings
+HISTORY_DB = Path(os.environ.get("HISTORY_DB", DATA_DIR / "history.db"))
+HISTORY_BATCH_SIZE = 200  # Records committed per transaction
+HISTORY_FLUSH_INTERVAL = 1.0  # Seconds the writer waits to fill a batch
+HISTORY_INSTANT_ANSWERS = os.environ.get("HISTORY_INSTANT_ANSWERS", "true").lower() == "true"
+
+# Knowledge-source ingestion settings
+INGEST_SOURCE_EXTENSIONS = (".html", ".pdf", ".csv")
+INGEST_MANIFEST = STORAGE_DIR / "ingest_manifest.json"
+EMBEDDING_CACHE = STORAGE_DIR / "embedding_cache.jsonl"
+EMBED_BATCH_SIZE = 64
+EMBED_WORKERS = 4
+EMBED_MAX_RETRIES = 3
+CHUNK_SIZE = 1024
+CHUNK_OVERLAP = 20
+COMPACT_CHUNK_TOKENS = 256
+CHUNK_DEDUPE_THRESHOLD = 0.9
+
+# Retrieval settings
+BM25_INDEX_FILE = STORAGE_DIR / "bm25_index.json"
+BM25_K1 = 1.5
+BM25_B = 0.75
+HYBRID_RETRIEVAL = True
+# Map the index embeddings from one compiled file shared by all worker processes
+# instead of loading them into each; "false" lets LlamaIndex load its own copy
+SHARED_VECTOR_STORE = os.environ.get("SHARED_VECTOR_STORE", "true").lower() == "true"
+VECTOR_SNAPSHOT_FILE = KB_SNAPSHOT_DIR / "vector_store.vecsnap"
+RETRIEVAL_CANDIDATES = 10  # Candidates taken from each retriever before fusion
+SIMILARITY_TOP_K = 2
+RRF_K = 60
+
+# Context packing settings (token budget within CONTEXT_WINDOW)
+RESPONSE_TOKEN_RESERVE = 256
+PROMPT_TEMPLATE_TOKENS = 100
+MAX_QUESTION_TOKENS = 256
+CONTEXT_DEDUPE_THRESHOLD = 0.8
 
 # System prompts
 SYSTEM_PROMPT = """As an expert in halal food certification, your task is to meticulously analyze the ingredients of food products using a structured, educational approach.
@@ -0,0 +1,3 @@
+"""
+Package initialization for loadtest module.
+"""
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+Load-test profile for the HTTP classification service.
+
+Drives a weighted mix of text classifications and e-number lookups (and
+optionally image classifications) at fixed concurrency, then reports
+throughput, latency percentiles and errors per endpoint.
+
+Usage:
+    python -m loadtest.http_service [--url URL] [--concurrency N] [--duration SECONDS] [--image PATH]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+# Try to import aiohttp, but make it optional
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Typical label texts, mixing dataset hits, e-numbers and unknowns; the
+# last ones have only Halal ingredients besides their unknowns, so their
+# verdict stays open and the unknowns are explained
+SAMPLE_LABELS = [
+    "sugar, wheat flour, vegetable oil (palm), cocoa powder, emulsifier (e322), salt",
+    "water, sugar, e330, e211, e102, flavouring",
+    "wheat flour, palm oil, salt, flavour enhancer (621), e471, gelatin",
+    "milk solids, sugar, cocoa butter, emulsifier (soy lecithin), vanilla extract",
+    "potatoes, vegetable oil, salt, e621, e631, e627, maltodextrin, spices",
+    "glucose syrup, sugar, gelatin, citric acid, e120, e129, carnauba wax",
+    "wheat flour, sugar, palm oil, salt, yeast extract, ammonium bicarbonate",
+    "glucose syrup, sugar, citric acid, agar, rice starch, natural colour",
+    "potatoes, sunflower oil, salt, maltodextrin, onion powder",
+    "almond nuts, sugar, cocoa butter, alkalized cocoa powder, hazelnut paste",
+]
+
+SAMPLE_ENUMBERS = ["E471", "e120", "322", "E441", "e904", "1422", "E999"]
+
+# Relative weight of each request type in the mix
+DEFAULT_MIX = {"text": 0.7, "enumber": 0.3, "image": 0.0}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of values.
+
+    Args:
+        values (List[float]): Samples
+        pct (float): Percentile between 0 and 100
+
+    Returns:
+        float: The percentile, or 0.0 for no samples
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+async def _one_request(
+    session: Any, base_url: str, kind: str, image_bytes: Optional[bytes]
+) -> int:
+    if kind == "text":
+        payload = {"ingredients": random.choice(SAMPLE_LABELS)}
+        async with session.post(f"{base_url}/v1/classify/text", json=payload) as response:
+            await response.read()
+            return response.status
+    if kind == "enumber":
+        async with session.get(f"{base_url}/v1/enumbers/{random.choice(SAMPLE_ENUMBERS)}") as response:
+            await response.read()
+            return response.status
+    async with session.post(
+        f"{base_url}/v1/classify/image", data=image_bytes, headers={"Content-Type": "image/jpeg"}
+    ) as response:
+        await response.read()
+        return response.status
+
+
+async def run_load(
+    base_url: str,
+    concurrency: int,
+    duration: float,
+    mix: Dict[str, float],
+    image_bytes: Optional[bytes] = None
+) -> Dict[str, Any]:
+    """
+    Run the load profile and collect per-endpoint statistics.
+
+    Args:
+        base_url (str): Service base URL
+        concurrency (int): Number of concurrent simulated clients
+        duration (float): Test duration in seconds
+        mix (Dict[str, float]): Relative weights of "text", "enumber" and "image" requests
+        image_bytes (Optional[bytes]): Image to send for image requests
+
+    Returns:
+        Dict[str, Any]: Report with throughput and latency percentiles per request type
+    """
+    kinds = [kind for kind, weight in mix.items() if weight > 0 and (kind != "image" or image_bytes)]
+    weights = [mix[kind] for kind in kinds]
+    latencies: Dict[str, List[float]] = {kind: [] for kind in kinds}
+    errors: Dict[str, int] = {kind: 0 for kind in kinds}
+    deadline = time.perf_counter() + duration
+
+    async def client(session: Any) -> None:
+        while time.perf_counter() < deadline:
+            kind = random.choices(kinds, weights)[0]
+            start = time.perf_counter()
+            try:
+                status = await _one_request(session, base_url, kind, image_bytes)
+                ok = status < 500 and status != 429
+            except aiohttp.ClientError:
+                ok = False
+            latencies[kind].append(time.perf_counter() - start)
+            if not ok:
+                errors[kind] += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    report: Dict[str, Any] = {"concurrency": concurrency, "duration_s": round(elapsed, 2), "endpoints": {}}
+    for kind in kinds:
+        samples = latencies[kind]
+        report["endpoints"][kind] = {
+            "requests": len(samples),
+            "errors": errors[kind],
+            "rps": round(len(samples) / elapsed, 1),
+            "p50_ms": round(percentile(samples, 50) * 1000, 1),
+            "p95_ms": round(percentile(samples, 95) * 1000, 1),
+            "p99_ms": round(percentile(samples, 99) * 1000, 1),
+        }
+    report["total_rps"] = round(sum(len(v) for v in latencies.values()) / elapsed, 1)
+    return report
+
+
+def main() -> None:
+    """Command-line entry point for the load-test profile."""
+    parser = argparse.ArgumentParser(description="Load-test the HTTP classification service.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Service base URL")
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=30.0, help="Test duration in seconds")
+    parser.add_argument("--image", help="JPEG to include image classifications (calls OpenAI)")
+    parser.add_argument("--image-weight", type=float, default=0.05, help="Share of image requests")
+    args = parser.parse_args()
+
+    if aiohttp is None:
+        raise ImportError("aiohttp is required for the load test. Please install it with: pip install aiohttp")
+
+    mix = dict(DEFAULT_MIX)
+    image_bytes = None
+    if args.image:
+        with open(args.image, "rb") as f:
+            image_bytes = f.read()
+        mix["image"] = args.image_weight
+
+    report = asyncio.run(run_load(args.url.rstrip("/"), args.concurrency, args.duration, mix, image_bytes))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
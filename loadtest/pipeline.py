@@ -0,0 +1,336 @@
+"""
+Concurrent-session load test of the analysis pipeline against a stubbed OpenAI.
+
+Each worker process loads the knowledge base and runs a number of simulated
+sessions as threads (as Streamlit runs each session's script in a thread).
+Sessions repeatedly analyse either a typed ingredients list or a label photo
+through the same functions the app uses, with OpenAI replaced by the local
+stub in loadtest.stub_openai, so the run needs no network access or API key.
+
+Every stage of the pipeline is timed: parsing, the dataset lookup, the
+vision extraction and the query about unknown ingredients (both including
+the time spent waiting in the rate limiter). The report gives throughput,
+p50/p95/p99 latency per stage and end to end, and CPU and memory per worker.
+
+Usage:
+    python -m loadtest.pipeline [--sessions N] [--processes P] [--duration SECONDS]
+        [--image-share P] [--vision-latency MEDIAN,SIGMA] [--text-latency MEDIAN,SIGMA]
+        [--error-rate P] [--rate-limit-rate P] [--stub-url URL]
+
+The process-wide OpenAI rate limiter stays in place; set OPENAI_RPM_LIMIT and
+OPENAI_TPM_LIMIT to the account's limits to include its queueing in the results.
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import resource
+import threading
+import time
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Optional
+
+from PIL import Image, ImageDraw
+
+from loadtest.http_service import SAMPLE_LABELS, percentile
+from loadtest.stub_openai import (
+    DEFAULT_TEXT_LATENCY, DEFAULT_VISION_LATENCY, StubProfile, parse_latency, start_stub_in_thread
+)
+
+# Pipeline functions timed in each worker, by the stage they belong to
+STAGES = {
+    "parse_ingredient_tree": "parse",
+    "parse_ingredients": "parse",
+    "classify_ingredient_tree": "lookup",
+    "check_halal_status": "lookup",
+    "extract_ingredients_from_image": "vision",
+    "extract_ingredients_structured": "vision",
+    "query_openai_about_ingredients": "explain_unknowns",
+}
+
+# Made-up ingredients appended to some labels so that not every session asks
+# about the same unknowns (identical concurrent questions share one call)
+_MADE_UP = ["extract of {}", "{} powder", "natural {} flavour", "{} gum"]
+
+
+def synthetic_label(rng: random.Random) -> bytes:
+    """
+    A distinct label-like JPEG, so that vision calls are not coalesced.
+
+    Args:
+        rng (random.Random): Random source
+
+    Returns:
+        bytes: JPEG bytes
+    """
+    image = Image.new("L", (640, 480), 255)
+    draw = ImageDraw.Draw(image)
+    for line in range(12):
+        x = 20
+        while x < 600:
+            width = rng.randint(15, 70)
+            draw.rectangle([x, 30 + line * 36, x + width, 50 + line * 36], fill=rng.randint(0, 80))
+            x += width + rng.randint(8, 16)
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def sample_ingredients(rng: random.Random) -> str:
+    """A sample label, half the time with a made-up unknown ingredient added."""
+    text = rng.choice(SAMPLE_LABELS)
+    if rng.random() < 0.5:
+        text += ", " + rng.choice(_MADE_UP).format(f"herb{rng.randint(0, 10 ** 6)}")
+    return text
+
+
+def _instrument(module: Any, timings: Dict[str, List[float]]) -> Callable[[], None]:
+    originals = {name: getattr(module, name) for name in STAGES if hasattr(module, name)}
+
+    def timed(name: str, function: Callable) -> Callable:
+        samples = timings.setdefault(STAGES[name], [])
+
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+        return wrapper
+
+    for name, function in originals.items():
+        setattr(module, name, timed(name, function))
+
+    def restore() -> None:
+        for name, function in originals.items():
+            setattr(module, name, function)
+    return restore
+
+
+def _memory_mb() -> Dict[str, float]:
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        with open("/proc/self/statm") as f:
+            pages = f.read().split()
+        page_mb = resource.getpagesize() / (1024 * 1024)
+        rss, shared = int(pages[1]) * page_mb, int(pages[2]) * page_mb
+    except (OSError, IndexError, ValueError):
+        rss, shared = peak, 0.0
+    return {"rss_mb": round(rss, 1), "shared_mb": round(shared, 1), "peak_rss_mb": round(peak, 1)}
+
+
+def run_worker(
+    worker_id: int,
+    sessions: int,
+    duration: float,
+    endpoint: str,
+    image_share: float,
+    think_time: float,
+    seed: int
+) -> Dict[str, Any]:
+    """
+    Run simulated sessions in this process for a fixed duration.
+
+    Args:
+        worker_id (int): Worker number, for the report
+        sessions (int): Concurrent sessions (threads)
+        duration (float): Seconds to run
+        endpoint (str): Chat completions URL of the stub
+        image_share (float): Share of analyses that start from a photo
+        think_time (float): Mean pause between a session's analyses, in seconds
+        seed (int): Random seed
+
+    Returns:
+        Dict[str, Any]: Raw latency samples per stage, errors, CPU and memory
+    """
+    from config.settings import INGREDIENTS_DATASET, MAX_TOKENS, VISION_MODEL, VISION_STRUCTURED_OUTPUT
+    import src.utils.analysis as analysis
+    from src.utils.knowledge_base import load_knowledge_base
+
+    start_cpu = time.process_time()
+    load_start = time.perf_counter()
+    kb = load_knowledge_base(str(INGREDIENTS_DATASET))
+    load_s = time.perf_counter() - load_start
+
+    timings: Dict[str, List[float]] = {"text_total": [], "image_total": []}
+    errors: Dict[str, Dict[str, int]] = {"text": {}, "image": {}}
+    restore = _instrument(analysis, timings)
+    deadline = time.perf_counter() + duration
+
+    def session(number: int) -> None:
+        rng = random.Random(seed * 100003 + worker_id * 1009 + number)
+        while time.perf_counter() < deadline:
+            kind = "image" if rng.random() < image_share else "text"
+            image_bytes = synthetic_label(rng) if kind == "image" else b""
+            text = sample_ingredients(rng)
+            start = time.perf_counter()
+            try:
+                if kind == "image":
+                    analysis.analyze_image(
+                        image_bytes, kb.lookup_table, "stub-key", endpoint, VISION_MODEL, MAX_TOKENS,
+                        structured=VISION_STRUCTURED_OUTPUT
+                    )
+                else:
+                    analysis.analyze_ingredients_text(text, kb.lookup_table, "stub-key", endpoint)
+                timings[f"{kind}_total"].append(time.perf_counter() - start)
+            except Exception as e:
+                name = type(e).__name__
+                errors[kind][name] = errors[kind].get(name, 0) + 1
+            if think_time > 0:
+                time.sleep(rng.expovariate(1 / think_time))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=session, args=(n,), daemon=True) for n in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    restore()
+
+    cpu_s = time.process_time() - start_cpu
+    return {
+        "worker": worker_id,
+        "sessions": sessions,
+        "elapsed_s": elapsed,
+        "kb_load_ms": round(load_s * 1000, 2),
+        "cpu_s": round(cpu_s, 2),
+        "cpu_utilisation": round(cpu_s / elapsed, 3) if elapsed else 0.0,
+        **_memory_mb(),
+        "timings": timings,
+        "errors": errors,
+    }
+
+
+def _worker_entry(queue: Any, *args: Any) -> None:
+    queue.put(run_worker(*args))
+
+
+def summarise(workers: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge worker results into the report.
+
+    Args:
+        workers (List[Dict[str, Any]]): Results from run_worker
+
+    Returns:
+        Dict[str, Any]: Throughput, per-stage latency percentiles, errors and per-worker resources
+    """
+    elapsed = max(worker["elapsed_s"] for worker in workers)
+    merged: Dict[str, List[float]] = {}
+    errors: Dict[str, Dict[str, int]] = {}
+    for worker in workers:
+        for stage, samples in worker["timings"].items():
+            merged.setdefault(stage, []).extend(samples)
+        for kind, counts in worker["errors"].items():
+            bucket = errors.setdefault(kind, {})
+            for name, count in counts.items():
+                bucket[name] = bucket.get(name, 0) + count
+
+    completed = len(merged.get("text_total", [])) + len(merged.get("image_total", []))
+    report: Dict[str, Any] = {
+        "sessions": sum(worker["sessions"] for worker in workers),
+        "processes": len(workers),
+        "duration_s": round(elapsed, 2),
+        "analyses_per_s": round(completed / elapsed, 2) if elapsed else 0.0,
+        "stages": {},
+        "errors": errors,
+        "workers": [
+            {key: value for key, value in worker.items() if key not in ("timings", "errors", "elapsed_s")}
+            for worker in workers
+        ],
+    }
+    for stage in ("parse", "lookup", "vision", "explain_unknowns", "text_total", "image_total"):
+        samples = merged.get(stage, [])
+        if not samples:
+            continue
+        report["stages"][stage] = {
+            "calls": len(samples),
+            "per_s": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(samples, 50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 99) * 1000, 2),
+        }
+    return report
+
+
+def run_pipeline_load(
+    sessions: int,
+    processes: int,
+    duration: float,
+    endpoint: str,
+    image_share: float = 0.3,
+    think_time: float = 0.0,
+    seed: int = 0
+) -> Dict[str, Any]:
+    """
+    Spread sessions over worker processes, run them and merge the results.
+
+    Args:
+        sessions (int): Total concurrent sessions
+        processes (int): Worker processes
+        duration (float): Seconds to run
+        endpoint (str): Chat completions URL of the stub
+        image_share (float): Share of analyses that start from a photo
+        think_time (float): Mean pause between a session's analyses, in seconds
+        seed (int): Random seed
+
+    Returns:
+        Dict[str, Any]: Report from summarise()
+    """
+    context = multiprocessing.get_context("spawn")  # Fresh interpreters, as separate replicas would be
+    queue = context.Queue()
+    per_worker = [sessions // processes + (1 if i < sessions % processes else 0) for i in range(processes)]
+    workers = [
+        context.Process(
+            target=_worker_entry,
+            args=(queue, i, count, duration, endpoint, image_share, think_time, seed),
+            daemon=True
+        )
+        for i, count in enumerate(per_worker) if count
+    ]
+    for worker in workers:
+        worker.start()
+    results = [queue.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+    return summarise(sorted(results, key=lambda result: result["worker"]))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command-line entry point for the pipeline load test."""
+    parser = argparse.ArgumentParser(description="Load-test the analysis pipeline against a stubbed OpenAI.")
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent sessions in total")
+    parser.add_argument("--processes", type=int, default=1, help="Worker processes the sessions are spread over")
+    parser.add_argument("--duration", type=float, default=30.0, help="Test duration in seconds")
+    parser.add_argument("--image-share", type=float, default=0.3, help="Share of analyses from a photo")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between analyses per session")
+    parser.add_argument("--vision-latency", type=parse_latency, default=DEFAULT_VISION_LATENCY,
+                        help="Stub vision latency as MEDIAN,SIGMA in seconds")
+    parser.add_argument("--text-latency", type=parse_latency, default=DEFAULT_TEXT_LATENCY,
+                        help="Stub text latency as MEDIAN,SIGMA in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stub requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of stub requests failing with 429")
+    parser.add_argument("--stub-url", help="Use a stub already running at this chat completions URL")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args(argv)
+
+    stop = None
+    endpoint = args.stub_url
+    if endpoint is None:
+        profile = StubProfile(args.vision_latency, args.text_latency, args.error_rate, args.rate_limit_rate)
+        endpoint, stop = start_stub_in_thread(profile, args.seed)
+    try:
+        report = run_pipeline_load(
+            args.sessions, args.processes, args.duration, endpoint,
+            image_share=args.image_share, think_time=args.think_time, seed=args.seed
+        )
+    finally:
+        if stop is not None:
+            stop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
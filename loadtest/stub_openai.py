@@ -0,0 +1,208 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint, for load tests without network access.
+
+Answers POST /v1/chat/completions after a simulated latency drawn from a
+log-normal distribution, with configurable shares of server errors and 429
+rate limits. Vision requests (with an image_url part) get an ingredients list
+back, other requests a short explanation. GET /stats reports the requests
+served by kind and outcome. Vision requests with a json_schema
+response_format get the ingredients list as JSON in that shape.
+
+Usage:
+    python -m loadtest.stub_openai [--port PORT] [--vision-latency MEDIAN,SIGMA]
+        [--text-latency MEDIAN,SIGMA] [--error-rate P] [--rate-limit-rate P]
+
+Point the app or service at it by setting the endpoint to
+http://127.0.0.1:PORT/v1/chat/completions.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import threading
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+from loadtest.http_service import SAMPLE_LABELS
+from src.utils.ingredient_parser import IngredientNode, normalise_enumber, parse_ingredient_tree
+
+# Try to import aiohttp, but make it optional
+try:
+    from aiohttp import web
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    web = None
+    AIOHTTP_AVAILABLE = False
+
+
+class Latency(NamedTuple):
+    """Log-normal latency: the median in seconds and the sigma of its logarithm."""
+    median: float
+    sigma: float
+
+    def sample(self, rng: random.Random) -> float:
+        return self.median * math.exp(rng.gauss(0.0, self.sigma)) if self.median > 0 else 0.0
+
+
+# Roughly what gpt-4o label extractions and gpt-3.5 explanations take
+DEFAULT_VISION_LATENCY = Latency(2.5, 0.4)
+DEFAULT_TEXT_LATENCY = Latency(1.2, 0.5)
+
+
+class StubProfile(NamedTuple):
+    """Behaviour of the stub endpoint."""
+    vision_latency: Latency = DEFAULT_VISION_LATENCY
+    text_latency: Latency = DEFAULT_TEXT_LATENCY
+    error_rate: float = 0.0  # Share of requests answered with a 500
+    rate_limit_rate: float = 0.0  # Share of requests answered with a 429
+    retry_after: float = 1.0  # Retry-After sent with a 429, in seconds
+
+
+def parse_latency(value: str) -> Latency:
+    """
+    Parse a "MEDIAN,SIGMA" latency argument (seconds).
+
+    Args:
+        value (str): e.g. "2.5,0.4"; a single number means no spread
+
+    Returns:
+        Latency: Parsed latency
+    """
+    parts = [float(part) for part in value.split(",")]
+    return Latency(parts[0], parts[1] if len(parts) > 1 else 0.0)
+
+
+def _is_vision(payload: Dict[str, Any]) -> bool:
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list) and any(part.get("type") == "image_url" for part in content):
+            return True
+    return False
+
+
+def _structured_ingredients(nodes: List[IngredientNode]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "name": node.name,
+            "e_code": f"E{normalise_enumber(node.name).upper()}" if normalise_enumber(node.name) else None,
+            "sub_ingredients": _structured_ingredients(node.children),
+        }
+        for node in nodes
+    ]
+
+
+def create_stub_app(profile: StubProfile = StubProfile(), seed: int = 0) -> Any:
+    """
+    Create the stub application.
+
+    Args:
+        profile (StubProfile): Latencies and error rates
+        seed (int): Random seed, so runs are repeatable
+
+    Returns:
+        web.Application: The stub application
+
+    Raises:
+        ImportError: If aiohttp is not available
+    """
+    if not AIOHTTP_AVAILABLE:
+        raise ImportError("aiohttp is required for the OpenAI stub. Please install it with: pip install aiohttp")
+
+    rng = random.Random(seed)
+    counts: Dict[str, int] = {}
+
+    async def completions(request: Any) -> Any:
+        payload = await request.json()
+        kind = "vision" if _is_vision(payload) else "text"
+        latency = (profile.vision_latency if kind == "vision" else profile.text_latency).sample(rng)
+        await asyncio.sleep(latency)
+
+        roll = rng.random()
+        if roll < profile.rate_limit_rate:
+            outcome, response = "rate_limited", web.json_response(
+                {"error": {"message": "Rate limit reached (stub)"}}, status=429,
+                headers={"Retry-After": str(profile.retry_after)}
+            )
+        elif roll < profile.rate_limit_rate + profile.error_rate:
+            outcome, response = "error", web.json_response({"error": {"message": "Server error (stub)"}}, status=500)
+        else:
+            if kind == "vision" and payload.get("response_format", {}).get("type") == "json_schema":
+                label = parse_ingredient_tree(rng.choice(SAMPLE_LABELS))
+                content = json.dumps({"ingredients": _structured_ingredients(label)}, separators=(",", ":"))
+            elif kind == "vision":
+                content = rng.choice(SAMPLE_LABELS)
+            else:
+                content = "These ingredients need checking with the manufacturer (stub response)."
+            completion_tokens = len(content) // 4 + 1
+            outcome, response = "ok", web.json_response({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "model": payload.get("model", ""),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": completion_tokens,
+                          "total_tokens": 100 + completion_tokens},
+            })
+        key = f"{kind}_{outcome}"
+        counts[key] = counts.get(key, 0) + 1
+        return response
+
+    async def stats(request: Any) -> Any:
+        return web.json_response(counts)
+
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    app.router.add_post("/v1/chat/completions", completions)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+def start_stub_in_thread(profile: StubProfile = StubProfile(), seed: int = 0) -> Tuple[str, Callable[[], None]]:
+    """
+    Serve the stub on an ephemeral local port from a background thread.
+
+    Args:
+        profile (StubProfile): Latencies and error rates
+        seed (int): Random seed
+
+    Returns:
+        Tuple[str, Callable[[], None]]: The chat completions URL and a function stopping the server
+    """
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(create_stub_app(profile, seed))
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = runner.addresses[0][1]
+    thread = threading.Thread(target=loop.run_forever, name="openai-stub", daemon=True)
+    thread.start()
+
+    def stop() -> None:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=10)
+
+    return f"http://127.0.0.1:{port}/v1/chat/completions", stop
+
+
+def main() -> None:
+    """Command-line entry point running the stub."""
+    parser = argparse.ArgumentParser(description="Serve a local stand-in for the OpenAI chat completions API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8100, help="Port to listen on")
+    parser.add_argument("--vision-latency", type=parse_latency, default=DEFAULT_VISION_LATENCY,
+                        help="Vision call latency as MEDIAN,SIGMA in seconds")
+    parser.add_argument("--text-latency", type=parse_latency, default=DEFAULT_TEXT_LATENCY,
+                        help="Text call latency as MEDIAN,SIGMA in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests failing with 429")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    if not AIOHTTP_AVAILABLE:
+        raise ImportError("aiohttp is required for the OpenAI stub. Please install it with: pip install aiohttp")
+    profile = StubProfile(args.vision_latency, args.text_latency, args.error_rate, args.rate_limit_rate)
+    web.run_app(create_stub_app(profile, args.seed), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
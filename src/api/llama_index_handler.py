@@ -2,8 +2,19 @@
 Module for handling LlamaIndex operations for document retrieval and chat.
 """
 import streamlit as st
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple, Optional, Any
+from typing import Tuple, Optional, Any, List, Dict
+
+from src.api.rate_limiter import PRIORITY_INTERACTIVE, get_scheduler
+from src.api.single_flight import SingleFlight
+from src.utils.bm25 import BM25Index, load_or_build_bm25, reciprocal_rank_fusion
+from src.utils.chat_memory import SummarizingMemory, adds_context, looks_standalone
+from src.utils.context_packer import ContextPacker
+from src.utils.profiling import profiled
+from src.utils.shared_vectors import load_shared_vector_store
+from src.utils.tokens import count_tokens
 
 # Try to import llama_index, but make it optional
 try:
@@ -11,6 +22,11 @@ try:
     from llama_index.chat_engine import CondenseQuestionChatEngine
     from llama_index.llms import OpenAI
     from llama_index import StorageContext, load_index_from_storage
+    from llama_index.query_engine import RetrieverQueryEngine
+    from llama_index.retrievers import BaseRetriever
+    from llama_index.schema import NodeWithScore, QueryBundle
+    from llama_index.postprocessor.types import BaseNodePostprocessor
+    from llama_index.bridge.pydantic import PrivateAttr
     LLAMA_INDEX_AVAILABLE = True
 except ImportError:
     LLAMA_INDEX_AVAILABLE = False
@@ -21,6 +37,21 @@ except ImportError:
         pass
     class CondenseQuestionChatEngine:
         pass
+    class BaseRetriever:
+        pass
+    class BaseNodePostprocessor:
+        pass
+    class QueryBundle:
+        def __init__(self, query_str: str):
+            self.query_str = query_str
+    def PrivateAttr(default=None, **kwargs):
+        return default
+
+# Identical standalone questions asked at the same time share one query
+query_flights = SingleFlight()
+
+# Condense calls run here while the session thread retrieves speculatively
+_condense_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="condense")
 
 
 @st.cache_resource(show_spinner=False)
@@ -29,7 +60,8 @@ def load_index_and_context(
     model_name: str, 
     temperature: float, 
     context_window: int, 
-    system_prompt: str
+    system_prompt: str,
+    shared_vectors: bool = False
 ) -> Tuple[Any, Any]:
     """
     Load the LlamaIndex index and service context.
@@ -40,6 +72,8 @@ def load_index_and_context(
         temperature (float): Temperature setting for the model
         context_window (int): Context window size
         system_prompt (str): System prompt for the model
+        shared_vectors (bool): Map the embeddings from the shared vector file
+            instead of loading them into this process
         
     Returns:
         Tuple[Any, Any]: Tuple of (index, service context)
@@ -53,33 +87,223 @@ def load_index_and_context(
             "Please install it with: pip install llama-index"
         )
         
-    with st.spinner(text="Loading – hang tight! This should take 1-2 minutes."):
-        # Rebuild the storage context
-        storage_context = StorageContext.from_defaults(persist_dir=persist_dir)
-
-        # Load the index
-        index = load_index_from_storage(storage_context)
-
-        # Load the model 
-        gpt_context = ServiceContext.from_defaults(
-            llm=OpenAI(model=model_name, temperature=temperature), 
-            context_window=context_window, 
-            system_prompt=system_prompt
-        )
+    # Rebuild the storage context
+    vector_store = load_shared_vector_store(Path(persist_dir)) if shared_vectors else None
+    storage_context = StorageContext.from_defaults(persist_dir=persist_dir, vector_store=vector_store)
+
+    # Load the index
+    index = load_index_from_storage(storage_context)
+
+    # Load the model 
+    gpt_context = ServiceContext.from_defaults(
+        llm=OpenAI(model=model_name, temperature=temperature), 
+        context_window=context_window, 
+        system_prompt=system_prompt
+    )
+    
+    return index, gpt_context
+
+
+@st.cache_resource(show_spinner=False)
+def load_bm25_index(persist_dir: str, index_path: str, k1: float, b: float) -> BM25Index:
+    """
+    Load the persisted BM25 keyword index, rebuilding it if the docstore changed.
+    
+    This only reads docstore.json, so it works without LlamaIndex or network access.
+    
+    Args:
+        persist_dir (str): Directory where the index is persisted
+        index_path (str): Path of the persisted BM25 index
+        k1 (float): BM25 term-frequency saturation
+        b (float): BM25 length normalisation
         
-        return index, gpt_context
+    Returns:
+        BM25Index: Keyword index over the node texts
+    """
+    return load_or_build_bm25(Path(persist_dir), Path(index_path), k1=k1, b=b)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing dense vector results with BM25 keyword results using
+    reciprocal rank fusion.
+    
+    If the vector retriever fails (for example without network access to
+    embed the query), the keyword results are used on their own.
+    """
+
+    def __init__(
+        self,
+        index: Any,
+        bm25_index: BM25Index,
+        similarity_top_k: int = 2,
+        candidates: int = 10,
+        rrf_k: int = 60
+    ):
+        super().__init__()
+        self._index = index
+        self._vector_retriever = index.as_retriever(similarity_top_k=candidates)
+        self._bm25_index = bm25_index
+        self._similarity_top_k = similarity_top_k
+        self._candidates = candidates
+        self._rrf_k = rrf_k
+
+    def _retrieve(self, query_bundle: "QueryBundle") -> List["NodeWithScore"]:
+        nodes_by_id = {}
+        rankings = []
+
+        try:
+            vector_results = self._vector_retriever.retrieve(query_bundle)
+        except Exception:
+            vector_results = []
+        for result in vector_results:
+            nodes_by_id[result.node.node_id] = result.node
+        if vector_results:
+            rankings.append([result.node.node_id for result in vector_results])
+
+        keyword_ids = [
+            node_id for node_id, _ in self._bm25_index.search(query_bundle.query_str, self._candidates)
+            if node_id in nodes_by_id or self._index.docstore.document_exists(node_id)
+        ]
+        if keyword_ids:
+            rankings.append(keyword_ids)
+
+        fused = []
+        for node_id, score in reciprocal_rank_fusion(rankings, k=self._rrf_k)[:self._similarity_top_k]:
+            node = nodes_by_id.get(node_id) or self._index.docstore.get_node(node_id)
+            fused.append(NodeWithScore(node=node, score=score))
+        return fused
 
 
-def get_chat_engine(index: Any, service_context: Any) -> Any:
+class ContextPackingPostprocessor(BaseNodePostprocessor):
     """
-    Create a chat engine from an index and service context.
+    Node postprocessor that deduplicates and trims retrieved nodes so the
+    prompt always fits the context budget, keeping a report of each call.
+    
+    The query engine is shared between sessions, so reports are kept per
+    thread (each Streamlit session runs its script in its own thread).
+    """
+
+    _packer: Any = PrivateAttr()
+    _reports: Any = PrivateAttr()
+
+    def __init__(self, packer: ContextPacker):
+        super().__init__()
+        self._packer = packer
+        self._reports = threading.local()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextPackingPostprocessor"
+
+    @property
+    def last_report(self) -> Dict[str, Any]:
+        """Utilisation report of the most recent query in this thread."""
+        return getattr(self._reports, "report", {})
+
+    def fit_question(self, question: str) -> str:
+        """
+        Cut a question to the packer's question budget before it is sent.
+
+        Args:
+            question (str): The (condensed) question
+
+        Returns:
+            str: The question to query with; the cut is noted in the next report
+        """
+        fitted, self._reports.question_tokens_cut = self._packer.fit_question(question)
+        return fitted
+
+    def _postprocess_nodes(
+        self, nodes: List["NodeWithScore"], query_bundle: Optional["QueryBundle"] = None
+    ) -> List["NodeWithScore"]:
+        question = query_bundle.query_str if query_bundle else ""
+        by_id = {result.node.node_id: result for result in nodes}
+        packed, self._reports.report = self._packer.pack(
+            question, [(result.node.node_id, result.node.get_content()) for result in nodes],
+            question_tokens_cut=getattr(self._reports, "question_tokens_cut", 0)
+        )
+        self._reports.question_tokens_cut = 0
+
+        packed_nodes = []
+        for node_id, text in packed:
+            original = by_id[node_id]
+            node = original.node.copy()
+            node.text = text
+            packed_nodes.append(NodeWithScore(node=node, score=original.score))
+        return packed_nodes
+
+
+class CoalescingQueryEngine:
+    """
+    Query engine wrapper that coalesces identical concurrent queries.
+
+    The chat engine condenses each turn into a standalone question before
+    querying, so sessions asking the same question at the same time can share
+    one retrieval and completion. Each session keeps its own chat history.
+    """
+
+    def __init__(self, query_engine: Any, scope: str, context_packing: Optional[ContextPackingPostprocessor] = None):
+        """
+        Args:
+            query_engine: Query engine doing the actual retrieval and synthesis
+            scope (str): Identifies the index and retrieval settings, so only
+                engines that would give the same answer share queries
+            context_packing (Optional[ContextPackingPostprocessor]): Packing
+                postprocessor of the engine; questions are fitted to its budget
+        """
+        self._query_engine = query_engine
+        self._scope = scope
+        self.context_packing = context_packing
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._query_engine, name)
+
+    def _key(self, query: Any) -> Tuple[str, str]:
+        query_str = getattr(query, "query_str", query)
+        return (self._scope, " ".join(str(query_str).lower().split()).rstrip("?!. "))
+
+    def query(self, query: Any) -> Any:
+        if self.context_packing is not None and isinstance(query, str):
+            query = self.context_packing.fit_question(query)
+        return query_flights.do(self._key(query), lambda: self._query_engine.query(query))
+
+    async def aquery(self, query: Any) -> Any:
+        # Async callers are not coalesced across threads
+        if self.context_packing is not None and isinstance(query, str):
+            query = self.context_packing.fit_question(query)
+        return await self._query_engine.aquery(query)
+
+
+def get_query_engine(
+    index: Any,
+    service_context: Any,
+    bm25_index: Optional[BM25Index] = None,
+    similarity_top_k: int = 2,
+    candidates: int = 10,
+    rrf_k: int = 60,
+    context_packer: Optional[ContextPacker] = None
+) -> Any:
+    """
+    Create the query engine answering standalone questions over the index.
+    
+    When a BM25 index is given, retrieval fuses keyword and vector results;
+    otherwise the plain vector query engine is used. The engine holds no
+    conversation state and can be shared by all sessions.
     
     Args:
         index: LlamaIndex vector store index
         service_context: Service context for the model
+        bm25_index (Optional[BM25Index]): Keyword index for hybrid retrieval
+        similarity_top_k (int): Number of nodes passed to the model
+        candidates (int): Candidates taken from each retriever before fusion
+        rrf_k (int): Reciprocal rank fusion damping constant
+        context_packer (Optional[ContextPacker]): Packer fitting retrieved nodes
+            into the context budget; its report is available from the engine's
+            context_packing attribute after each call
         
     Returns:
-        Any: Chat engine for conversational QA
+        Any: Query engine
         
     Raises:
         ImportError: If LlamaIndex is not available
@@ -90,6 +314,276 @@ def get_chat_engine(index: Any, service_context: Any) -> Any:
             "Please install it with: pip install llama-index"
         )
         
-    query_engine = index.as_query_engine(service_context=service_context)
+    packing = ContextPackingPostprocessor(context_packer) if context_packer is not None else None
+    node_postprocessors = [packing] if packing is not None else []
+
+    if bm25_index is not None and len(bm25_index):
+        retriever = HybridRetriever(
+            index, bm25_index, similarity_top_k=similarity_top_k, candidates=candidates, rrf_k=rrf_k
+        )
+        query_engine = RetrieverQueryEngine.from_args(
+            retriever, service_context=service_context, node_postprocessors=node_postprocessors
+        )
+    else:
+        query_engine = index.as_query_engine(
+            service_context=service_context, similarity_top_k=similarity_top_k,
+            node_postprocessors=node_postprocessors
+        )
+    # Index, keyword index and service context are process-wide cached resources
+    scope = f"{id(index)}:{id(bm25_index)}:{id(service_context)}:{similarity_top_k}:{candidates}:{rrf_k}"
+    return CoalescingQueryEngine(query_engine, scope, context_packing=packing)
+
+
+def get_chat_engine(
+    index: Any,
+    service_context: Any,
+    bm25_index: Optional[BM25Index] = None,
+    similarity_top_k: int = 2,
+    candidates: int = 10,
+    rrf_k: int = 60,
+    context_packer: Optional[ContextPacker] = None
+) -> Any:
+    """
+    Create a condense-question chat engine from an index and service context.
+    
+    Args:
+        index: LlamaIndex vector store index
+        service_context: Service context for the model
+        bm25_index (Optional[BM25Index]): Keyword index for hybrid retrieval
+        similarity_top_k (int): Number of nodes passed to the model
+        candidates (int): Candidates taken from each retriever before fusion
+        rrf_k (int): Reciprocal rank fusion damping constant
+        context_packer (Optional[ContextPacker]): Packer fitting retrieved nodes
+            into the context budget
+        
+    Returns:
+        Any: Chat engine for conversational QA
+        
+    Raises:
+        ImportError: If LlamaIndex is not available
+    """
+    query_engine = get_query_engine(
+        index, service_context, bm25_index=bm25_index, similarity_top_k=similarity_top_k,
+        candidates=candidates, rrf_k=rrf_k, context_packer=context_packer
+    )
     chat_engine = CondenseQuestionChatEngine.from_defaults(query_engine, verbose=True)
-    return chat_engine
\ No newline at end of file
+    chat_engine.context_packing = query_engine.context_packing
+    return chat_engine
+
+
+CONDENSE_TEMPLATE = (
+    "Given a conversation (between Human and Assistant) and a follow up message from Human, "
+    "rewrite the message to be a standalone question that captures all relevant context "
+    "from the conversation.\n\n"
+    "<Chat History>\n{chat_history}\n\n"
+    "<Follow Up Message>\n{question}\n\n"
+    "<Standalone question>\n"
+)
+
+
+class SessionChatEngine:
+    """
+    Chat engine created once per session over a shared query engine.
+    
+    Each turn condenses the follow-up question against a token-bounded memory
+    (running summary plus recent turns) instead of the full conversation, so
+    the condense prompt stays the same size as the conversation grows.
+    
+    The condense call is skipped on the first turn and for questions that look
+    standalone. For other follow-ups, retrieval on the raw question runs while
+    the question is condensed, and its results are kept when the condensed
+    question adds no new terms.
+    """
+
+    def __init__(
+        self,
+        query_engine: Any,
+        llm: Any,
+        memory_tokens: int = 512,
+        summary_words: int = 120,
+        skip_standalone: bool = True,
+        speculative_retrieval: bool = True
+    ):
+        """
+        Args:
+            query_engine: Shared query engine from get_query_engine
+            llm: LlamaIndex LLM used to condense questions and summarise turns
+            memory_tokens (int): Token budget of verbatim turns in the memory
+            summary_words (int): Target length of the running summary
+            skip_standalone (bool): Skip condensing questions that look standalone
+            speculative_retrieval (bool): Retrieve on the raw question while condensing
+        """
+        self.query_engine = query_engine
+        self.llm = llm
+        self.memory = SummarizingMemory(self._complete, token_limit=memory_tokens, summary_words=summary_words)
+        self.skip_standalone = skip_standalone
+        self.speculative_retrieval = speculative_retrieval
+        self.last_turn_report: Dict[str, Any] = {}
+
+    @property
+    def context_packing(self) -> Any:
+        """Context-packing postprocessor of the shared query engine, if any."""
+        return getattr(self.query_engine, "context_packing", None)
+
+    def fit_question(self, question: str) -> str:
+        """The question cut to the engine's context-packing budget, if it packs its context."""
+        packing = self.context_packing
+        return packing.fit_question(question) if packing is not None else question
+
+    def shared_resources(self) -> List[Any]:
+        """Objects this engine references but does not own (for memory reports)."""
+        return [self.query_engine, self.llm]
+
+    def _complete(self, prompt: str) -> str:
+        return self.llm.complete(prompt).text
+
+    def needs_condense(self, message: str) -> bool:
+        """
+        Whether answering the message requires a condense call.
+        
+        Args:
+            message (str): User message
+            
+        Returns:
+            bool: False on the first turn and for questions that look standalone
+        """
+        if not len(self.memory):
+            return False
+        return not (self.skip_standalone and looks_standalone(message))
+
+    def estimate(self, message: str, context_window: int) -> Tuple[int, int]:
+        """
+        Estimate the tokens and completions the next turn will use.
+        
+        Args:
+            message (str): User message
+            context_window (int): Model context window used for the answer
+            
+        Returns:
+            Tuple[int, int]: (estimated tokens, number of completions)
+        """
+        question_tokens = count_tokens(message)
+        if not self.needs_condense(message):
+            return question_tokens + context_window, 1
+        history_tokens = self.memory.turns_tokens() + count_tokens(self.memory.summary)
+        requests = 2
+        if self.memory.needs_folding():
+            # The summarisation call reads the turns being folded
+            requests += 1
+            history_tokens += self.memory.turns_tokens()
+        # Condense prompt and rewritten question, then the answer call
+        return history_tokens + 2 * question_tokens + context_window, requests
+
+    def chat(self, message: str) -> Any:
+        """
+        Answer a message in the context of the conversation so far.
+        
+        Args:
+            message (str): User message
+            
+        Returns:
+            Any: The query engine's response
+        """
+        if not self.needs_condense(message):
+            response = self.query_engine.query(message)
+            self.last_turn_report = {
+                "condense": "skipped (first turn)" if not len(self.memory) else "skipped (standalone)",
+                "condense_prompt_tokens": 0,
+                "standalone_question": message,
+                "summarised_this_turn": False,
+                **self.memory.stats(),
+            }
+            self.memory.add_turn(message, str(response.response or ""))
+            return response
+
+        summarised = self.memory.fold()
+        memory_stats = self.memory.stats()
+        prompt = CONDENSE_TEMPLATE.format(chat_history=self.memory.history_text(), question=message)
+
+        if self.speculative_retrieval and hasattr(self.query_engine, "retrieve"):
+            # Condense in the background; retrieve here so that per-thread
+            # context-packing reports stay with this session
+            condensing = _condense_executor.submit(self._complete, prompt)
+            # query() fits string questions itself; retrieve() and synthesize() do not
+            query_bundle = QueryBundle(self.fit_question(message))
+            nodes = self.query_engine.retrieve(query_bundle)
+            standalone_question = condensing.result().strip() or message
+            if adds_context(standalone_question, message):
+                condense = "condensed (speculative retrieval discarded)"
+                response = self.query_engine.query(standalone_question)
+            else:
+                condense = "condensed (speculative retrieval kept)"
+                response = self.query_engine.synthesize(query_bundle, nodes)
+        else:
+            condense = "condensed"
+            standalone_question = self._complete(prompt).strip() or message
+            response = self.query_engine.query(standalone_question)
+
+        self.memory.add_turn(message, str(response.response or ""))
+        self.last_turn_report = {
+            "condense": condense,
+            "condense_prompt_tokens": count_tokens(prompt),
+            "standalone_question": standalone_question,
+            "summarised_this_turn": summarised,
+            **memory_stats,
+        }
+        return response
+
+
+def format_turn_report(report: Optional[Dict[str, Any]]) -> str:
+    """
+    Summarise a SessionChatEngine turn report in one line for display.
+    
+    Args:
+        report (Optional[Dict[str, Any]]): The engine's last_turn_report
+        
+    Returns:
+        str: Human-readable summary, empty if there is no report
+    """
+    if not report:
+        return ""
+    if not report["condense_prompt_tokens"]:
+        return f"Condense {report['condense']}"
+    text = (
+        f"Condense prompt: {report['condense_prompt_tokens']} tokens, {report['condense']} "
+        f"({report['recent_turns']} recent turns, {report['recent_tokens']} tokens"
+    )
+    if report["summarised_turns"]:
+        text += f"; {report['summarised_turns']} earlier turns in a {report['summary_tokens']}-token summary"
+    return text + ")"
+
+
+@profiled("chat")
+def chat_with_rate_limit(
+    chat_engine: Any,
+    message: str,
+    context_window: int,
+    priority: int = PRIORITY_INTERACTIVE
+) -> Any:
+    """
+    Run one chat turn through the process-wide OpenAI rate limiter.
+
+    A condense-question turn makes two completions: rewriting the question
+    from the history, then answering it over at most a full context window.
+    A SessionChatEngine estimates its own turn, which may skip the condense
+    call or add one to fold old turns into its summary.
+
+    Args:
+        chat_engine: SessionChatEngine or chat engine returned by get_chat_engine
+        message (str): User message
+        context_window (int): Model context window used for the answer
+        priority (int): Rate-limiter priority for the turn
+
+    Returns:
+        Any: The chat engine's response
+    """
+    if isinstance(chat_engine, SessionChatEngine):
+        estimated_tokens, requests = chat_engine.estimate(message, context_window)
+    else:
+        history = getattr(chat_engine, "chat_history", None) or []
+        history_tokens = sum(count_tokens(str(getattr(m, "content", "") or "")) for m in history)
+        # Condense prompt and rewritten question, then the answer call
+        estimated_tokens = history_tokens + 2 * count_tokens(message) + context_window
+        requests = 2
+    with get_scheduler().slot(estimated_tokens, priority=priority, requests=requests):
+        return chat_engine.chat(message)
@@ -2,17 +2,80 @@
 Module for handling API requests to OpenAI services.
 """
 import base64
+import hashlib
+import json
+import math
 import requests
 from typing import Dict, Any, List, Optional
 from io import BytesIO
 from PIL import Image
 
+from config.settings import OPENAI_MAX_RATE_LIMIT_RETRIES, UNKNOWN_QUERY_COMPLETION_ESTIMATE
+from src.api.rate_limiter import PRIORITY_INTERACTIVE, get_scheduler
+from src.api.single_flight import SingleFlight
+from src.utils.ingredient_parser import IngredientNode, ingredient_tree_from_json
+from src.utils.tokens import count_tokens
+
 # Try to import openai, but make it optional
 try:
     import openai
 except ImportError:
     openai = None
 
+EXTRACTION_PROMPT = (
+    "Focus on identifying food ingredients in the image. "
+    "First, locate any section labeled 'Ingredients:' or 'INGREDIENTS'. "
+    "Then extract ONLY the actual ingredient names themselves (like water, sugar, flour, "
+    "etc.) that follow this heading. "
+    "Ignore any non-ingredient text. "
+    "Return the ingredients as a simple comma-separated list. "
+    "If there's no explicit ingredients label, identify the list of food additives and "
+    "ingredients directly from the packaging based on their appearance and position. "
+    "Focus on detecting actual food ingredients regardless of their position or "
+    "formatting on the package."
+)
+
+STRUCTURED_EXTRACTION_PROMPT = (
+    "Read the ingredients list on this food label. "
+    "Return every ingredient in label order, exactly as printed but without quantities or percentages. "
+    "Put bracketed components of an ingredient in its sub_ingredients, "
+    "and its E-number or INS code, if printed, in e_code (e.g. \"E322\"); otherwise use null. "
+    "Leave out allergen statements and any other text. "
+    "If there is no ingredients list, return an empty ingredients array."
+)
+
+# Strict structured-output schema; OpenAI requires every property to be listed
+# as required, so optional fields are nullable or empty instead
+_INGREDIENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "e_code": {"type": ["string", "null"]},
+        "sub_ingredients": {"type": "array", "items": {"$ref": "#/$defs/ingredient"}},
+    },
+    "required": ["name", "e_code", "sub_ingredients"],
+    "additionalProperties": False,
+}
+INGREDIENTS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "ingredients_list",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"ingredients": {"type": "array", "items": {"$ref": "#/$defs/ingredient"}}},
+            "required": ["ingredients"],
+            "additionalProperties": False,
+            "$defs": {"ingredient": _INGREDIENT_SCHEMA},
+        },
+    },
+}
+
+UNKNOWN_QUERY_MODEL = "gpt-3.5-turbo"
+
+# Identical requests in flight at the same time share one API call
+openai_flights = SingleFlight()
+
 
 def encode_image(image_bytes: bytes) -> str:
     """
@@ -44,7 +107,131 @@ def get_openai_headers(api_key: str) -> Dict[str, str]:
     }
 
 
-def extract_ingredients_from_image(image_bytes: bytes, api_key: str, endpoint: str, model: str, max_tokens: int) -> str:
+def credentials_key(api_key: str, endpoint: str) -> str:
+    """
+    Digest of the API key and endpoint for single-flight keys.
+
+    Callers only share a flight when they would have sent the same request with
+    the same credentials; the key itself is never kept in the flight table.
+
+    Args:
+        api_key (str): OpenAI API key
+        endpoint (str): API endpoint URL
+
+    Returns:
+        str: Hex digest identifying the credentials
+    """
+    return hashlib.sha256(f"{endpoint}\n{api_key}".encode("utf-8")).hexdigest()
+
+
+def estimate_image_tokens(image_bytes: bytes) -> int:
+    """
+    Estimate the prompt tokens a high-detail image costs the vision model.
+
+    The image is scaled to fit 2048x2048, then its shortest side to 768, and
+    charged 170 tokens per 512px tile plus a base of 85.
+
+    Args:
+        image_bytes (bytes): Raw image bytes
+
+    Returns:
+        int: Estimated image tokens
+    """
+    try:
+        width, height = Image.open(BytesIO(image_bytes)).size
+    except Exception:
+        # Unreadable here; assume a typical phone photo (4 tiles)
+        return 85 + 170 * 4
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def estimate_message_tokens(messages: List[Dict[str, Any]]) -> int:
+    """
+    Estimate the prompt tokens of the text parts of a chat payload.
+
+    Args:
+        messages (List[Dict[str, Any]]): Chat messages
+
+    Returns:
+        int: Estimated prompt tokens, including per-message overhead
+    """
+    total = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            total += count_tokens(content)
+        else:
+            total += sum(count_tokens(part.get("text", "")) for part in content)
+        total += 4
+    return total
+
+
+def post_chat_completion(
+    endpoint: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    estimated_tokens: int,
+    priority: int = PRIORITY_INTERACTIVE
+) -> Dict[str, Any]:
+    """
+    Send a chat completion request through the process-wide rate limiter.
+
+    The request waits for rate-limit budget before it is sent. A 429 pauses
+    the scheduler for the Retry-After period and the request is queued again.
+    Each attempt's reservation is corrected to the reported usage, or refunded
+    if the attempt failed.
+
+    Args:
+        endpoint (str): API endpoint URL
+        headers (Dict[str, str]): Request headers
+        payload (Dict[str, Any]): Request body
+        estimated_tokens (int): Prompt plus expected completion tokens
+        priority (int): Scheduler priority
+
+    Returns:
+        Dict[str, Any]: Decoded response body
+
+    Raises:
+        requests.exceptions.RequestException: If API request fails
+        SchedulerTimeout: If no budget became available in time
+    """
+    scheduler = get_scheduler()
+    for attempt in range(OPENAI_MAX_RATE_LIMIT_RETRIES + 1):
+        ticket = scheduler.acquire(estimated_tokens, priority=priority)
+        try:
+            response = requests.post(endpoint, headers=headers, json=payload)
+        except requests.exceptions.RequestException:
+            scheduler.refund(ticket)
+            raise
+        if not response.ok:
+            # Rejected requests (including each retried 429) use no tokens
+            scheduler.refund(ticket)
+        if response.status_code != 429 or attempt == OPENAI_MAX_RATE_LIMIT_RETRIES:
+            break
+        try:
+            retry_after = float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            retry_after = 2.0 ** attempt
+        scheduler.penalize(retry_after)
+    response.raise_for_status()  # Raise exception for HTTP errors
+
+    response_data = response.json()
+    scheduler.reconcile(ticket, response_data.get("usage", {}).get("total_tokens"))
+    return response_data
+
+
+def extract_ingredients_from_image(
+    image_bytes: bytes,
+    api_key: str,
+    endpoint: str,
+    model: str,
+    max_tokens: int,
+    priority: int = PRIORITY_INTERACTIVE
+) -> str:
     """
     Use OpenAI's Vision model to extract ingredients from an image.
     
@@ -54,6 +241,7 @@ def extract_ingredients_from_image(image_bytes: bytes, api_key: str, endpoint: s
         endpoint (str): API endpoint URL
         model (str): Model name to use
         max_tokens (int): Maximum tokens for response
+        priority (int): Rate-limiter priority for the request
         
     Returns:
         str: Extracted ingredients text
@@ -61,6 +249,22 @@ def extract_ingredients_from_image(image_bytes: bytes, api_key: str, endpoint: s
     Raises:
         requests.exceptions.RequestException: If API request fails
     """
+    # A caller never joins a flight sent with other credentials, and an interactive
+    # caller never waits in a background flight
+    key = (
+        "vision", credentials_key(api_key, endpoint), hashlib.sha256(image_bytes).hexdigest(), model,
+        EXTRACTION_PROMPT, max_tokens, priority
+    )
+    response_data = openai_flights.do(
+        key, lambda: _extract_ingredients(image_bytes, api_key, endpoint, model, max_tokens, priority)
+    )
+    return response_data['choices'][0]['message']['content']
+
+
+def _extract_ingredients(
+    image_bytes: bytes, api_key: str, endpoint: str, model: str, max_tokens: int, priority: int,
+    prompt: str = EXTRACTION_PROMPT, response_format: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
     # Encode the image
     base64_image = encode_image(image_bytes)
     
@@ -76,7 +280,7 @@ def extract_ingredients_from_image(image_bytes: bytes, api_key: str, endpoint: s
                 "content": [
                     {
                         "type": "text",
-                        "text": "Focus on identifying food ingredients in the image. First, locate any section labeled 'Ingredients:' or 'INGREDIENTS'. Then extract ONLY the actual ingredient names themselves (like water, sugar, flour, etc.) that follow this heading. Ignore any non-ingredient text. Return the ingredients as a simple comma-separated list. If there's no explicit ingredients label, identify the list of food additives and ingredients directly from the packaging based on their appearance and position. Focus on detecting actual food ingredients regardless of their position or formatting on the package."
+                        "text": prompt
                     },
                     {
                         "type": "image_url",
@@ -89,19 +293,67 @@ def extract_ingredients_from_image(image_bytes: bytes, api_key: str, endpoint: s
         ],
         "max_tokens": max_tokens
     }
+    if response_format is not None:
+        payload["response_format"] = response_format
     
-    # Make the API request to OpenAI
-    response = requests.post(endpoint, headers=headers, json=payload)
-    response.raise_for_status()  # Raise exception for HTTP errors
-    
-    # Extract content from response
-    response_data = response.json()
-    ingredients_text = response_data['choices'][0]['message']['content']
-    
-    return ingredients_text
+    # Make the API request to OpenAI once the rate limiter lets it through
+    estimated_tokens = (
+        estimate_message_tokens(payload["messages"]) + estimate_image_tokens(image_bytes) + max_tokens
+    )
+    return post_chat_completion(endpoint, headers, payload, estimated_tokens, priority)
 
 
-def query_openai_about_ingredients(ingredient_list: List[str], api_key: str, endpoint: str) -> str:
+def extract_ingredients_structured(
+    image_bytes: bytes,
+    api_key: str,
+    endpoint: str,
+    model: str,
+    max_tokens: int,
+    priority: int = PRIORITY_INTERACTIVE
+) -> List[IngredientNode]:
+    """
+    Use OpenAI's Vision model to extract ingredients from an image as JSON.
+
+    The model answers with JSON matching INGREDIENTS_RESPONSE_FORMAT, which
+    is validated and turned into parsed entries; the text parser isn't used.
+
+    Args:
+        image_bytes (bytes): Raw image bytes
+        api_key (str): OpenAI API key
+        endpoint (str): API endpoint URL
+        model (str): Model name to use (must support structured outputs)
+        max_tokens (int): Maximum tokens for response
+        priority (int): Rate-limiter priority for the request
+
+    Returns:
+        List[IngredientNode]: Top-level entries with their sub-ingredients
+
+    Raises:
+        requests.exceptions.RequestException: If API request fails
+        ValueError: If the model refused, ran out of tokens or returned JSON not matching the schema
+    """
+    key = (
+        "vision-json", credentials_key(api_key, endpoint), hashlib.sha256(image_bytes).hexdigest(), model,
+        STRUCTURED_EXTRACTION_PROMPT, max_tokens, priority
+    )
+    response_data = openai_flights.do(key, lambda: _extract_ingredients(
+        image_bytes, api_key, endpoint, model, max_tokens, priority,
+        prompt=STRUCTURED_EXTRACTION_PROMPT, response_format=INGREDIENTS_RESPONSE_FORMAT
+    ))
+    choice = response_data['choices'][0]
+    if choice.get("finish_reason") == "length":
+        raise ValueError(f"Structured extraction was cut off at {max_tokens} tokens")
+    if choice['message'].get("refusal"):
+        raise ValueError(f"Structured extraction refused: {choice['message']['refusal']}")
+    return ingredient_tree_from_json(json.loads(choice['message']['content'] or ""))
+
+
+def query_openai_about_ingredients(
+    ingredient_list: List[str],
+    api_key: str,
+    endpoint: str,
+    priority: int = PRIORITY_INTERACTIVE
+) -> str:
     """
     Query OpenAI about the halal status of unknown ingredients.
     
@@ -109,6 +361,7 @@ def query_openai_about_ingredients(ingredient_list: List[str], api_key: str, end
         ingredient_list (List[str]): List of ingredients to query
         api_key (str): OpenAI API key
         endpoint (str): API endpoint URL
+        priority (int): Rate-limiter priority for the request
         
     Returns:
         str: OpenAI's response about the ingredients
@@ -116,16 +369,26 @@ def query_openai_about_ingredients(ingredient_list: List[str], api_key: str, end
     Raises:
         requests.exceptions.RequestException: If API request fails
     """
+    key = (
+        "unknowns", credentials_key(api_key, endpoint), UNKNOWN_QUERY_MODEL,
+        tuple(" ".join(str(i).lower().split()) for i in ingredient_list), priority
+    )
+    return openai_flights.do(
+        key, lambda: _query_unknowns(ingredient_list, api_key, endpoint, priority)
+    )
+
+
+def _query_unknowns(ingredient_list: List[str], api_key: str, endpoint: str, priority: int) -> str:
     headers = get_openai_headers(api_key)
     
     payload = {
-        "model": "gpt-3.5-turbo",
+        "model": UNKNOWN_QUERY_MODEL,
         "messages": [
             {"role": "system", "content": "You are a helpful assistant that provides information."},
             {"role": "user", "content": f"Determine if the ingredients in '{ingredient_list}' are halal."}
         ]
     }
     
-    response = requests.post(endpoint, headers=headers, json=payload)
-    response.raise_for_status()
-    return response.json()['choices'][0]['message']['content']
\ No newline at end of file
+    estimated_tokens = estimate_message_tokens(payload["messages"]) + UNKNOWN_QUERY_COMPLETION_ESTIMATE
+    response_data = post_chat_completion(endpoint, headers, payload, estimated_tokens, priority)
+    return response_data['choices'][0]['message']['content']
\ No newline at end of file
@@ -0,0 +1,279 @@
+"""
+Process-wide rate limiter and token-budget scheduler for OpenAI calls.
+
+Every OpenAI request in the process waits here for a requests-per-minute and a
+tokens-per-minute budget before it is dispatched. Callers queue instead of
+failing, interactive work is dispatched before background work, and a 429
+from the API pauses dispatching for everyone rather than letting each caller
+retry on its own.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from config.settings import OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT, OPENAI_MAX_QUEUE_WAIT
+
+# Lower values are dispatched first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+
+class SchedulerTimeout(TimeoutError):
+    """Raised when a request waited longer than allowed for its budget."""
+
+
+class TokenBucket:
+    """
+    Continuously refilling budget, e.g. 500 requests or 200k tokens per minute.
+    """
+
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / per_seconds
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until the bucket holds the amount (capped at capacity)."""
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def consume(self, amount: float) -> None:
+        # Requests larger than the whole bucket are let through on a full bucket
+        self.level -= min(amount, self.capacity)
+
+
+class Ticket:
+    """
+    A dispatched request's reservation, used to reconcile the token estimate
+    with the usage the API reports.
+    """
+
+    def __init__(self, estimated_tokens: int, priority: int, waited: float):
+        self.estimated_tokens = estimated_tokens
+        self.priority = priority
+        self.waited = waited
+
+
+class OpenAIScheduler:
+    """
+    Priority queue in front of requests-per-minute and tokens-per-minute buckets.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int,
+        tokens_per_minute: int,
+        max_wait: Optional[float] = None,
+        history: int = 1000
+    ):
+        """
+        Args:
+            requests_per_minute (int): Request budget per minute
+            tokens_per_minute (int): Token budget per minute
+            max_wait (Optional[float]): Default maximum queueing time in seconds
+            history (int): Number of recent wait times kept for metrics
+        """
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._max_wait = max_wait
+        self._condition = threading.Condition()
+        self._queue: List[Any] = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._waits: Deque[float] = deque(maxlen=history)
+        self._dispatched: Dict[int, int] = {}
+        self._timeouts = 0
+        self._rate_limited = 0
+
+    def acquire(
+        self,
+        estimated_tokens: int,
+        priority: int = PRIORITY_INTERACTIVE,
+        requests: int = 1,
+        timeout: Optional[float] = None
+    ) -> Ticket:
+        """
+        Block until the request may be dispatched.
+
+        Args:
+            estimated_tokens (int): Prompt plus expected completion tokens
+            priority (int): PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
+            requests (int): Number of API requests this reservation covers
+            timeout (Optional[float]): Maximum wait in seconds (defaults to the scheduler's)
+
+        Returns:
+            Ticket: Reservation to pass to reconcile()
+
+        Raises:
+            SchedulerTimeout: If the budget did not become available in time
+        """
+        timeout = self._max_wait if timeout is None else timeout
+        enqueued = time.monotonic()
+        entry = [priority, next(self._sequence)]
+        with self._condition:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._requests.refill(now)
+                    self._tokens.refill(now)
+                    if self._queue[0] is entry:
+                        delay = max(
+                            self._paused_until - now,
+                            self._requests.time_until(requests),
+                            self._tokens.time_until(estimated_tokens),
+                        )
+                        if delay <= 0:
+                            break
+                    else:
+                        # Someone ahead of us is waiting; they will notify us
+                        delay = None
+                    if timeout is not None:
+                        remaining = enqueued + timeout - now
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise SchedulerTimeout(
+                                f"Waited {timeout:.1f}s for OpenAI rate-limit budget"
+                            )
+                        delay = remaining if delay is None else min(delay, remaining)
+                    self._condition.wait(delay)
+
+                heapq.heappop(self._queue)
+                self._requests.consume(requests)
+                self._tokens.consume(estimated_tokens)
+            except BaseException:
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                raise
+            finally:
+                self._condition.notify_all()
+
+            waited = time.monotonic() - enqueued
+            self._waits.append(waited)
+            self._dispatched[priority] = self._dispatched.get(priority, 0) + 1
+        return Ticket(estimated_tokens, priority, waited)
+
+    def reconcile(self, ticket: Ticket, actual_tokens: Optional[int]) -> None:
+        """
+        Correct the token bucket once the API reports the real usage.
+
+        Args:
+            ticket (Ticket): Reservation returned by acquire()
+            actual_tokens (Optional[int]): Total tokens reported by the API
+        """
+        if actual_tokens is None:
+            return
+        with self._condition:
+            self._tokens.level = min(
+                self._tokens.capacity, self._tokens.level + ticket.estimated_tokens - actual_tokens
+            )
+            self._condition.notify_all()
+
+    def refund(self, ticket: Ticket) -> None:
+        """
+        Return a ticket's whole token estimate, for a request the API rejected
+        or that never reached it.
+
+        Args:
+            ticket (Ticket): Reservation returned by acquire()
+        """
+        self.reconcile(ticket, 0)
+
+    def penalize(self, retry_after: float) -> None:
+        """
+        Pause all dispatching after the API answered 429.
+
+        Args:
+            retry_after (float): Seconds to wait, from the Retry-After header
+        """
+        with self._condition:
+            self._rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    @contextmanager
+    def slot(
+        self,
+        estimated_tokens: int,
+        priority: int = PRIORITY_INTERACTIVE,
+        requests: int = 1
+    ) -> Iterator[Ticket]:
+        """
+        Context manager reserving budget for the enclosed API call(s).
+
+        Args:
+            estimated_tokens (int): Prompt plus expected completion tokens
+            priority (int): PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND
+            requests (int): Number of API requests made inside the block
+        """
+        yield self.acquire(estimated_tokens, priority=priority, requests=requests)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Snapshot of queue depth, wait times and remaining budget.
+
+        Returns:
+            Dict[str, Any]: Scheduler metrics
+        """
+        with self._condition:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            waits = sorted(self._waits)
+            depth_by_priority: Dict[str, int] = {}
+            for priority, _ in self._queue:
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                depth_by_priority[name] = depth_by_priority.get(name, 0) + 1
+            return {
+                "queue_depth": len(self._queue),
+                "queue_depth_by_priority": depth_by_priority,
+                "dispatched": {PRIORITY_NAMES.get(p, str(p)): n for p, n in self._dispatched.items()},
+                "wait_p50_s": _nearest_rank(waits, 50),
+                "wait_p95_s": _nearest_rank(waits, 95),
+                "wait_max_s": _nearest_rank(waits, 100),
+                "requests_available": int(self._requests.level),
+                "tokens_available": int(self._tokens.level),
+                "paused_for_s": round(max(0.0, self._paused_until - now), 1),
+                "rate_limited": self._rate_limited,
+                "timeouts": self._timeouts,
+            }
+
+
+def _nearest_rank(ordered: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list, rounded to milliseconds."""
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[rank], 3)
+
+
+_scheduler: Optional[OpenAIScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> OpenAIScheduler:
+    """
+    Return the process-wide scheduler, creating it from settings on first use.
+
+    Returns:
+        OpenAIScheduler: Shared scheduler instance
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = OpenAIScheduler(
+                    OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT, max_wait=OPENAI_MAX_QUEUE_WAIT
+                )
+    return _scheduler
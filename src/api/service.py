@@ -0,0 +1,419 @@
+"""
+Headless HTTP classification service for POS and inventory integrations.
+
+Exposes text classification, image classification and e-number lookup over the
+same analysis modules as the Streamlit app. Text lookups are answered on the
+event loop; blocking OpenAI calls run on a bounded worker pool, and identical
+requests in flight at the same time share one upstream call.
+
+Usage:
+    python -m src.api.service [--host HOST] [--port PORT] [--workers N]
+
+For several processes per container, run the factory under gunicorn:
+    gunicorn "src.api.service:make_app" --worker-class aiohttp.GunicornWebWorker -w 4
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+import requests
+from PIL import Image
+
+from config.settings import (
+    INGREDIENTS_DATASET, OPENAI_API_ENDPOINT, VISION_MODEL, MAX_TOKENS,
+    SERVICE_HOST, SERVICE_PORT, SERVICE_WORKERS, SERVICE_MAX_TEXT_BYTES, SERVICE_MAX_IMAGE_BYTES,
+    IMAGE_REUSE_EXTRACTIONS, LOCAL_OCR_ENABLED, LOCAL_CLASSIFIER_ENABLED, VISION_STRUCTURED_OUTPUT, WARMUP_ENABLED,
+    load_api_config
+)
+from src.api.openai_handler import openai_flights
+from src.api.rate_limiter import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, SchedulerTimeout, get_scheduler
+from src.api.single_flight import AsyncSingleFlight
+from src.utils.analysis import analyze_image, analyze_ingredients_text
+from src.utils.call_planner import DETAIL_FULL, DETAIL_VERDICT, call_stats
+from src.utils.history_store import get_history_store
+from src.utils.image_hash import get_image_index
+from src.utils.ingredient_parser import normalise_enumber
+from src.utils.ingredient_classifier import IngredientClassifier, get_local_classifier
+from src.utils.local_ocr import ocr_stats
+from src.utils.kb_reloader import KnowledgeBaseReloader, get_kb_reloader
+from src.utils.knowledge_base import KnowledgeBase
+from src.utils.results_sink import analysis_record, get_results_sink
+from src.utils.warmup import Warmup
+
+# Try to import aiohttp, but make it optional
+try:
+    from aiohttp import web
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    web = None
+    AIOHTTP_AVAILABLE = False
+
+KB_KEY = "knowledge_base"
+EXECUTOR_KEY = "executor"
+API_KEY_KEY = "api_key"
+FLIGHTS_KEY = "flights"
+WARMUP_KEY = "warmup"
+
+
+def json_error(status: int, message: str) -> Any:
+    """
+    Build a JSON error response.
+
+    Args:
+        status (int): HTTP status code
+        message (str): Error message
+
+    Returns:
+        web.Response: Response with body {"error": message}
+    """
+    return web.json_response({"error": message}, status=status)
+
+
+def upstream_error(error: Exception) -> Any:
+    """
+    Map a failed OpenAI call to an error response.
+
+    Only failures of the upstream API are caught by the handlers; anything else
+    is a bug in the service and surfaces as a 500.
+
+    Args:
+        error (Exception): RequestException or SchedulerTimeout from the analysis
+
+    Returns:
+        web.Response: 503 if the rate-limit budget ran out, 502 otherwise
+    """
+    if isinstance(error, SchedulerTimeout):
+        return json_error(503, f"OpenAI budget exhausted, retry later: {error}")
+    return json_error(502, f"Upstream analysis failed: {error}")
+
+
+def is_readable_image(image_bytes: bytes) -> bool:
+    """Whether the bytes decode as an image, checked before spending a vision call on them."""
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            image.verify()
+        return True
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError):
+        return False
+
+
+def request_priority(value: Optional[str]) -> int:
+    """
+    Map a client's "priority" field to a rate-limiter priority.
+
+    Inventory and other batch jobs send "background" so that they queue
+    behind interactive POS scans when the OpenAI budget is tight.
+
+    Args:
+        value (Optional[str]): "interactive" (default) or "background"
+
+    Returns:
+        int: Rate-limiter priority
+    """
+    return PRIORITY_BACKGROUND if (value or "").lower() in ("background", "batch") else PRIORITY_INTERACTIVE
+
+
+def classification_payload(results: Dict[str, Any], kb: KnowledgeBase) -> Dict[str, Any]:
+    """
+    Shape analysis results for the JSON API.
+
+    Args:
+        results (Dict[str, Any]): Results from the analysis pipeline
+        kb (KnowledgeBase): Knowledge base used for the classification
+
+    Returns:
+        Dict[str, Any]: Response body
+    """
+    return {
+        "product_status": results["product_status"],
+        "ingredients": [
+            {"name": name, "status": results["ingredient_statuses"][name.lower()]}
+            for name in results["ingredients_list"]
+        ],
+        "unknown_ingredients": results["unknown_ingredients"],
+        "predicted_unknowns": results.get("predicted_unknowns") or [],
+        "analysis": results.get("halal_status_response"),
+        "call_plan": results.get("call_plan"),
+        "deferred_unknowns": results.get("deferred_unknowns") or [],
+        "ingredients_text": results["ingredients_text"],
+        "kb_version": kb.version,
+        "previously_analysed_at": results.get("previously_analysed_at"),
+        "image_match": results.get("image_match"),
+        "local_ocr": results.get("local_ocr"),
+        "structured_extraction": results.get("structured_extraction"),
+    }
+
+
+def previous_lookup(kb: KnowledgeBase) -> Any:
+    """
+    Lookup of earlier results for the same ingredients and dataset version.
+
+    Args:
+        kb (KnowledgeBase): Knowledge base used for the classification
+
+    Returns:
+        Any: Callable for the analysis pipeline's previous_lookup argument
+    """
+    history = get_history_store()
+    return lambda ingredients_text: history.find_previous(ingredients_text, kb.version)
+
+
+def local_classifier() -> Optional[IngredientClassifier]:
+    """The local classifier for unknown ingredients, or None if disabled or untrained."""
+    return get_local_classifier() if LOCAL_CLASSIFIER_ENABLED else None
+
+
+def log_result(results: Dict[str, Any], kb: KnowledgeBase, product_name: str = "") -> None:
+    """
+    Queue a classification for the results log and the history store
+    (both buffered, written in the background).
+
+    Args:
+        results (Dict[str, Any]): Results from the analysis pipeline
+        kb (KnowledgeBase): Knowledge base used for the classification
+        product_name (str): Optional product name sent by the client
+    """
+    record = analysis_record(dict(results, kb_version=kb.version), source="service", product_name=product_name)
+    get_results_sink().append(record)
+    get_history_store().record(record)
+
+
+async def handle_health(request: Any) -> Any:
+    """Liveness check reporting the knowledge base size and version; 503 if a required component failed to load."""
+    kb = request.app[KB_KEY].current()
+    warmup = request.app[WARMUP_KEY]
+    return web.json_response(
+        {"status": "ok" if warmup.is_live() else "failed", "ingredients": len(kb), "kb_version": kb.version},
+        status=200 if warmup.is_live() else 503
+    )
+
+
+async def handle_ready(request: Any) -> Any:
+    """Readiness check: 503 until the required components have warmed up."""
+    status = request.app[WARMUP_KEY].status()
+    return web.json_response(status, status=200 if status["ready"] else 503)
+
+
+async def handle_classify_text(request: Any) -> Any:
+    """
+    POST /v1/classify/text
+
+    Body: {"ingredients": "water, sugar, e471", "explain_unknowns": false,
+           "priority": "interactive", "product_name": "optional"}
+    """
+    if request.content_length is not None and request.content_length > SERVICE_MAX_TEXT_BYTES:
+        return json_error(413, f"Request body exceeds {SERVICE_MAX_TEXT_BYTES} bytes")
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return json_error(400, "Request body must be JSON")
+
+    ingredients_text = body.get("ingredients") if isinstance(body, dict) else None
+    if not isinstance(ingredients_text, str) or not ingredients_text.strip():
+        return json_error(400, "'ingredients' must be a non-empty string")
+    if len(ingredients_text.encode("utf-8")) > SERVICE_MAX_TEXT_BYTES:
+        return json_error(413, f"'ingredients' exceeds {SERVICE_MAX_TEXT_BYTES} bytes")
+
+    kb = request.app[KB_KEY].current()
+    explain = bool(body.get("explain_unknowns", False))
+    product_name = str(body.get("product_name") or "")
+    if not explain:
+        # Pure lookup: cheap enough to answer on the event loop
+        results = analyze_ingredients_text(
+            ingredients_text, kb.lookup_table, detail=DETAIL_VERDICT, classifier=local_classifier()
+        )
+        log_result(results, kb, product_name)
+        return web.json_response(classification_payload(results, kb))
+
+    api_key = request.app[API_KEY_KEY]
+    if not api_key:
+        return json_error(503, "OpenAI API key is not configured")
+    priority = request_priority(body.get("priority"))
+    loop = asyncio.get_running_loop()
+    # Requests only share a flight with requests on the same dataset version and
+    # priority, so an interactive request never waits behind a background one
+    key = ("text", kb.version, " ".join(ingredients_text.lower().split()), priority)
+    try:
+        results = await request.app[FLIGHTS_KEY].do(key, lambda: loop.run_in_executor(
+            request.app[EXECUTOR_KEY],
+            lambda: analyze_ingredients_text(
+                ingredients_text, kb.lookup_table, api_key, OPENAI_API_ENDPOINT, priority=priority,
+                previous_lookup=previous_lookup(kb), classifier=local_classifier()
+            )
+        ))
+    except (requests.exceptions.RequestException, SchedulerTimeout) as e:
+        return upstream_error(e)
+    log_result(results, kb, product_name)
+    return web.json_response(classification_payload(results, kb))
+
+
+async def handle_classify_image(request: Any) -> Any:
+    """
+    POST /v1/classify/image
+
+    Body: raw image bytes (image/jpeg or image/png), or multipart/form-data with
+    an "image" field. Add ?explain_unknowns=true to query OpenAI about unknowns,
+    ?priority=background for batch work and ?product_name=... to label the result.
+    """
+    if request.content_type.startswith("multipart/"):
+        form = await request.post()
+        field = form.get("image")
+        if field is None or not hasattr(field, "file"):
+            return json_error(400, "Multipart body must contain an 'image' file field")
+        image_bytes = field.file.read()
+    elif request.content_type.startswith("image/"):
+        image_bytes = await request.read()
+    else:
+        return json_error(415, "Send the image as image/* or multipart/form-data")
+    if not image_bytes:
+        return json_error(400, "Empty image")
+    if not is_readable_image(image_bytes):
+        return json_error(400, "Body is not a readable JPEG or PNG image")
+
+    api_key = request.app[API_KEY_KEY]
+    if not api_key:
+        return json_error(503, "OpenAI API key is not configured")
+
+    kb = request.app[KB_KEY].current()
+    explain = request.query.get("explain_unknowns", "false").lower() in ("1", "true", "yes")
+    priority = request_priority(request.query.get("priority"))
+    loop = asyncio.get_running_loop()
+    key = ("image", kb.version, hashlib.sha256(image_bytes).hexdigest(), explain, priority)
+    try:
+        results = await request.app[FLIGHTS_KEY].do(key, lambda: loop.run_in_executor(
+            request.app[EXECUTOR_KEY],
+            lambda: analyze_image(
+                image_bytes, kb.lookup_table, api_key, OPENAI_API_ENDPOINT, VISION_MODEL, MAX_TOKENS,
+                detail=DETAIL_FULL if explain else DETAIL_VERDICT, priority=priority, previous_lookup=previous_lookup(kb),
+                image_index=get_image_index() if IMAGE_REUSE_EXTRACTIONS else None, local_ocr=LOCAL_OCR_ENABLED,
+                classifier=local_classifier(), structured=VISION_STRUCTURED_OUTPUT
+            )
+        ))
+    except (requests.exceptions.RequestException, SchedulerTimeout) as e:
+        return upstream_error(e)
+    log_result(results, kb, request.query.get("product_name", ""))
+    return web.json_response(classification_payload(results, kb))
+
+
+async def handle_openai_metrics(request: Any) -> Any:
+    """
+    GET /metrics/openai: rate-limiter queue depth, wait times, budget, coalescing,
+    photo reuse, local OCR and the knowledge base version.
+    """
+    metrics = get_scheduler().metrics()
+    metrics["coalescing"] = {
+        "requests": request.app[FLIGHTS_KEY].stats(),
+        "openai_calls": openai_flights.stats(),
+    }
+    metrics["near_duplicate_images"] = get_image_index().stats()
+    metrics["local_ocr"] = ocr_stats.stats()
+    metrics["call_plan"] = call_stats.stats()
+    metrics["warmup"] = request.app[WARMUP_KEY].status()
+    metrics["knowledge_base"] = request.app[KB_KEY].stats()
+    return web.json_response(metrics)
+
+
+async def handle_enumber(request: Any) -> Any:
+    """GET /v1/enumbers/{code}, e.g. /v1/enumbers/E471"""
+    code = request.match_info["code"]
+    if normalise_enumber(code) is None:
+        return json_error(400, f"'{code}' is not an e-number")
+    record = request.app[KB_KEY].current().lookup_enumber(code)
+    if record is None:
+        return json_error(404, f"No record for e-number '{code}'")
+    return web.json_response({"code": code.upper(), **record, "status": record["status"] or "Unknown"})
+
+
+async def error_middleware(request: Any, handler: Any) -> Any:
+    """Return JSON for every error, including aiohttp's own size-limit errors."""
+    try:
+        return await handler(request)
+    except web.HTTPException as e:
+        if e.content_type == "application/json":
+            raise
+        return json_error(e.status, e.reason)
+
+
+async def _shutdown_executor(app: Any) -> None:
+    app[EXECUTOR_KEY].shutdown(wait=False)
+
+
+async def _start_warmup(app: Any) -> None:
+    app[WARMUP_KEY].start()
+
+
+def create_app(
+    kb: Optional[KnowledgeBase] = None,
+    api_key: Optional[str] = None,
+    workers: int = SERVICE_WORKERS
+) -> Any:
+    """
+    Create the aiohttp application.
+
+    Args:
+        kb (Optional[KnowledgeBase]): Fixed knowledge base; if omitted the dataset
+            is loaded and reloaded whenever it changes
+        api_key (Optional[str]): OpenAI API key (loaded from config if omitted)
+        workers (int): Size of the worker pool for blocking OpenAI calls
+
+    Returns:
+        web.Application: The configured application
+
+    Raises:
+        ImportError: If aiohttp is not available
+    """
+    if not AIOHTTP_AVAILABLE:
+        raise ImportError(
+            "aiohttp is required for the HTTP service. "
+            "Please install it with: pip install aiohttp"
+        )
+
+    app = web.Application(client_max_size=SERVICE_MAX_IMAGE_BYTES, middlewares=[web.middleware(error_middleware)])
+    app[KB_KEY] = KnowledgeBaseReloader(kb=kb) if kb is not None else get_kb_reloader(str(INGREDIENTS_DATASET))
+    app[API_KEY_KEY] = api_key if api_key is not None else load_api_config()["api"].get("openai_key", "")
+    app[EXECUTOR_KEY] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="classify")
+    app[FLIGHTS_KEY] = AsyncSingleFlight()
+    # Loaded in the background once the server starts, instead of on the first request
+    app[WARMUP_KEY] = Warmup()
+    if WARMUP_ENABLED:
+        app[WARMUP_KEY].add("knowledge_base", app[KB_KEY].current).add("history", get_history_store)
+        if LOCAL_CLASSIFIER_ENABLED:
+            app[WARMUP_KEY].add("classifier", get_local_classifier)
+        if IMAGE_REUSE_EXTRACTIONS:
+            app[WARMUP_KEY].add("image_index", get_image_index)
+    app.on_startup.append(_start_warmup)
+    app.on_cleanup.append(_shutdown_executor)
+
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/readyz", handle_ready)
+    app.router.add_post("/v1/classify/text", handle_classify_text)
+    app.router.add_post("/v1/classify/image", handle_classify_image)
+    app.router.add_get("/v1/enumbers/{code}", handle_enumber)
+    app.router.add_get("/metrics/openai", handle_openai_metrics)
+    return app
+
+
+async def make_app() -> Any:
+    """Application factory for gunicorn's aiohttp worker."""
+    return create_app()
+
+
+def main() -> None:
+    """Command-line entry point running the service."""
+    parser = argparse.ArgumentParser(description="Run the halal classification HTTP service.")
+    parser.add_argument("--host", default=SERVICE_HOST, help="Interface to bind")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Worker threads for OpenAI calls")
+    args = parser.parse_args()
+    # Background components (the knowledge base reloader) report errors through logging
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    web.run_app(create_app(workers=args.workers), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
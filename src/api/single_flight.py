@@ -0,0 +1,150 @@
+"""
+Single-flight coalescing of identical in-flight requests.
+
+When several callers ask for the same thing at the same time (the same label
+photo scanned in several sessions, the same e-number question), only the first
+caller does the work; the others wait for its result. Nothing is cached once the
+call finishes, so later callers always get a fresh request.
+
+SingleFlight is for threads (Streamlit sessions, executor workers);
+AsyncSingleFlight is for coroutines on an event loop.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class FlightCancelled(Exception):
+    """The leading call was interrupted before it produced a result."""
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key across threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._leaders = 0
+        self._coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Run fn, or wait for an identical call that is already running.
+
+        If the leading call raises, every waiter receives the same exception.
+        If the leader is interrupted (e.g. its Streamlit script is stopped by a
+        rerun), waiters do not inherit the interruption: one of them retries
+        the call as the new leader.
+
+        Args:
+            key (Hashable): Normalised request key
+            fn (Callable[[], Any]): Function performing the request
+            timeout (Optional[float]): Maximum seconds a waiter waits for the leader
+
+        Returns:
+            Any: The result of fn
+
+        Raises:
+            concurrent.futures.TimeoutError: If a waiter's timeout expires
+        """
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = Future()
+                    self._calls[key] = future
+                    self._leaders += 1
+                else:
+                    self._coalesced += 1
+
+            if not leader:
+                try:
+                    return future.result(timeout)
+                except FlightCancelled:
+                    continue
+
+            try:
+                result = fn()
+            except Exception as e:
+                self._finish(key)
+                future.set_exception(e)
+                raise
+            except BaseException:
+                self._finish(key)
+                future.set_exception(FlightCancelled(f"Leading call for {key!r} was interrupted"))
+                raise
+            self._finish(key)
+            future.set_result(result)
+            return result
+
+    def _finish(self, key: Hashable) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: Calls made, calls coalesced and calls currently in flight
+        """
+        with self._lock:
+            return {"executed": self._leaders, "coalesced": self._coalesced, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """
+    Coalesces concurrent coroutine calls with the same key on one event loop.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, List[Any]] = {}
+        self._leaders = 0
+        self._coalesced = 0
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await factory(), or an identical call that is already running.
+
+        A waiter that is cancelled (e.g. its client disconnected) stops waiting
+        without affecting the others; the shared call itself is cancelled once
+        no waiters are left.
+
+        Args:
+            key (Hashable): Normalised request key
+            factory (Callable[[], Awaitable[Any]]): Creates the awaitable doing the request
+
+        Returns:
+            Any: The awaited result
+        """
+        flight = self._calls.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(factory())
+            flight = [task, 0]
+            self._calls[key] = flight
+            self._leaders += 1
+            task.add_done_callback(lambda _: self._finish(key, flight))
+        else:
+            self._coalesced += 1
+
+        task = flight[0]
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            flight[1] -= 1
+            if flight[1] == 0 and not task.done():
+                task.cancel()
+
+    def _finish(self, key: Hashable, flight: List[Any]) -> None:
+        if self._calls.get(key) is flight:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: Calls made, calls coalesced and calls currently in flight
+        """
+        return {"executed": self._leaders, "coalesced": self._coalesced, "in_flight": len(self._calls)}
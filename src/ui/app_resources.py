@@ -0,0 +1,125 @@
+"""
+Process-wide resources of the Streamlit app, shared by all sessions and warmed up at start.
+
+Streamlit only runs the app script when a browser connects, so run the app
+through this module to start loading the knowledge base and the retrieval
+index before the first user arrives:
+
+    python -m src.ui.app_resources [streamlit run options, e.g. --server.port=8501]
+
+Started with "streamlit run app_improved.py" instead, the warm-up begins with
+the first session.
+"""
+import sys
+import threading
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+from config.settings import (
+    STORAGE_DIR, BM25_INDEX_FILE, BM25_K1, BM25_B, HYBRID_RETRIEVAL, SHARED_VECTOR_STORE, DEFAULT_MODEL,
+    TEMPERATURE, CONTEXT_WINDOW, SYSTEM_PROMPT, RETRIEVAL_CANDIDATES, SIMILARITY_TOP_K, RRF_K,
+    RESPONSE_TOKEN_RESERVE, PROMPT_TEMPLATE_TOKENS, MAX_QUESTION_TOKENS, CONTEXT_DEDUPE_THRESHOLD,
+    INGREDIENTS_DATASET, LOCAL_CLASSIFIER_ENABLED, WARMUP_ENABLED, WARMUP_STATUS_FILE, load_api_config
+)
+from src.utils.warmup import Warmup
+
+# Try to import openai, but make it optional
+try:
+    import openai
+except ImportError:
+    openai = None
+
+APP_SCRIPT = Path(__file__).resolve().parents[2] / "app_improved.py"
+
+# Warm-up components; "query_engine" covers the index, the service context and the BM25 index
+KNOWLEDGE_BASE = "knowledge_base"
+QUERY_ENGINE = "query_engine"
+CLASSIFIER = "classifier"
+
+_query_engine: Optional[Tuple[Any, Any]] = None
+_query_engine_lock = threading.Lock()
+_warmup: Optional[Warmup] = None
+_warmup_lock = threading.Lock()
+
+
+def get_shared_query_engine() -> Tuple[Any, Any]:
+    """
+    Build the retrieval query engine once per process, shared by all sessions.
+
+    Returns:
+        Tuple[Any, Any]: Tuple of (query engine, LLM used for chat bookkeeping)
+
+    Raises:
+        ImportError: If LlamaIndex is not available
+    """
+    global _query_engine
+    from src.api.llama_index_handler import get_query_engine, load_bm25_index, load_index_and_context
+    from src.utils.context_packer import ContextPacker
+
+    with _query_engine_lock:
+        if _query_engine is None:
+            # Warm-up can run before any session has set the key for the chat model
+            if openai is not None and not openai.api_key:
+                openai.api_key = load_api_config()["api"].get("openai_key", "")
+            index, gpt_context = load_index_and_context(
+                str(STORAGE_DIR), DEFAULT_MODEL, TEMPERATURE, CONTEXT_WINDOW, SYSTEM_PROMPT,
+                shared_vectors=SHARED_VECTOR_STORE
+            )
+            bm25_index = None
+            if HYBRID_RETRIEVAL:
+                bm25_index = load_bm25_index(str(STORAGE_DIR), str(BM25_INDEX_FILE), BM25_K1, BM25_B)
+            context_packer = ContextPacker(
+                CONTEXT_WINDOW, SYSTEM_PROMPT, response_tokens=RESPONSE_TOKEN_RESERVE,
+                template_tokens=PROMPT_TEMPLATE_TOKENS, max_question_tokens=MAX_QUESTION_TOKENS,
+                dedupe_threshold=CONTEXT_DEDUPE_THRESHOLD
+            )
+            query_engine = get_query_engine(
+                index, gpt_context, bm25_index=bm25_index, similarity_top_k=SIMILARITY_TOP_K,
+                candidates=RETRIEVAL_CANDIDATES, rrf_k=RRF_K, context_packer=context_packer
+            )
+            _query_engine = (query_engine, gpt_context.llm)
+        return _query_engine
+
+
+def get_app_warmup() -> Optional[Warmup]:
+    """
+    Return the process-wide warm-up of the app's components, starting it on first use.
+
+    The knowledge base is loaded first, so analyses are ready within
+    moments; the retrieval index used by the chat follows.
+
+    Returns:
+        Optional[Warmup]: The warm-up, or None if WARMUP_ENABLED is off
+    """
+    global _warmup
+    if not WARMUP_ENABLED:
+        return None
+    from src.utils.ingredient_classifier import get_local_classifier
+    from src.utils.kb_reloader import get_kb_reloader
+
+    with _warmup_lock:
+        if _warmup is None:
+            _warmup = Warmup(status_file=WARMUP_STATUS_FILE)
+            _warmup.add(KNOWLEDGE_BASE, lambda: get_kb_reloader(str(INGREDIENTS_DATASET)).current())
+            _warmup.add(QUERY_ENGINE, get_shared_query_engine)
+            if LOCAL_CLASSIFIER_ENABLED:
+                _warmup.add(CLASSIFIER, get_local_classifier)
+            _warmup.start()
+        return _warmup
+
+
+def main() -> None:
+    """Command-line entry point: start the warm-up, then serve the app in this process."""
+    from streamlit.web import cli
+
+    # Run with -m, this module is __main__; the app imports src.ui.app_resources,
+    # so warm up that module's resources or the app would load its own copies
+    from src.ui import app_resources
+
+    app_resources.get_app_warmup()
+    sys.argv = ["streamlit", "run", str(APP_SCRIPT), *sys.argv[1:]]
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()
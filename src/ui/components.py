@@ -423,15 +423,10 @@ def create_export_button(data: dict, filename: str = "analysis_results.csv") ->
         data (dict): Data to export
         filename (str): Name of the export file
     """
-    import pandas as pd
-    import io
+    from src.utils.results_sink import rows_to_csv
     
-    # Convert the data to a DataFrame
-    df = pd.DataFrame.from_dict(data, orient='index').reset_index()
-    df.columns = ['Item', 'Value']
-    
-    # Convert to CSV
-    csv = df.to_csv(index=False).encode()
+    # Item/value rows straight to CSV, no DataFrame needed
+    csv = rows_to_csv([["Item", "Value"]] + [[key, value] for key, value in data.items()])
     
     # Create a download button
     st.download_button(
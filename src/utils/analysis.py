@@ -0,0 +1,246 @@
+"""
+Ingredient analysis pipeline shared by the Streamlit app and the HTTP service.
+"""
+from typing import Any, Callable, Dict, List, Optional
+
+from config.settings import LOCAL_CLASSIFIER_MIN_CONFIDENCE, NESTED_INGREDIENTS, VISION_STRUCTURED_MAX_TOKENS
+from src.api.openai_handler import (
+    extract_ingredients_from_image, extract_ingredients_structured, query_openai_about_ingredients
+)
+from src.api.rate_limiter import PRIORITY_INTERACTIVE
+from src.utils.call_planner import DETAIL_FULL, DETAIL_VERDICT, call_stats, plan_calls
+from src.utils.image_hash import NearDuplicateIndex, image_hashes
+from src.utils.ingredient_classifier import IngredientClassifier
+from src.utils.local_ocr import read_ingredients_locally, reads_same_ingredients
+from src.utils.profiling import profiled
+from src.utils.ingredient_parser import (
+    IngredientNode, parse_ingredients, parse_ingredient_tree, check_halal_status, classify_ingredient_tree,
+    format_ingredient_tree
+)
+
+
+@profiled("analyze_text")
+def analyze_ingredients_text(
+    ingredients_text: str,
+    lookup_table: Dict[str, str],
+    api_key: Optional[str] = None,
+    endpoint: Optional[str] = None,
+    detail: str = DETAIL_FULL,
+    priority: int = PRIORITY_INTERACTIVE,
+    previous_lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None,
+    classifier: Optional[IngredientClassifier] = None,
+    tree: Optional[List[IngredientNode]] = None
+) -> Dict[str, Any]:
+    """
+    Parse an ingredients list and classify it against the lookup table.
+
+    Args:
+        ingredients_text (str): Raw ingredients text
+        lookup_table (Dict[str, str]): Dictionary mapping ingredient names to halal status
+        api_key (Optional[str]): OpenAI API key used to explain unknown ingredients
+        endpoint (Optional[str]): API endpoint URL
+        detail (str): DETAIL_VERDICT for the verdict alone, or DETAIL_FULL to
+            also have OpenAI explain unknown ingredients while the verdict is
+            open (see call_planner); a decided product's explanation is deferred
+        priority (int): Rate-limiter priority for OpenAI calls
+        previous_lookup (Optional[Callable[[str], Optional[Dict[str, Any]]]]):
+            Returns earlier results for the same ingredients text, e.g. from the
+            history store; they are reused if they answer everything asked
+        classifier (Optional[IngredientClassifier]): Local model predicting
+            unknown ingredients; only those it is unsure of are sent to OpenAI
+        tree (Optional[List[IngredientNode]]): Entries already parsed from a
+            structured extraction; the text is then not parsed again
+
+    Returns:
+        Dict[str, Any]: Results of the analysis, with "predicted_unknowns"
+            holding the local predictions ({"ingredient", "status", "confidence"}),
+            "call_plan" the planned explanation call ({"explain_unknowns",
+            "reason"}) and "deferred_unknowns" the ingredients whose explanation
+            was deferred (see explain_deferred)
+
+    Raises:
+        requests.exceptions.RequestException: If the OpenAI request fails
+        ValueError: If detail isn't a known level
+    """
+    if previous_lookup is not None:
+        previous = previous_lookup(ingredients_text)
+        if previous:
+            unexplained = [] if previous["halal_status_response"] else previous["unknown_ingredients"]
+            # Counted only if reused; otherwise the fresh analysis below plans again
+            plan = plan_calls(
+                previous["product_status"], unexplained, detail,
+                api_available=bool(api_key and endpoint), record=False
+            )
+            if not plan.explain_unknowns:
+                call_stats.record(plan)
+                previous["call_plan"] = plan._asdict()
+                previous["deferred_unknowns"] = unexplained if plan.deferred else []
+                return previous
+
+    if NESTED_INGREDIENTS:
+        # Sub-ingredients are classified separately and rolled up to their compound
+        if tree is None:
+            tree = parse_ingredient_tree(ingredients_text)
+        product_status, unknown_ingredients, ingredient_statuses = classify_ingredient_tree(tree, lookup_table)
+        ingredients_list = [node.text for node in tree]
+    else:
+        ingredients_list = [node.text for node in tree] if tree is not None else parse_ingredients(ingredients_text)
+        # For the verdict alone, the scan stops at the first decisive ingredient
+        product_status, unknown_ingredients = check_halal_status(
+            ingredients_list, lookup_table, stop_at_decisive=detail == DETAIL_VERDICT
+        )
+        ingredient_statuses = {
+            name.lower(): lookup_table.get(name.lower(), "Unknown") for name in ingredients_list
+        }
+
+    # Predictions explain unknowns like the OpenAI answer; the product status stays dataset-based
+    predicted_unknowns, to_query = [], unknown_ingredients
+    if classifier is not None and unknown_ingredients:
+        predicted_unknowns, to_query = classifier.triage(unknown_ingredients, LOCAL_CLASSIFIER_MIN_CONFIDENCE)
+
+    plan = plan_calls(product_status, to_query, detail, api_available=bool(api_key and endpoint))
+    halal_status_response = None
+    if plan.explain_unknowns:
+        halal_status_response = query_openai_about_ingredients(
+            to_query, api_key, endpoint, priority=priority
+        )
+
+    return {
+        "ingredients_text": ingredients_text,
+        "ingredients_list": ingredients_list,
+        # Only the statuses of this product's ingredients, not the whole table
+        "ingredient_statuses": ingredient_statuses,
+        "product_status": product_status,
+        "unknown_ingredients": unknown_ingredients,
+        "predicted_unknowns": predicted_unknowns,
+        "halal_status_response": halal_status_response,
+        "call_plan": plan._asdict(),
+        "deferred_unknowns": to_query if plan.deferred else [],
+    }
+
+
+def explain_deferred(
+    results: Dict[str, Any], api_key: str, endpoint: str, priority: int = PRIORITY_INTERACTIVE
+) -> Dict[str, Any]:
+    """
+    Fetch the explanation deferred for a decided product, e.g. when the user expands it.
+
+    Args:
+        results (Dict[str, Any]): Results from analyze_ingredients_text or analyze_image
+        api_key (str): OpenAI API key
+        endpoint (str): API endpoint URL
+        priority (int): Rate-limiter priority for the OpenAI call
+
+    Returns:
+        Dict[str, Any]: The same results, with "halal_status_response" filled in
+
+    Raises:
+        requests.exceptions.RequestException: If the OpenAI request fails
+    """
+    deferred = results.get("deferred_unknowns")
+    if deferred and not results.get("halal_status_response"):
+        results["halal_status_response"] = query_openai_about_ingredients(
+            deferred, api_key, endpoint, priority=priority
+        )
+        results["deferred_unknowns"] = []
+        call_stats.record_deferred_call()
+    return results
+
+
+@profiled("analyze_image")
+def analyze_image(
+    image_bytes: bytes,
+    lookup_table: Dict[str, str],
+    api_key: str,
+    endpoint: str,
+    model: str,
+    max_tokens: int,
+    detail: str = DETAIL_FULL,
+    priority: int = PRIORITY_INTERACTIVE,
+    previous_lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None,
+    image_index: Optional[NearDuplicateIndex] = None,
+    local_ocr: bool = False,
+    classifier: Optional[IngredientClassifier] = None,
+    structured: bool = False,
+    structured_max_tokens: int = VISION_STRUCTURED_MAX_TOKENS
+) -> Dict[str, Any]:
+    """
+    Extract the ingredients from a label photo and classify them.
+
+    Args:
+        image_bytes (bytes): Raw image bytes
+        lookup_table (Dict[str, str]): Dictionary mapping ingredient names to halal status
+        api_key (str): OpenAI API key
+        endpoint (str): API endpoint URL
+        model (str): Vision model name
+        max_tokens (int): Maximum tokens for the extraction response
+        detail (str): DETAIL_VERDICT or DETAIL_FULL (see analyze_ingredients_text)
+        priority (int): Rate-limiter priority for OpenAI calls
+        previous_lookup (Optional[Callable[[str], Optional[Dict[str, Any]]]]):
+            Returns earlier results for the extracted text (see analyze_ingredients_text)
+        image_index (Optional[NearDuplicateIndex]): Index of earlier photos; an
+            identical photo, or with local_ocr a near-duplicate that local OCR
+            confirms shows the same ingredients, reuses its extraction instead
+            of calling the vision model
+        local_ocr (bool): Try local OCR first and only call the vision model if
+            its confidence or dataset match rate is too low
+        classifier (Optional[IngredientClassifier]): Local model for unknown
+            ingredients (see analyze_ingredients_text)
+        structured (bool): Ask the vision model for JSON matching a schema
+            instead of free text; an invalid answer falls back to free text
+        structured_max_tokens (int): Maximum tokens for the JSON answer
+
+    Returns:
+        Dict[str, Any]: Results of the analysis, with "image_match" holding the
+            similarity, extraction time and confirmation of a reused photo and "local_ocr" the
+            confidence and match rate of a local read (each None otherwise), and
+            "structured_extraction" whether the ingredients came from a JSON answer
+
+    Raises:
+        requests.exceptions.RequestException: If an OpenAI request fails
+    """
+    hashes, match = None, None
+    if image_index is not None:
+        try:
+            hashes = image_hashes(image_bytes)
+            verify = (lambda text: reads_same_ingredients(image_bytes, text)) if local_ocr else None
+            match = image_index.lookup(hashes, model, verify=verify)
+        except (OSError, ValueError) as e:
+            print(f"Error hashing image: {e}")
+
+    local = None
+    if local_ocr and not match:
+        local = read_ingredients_locally(image_bytes, lookup_table)
+
+    tree = None
+    if match:
+        ingredients_text = match["ingredients_text"]
+    elif local:
+        ingredients_text = local["ingredients_text"]
+    else:
+        if structured:
+            try:
+                tree = extract_ingredients_structured(
+                    image_bytes, api_key, endpoint, model, structured_max_tokens, priority=priority
+                )
+                ingredients_text = format_ingredient_tree(tree)
+            except ValueError as e:
+                print(f"Error reading structured extraction, extracting as text instead: {e}")
+        if tree is None:
+            ingredients_text = extract_ingredients_from_image(
+                image_bytes, api_key, endpoint, model, max_tokens, priority=priority
+            )
+        if hashes is not None:
+            image_index.add(hashes, model, ingredients_text)
+
+    results = analyze_ingredients_text(
+        ingredients_text, lookup_table, api_key=api_key, endpoint=endpoint,
+        detail=detail, priority=priority, previous_lookup=previous_lookup,
+        classifier=classifier, tree=tree
+    )
+    results["image_match"] = (
+        {key: match[key] for key in ("similarity", "extracted_at", "confirmed_by")} if match else None
+    )
+    results["local_ocr"] = {"confidence": local["confidence"], "match_rate": local["match_rate"]} if local else None
+    results["structured_extraction"] = tree is not None
+    return results
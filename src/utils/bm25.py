@@ -0,0 +1,234 @@
+"""
+Local BM25 inverted index over the node texts in the persisted docstore.
+
+Exact-token questions such as "E471" or "ingredient 540" are answered well by
+keyword matching, and this index needs neither LlamaIndex nor the network.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+INDEX_FORMAT_VERSION = 1
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:\([a-z0-9\-]+\))?", re.IGNORECASE)
+
+# E-numbers with or without the prefix: e471, 471, e150a, 1422
+_ENUMBER_RE = re.compile(r"^e?(\d{3,4}[a-z]?)$")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how i if in is it its of on or that the "
+    "this to was what when which who why will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase index terms.
+
+    E-numbers are indexed under both their prefixed and bare forms so that
+    "E471" and "471" match each other.
+
+    Args:
+        text (str): Text to tokenize
+
+    Returns:
+        List[str]: Index terms
+    """
+    terms = []
+    for word in _WORD_RE.findall(text.lower()):
+        word = word.split("(", 1)[0]
+        if not word or word in _STOPWORDS:
+            continue
+        match = _ENUMBER_RE.match(word)
+        if match:
+            terms.append(f"e{match.group(1)}")
+            terms.append(match.group(1))
+        else:
+            terms.append(word)
+    return terms
+
+
+def load_node_texts(persist_dir: Path) -> Tuple[Dict[str, str], str]:
+    """
+    Read node texts straight from a persisted docstore.json.
+
+    Args:
+        persist_dir (Path): Directory where the index is persisted
+
+    Returns:
+        Tuple[Dict[str, str], str]: Tuple of (node id to text, fingerprint of the
+            docstore contents used to detect a stale BM25 index)
+    """
+    docstore_path = Path(persist_dir) / "docstore.json"
+    if not docstore_path.exists():
+        return {}, ""
+    with open(docstore_path, "r", encoding="utf-8") as f:
+        nodes = json.load(f).get("docstore/data", {})
+
+    texts = {}
+    digest = hashlib.sha256()
+    for node_id in sorted(nodes):
+        data = nodes[node_id].get("__data__", {})
+        texts[node_id] = data.get("text", "")
+        digest.update(node_id.encode("utf-8"))
+        digest.update(str(data.get("hash", "")).encode("utf-8"))
+    return texts, digest.hexdigest()
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index mapping terms to postings of (node id, term frequency).
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.fingerprint = ""
+        self.postings: Dict[str, List[Tuple[str, int]]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.avg_doc_length = 0.0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def build(self, texts: Dict[str, str], fingerprint: str = "") -> "BM25Index":
+        """
+        Build the index from node texts.
+
+        Args:
+            texts (Dict[str, str]): Mapping of node id to text
+            fingerprint (str): Fingerprint of the source corpus
+
+        Returns:
+            BM25Index: The index itself, for chaining
+        """
+        postings: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+        self.doc_lengths = {}
+        for node_id, text in texts.items():
+            terms = tokenize(text)
+            self.doc_lengths[node_id] = len(terms)
+            for term, frequency in Counter(terms).items():
+                postings[term].append((node_id, frequency))
+        self.postings = dict(postings)
+        self.avg_doc_length = (
+            sum(self.doc_lengths.values()) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        )
+        self.fingerprint = fingerprint
+        return self
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[str, float]]:
+        """
+        Rank nodes against a query.
+
+        Args:
+            query (str): Query text
+            top_k (int): Maximum number of results
+
+        Returns:
+            List[Tuple[str, float]]: (node id, score) pairs, best first
+        """
+        if not self.doc_lengths:
+            return []
+        total_docs = len(self.doc_lengths)
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for node_id, frequency in postings:
+                length_norm = 1 - self.b + self.b * self.doc_lengths[node_id] / (self.avg_doc_length or 1)
+                scores[node_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def save(self, index_path: Path) -> None:
+        """
+        Atomically persist the index as JSON.
+
+        Args:
+            index_path (Path): Destination path
+        """
+        index_path = Path(index_path)
+        tmp_path = index_path.with_suffix(index_path.suffix + ".tmp")
+        payload = {
+            "version": INDEX_FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "fingerprint": self.fingerprint,
+            "avg_doc_length": self.avg_doc_length,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, separators=(",", ":"))
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def load(cls, index_path: Path) -> Optional["BM25Index"]:
+        """
+        Load a persisted index.
+
+        Args:
+            index_path (Path): Path written by save()
+
+        Returns:
+            Optional[BM25Index]: The index, or None if missing or in an old format
+        """
+        if not Path(index_path).exists():
+            return None
+        with open(index_path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") != INDEX_FORMAT_VERSION:
+            return None
+        index = cls(k1=payload["k1"], b=payload["b"])
+        index.fingerprint = payload["fingerprint"]
+        index.avg_doc_length = payload["avg_doc_length"]
+        index.doc_lengths = payload["doc_lengths"]
+        index.postings = {term: [tuple(p) for p in postings] for term, postings in payload["postings"].items()}
+        return index
+
+
+def load_or_build_bm25(persist_dir: Path, index_path: Path, k1: float = 1.5, b: float = 0.75) -> BM25Index:
+    """
+    Load the persisted BM25 index, rebuilding it if the docstore has changed.
+
+    Args:
+        persist_dir (Path): Directory where the vector index is persisted
+        index_path (Path): Path of the persisted BM25 index
+        k1 (float): BM25 term-frequency saturation
+        b (float): BM25 length normalisation
+
+    Returns:
+        BM25Index: Index in sync with the docstore
+    """
+    texts, fingerprint = load_node_texts(persist_dir)
+    index = BM25Index.load(index_path)
+    if index is not None and index.fingerprint == fingerprint and (index.k1, index.b) == (k1, b):
+        return index
+    index = BM25Index(k1=k1, b=b).build(texts, fingerprint)
+    if texts:
+        index.save(index_path)
+    return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    Fuse several rankings of node ids with reciprocal rank fusion.
+
+    Args:
+        rankings (List[List[str]]): Node ids from each retriever, best first
+        k (int): RRF damping constant
+
+    Returns:
+        List[Tuple[str, float]]: (node id, fused score) pairs, best first
+    """
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, node_id in enumerate(ranking, start=1):
+            fused[node_id] += 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,130 @@
+"""
+Decides which LLM calls an analysis actually needs.
+
+The product verdict comes from the dataset alone: one Non-Halal or Doubtful
+ingredient makes the product Non-Halal, and an explanation of its unknown
+ingredients can't change that. Two levels of detail are planned for:
+
+    verdict  just the verdict; unknown ingredients are never explained
+    full     unknown ingredients are explained when the verdict is still open;
+             for a product already decided the explanation is deferred and
+             only fetched if the user asks for it (explain_deferred())
+
+Every plan is counted, so the calls avoided and the reasons can be reported.
+"""
+import threading
+from typing import Any, Dict, List, NamedTuple
+
+# Levels of detail an analysis is planned for
+DETAIL_VERDICT = "verdict"
+DETAIL_FULL = "full"
+DETAIL_LEVELS = (DETAIL_VERDICT, DETAIL_FULL)
+
+# Reasons for a plan; only NEEDED makes the call
+NEEDED = "needed"
+NO_UNKNOWNS = "no_unknowns"
+VERDICT_ONLY = "verdict_only"
+DECIDED = "decided"
+NO_API = "no_api"
+
+
+class CallPlan(NamedTuple):
+    """Whether to explain the unknown ingredients now, and why."""
+    explain_unknowns: bool
+    reason: str
+
+    @property
+    def deferred(self) -> bool:
+        """The explanation was left for later, to be loaded on request."""
+        return self.reason == DECIDED
+
+
+class CallPlanStats:
+    """
+    Thread-safe counts of planned explanation calls by outcome.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reasons: Dict[str, int] = {}
+        self._deferred_made = 0
+
+    def record(self, plan: CallPlan) -> None:
+        """
+        Count one plan.
+
+        Args:
+            plan (CallPlan): The plan made for an analysis
+        """
+        with self._lock:
+            self._reasons[plan.reason] = self._reasons.get(plan.reason, 0) + 1
+
+    def record_deferred_call(self) -> None:
+        """Count a deferred explanation the user asked for after all."""
+        with self._lock:
+            self._deferred_made += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Analyses planned, explanation calls made and
+                avoided (with the avoided share), plans by reason and deferred
+                explanations later fetched on request
+        """
+        with self._lock:
+            reasons = dict(self._reasons)
+            deferred_made = self._deferred_made
+        made = reasons.get(NEEDED, 0) + deferred_made
+        avoided = reasons.get(VERDICT_ONLY, 0) + reasons.get(DECIDED, 0) - deferred_made
+        return {
+            "analyses": sum(reasons.values()),
+            "calls_made": made,
+            "calls_avoided": avoided,
+            "avoided_fraction": round(avoided / (made + avoided), 3) if made + avoided else 0.0,
+            "plans_by_reason": reasons,
+            "deferred_made_on_request": deferred_made,
+        }
+
+
+call_stats = CallPlanStats()
+
+
+def plan_calls(
+    product_status: str,
+    unknown_ingredients: List[str],
+    detail: str = DETAIL_FULL,
+    api_available: bool = True,
+    record: bool = True
+) -> CallPlan:
+    """
+    Plan the explanation call for an analysis and count the plan.
+
+    Args:
+        product_status (str): Verdict from the dataset
+        unknown_ingredients (List[str]): Ingredients still to be explained
+        detail (str): DETAIL_VERDICT or DETAIL_FULL
+        api_available (bool): An API key and endpoint were given
+        record (bool): Count the plan; pass False when the caller counts it
+            later with call_stats.record(), once it knows the plan is final
+
+    Returns:
+        CallPlan: Whether to make the call now and why
+
+    Raises:
+        ValueError: If detail isn't one of DETAIL_LEVELS
+    """
+    if detail not in DETAIL_LEVELS:
+        raise ValueError(f"Unknown detail level {detail!r}; expected one of {', '.join(DETAIL_LEVELS)}")
+    if not unknown_ingredients:
+        plan = CallPlan(False, NO_UNKNOWNS)
+    elif detail == DETAIL_VERDICT:
+        plan = CallPlan(False, VERDICT_ONLY)
+    elif not api_available:
+        plan = CallPlan(False, NO_API)
+    elif product_status == "Non-Halal":
+        plan = CallPlan(False, DECIDED)
+    else:
+        plan = CallPlan(True, NEEDED)
+    if record:
+        call_stats.record(plan)
+    return plan
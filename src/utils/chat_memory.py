@@ -0,0 +1,182 @@
+"""
+Token-bounded conversation memory that summarises old turns incrementally.
+
+Recent turns are kept verbatim. Once they exceed the token budget, the oldest
+turns are folded into a running summary with one summarisation call, so the
+prompt used to condense follow-up questions stays roughly constant in size no
+matter how long the conversation runs.
+"""
+import re
+from typing import Any, Callable, Dict, List, Tuple
+
+from src.utils.bm25 import tokenize
+from src.utils.tokens import count_tokens
+
+# Words that point back at earlier turns ("is it halal?", "what about that one?")
+_REFERRING_WORDS = frozenset(
+    "it its it's they them their theirs this that these those he she one ones same above "
+    "previous earlier former latter else instead other another again also".split()
+)
+_FOLLOW_UP_OPENERS = ("and ", "but ", "what about", "how about", "so ", "then ", "or ")
+_WORD_RE = re.compile(r"[a-z']+")
+
+SUMMARY_TEMPLATE = (
+    "Progressively summarise the conversation below, adding onto the previous summary. "
+    "Keep every ingredient name, e-number and halal status that was mentioned. "
+    "Answer in at most {max_words} words.\n\n"
+    "Previous summary:\n{summary}\n\n"
+    "New lines of conversation:\n{new_lines}\n\n"
+    "New summary:"
+)
+
+
+def format_turns(turns: List[Tuple[str, str]]) -> str:
+    """
+    Render (user, assistant) turns as conversation lines.
+
+    Args:
+        turns (List[Tuple[str, str]]): Conversation turns
+
+    Returns:
+        str: One "Human:"/"Assistant:" line per message
+    """
+    return "\n".join(f"Human: {user}\nAssistant: {assistant}" for user, assistant in turns)
+
+
+def looks_standalone(question: str) -> bool:
+    """
+    Heuristically decide whether a question can be answered without the history.
+
+    Questions like "What is the Halal status of Dicalcium Ferrocyanide
+    (ingredient 540)?" name their subject; "Is it halal?" or "What about
+    E472?" lean on earlier turns. Anything doubtful is treated as a follow-up.
+
+    Args:
+        question (str): User question
+
+    Returns:
+        bool: True if condensing against the history can be skipped
+    """
+    text = " ".join(question.lower().split())
+    if text.startswith(_FOLLOW_UP_OPENERS):
+        return False
+    words = _WORD_RE.findall(text)
+    if any(word in _REFERRING_WORDS for word in words):
+        return False
+    # Needs at least two content terms (e.g. an ingredient and what is asked about it)
+    return len(set(tokenize(text))) >= 2
+
+
+def adds_context(condensed: str, question: str) -> bool:
+    """
+    Whether a condensed question brings in terms the raw question lacked.
+
+    If it doesn't, retrieval on the raw question finds the same material and
+    its results can be kept.
+
+    Args:
+        condensed (str): Question rewritten against the history
+        question (str): Question as asked
+
+    Returns:
+        bool: True if the condensed question has new index terms
+    """
+    return bool(set(tokenize(condensed)) - set(tokenize(question)))
+
+
+class SummarizingMemory:
+    """
+    Running summary plus the most recent turns, within a token budget.
+    """
+
+    def __init__(self, summarize: Callable[[str], str], token_limit: int = 512, summary_words: int = 120):
+        """
+        Args:
+            summarize (Callable[[str], str]): Completes a prompt, used to fold
+                old turns into the summary
+            token_limit (int): Maximum tokens of verbatim turns kept
+            summary_words (int): Target length of the running summary
+        """
+        self._summarize = summarize
+        self.token_limit = token_limit
+        self.summary_words = summary_words
+        self.summary = ""
+        self.turns: List[Tuple[str, str]] = []
+        self.summarised_turns = 0
+
+    def __len__(self) -> int:
+        return self.summarised_turns + len(self.turns)
+
+    def add_turn(self, user: str, assistant: str) -> None:
+        """
+        Record a completed turn.
+
+        Folding only happens when a follow-up needs condensing, so a run of
+        standalone questions could pile up turns; beyond four times the budget
+        the oldest are dropped without summarising.
+
+        Args:
+            user (str): User message
+            assistant (str): Assistant answer
+        """
+        self.turns.append((user, assistant))
+        while len(self.turns) > 1 and self.turns_tokens() > 4 * self.token_limit:
+            self.turns.pop(0)
+
+    def turns_tokens(self) -> int:
+        """Tokens of the verbatim turns."""
+        return count_tokens(format_turns(self.turns))
+
+    def needs_folding(self) -> bool:
+        """Whether the next fold() will make a summarisation call."""
+        return len(self.turns) > 1 and self.turns_tokens() > self.token_limit
+
+    def fold(self) -> bool:
+        """
+        Fold the oldest turns into the summary until the rest fit the budget.
+
+        The most recent turn is always kept verbatim. Old turns are folded in a
+        single summarisation call, down to half the budget, so folding happens
+        every few turns rather than on every turn.
+
+        Returns:
+            bool: True if a summarisation call was made
+        """
+        if not self.needs_folding():
+            return False
+        folded = []
+        while len(self.turns) > 1 and self.turns_tokens() > self.token_limit // 2:
+            folded.append(self.turns.pop(0))
+        prompt = SUMMARY_TEMPLATE.format(
+            max_words=self.summary_words, summary=self.summary or "(none)", new_lines=format_turns(folded)
+        )
+        self.summary = self._summarize(prompt).strip()
+        self.summarised_turns += len(folded)
+        return True
+
+    def history_text(self) -> str:
+        """
+        Conversation history for the condense prompt.
+
+        Returns:
+            str: Running summary (if any) followed by the verbatim turns
+        """
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the earlier conversation: {self.summary}")
+        if self.turns:
+            parts.append(format_turns(self.turns))
+        return "\n".join(parts)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Summary tokens, verbatim turn count and tokens, and
+                number of turns folded into the summary
+        """
+        return {
+            "summary_tokens": count_tokens(self.summary),
+            "recent_turns": len(self.turns),
+            "recent_tokens": self.turns_tokens(),
+            "summarised_turns": self.summarised_turns,
+        }
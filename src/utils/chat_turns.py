@@ -0,0 +1,114 @@
+"""
+Chat submission log that executes each question exactly once.
+
+Streamlit reruns the whole script on every interaction and text inputs keep
+their value, so "the input has text" does not mean "the user asked a
+question". Questions are instead recorded as turns with their own IDs when
+they are submitted; each pending turn is executed once and its answer is
+stored on the turn, so later reruns replay it without calling the model.
+"""
+from typing import Any, Dict, Iterator, List, Optional
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+
+class ChatTurnLog:
+    """
+    Ordered, bounded log of chat turns.
+
+    Each turn is a dict with "id", "question", "status" (pending, done or
+    failed), "answer" and "notes" (captions shown under the answer).
+    """
+
+    def __init__(self, limit: int = 10):
+        """
+        Args:
+            limit (int): Maximum number of turns kept; the oldest finished
+                turns are dropped first
+        """
+        self.limit = limit
+        self.turns: List[Dict[str, Any]] = []
+        self._next_id = 1
+        self.executed = 0
+        self.duplicates_ignored = 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(list(self.turns))
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def submit(self, question: str) -> Optional[int]:
+        """
+        Record a submitted question as a new pending turn.
+
+        A question identical to one that is still pending is not added again
+        (e.g. Enter pressed twice while the first answer is being generated).
+
+        Args:
+            question (str): Question as typed
+
+        Returns:
+            Optional[int]: ID of the pending turn, or None for an empty question
+        """
+        question = question.strip()
+        if not question:
+            return None
+        normalised = " ".join(question.lower().split())
+        for turn in self.turns:
+            if turn["status"] == PENDING and " ".join(turn["question"].lower().split()) == normalised:
+                self.duplicates_ignored += 1
+                return turn["id"]
+
+        turn = {"id": self._next_id, "question": question, "status": PENDING, "answer": None, "notes": []}
+        self._next_id += 1
+        self.turns.append(turn)
+        self._trim()
+        return turn["id"]
+
+    def pending(self) -> List[Dict[str, Any]]:
+        """
+        Returns:
+            List[Dict[str, Any]]: Turns not yet executed, oldest first
+        """
+        return [turn for turn in self.turns if turn["status"] == PENDING]
+
+    def complete(self, turn_id: int, answer: str, notes: Optional[List[str]] = None) -> None:
+        """
+        Store a turn's answer so it is never executed again.
+
+        Args:
+            turn_id (int): Turn ID returned by submit()
+            answer (str): Answer to replay on later reruns
+            notes (Optional[List[str]]): Captions shown under the answer
+        """
+        self._finish(turn_id, DONE, answer, notes)
+
+    def fail(self, turn_id: int, answer: str, notes: Optional[List[str]] = None) -> None:
+        """
+        Mark a turn as failed with the fallback answer shown to the user.
+
+        Failed turns are not retried automatically; the user can ask again.
+
+        Args:
+            turn_id (int): Turn ID returned by submit()
+            answer (str): Fallback answer
+            notes (Optional[List[str]]): Captions shown under the answer
+        """
+        self._finish(turn_id, FAILED, answer, notes)
+
+    def _finish(self, turn_id: int, status: str, answer: str, notes: Optional[List[str]]) -> None:
+        for turn in self.turns:
+            if turn["id"] == turn_id and turn["status"] == PENDING:
+                turn.update(status=status, answer=answer, notes=[note for note in notes or [] if note])
+                self.executed += 1
+        self._trim()
+
+    def _trim(self) -> None:
+        while len(self.turns) > self.limit:
+            finished = next((turn for turn in self.turns if turn["status"] != PENDING), None)
+            if finished is None:
+                break
+            self.turns.remove(finished)
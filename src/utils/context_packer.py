@@ -0,0 +1,213 @@
+"""
+Token-budgeted packing of retrieved context for the chat query engine.
+
+The system prompt, the (condensed) question and the model's answer all share a
+small context window. The packer counts tokens locally, gives retrieved context
+whatever is left, drops duplicate passages and keeps only the sentences most
+relevant to the question. Questions longer than their cap are cut to it
+before they are sent (fit_question).
+"""
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from src.utils.bm25 import tokenize
+from src.utils.tokens import count_tokens
+
+# Sentence ends, or line breaks (compact e-number rows are one per line)
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split a passage into sentences, treating each line as its own unit.
+
+    Args:
+        text (str): Passage text
+
+    Returns:
+        List[str]: Non-empty sentences in their original order
+    """
+    return [sentence.strip() for sentence in _SENTENCE_SPLIT_RE.split(text) if sentence.strip()]
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextPacker:
+    """
+    Allocate a fixed context window between the system prompt, the question,
+    the retrieved context and the model's answer.
+    """
+
+    def __init__(
+        self,
+        context_window: int,
+        system_prompt: str = "",
+        response_tokens: int = 256,
+        template_tokens: int = 100,
+        max_question_tokens: int = 256,
+        dedupe_threshold: float = 0.8
+    ):
+        """
+        Args:
+            context_window (int): Total tokens the model accepts
+            system_prompt (str): System prompt sent with every call
+            response_tokens (int): Tokens reserved for the answer
+            template_tokens (int): Tokens used by the QA prompt template itself
+            max_question_tokens (int): Longest question sent; longer ones are cut to it
+            dedupe_threshold (float): Term overlap at which two passages are duplicates
+        """
+        self.context_window = context_window
+        self.system_tokens = count_tokens(system_prompt)
+        self.response_tokens = response_tokens
+        self.template_tokens = template_tokens
+        self.max_question_tokens = max_question_tokens
+        self.dedupe_threshold = dedupe_threshold
+
+    def fit_question(self, question: str) -> Tuple[str, int]:
+        """
+        Cut a question to max_question_tokens, keeping its leading words.
+
+        Args:
+            question (str): The (condensed) question
+
+        Returns:
+            Tuple[str, int]: Tuple of (question to send, tokens cut off)
+        """
+        tokens = count_tokens(question)
+        if tokens <= self.max_question_tokens:
+            return question, 0
+        words = question.split()
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(" ".join(words[:middle])) <= self.max_question_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        fitted = " ".join(words[:low])
+        return fitted, tokens - count_tokens(fitted)
+
+    def budget(self, question: str) -> Dict[str, int]:
+        """
+        Work out how many tokens each part of the prompt may use.
+
+        Args:
+            question (str): The (condensed) question
+
+        Returns:
+            Dict[str, int]: Token allocation for system prompt, question, context and response
+        """
+        # The question's real length: context shrinks for one that wasn't fitted
+        question_tokens = count_tokens(question)
+        fixed = self.system_tokens + self.template_tokens + self.response_tokens + question_tokens
+        return {
+            "system": self.system_tokens,
+            "template": self.template_tokens,
+            "question": question_tokens,
+            "response": self.response_tokens,
+            "context": max(0, self.context_window - fixed),
+        }
+
+    def pack(
+        self, question: str, passages: List[Tuple[str, str]], question_tokens_cut: int = 0
+    ) -> Tuple[List[Tuple[str, str]], Dict[str, Any]]:
+        """
+        Fit retrieved passages into the context budget.
+
+        Passages are deduplicated, then sentences are admitted in order of
+        relevance to the question (ties broken by retrieval rank) until the
+        budget is spent. Each kept passage retains its sentences in their
+        original order.
+
+        Args:
+            question (str): The (condensed) question
+            passages (List[Tuple[str, str]]): (passage id, text) pairs, best first
+            question_tokens_cut (int): Tokens fit_question cut off the question, for the report
+
+        Returns:
+            Tuple[List[Tuple[str, str]], Dict[str, Any]]: Tuple of (packed
+                (passage id, text) pairs in retrieval order, utilisation report)
+        """
+        allocation = self.budget(question)
+        context_budget = allocation["context"]
+        query_terms = set(tokenize(question))
+
+        # Drop passages that repeat an earlier, higher-ranked passage
+        unique: List[Tuple[str, str]] = []
+        seen_terms: List[Set[str]] = []
+        for passage_id, text in passages:
+            terms = set(tokenize(text))
+            if any(_jaccard(terms, other) >= self.dedupe_threshold for other in seen_terms):
+                continue
+            unique.append((passage_id, text))
+            seen_terms.append(terms)
+
+        # Score every sentence by how many question terms it covers
+        candidates = []
+        seen_sentences: Set[str] = set()
+        for rank, (passage_id, text) in enumerate(unique):
+            for position, sentence in enumerate(split_sentences(text)):
+                key = " ".join(sentence.lower().split())
+                if key in seen_sentences:
+                    continue
+                seen_sentences.add(key)
+                score = len(query_terms & set(tokenize(sentence)))
+                candidates.append((-score, rank, position, sentence))
+        total_sentences = len(candidates)
+        candidates.sort()
+
+        used = 0
+        kept: Dict[int, List[Tuple[int, str]]] = {}
+        for _, rank, position, sentence in candidates:
+            cost = count_tokens(sentence) + 1
+            if used + cost > context_budget:
+                continue
+            kept.setdefault(rank, []).append((position, sentence))
+            used += cost
+
+        packed = [
+            (unique[rank][0], "\n".join(sentence for _, sentence in sorted(kept[rank])))
+            for rank in sorted(kept)
+        ]
+        kept_sentences = sum(len(sentences) for sentences in kept.values())
+        prompt_tokens = allocation["system"] + allocation["template"] + allocation["question"] + used
+        report = {
+            "context_window": self.context_window,
+            "allocation": allocation,
+            "question_tokens_cut": question_tokens_cut,
+            "context_tokens": used,
+            "prompt_tokens": prompt_tokens,
+            "passages_in": len(passages),
+            "duplicates_dropped": len(passages) - len(unique),
+            "passages_out": len(packed),
+            "sentences_dropped": total_sentences - kept_sentences,
+            "context_utilisation": round(used / context_budget, 3) if context_budget else 0.0,
+            "window_utilisation": round((prompt_tokens + self.response_tokens) / self.context_window, 3),
+        }
+        return packed, report
+
+
+def format_pack_report(report: Optional[Dict[str, Any]]) -> str:
+    """
+    Summarise a packing report in one line for display.
+
+    Args:
+        report (Optional[Dict[str, Any]]): Report returned by ContextPacker.pack
+
+    Returns:
+        str: Human-readable summary, empty if there is no report
+    """
+    if not report:
+        return ""
+    summary = (
+        f"Context {report['context_tokens']}/{report['allocation']['context']} tokens "
+        f"({report['context_utilisation']:.0%}) from {report['passages_out']}/{report['passages_in']} passages; "
+        f"prompt {report['prompt_tokens']} of {report['context_window']} tokens"
+    )
+    if report.get("question_tokens_cut"):
+        summary += f"; question cut by {report['question_tokens_cut']} tokens"
+    return summary
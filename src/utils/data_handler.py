@@ -40,36 +40,32 @@ def save_analysis_results(
     filename: Optional[str] = None
 ) -> str:
     """
-    Save analysis results to a CSV file.
+    Save analysis results to the append-only results log.
+    
+    The record is buffered and appended to the current log segment by a
+    background thread, instead of creating one CSV file per analysis.
     
     Args:
         result (Dict[str, Any]): Analysis results
-        output_dir (Optional[str]): Directory to save the file (defaults to data directory)
-        filename (Optional[str]): Filename (defaults to "analysis_results.csv")
+        output_dir (Optional[str]): Results log directory (defaults to RESULTS_DIR)
+        filename (Optional[str]): Write a single-record CSV with this name into
+            output_dir instead (for one-off exports)
         
     Returns:
-        str: Path to the saved file
+        str: Path of the file the record is written to
     """
-    import pandas as pd
-    from datetime import datetime
-    
-    # Default values
-    if output_dir is None:
-        output_dir = "data"
-        
-    if filename is None:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"analysis_results_{timestamp}.csv"
-    
-    # Create directory if it doesn't exist
-    output_path = Path(output_dir)
-    output_path.mkdir(exist_ok=True, parents=True)
+    from config.settings import RESULTS_DIR
+    from src.utils.results_sink import analysis_record, export_summary, get_results_sink, rows_to_csv
     
-    # Create DataFrame from results
-    df = pd.DataFrame.from_dict({k: [v] for k, v in result.items()})
+    output_path = Path(output_dir) if output_dir is not None else RESULTS_DIR
+    record = analysis_record(result)
     
-    # Save to CSV
-    file_path = output_path / filename
-    df.to_csv(file_path, index=False)
+    if filename is not None:
+        output_path.mkdir(exist_ok=True, parents=True)
+        file_path = output_path / filename
+        file_path.write_bytes(rows_to_csv([["Item", "Value"]] + [list(item) for item in export_summary(record).items()]))
+        return str(file_path)
     
-    return str(file_path)
\ No newline at end of file
+    sink = get_results_sink(output_path)
+    sink.append(record)
+    return str(sink.segment or output_path)
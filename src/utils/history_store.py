@@ -0,0 +1,433 @@
+"""
+Indexed SQLite store of past analyses.
+
+Analyses are written in batches by a background thread into a WAL-mode
+database, indexed by product name, ingredient (down to the e-numbers inside
+compound ingredients), verdict and time, so questions such as "which products
+contained E471 last month" or "top unknown ingredients" are answered from
+local indexes without re-running any model.
+The same store backs the "previously analysed" instant answer.
+
+Usage:
+    python -m src.utils.history_store products-with E471 [--since 2024-01-01]
+    python -m src.utils.history_store top-unknowns [--since DATE] [--limit N]
+    python -m src.utils.history_store verdicts [--since DATE]
+    python -m src.utils.history_store import-log      # backfill from the results log
+"""
+import argparse
+import atexit
+import hashlib
+import json
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config.settings import HISTORY_DB, HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL
+from src.utils.ingredient_parser import IngredientNode, normalise_enumber, parse_ingredient_tree, parse_ingredients
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    recorded_at TEXT NOT NULL,
+    source TEXT NOT NULL,
+    product_name TEXT NOT NULL,
+    product_key TEXT NOT NULL,
+    ingredients_key TEXT NOT NULL,
+    product_status TEXT NOT NULL,
+    kb_version TEXT NOT NULL,
+    ingredients_text TEXT NOT NULL,
+    halal_status_response TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analysis_ingredients (
+    analysis_id INTEGER NOT NULL REFERENCES analyses(id),
+    position INTEGER NOT NULL,
+    ingredient TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    is_unknown INTEGER NOT NULL,
+    -- 0 for the recorded entries; sub-ingredients only carry a status when unknown
+    depth INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (analysis_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_analyses_recorded ON analyses(recorded_at);
+CREATE INDEX IF NOT EXISTS idx_analyses_product ON analyses(product_key, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_analyses_status ON analyses(product_status, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_analyses_ingredients_key ON analyses(ingredients_key, kb_version, recorded_at);
+CREATE INDEX IF NOT EXISTS idx_ingredients_ingredient ON analysis_ingredients(ingredient, analysis_id);
+CREATE INDEX IF NOT EXISTS idx_ingredients_unknown ON analysis_ingredients(is_unknown, ingredient);
+"""
+
+
+def ingredient_key(name: str) -> str:
+    """
+    Normalise an ingredient name for indexing; e-numbers become "e471".
+
+    Args:
+        name (str): Ingredient name or e-number as written
+
+    Returns:
+        str: Index key
+    """
+    name = " ".join(name.lower().split())
+    bare = normalise_enumber(name)
+    return f"e{bare}" if bare else name
+
+
+def ingredients_fingerprint(ingredients: List[str]) -> str:
+    """
+    Fingerprint of a parsed ingredients list, independent of spacing and case.
+
+    Args:
+        ingredients (List[str]): Parsed ingredient names
+
+    Returns:
+        str: Hex digest
+    """
+    return hashlib.sha256("|".join(ingredient_key(i) for i in ingredients).encode("utf-8")).hexdigest()
+
+
+def _with_depth(node: IngredientNode, depth: int = 0) -> Iterator[Tuple[IngredientNode, int]]:
+    """Yield a parsed entry and all its sub-ingredients with their nesting depth, depth first."""
+    yield node, depth
+    for child in node.children:
+        yield from _with_depth(child, depth + 1)
+
+
+def ingredient_rows(
+    ingredients: List[str], statuses: List[str], unknown_ingredients: List[str]
+) -> List[Tuple[str, str, str, int, int]]:
+    """
+    Index rows for every node of a record's ingredients, sub-ingredients included.
+
+    "chocolate (cocoa, emulsifier (e471))" gives rows for "chocolate", "cocoa",
+    "emulsifier" and "e471", so each can be searched on its own.
+
+    Args:
+        ingredients (List[str]): Top-level entries as recorded
+        statuses (List[str]): Status of each top-level entry
+        unknown_ingredients (List[str]): Names the analysis reported as unknown
+
+    Returns:
+        List[Tuple[str, str, str, int, int]]: (ingredient key, name, status,
+            is_unknown, depth) in label order
+    """
+    unknown = {ingredient_key(name) for name in unknown_ingredients}
+    rows = []
+    for text, status in zip(ingredients, statuses):
+        nodes = parse_ingredient_tree(text)
+        if not nodes:
+            rows.append((ingredient_key(text), text, status, int(ingredient_key(text) in unknown), 0))
+            continue
+        for node, depth in _with_depth(nodes[0]):
+            is_unknown = ingredient_key(node.name) in unknown or ingredient_key(node.text) in unknown
+            if depth:
+                node_status = "Unknown" if is_unknown else ""
+                rows.append((ingredient_key(node.name), node.text, node_status, int(is_unknown), depth))
+            else:
+                rows.append((ingredient_key(node.name), text, status, int(is_unknown), 0))
+    return rows
+
+
+class HistoryStore:
+    """
+    Batched writer and indexed reader over the analyses database.
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        batch_size: int = HISTORY_BATCH_SIZE,
+        flush_interval: float = HISTORY_FLUSH_INTERVAL
+    ):
+        """
+        Args:
+            db_path (Path): SQLite database file
+            batch_size (int): Maximum records committed in one transaction
+            flush_interval (float): Seconds the writer waits to fill a batch
+        """
+        self.db_path = Path(db_path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Databases created before sub-ingredients were indexed
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(analysis_ingredients)")}
+            if "depth" not in columns:
+                conn.execute("ALTER TABLE analysis_ingredients ADD COLUMN depth INTEGER NOT NULL DEFAULT 0")
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        # SQLite connections must not be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def record(self, record: Dict[str, Any]) -> None:
+        """
+        Queue an analysis for writing; returns immediately.
+
+        Args:
+            record (Dict[str, Any]): Record from results_sink.analysis_record
+        """
+        self._queue.put(record)
+
+    def flush(self, timeout: float = 10.0) -> None:
+        """
+        Block until everything queued so far has been committed.
+
+        Args:
+            timeout (float): Maximum seconds to wait
+        """
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self) -> None:
+        """Commit queued records and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join(timeout=30)
+
+    def _run(self) -> None:
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            batch: List[Dict[str, Any]] = []
+            events: List[threading.Event] = []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    events.append(item)
+                else:
+                    batch.append(item)
+                if stopping or events or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self._write_batch(conn, batch)
+                except sqlite3.Error as e:
+                    print(f"Error writing analysis history: {e}")
+            for event in events:
+                event.set()
+        conn.close()
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[Dict[str, Any]]) -> None:
+        with conn:
+            for record in batch:
+                ingredients = record.get("ingredients", [])
+                product_name = " ".join(str(record.get("product_name", "")).split())
+                cursor = conn.execute(
+                    "INSERT INTO analyses (recorded_at, source, product_name, product_key, ingredients_key, "
+                    "product_status, kb_version, ingredients_text, halal_status_response) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        record["recorded_at"], record.get("source", ""), product_name, product_name.lower(),
+                        ingredients_fingerprint(ingredients), record.get("product_status", "Unknown"),
+                        record.get("kb_version", ""), record.get("ingredients_text", ""),
+                        record.get("halal_status_response", "") or "",
+                    ),
+                )
+                rows = ingredient_rows(
+                    ingredients, record.get("statuses", []), record.get("unknown_ingredients", [])
+                )
+                conn.executemany(
+                    "INSERT INTO analysis_ingredients "
+                    "(analysis_id, position, ingredient, name, status, is_unknown, depth) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(cursor.lastrowid, position, *row) for position, row in enumerate(rows)],
+                )
+
+    def find_previous(self, ingredients_text: str, kb_version: str) -> Optional[Dict[str, Any]]:
+        """
+        Most recent analysis of the same ingredients against the same dataset version.
+
+        Args:
+            ingredients_text (str): Raw ingredients text
+            kb_version (str): Version of the knowledge base in use
+
+        Returns:
+            Optional[Dict[str, Any]]: Results in the analysis pipeline's shape plus
+                "previously_analysed_at", or None if never seen
+        """
+        ingredients = parse_ingredients(ingredients_text)
+        if not ingredients:
+            return None
+        conn = self._reader()
+        row = conn.execute(
+            # Prefer analyses that include the explanation of unknown ingredients
+            "SELECT * FROM analyses WHERE ingredients_key = ? AND kb_version = ? "
+            "ORDER BY halal_status_response != '' DESC, recorded_at DESC LIMIT 1",
+            (ingredients_fingerprint(ingredients), kb_version),
+        ).fetchone()
+        if row is None:
+            return None
+        items = conn.execute(
+            "SELECT name, status, is_unknown, depth FROM analysis_ingredients WHERE analysis_id = ? "
+            "ORDER BY position",
+            (row["id"],),
+        ).fetchall()
+        entries = [item for item in items if not item["depth"]]
+        return {
+            "ingredients_text": ingredients_text,
+            "ingredients_list": [item["name"] for item in entries],
+            "ingredient_statuses": {item["name"].lower(): item["status"] for item in entries},
+            "product_status": row["product_status"],
+            "unknown_ingredients": [item["name"] for item in items if item["is_unknown"]],
+            "halal_status_response": row["halal_status_response"] or None,
+            "kb_version": row["kb_version"],
+            "previously_analysed_at": row["recorded_at"],
+        }
+
+    def products_with_ingredient(
+        self, ingredient: str, since: Optional[str] = None, until: Optional[str] = None, limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """
+        Analyses whose ingredients include the given ingredient or e-number.
+
+        Args:
+            ingredient (str): Ingredient name or e-number (e.g. "E471" or "471")
+            since (Optional[str]): ISO date or timestamp, inclusive
+            until (Optional[str]): ISO date or timestamp, exclusive
+            limit (int): Maximum rows returned, newest first
+
+        Returns:
+            List[Dict[str, Any]]: recorded_at, product_name, product_status and ingredients_text
+        """
+        rows = self._reader().execute(
+            "SELECT a.recorded_at, a.product_name, a.product_status, a.ingredients_text "
+            "FROM analysis_ingredients i JOIN analyses a ON a.id = i.analysis_id "
+            "WHERE i.ingredient = ? AND a.recorded_at >= ? AND a.recorded_at < ? "
+            "ORDER BY a.recorded_at DESC LIMIT ?",
+            (ingredient_key(ingredient), since or "", until or "￿", limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def top_unknown_ingredients(self, since: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Ingredients most often missing from the knowledge base.
+
+        Args:
+            since (Optional[str]): ISO date or timestamp, inclusive
+            limit (int): Maximum rows returned
+
+        Returns:
+            List[Dict[str, Any]]: ingredient and count, most frequent first
+        """
+        rows = self._reader().execute(
+            "SELECT i.ingredient, COUNT(*) AS count "
+            "FROM analysis_ingredients i JOIN analyses a ON a.id = i.analysis_id "
+            "WHERE i.is_unknown = 1 AND a.recorded_at >= ? "
+            "GROUP BY i.ingredient ORDER BY count DESC, i.ingredient LIMIT ?",
+            (since or "", limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def verdict_counts(self, since: Optional[str] = None) -> Dict[str, int]:
+        """
+        Number of analyses per product verdict.
+
+        Args:
+            since (Optional[str]): ISO date or timestamp, inclusive
+
+        Returns:
+            Dict[str, int]: Verdict to count
+        """
+        rows = self._reader().execute(
+            "SELECT product_status, COUNT(*) AS count FROM analyses WHERE recorded_at >= ? "
+            "GROUP BY product_status ORDER BY count DESC",
+            (since or "",),
+        ).fetchall()
+        return {row["product_status"]: row["count"] for row in rows}
+
+
+_stores: Dict[str, HistoryStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_history_store(db_path: Path = HISTORY_DB) -> HistoryStore:
+    """
+    Return the process-wide store for a database, closed automatically at exit.
+
+    Args:
+        db_path (Path): SQLite database file
+
+    Returns:
+        HistoryStore: Shared store
+    """
+    key = str(Path(db_path).resolve())
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = HistoryStore(db_path)
+            _stores[key] = store
+            atexit.register(store.close)
+        return store
+
+
+def main() -> None:
+    """Command-line entry point for querying the analysis history."""
+    parser = argparse.ArgumentParser(description="Query the analysis history.")
+    parser.add_argument("--db", default=str(HISTORY_DB), help="History database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    products = subparsers.add_parser("products-with", help="Products containing an ingredient")
+    products.add_argument("ingredient", help="Ingredient name or e-number")
+    products.add_argument("--since", help="ISO date, inclusive")
+    products.add_argument("--until", help="ISO date, exclusive")
+    products.add_argument("--limit", type=int, default=100)
+    unknowns = subparsers.add_parser("top-unknowns", help="Most frequent unknown ingredients")
+    unknowns.add_argument("--since", help="ISO date, inclusive")
+    unknowns.add_argument("--limit", type=int, default=20)
+    verdicts = subparsers.add_parser("verdicts", help="Analyses per verdict")
+    verdicts.add_argument("--since", help="ISO date, inclusive")
+    subparsers.add_parser("import-log", help="Backfill from the analysis results log")
+    args = parser.parse_args()
+
+    store = HistoryStore(Path(args.db))
+    start = time.perf_counter()
+    if args.command == "products-with":
+        result: Any = store.products_with_ingredient(args.ingredient, args.since, args.until, args.limit)
+    elif args.command == "top-unknowns":
+        result = store.top_unknown_ingredients(args.since, args.limit)
+    elif args.command == "verdicts":
+        result = store.verdict_counts(args.since)
+    else:
+        from src.utils.results_sink import iter_records
+        count = 0
+        for record in iter_records():
+            store.record(record)
+            count += 1
+        store.close()
+        result = {"imported": count}
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    store.close()
+    print(json.dumps(result, indent=2))
+    print(f"({elapsed_ms:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+HTML cleaning and token-compact chunking for the retrieval corpus.
+
+The saved pages in data/ are mostly markup. E-number tables and the ECodes cards
+are reduced to one compact row per additive ("e-number | name | category | status"),
+prose pages are reduced to their visible text, and near-identical chunks are dropped.
+
+Usage:
+    python -m src.utils.html_chunker [--data-dir DIR] [--persist-dir DIR]
+"""
+import argparse
+import json
+import re
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from config.settings import DATA_DIR, STORAGE_DIR, COMPACT_CHUNK_TOKENS, CHUNK_DEDUPE_THRESHOLD
+from src.utils.tokens import count_tokens
+
+ROW_HEADER = "e-number | name | category | status"
+
+# Elements whose content is never useful as retrieval context
+_SKIP_TAGS = {"script", "style", "noscript", "nav", "footer", "svg", "form", "select", "iframe", "button"}
+
+# Elements that end a line of visible text
+_BLOCK_TAGS = {
+    "p", "div", "li", "ul", "ol", "br", "h1", "h2", "h3", "h4", "h5", "h6", "section",
+    "article", "table", "tr", "blockquote", "dd", "dt", "hr",
+}
+
+# Page chrome identified by class, id or role: government masthead, menus, screen-reader text
+_CHROME_MARKERS = ("masthead", "navbar", "dropdown-menu", "breadcrumb", "sidebar", "sr-only", "navigation")
+
+_VOID_TAGS = {"br", "hr", "img", "input", "meta", "link", "area", "base", "col", "embed", "source", "wbr"}
+
+# E-number codes as written in the sources: E471, e150(a-d), E160a, 1422, 296
+_CODE_RE = re.compile(r"^(?:e\s*)?\d{3,4}[a-z]?(?:\s*\([a-z0-9,\- ]+\))?$", re.IGNORECASE)
+
+# ECodes card headings: "e100 - Halal"
+_CARD_HEADING_RE = re.compile(r"^(e?\s*\d{3,4}[a-z]?(?:\([a-z0-9,\- ]+\))?)\s*-\s*(.+)$", re.IGNORECASE)
+
+_STATUS_WORDS = (
+    ("non-halal", "Non-Halal"),
+    ("haraam", "Non-Halal"),
+    ("haram", "Non-Halal"),
+    ("mushbooh", "Doubtful"),
+    ("doubtful", "Doubtful"),
+    ("syubhah", "Doubtful"),
+    ("halal", "Halal"),
+)
+
+
+class _BlockExtractor(HTMLParser):
+    """
+    Collect the visible text of a page as a stream of blocks.
+
+    Each block is either ("row", [cell, ...]) for a table row or
+    ("text", tag, line) for a line of visible text.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.blocks: List[Tuple[Any, ...]] = []
+        self._skip_tag: Optional[str] = None
+        self._skip_nesting = 0
+        self._row: Optional[List[str]] = None
+        self._cell: Optional[List[str]] = None
+        self._line: List[str] = []
+        self._line_tag = "p"
+
+    def _flush_line(self) -> None:
+        text = " ".join("".join(self._line).split())
+        if text and self._row is None:
+            self.blocks.append(("text", self._line_tag, text))
+        self._line = []
+
+    @staticmethod
+    def _is_chrome(tag: str, attrs: List[Tuple[str, Optional[str]]]) -> bool:
+        if tag in _SKIP_TAGS:
+            return True
+        markers = " ".join(value or "" for name, value in attrs if name in ("class", "id", "role")).lower()
+        return any(marker in markers for marker in _CHROME_MARKERS)
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_nesting += 1
+            return
+        if tag not in _VOID_TAGS and self._is_chrome(tag, attrs):
+            self._skip_tag, self._skip_nesting = tag, 1
+            return
+        if tag == "tr":
+            self._flush_line()
+            self._row = []
+        elif tag in ("td", "th") and self._row is not None:
+            self._cell = []
+        elif tag in _BLOCK_TAGS:
+            if self._cell is not None:
+                self._cell.append(" ")
+            else:
+                self._flush_line()
+                self._line_tag = tag
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_nesting -= 1
+                if self._skip_nesting == 0:
+                    self._skip_tag = None
+            return
+        if tag in ("td", "th") and self._cell is not None and self._row is not None:
+            self._row.append(" ".join("".join(self._cell).split()))
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            if any(self._row):
+                self.blocks.append(("row", self._row))
+            self._row = None
+            self._cell = None
+        elif tag in _BLOCK_TAGS and self._cell is None:
+            self._flush_line()
+            self._line_tag = "p"
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_tag is not None:
+            return
+        if self._cell is not None:
+            self._cell.append(data)
+        elif self._row is None:
+            self._line.append(data)
+
+    def close(self) -> None:
+        super().close()
+        self._flush_line()
+
+
+def normalise_status(text: str) -> Tuple[str, str]:
+    """
+    Reduce a free-text halal ruling to a status label plus any remaining note.
+
+    Args:
+        text (str): Ruling text such as "Mushbooh, Halal if obtained from plant fat"
+
+    Returns:
+        Tuple[str, str]: Tuple of (status label, note). The note is empty when the
+            text is just the status word.
+    """
+    lowered = text.lower()
+    positions = [
+        (lowered.find(word), label) for word, label in _STATUS_WORDS if word in lowered
+    ]
+    if not positions:
+        return "Unknown", text
+    # The earliest status word is the ruling; anything else is a qualification
+    status = min(positions)[1]
+    if any(label != status for _, label in positions):
+        status = "Doubtful" if status == "Halal" else status
+    note = text if lowered.strip(" .") not in {word for word, _ in _STATUS_WORDS} else ""
+    return status, note
+
+
+def _format_row(code: str, name: str, category: str, status_text: str, description: str = "") -> str:
+    status, note = normalise_status(status_text)
+    note = " ".join(part for part in (note, description) if part)
+    fields = [code.upper().replace(" ", ""), name, category, status]
+    if note:
+        fields.append(f"note: {note}")
+    return " | ".join(field.strip() for field in fields)
+
+
+def extract_compact_lines(html_text: str) -> Tuple[List[str], List[str]]:
+    """
+    Extract compact additive rows and visible prose lines from a saved page.
+
+    Args:
+        html_text (str): Raw HTML
+
+    Returns:
+        Tuple[List[str], List[str]]: Tuple of (additive rows, prose lines)
+    """
+    parser = _BlockExtractor()
+    parser.feed(html_text)
+    parser.close()
+
+    rows: List[str] = []
+    prose: List[str] = []
+    blocks = parser.blocks
+    i = 0
+    while i < len(blocks):
+        block = blocks[i]
+        if block[0] == "row":
+            cells = [cell for cell in block[1] if cell]
+            if len(cells) >= 4 and _CODE_RE.match(cells[0]):
+                rows.append(_format_row(cells[0], cells[1], cells[2], " ".join(cells[3:])))
+            elif cells:
+                prose.append(" | ".join(cells))
+            i += 1
+            continue
+
+        _, tag, text = block
+        match = _CARD_HEADING_RE.match(text) if tag in ("h2", "h3", "h4") else None
+        if match and _CODE_RE.match(match.group(1)):
+            # ECodes card: heading "e100 - Halal", then name, then "Category: description"
+            following = [b[2] for b in blocks[i + 1:i + 3] if b[0] == "text" and b[1] not in ("h2", "h3", "h4")]
+            name = following[0] if following else ""
+            category, _, description = (following[1] if len(following) > 1 else "").partition(":")
+            rows.append(_format_row(match.group(1), name, category, match.group(2), description.strip()))
+            i += 1 + len(following)
+            continue
+
+        prose.append(text)
+        i += 1
+    return rows, prose
+
+
+def _pack(lines: Iterable[str], max_tokens: int, header: str = "") -> List[str]:
+    """Greedily pack lines into chunks of at most max_tokens tokens."""
+    chunks: List[str] = []
+    current: List[str] = [header] if header else []
+    base = count_tokens(header) if header else 0
+    used = base
+    for line in lines:
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens and len(current) > (1 if header else 0):
+            chunks.append("\n".join(current))
+            current = [header] if header else []
+            used = base
+        current.append(line)
+        used += cost
+    if len(current) > (1 if header else 0):
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def _shingles(text: str, size: int = 5) -> Set[int]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {hash(" ".join(words))}
+    return {hash(" ".join(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+def dedupe_chunks(chunks: List[str], threshold: float = CHUNK_DEDUPE_THRESHOLD) -> Tuple[List[str], int]:
+    """
+    Drop chunks that are near-identical to an earlier chunk.
+
+    Similarity is the Jaccard overlap of word 5-shingles, which catches the
+    repeated navigation and banner text shared by the saved MUIS pages.
+
+    Args:
+        chunks (List[str]): Chunks in corpus order
+        threshold (float): Similarity at or above which a chunk is a duplicate
+
+    Returns:
+        Tuple[List[str], int]: Tuple of (kept chunks, number dropped)
+    """
+    kept: List[str] = []
+    kept_shingles: List[Set[int]] = []
+    for chunk in chunks:
+        shingles = _shingles(chunk)
+        duplicate = any(
+            len(shingles & other) / len(shingles | other) >= threshold
+            for other in kept_shingles if shingles and other
+        )
+        if duplicate:
+            continue
+        kept.append(chunk)
+        kept_shingles.append(shingles)
+    return kept, len(chunks) - len(kept)
+
+
+def chunk_html(
+    html_text: str,
+    source_name: str,
+    max_tokens: int = COMPACT_CHUNK_TOKENS,
+    threshold: float = CHUNK_DEDUPE_THRESHOLD
+) -> List[str]:
+    """
+    Turn a saved HTML page into deduplicated, token-compact chunks.
+
+    Args:
+        html_text (str): Raw HTML
+        source_name (str): Source label written at the top of each chunk
+        max_tokens (int): Maximum tokens per chunk
+        threshold (float): Near-duplicate similarity threshold
+
+    Returns:
+        List[str]: Compact chunks
+    """
+    rows, prose = extract_compact_lines(html_text)
+    title = Path(source_name).stem
+    chunks = _pack(rows, max_tokens, header=f"{title}\n{ROW_HEADER}")
+    chunks.extend(_pack(dict.fromkeys(prose), max_tokens, header=title))
+    kept, _ = dedupe_chunks(chunks, threshold)
+    return kept
+
+
+def _token_stats(counts: List[int]) -> Dict[str, Any]:
+    if not counts:
+        return {"nodes": 0, "total": 0, "mean": 0, "max": 0}
+    return {
+        "nodes": len(counts),
+        "total": sum(counts),
+        "mean": round(sum(counts) / len(counts), 1),
+        "max": max(counts),
+    }
+
+
+def chunking_report(data_dir: Path = DATA_DIR, persist_dir: Path = STORAGE_DIR) -> Dict[str, Any]:
+    """
+    Compare tokens per node in the persisted corpus with the compact chunking.
+
+    Args:
+        data_dir (Path): Directory containing the HTML sources
+        persist_dir (Path): Directory containing the persisted docstore.json
+
+    Returns:
+        Dict[str, Any]: Per-source token statistics before and after, plus the
+            number of chunks that duplicate a chunk from another source
+    """
+    before: Dict[str, List[int]] = {}
+    docstore_path = Path(persist_dir) / "docstore.json"
+    if docstore_path.exists():
+        with open(docstore_path, "r", encoding="utf-8") as f:
+            nodes = json.load(f).get("docstore/data", {})
+        for node in nodes.values():
+            data = node.get("__data__", {})
+            file_name = str(data.get("metadata", {}).get("file_name", ""))
+            file_name = file_name.replace("\\", "/").rsplit("/", 1)[-1]
+            before.setdefault(file_name, []).append(count_tokens(data.get("text", "")))
+
+    report: Dict[str, Any] = {"sources": {}}
+    all_chunks: List[str] = []
+    for source in sorted(Path(data_dir).glob("*.html")):
+        html_text = source.read_text(encoding="utf-8", errors="replace")
+        chunks = chunk_html(html_text, source.name)
+        all_chunks.extend(chunks)
+        report["sources"][source.name] = {
+            "before": _token_stats(before.get(source.name, [])),
+            "after": _token_stats([count_tokens(chunk) for chunk in chunks]),
+        }
+
+    _, dropped = dedupe_chunks(all_chunks)
+    report["cross_source_duplicates"] = dropped
+    report["before_total"] = sum(s["before"]["total"] for s in report["sources"].values())
+    report["after_total"] = sum(s["after"]["total"] for s in report["sources"].values())
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command-line entry point printing the before/after token report."""
+    parser = argparse.ArgumentParser(description="Report tokens per node before and after compact chunking.")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR, help="Directory containing the HTML sources")
+    parser.add_argument("--persist-dir", type=Path, default=STORAGE_DIR, help="Index persist directory")
+    args = parser.parse_args(argv)
+    print(json.dumps(chunking_report(args.data_dir, args.persist_dir), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Perceptual hashing of label photos and a near-duplicate index of extractions.
+
+Re-uploads of the same photo differ in compression, scale and exposure, so
+their bytes never match. Perceptual hashes of a normalised grayscale
+thumbnail are compared instead: a 1024-bit difference hash (dHash), indexed
+in 16-bit bands for fast Hamming lookup, confirmed by a 64-bit DCT hash
+(pHash). A photo close enough to one already extracted reuses the stored
+ingredients text instead of calling the vision model again, but only once it
+is confirmed to show the same label: either its bytes are identical, or a
+verifier (local OCR) reads the same ingredients from it. Labels that differ in
+a single word ("flavouring (vanillin)" and "flavouring (alcohol)") hash
+almost identically, so similarity alone never decides.
+
+Flat areas (blank label background) carry no information, so dHash bits are
+only compared where either photo has an edge; thumbnails with too few edges
+(text too small to show at thumbnail size) are never matched, since labels
+that differ only in their text would look identical.
+"""
+import hashlib
+import json
+import math
+import threading
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from PIL import Image, ImageOps
+
+from config.settings import IMAGE_INDEX_FILE, NEAR_DUPLICATE_MIN_SIMILARITY
+
+DHASH_SIZE = 32  # 32x32 = 1024 bits
+DHASH_BITS = DHASH_SIZE * DHASH_SIZE
+EDGE_THRESHOLD = 8  # Grey-level step between neighbours that counts as an edge
+MIN_EDGE_FRACTION = 0.05  # Below this a thumbnail is too featureless to match
+PHASH_SIZE = 32  # DCT input side; the 8x8 lowest frequencies give 64 bits
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# DCT-II basis for the 8 lowest frequencies, computed once
+_DCT = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * PHASH_SIZE)) for x in range(PHASH_SIZE)]
+    for u in range(8)
+]
+
+
+class ImageHashes(NamedTuple):
+    """Perceptual hashes of one photo."""
+    dhash: int  # Whether each pixel is brighter than its right neighbour
+    edges: int  # Whether that step is an edge (above EDGE_THRESHOLD)
+    phash: int  # Low-frequency DCT signs
+    sha256: str = ""  # Digest of the image bytes, for exact re-uploads
+
+
+def _thumbnail(image_bytes: bytes) -> Image.Image:
+    image = Image.open(BytesIO(image_bytes))
+    # Let the JPEG decoder downscale while decoding instead of decoding full size
+    image.draft("L", (DHASH_SIZE * 8, DHASH_SIZE * 8))
+    image = ImageOps.exif_transpose(image).convert("L")
+    return ImageOps.autocontrast(image)
+
+
+def dhash(image: Image.Image) -> ImageHashes:
+    """
+    Difference hash and edge mask of a grayscale image (pHash left as 0).
+
+    Args:
+        image (Image.Image): Grayscale image
+
+    Returns:
+        ImageHashes: 1024-bit dHash and edge mask
+    """
+    width = DHASH_SIZE + 1
+    pixels = image.resize((width, DHASH_SIZE), Image.LANCZOS).tobytes()
+    value = edges = 0
+    for row in range(DHASH_SIZE):
+        offset = row * width
+        for col in range(DHASH_SIZE):
+            left, right = pixels[offset + col], pixels[offset + col + 1]
+            value = (value << 1) | (left > right)
+            edges = (edges << 1) | (abs(left - right) > EDGE_THRESHOLD)
+    return ImageHashes(value, edges, 0)
+
+
+def phash(image: Image.Image) -> int:
+    """
+    DCT hash: whether each low-frequency coefficient is above their median.
+
+    Args:
+        image (Image.Image): Grayscale image
+
+    Returns:
+        int: 64-bit hash
+    """
+    pixels = image.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS).tobytes()
+    rows = [pixels[y * PHASH_SIZE:(y + 1) * PHASH_SIZE] for y in range(PHASH_SIZE)]
+    # Separable 2-D DCT, restricted to the 8x8 lowest frequencies
+    row_freqs = [[sum(b * p for b, p in zip(basis, row)) for basis in _DCT] for row in rows]
+    coefficients = [
+        sum(basis[y] * row_freqs[y][u] for y in range(PHASH_SIZE)) for basis in _DCT for u in range(8)
+    ]
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]  # DC term left out
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+
+def image_hashes(image_bytes: bytes) -> ImageHashes:
+    """
+    Perceptual hashes of a photo.
+
+    Args:
+        image_bytes (bytes): Raw image bytes
+
+    Returns:
+        ImageHashes: dHash, edge mask, pHash and content digest
+    """
+    image = _thumbnail(image_bytes)
+    return dhash(image)._replace(phash=phash(image), sha256=hashlib.sha256(image_bytes).hexdigest())
+
+
+def _popcount(value: int) -> int:
+    # int.bit_count() needs Python 3.10; the Docker image runs 3.9
+    return bin(value).count("1")
+
+
+def matchable(hashes: ImageHashes) -> bool:
+    """Whether a thumbnail has enough edges to be compared reliably."""
+    return _popcount(hashes.edges) >= MIN_EDGE_FRACTION * DHASH_BITS
+
+
+def similarity(a: ImageHashes, b: ImageHashes) -> float:
+    """
+    Similarity of two photos from their hashes; the weaker of the two hashes decides.
+
+    Args:
+        a (ImageHashes): Hashes of the first photo
+        b (ImageHashes): Hashes of the second photo
+
+    Returns:
+        float: 1.0 for identical hashes, down to 0.0
+    """
+    compared = a.edges | b.edges
+    d_distance = _popcount((a.dhash ^ b.dhash) & compared) / max(_popcount(compared), 1)
+    p_distance = _popcount(a.phash ^ b.phash) / 64
+    return 1.0 - max(d_distance, p_distance)
+
+
+def _bands(hashes: ImageHashes) -> List[int]:
+    # Bands without edges are blank background in most photos; indexing them
+    # would make every photo a candidate for every other
+    return [
+        band for band in range(DHASH_BITS // BAND_BITS)
+        if (hashes.edges >> (band * BAND_BITS)) & BAND_MASK
+    ]
+
+
+class NearDuplicateIndex:
+    """
+    Hamming-distance index from photo hashes to the ingredients extracted from them.
+
+    The dHash is split into 64 bands of 16 bits. Two hashes within 63 bits of
+    each other share at least one band exactly, so only entries sharing a band
+    with edges in it are compared. Entries are appended to a JSON Lines file
+    and reloaded on start.
+    """
+
+    def __init__(self, path: Optional[Path] = None, min_similarity: float = NEAR_DUPLICATE_MIN_SIMILARITY):
+        """
+        Args:
+            path (Optional[Path]): JSON Lines file the index is persisted to; None keeps it in memory
+            min_similarity (float): Similarity needed to reuse an extraction
+        """
+        self.path = Path(path) if path else None
+        self.min_similarity = min_similarity
+        self._entries: List[Dict[str, Any]] = []
+        self._bands: Dict[Any, List[int]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.unconfirmed = 0
+        if self.path and self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._insert(json.loads(line))
+                    except (json.JSONDecodeError, KeyError, ValueError):
+                        continue  # Partial line from an interrupted write
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _insert(self, entry: Dict[str, Any]) -> None:
+        hashes = ImageHashes(
+            int(entry["dhash"], 16), int(entry["edges"], 16), int(entry["phash"], 16), entry.get("sha256", "")
+        )
+        entry["hashes"] = hashes
+        position = len(self._entries)
+        self._entries.append(entry)
+        for band in _bands(hashes):
+            key = (band, (hashes.dhash >> (band * BAND_BITS)) & BAND_MASK)
+            self._bands.setdefault(key, []).append(position)
+
+    def lookup(
+        self, hashes: ImageHashes, model: str, verify: Optional[Callable[[str], bool]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Find an earlier photo of the same label extracted with the same model.
+
+        A similar photo is only reused if its bytes are identical or verify
+        confirms that the new photo shows the stored ingredients.
+
+        Args:
+            hashes (ImageHashes): Hashes from image_hashes()
+            model (str): Vision model the extraction must come from
+            verify (Optional[Callable[[str], bool]]): Checks the stored ingredients
+                text against the new photo, e.g. with local OCR; None accepts
+                identical bytes only
+
+        Returns:
+            Optional[Dict[str, Any]]: {"ingredients_text", "similarity", "extracted_at",
+                "confirmed_by"} for a confirmed match at or above min_similarity, else None
+        """
+        if not matchable(hashes):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            candidates = set()
+            for band in _bands(hashes):
+                candidates.update(self._bands.get((band, (hashes.dhash >> (band * BAND_BITS)) & BAND_MASK), ()))
+            best, best_score, identical = None, 0.0, None
+            for position in candidates:
+                entry = self._entries[position]
+                if entry["model"] != model:
+                    continue
+                if hashes.sha256 and entry["hashes"].sha256 == hashes.sha256:
+                    identical = entry
+                score = similarity(hashes, entry["hashes"])
+                if score > best_score:
+                    best, best_score = entry, score
+
+        if identical is not None:
+            return self._hit(identical, similarity(hashes, identical["hashes"]), "content_hash")
+        if best is None or best_score < self.min_similarity:
+            with self._lock:
+                self.misses += 1
+            return None
+        # Outside the lock: local OCR takes a second or so
+        if verify is None or not verify(best["ingredients_text"]):
+            with self._lock:
+                self.misses += 1
+                self.unconfirmed += 1
+            return None
+        return self._hit(best, best_score, "verified")
+
+    def _hit(self, entry: Dict[str, Any], score: float, confirmed_by: str) -> Dict[str, Any]:
+        with self._lock:
+            self.hits += 1
+        return {
+            "ingredients_text": entry["ingredients_text"],
+            "similarity": round(score, 4),
+            "extracted_at": entry["extracted_at"],
+            "confirmed_by": confirmed_by,
+        }
+
+    def add(self, hashes: ImageHashes, model: str, ingredients_text: str) -> None:
+        """
+        Record the extraction for a photo; featureless thumbnails are skipped.
+
+        Args:
+            hashes (ImageHashes): Hashes from image_hashes()
+            model (str): Vision model that produced the extraction
+            ingredients_text (str): Extracted ingredients text
+        """
+        if not ingredients_text.strip() or not matchable(hashes):
+            return
+        entry = {
+            "dhash": format(hashes.dhash, "x"),
+            "edges": format(hashes.edges, "x"),
+            "phash": format(hashes.phash, "x"),
+            "sha256": hashes.sha256,
+            "model": model,
+            "ingredients_text": ingredients_text,
+            "extracted_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            if self.path:
+                try:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(entry) + "\n")
+                except OSError as e:
+                    print(f"Error saving image index entry: {e}")
+            self._insert(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Indexed photos, reused extractions, misses and the
+                similar photos that could not be confirmed as the same label
+        """
+        return {
+            "entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+            "unconfirmed": self.unconfirmed,
+        }
+
+
+_index: Optional[NearDuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_image_index() -> NearDuplicateIndex:
+    """
+    Return the process-wide near-duplicate index, loaded from IMAGE_INDEX_FILE once.
+
+    Returns:
+        NearDuplicateIndex: Shared index
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = NearDuplicateIndex(IMAGE_INDEX_FILE)
+        return _index
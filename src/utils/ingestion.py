@@ -0,0 +1,512 @@
+"""
+Incremental ingestion of the knowledge sources in data/ into the persisted LlamaIndex index.
+
+Every source file and every chunk is fingerprinted. Sources whose bytes and parser
+have not changed are skipped without parsing, and only chunks that have never been
+embedded are sent to the embedding model. Embeddings are cached on disk as each
+batch completes, so an interrupted run resumes where it stopped.
+
+Usage:
+    python -m src.utils.ingestion [--data-dir DIR] [--persist-dir DIR] [--full] [--dry-run]
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from src.utils.html_chunker import chunk_html
+from config.settings import (
+    DATA_DIR, STORAGE_DIR, INGEST_SOURCE_EXTENSIONS, INGEST_MANIFEST, EMBEDDING_CACHE,
+    EMBED_BATCH_SIZE, EMBED_WORKERS, EMBED_MAX_RETRIES, CHUNK_SIZE, CHUNK_OVERLAP
+)
+
+# Try to import llama_index, but make it optional
+try:
+    from llama_index import (
+        Document, ServiceContext, SimpleDirectoryReader, StorageContext, VectorStoreIndex,
+        load_index_from_storage
+    )
+    from llama_index.node_parser import SentenceSplitter
+    from llama_index.storage.docstore import SimpleDocumentStore
+    from llama_index.storage.index_store import SimpleIndexStore
+    from llama_index.vector_stores import SimpleVectorStore
+    LLAMA_INDEX_AVAILABLE = True
+except ImportError:
+    LLAMA_INDEX_AVAILABLE = False
+
+MANIFEST_VERSION = 1
+
+# Bump the version of a parser whenever its output changes so that the
+# affected sources are re-parsed on the next run.
+PARSER_VERSIONS = {
+    ".html": "compact-html/1",
+    ".pdf": "simple-directory-reader/1",
+    ".csv": "simple-directory-reader/1",
+}
+
+
+def fingerprint_file(file_path: Path, block_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 fingerprint of a file without loading it into memory.
+
+    Args:
+        file_path (Path): File to fingerprint
+        block_size (int): Read size in bytes
+
+    Returns:
+        str: Hex digest of the file contents
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint_text(text: str) -> str:
+    """
+    Compute the SHA-256 fingerprint of a chunk of text.
+
+    Args:
+        text (str): Chunk text
+
+    Returns:
+        str: Hex digest of the text
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def discover_sources(data_dir: Path, extensions: Iterable[str] = INGEST_SOURCE_EXTENSIONS) -> List[Path]:
+    """
+    List the knowledge source files at the top level of the data directory.
+
+    The saved "_files" asset folders next to each HTML page are not sources
+    and are skipped, matching how the index was originally built.
+
+    Args:
+        data_dir (Path): Directory containing the source files
+        extensions (Iterable[str]): File extensions to ingest
+
+    Returns:
+        List[Path]: Sorted list of source files
+    """
+    suffixes = {ext.lower() for ext in extensions}
+    return sorted(
+        path for path in Path(data_dir).iterdir()
+        if path.is_file() and not path.name.startswith(".") and path.suffix.lower() in suffixes
+    )
+
+
+def load_manifest(manifest_path: Path) -> Dict[str, Any]:
+    """
+    Load the ingestion manifest, returning an empty one if it doesn't exist yet.
+
+    Args:
+        manifest_path (Path): Path to the manifest JSON file
+
+    Returns:
+        Dict[str, Any]: Manifest with a "sources" mapping keyed by file name
+    """
+    if not Path(manifest_path).exists():
+        return {"version": MANIFEST_VERSION, "sources": {}}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest.setdefault("sources", {})
+    return manifest
+
+
+def save_manifest(manifest: Dict[str, Any], manifest_path: Path) -> None:
+    """
+    Atomically write the ingestion manifest.
+
+    Args:
+        manifest (Dict[str, Any]): Manifest to save
+        manifest_path (Path): Destination path
+    """
+    manifest_path = Path(manifest_path)
+    tmp_path = manifest_path.with_suffix(manifest_path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+class EmbeddingCache:
+    """
+    Append-only on-disk cache of chunk embeddings keyed by model and chunk fingerprint.
+
+    Each completed batch is appended and flushed immediately, which is what lets
+    an interrupted ingestion run resume without re-embedding finished batches.
+    """
+
+    def __init__(self, cache_path: Path):
+        self.cache_path = Path(cache_path)
+        self._entries: Dict[str, List[float]] = {}
+        if self.cache_path.exists():
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A partially written last line from an interrupted run
+                        continue
+                    self._entries[record["key"]] = record["embedding"]
+
+    @staticmethod
+    def make_key(model_name: str, chunk_hash: str) -> str:
+        return f"{model_name}:{chunk_hash}"
+
+    def get(self, key: str) -> Optional[List[float]]:
+        return self._entries.get(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """
+        Add embeddings to the cache and persist them straight away.
+
+        Args:
+            items (Dict[str, List[float]]): Mapping of cache key to embedding
+        """
+        self.cache_path.parent.mkdir(exist_ok=True, parents=True)
+        with open(self.cache_path, "a", encoding="utf-8") as f:
+            for key, embedding in items.items():
+                f.write(json.dumps({"key": key, "embedding": embedding}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._entries.update(items)
+
+
+def embed_missing(
+    texts: Dict[str, str],
+    embed_model: Any,
+    cache: EmbeddingCache,
+    model_name: str,
+    batch_size: int = EMBED_BATCH_SIZE,
+    workers: int = EMBED_WORKERS,
+    max_retries: int = EMBED_MAX_RETRIES
+) -> int:
+    """
+    Embed every chunk that isn't in the cache yet, in parallel batches.
+
+    Args:
+        texts (Dict[str, str]): Mapping of chunk fingerprint to chunk text
+        embed_model: LlamaIndex embedding model
+        cache (EmbeddingCache): Cache to read from and write completed batches to
+        model_name (str): Embedding model name, part of the cache key
+        batch_size (int): Number of chunks per embedding request
+        workers (int): Number of concurrent embedding requests
+        max_retries (int): Attempts per batch before giving up
+
+    Returns:
+        int: Number of chunks that were embedded
+
+    Raises:
+        RuntimeError: If any batch still fails after all retries. Completed
+            batches are already cached, so re-running resumes from there.
+    """
+    pending = [
+        (chunk_hash, text) for chunk_hash, text in texts.items()
+        if EmbeddingCache.make_key(model_name, chunk_hash) not in cache
+    ]
+    if not pending:
+        return 0
+
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+
+    def embed_once(batch: List[Tuple[str, str]]) -> Dict[str, List[float]]:
+        embeddings = embed_model.get_text_embedding_batch([text for _, text in batch])
+        return {
+            EmbeddingCache.make_key(model_name, chunk_hash): embedding
+            for (chunk_hash, _), embedding in zip(batch, embeddings)
+        }
+
+    def embed_batch(batch: List[Tuple[str, str]]) -> Dict[str, List[float]]:
+        for attempt in range(1, max_retries):
+            try:
+                return embed_once(batch)
+            except Exception:
+                time.sleep(2 ** attempt)
+        # Last attempt: its error is reported as the batch's failure
+        return embed_once(batch)
+
+    embedded = 0
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(embed_batch, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                failures.append(e)
+                continue
+            # Only the main thread writes to the cache file
+            cache.put_many(result)
+            embedded += len(result)
+            print(f"Embedded {embedded}/{len(pending)} chunks")
+
+    if failures:
+        raise RuntimeError(
+            f"{len(failures)} of {len(batches)} embedding batches failed "
+            f"(first error: {failures[0]}). Re-run to resume."
+        )
+    return embedded
+
+
+def _legacy_file_name(metadata: Dict[str, Any]) -> str:
+    """Return the bare file name from metadata written on any OS."""
+    file_name = str(metadata.get("file_name", ""))
+    return file_name.replace("\\", "/").rsplit("/", 1)[-1]
+
+
+def _load_storage_context(persist_dir: Path) -> Any:
+    """
+    Load the persisted storage context, tolerating a missing vector store file.
+
+    The committed storage/ only contains the docstore and index store, so the
+    vector store is started empty when it hasn't been persisted yet.
+    """
+    def exists(name: str) -> bool:
+        return (persist_dir / name).exists()
+
+    docstore = (
+        SimpleDocumentStore.from_persist_dir(str(persist_dir))
+        if exists("docstore.json") else SimpleDocumentStore()
+    )
+    index_store = (
+        SimpleIndexStore.from_persist_dir(str(persist_dir))
+        if exists("index_store.json") else SimpleIndexStore()
+    )
+    vector_store = (
+        SimpleVectorStore.from_persist_dir(str(persist_dir))
+        if exists("default__vector_store.json") or exists("vector_store.json") else SimpleVectorStore()
+    )
+    return StorageContext.from_defaults(docstore=docstore, index_store=index_store, vector_store=vector_store)
+
+
+def _has_embedding(vector_store: Any, node_id: str) -> bool:
+    try:
+        return vector_store.get(node_id) is not None
+    except KeyError:
+        return False
+
+
+def parse_source(source: Path, splitter: Any) -> Tuple[List[Any], List[Any]]:
+    """
+    Parse a source file into documents and fingerprinted chunk nodes.
+
+    HTML pages go through the compact chunker, one document per chunk, so
+    table markup never reaches the index. Document ids are derived from the
+    file name so they stay stable across runs, and node ids are derived from
+    the document id and chunk fingerprint.
+
+    Args:
+        source (Path): Source file to parse
+        splitter: LlamaIndex node parser
+
+    Returns:
+        Tuple[List[Any], List[Any]]: Tuple of (documents, nodes)
+    """
+    if source.suffix.lower() == ".html":
+        html_text = source.read_text(encoding="utf-8", errors="replace")
+        documents = [
+            Document(text=chunk, id_=f"{source.name}_part_{position}", metadata={"file_name": source.name})
+            for position, chunk in enumerate(chunk_html(html_text, source.name))
+        ]
+    else:
+        documents = SimpleDirectoryReader(
+            input_files=[str(source)],
+            file_metadata=lambda filename: {"file_name": Path(filename).name},
+            filename_as_id=True
+        ).load_data()
+
+    nodes = splitter.get_nodes_from_documents(documents)
+    for position, node in enumerate(nodes):
+        chunk_hash = fingerprint_text(node.get_content())
+        node.metadata["chunk_hash"] = chunk_hash
+        node.excluded_embed_metadata_keys.append("chunk_hash")
+        node.excluded_llm_metadata_keys.append("chunk_hash")
+        node.id_ = f"{node.ref_doc_id}:{position}:{chunk_hash[:16]}"
+    return documents, nodes
+
+
+def run_ingestion(
+    data_dir: Path = DATA_DIR,
+    persist_dir: Path = STORAGE_DIR,
+    manifest_path: Path = INGEST_MANIFEST,
+    cache_path: Path = EMBEDDING_CACHE,
+    full: bool = False,
+    dry_run: bool = False,
+    batch_size: int = EMBED_BATCH_SIZE,
+    workers: int = EMBED_WORKERS
+) -> Dict[str, Any]:
+    """
+    Bring the persisted index up to date with the sources in the data directory.
+
+    Args:
+        data_dir (Path): Directory containing the knowledge sources
+        persist_dir (Path): Directory where the index is persisted
+        manifest_path (Path): Ingestion manifest location
+        cache_path (Path): Embedding cache location
+        full (bool): Re-parse every source even if its fingerprint is unchanged
+        dry_run (bool): Only report what would change
+        batch_size (int): Number of chunks per embedding request
+        workers (int): Number of concurrent embedding requests
+
+    Returns:
+        Dict[str, Any]: Report of added, changed, unchanged and removed sources
+
+    Raises:
+        ImportError: If LlamaIndex is not available
+    """
+    if not LLAMA_INDEX_AVAILABLE:
+        raise ImportError(
+            "LlamaIndex is required for this feature. "
+            "Please install it with: pip install llama-index"
+        )
+
+    data_dir, persist_dir = Path(data_dir), Path(persist_dir)
+    persist_dir.mkdir(exist_ok=True, parents=True)
+    manifest = load_manifest(manifest_path)
+    known = manifest["sources"]
+
+    splitter = SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    service_context = ServiceContext.from_defaults(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    embed_model = service_context.embed_model
+    model_name = getattr(embed_model, "model_name", type(embed_model).__name__)
+
+    storage_context = _load_storage_context(persist_dir)
+    if storage_context.index_store.index_structs():
+        index = load_index_from_storage(storage_context, service_context=service_context)
+    else:
+        index = VectorStoreIndex(nodes=[], storage_context=storage_context, service_context=service_context)
+    ref_doc_info = index.docstore.get_all_ref_doc_info() or {}
+
+    # Group documents from the original notebook build (random ids, absolute
+    # Windows paths) by file name so they can be matched to their sources.
+    legacy_docs: Dict[str, Dict[str, Any]] = {}
+    for ref_doc_id, info in ref_doc_info.items():
+        legacy_docs.setdefault(_legacy_file_name(info.metadata), {})[ref_doc_id] = info
+
+    report: Dict[str, List[str]] = {"added": [], "changed": [], "unchanged": [], "removed": []}
+    sources = discover_sources(data_dir)
+    pending_nodes: List[Any] = []
+    stale_ref_docs: List[str] = []
+
+    for source in sources:
+        name = source.name
+        file_hash = fingerprint_file(source)
+        parser = PARSER_VERSIONS.get(source.suffix.lower(), "simple-directory-reader/1")
+        entry = known.get(name)
+
+        if entry and not full and entry["file_hash"] == file_hash and entry["parser"] == parser:
+            if all(_has_embedding(index.vector_store, node_id) for node_id in entry.get("node_ids", [])):
+                report["unchanged"].append(name)
+                continue
+
+        documents, nodes = parse_source(source, splitter)
+
+        if entry is None and name in legacy_docs and not full:
+            # First run against the notebook-built index: compare against the
+            # doc_hash values already recorded in storage/docstore.json.
+            legacy = legacy_docs[name]
+            legacy_metadata = next(iter(legacy.values())).metadata
+            legacy_hashes = {index.docstore.get_document_hash(ref_id) for ref_id in legacy}
+            parsed_hashes = {Document(text=doc.text, metadata=legacy_metadata).hash for doc in documents}
+            legacy_node_ids = [node_id for info in legacy.values() for node_id in info.node_ids]
+            if legacy_hashes == parsed_hashes and all(
+                _has_embedding(index.vector_store, node_id) for node_id in legacy_node_ids
+            ):
+                known[name] = {
+                    "file_hash": file_hash,
+                    "parser": parser,
+                    "ref_doc_ids": sorted(legacy),
+                    "node_ids": legacy_node_ids,
+                    "chunk_hashes": [],
+                }
+                report["unchanged"].append(name)
+                continue
+
+        report["changed" if (entry or name in legacy_docs) else "added"].append(name)
+        stale_ref_docs.extend(entry["ref_doc_ids"] if entry else legacy_docs.get(name, {}).keys())
+        pending_nodes.extend(nodes)
+        known[name] = {
+            "file_hash": file_hash,
+            "parser": parser,
+            "ref_doc_ids": sorted({node.ref_doc_id for node in nodes}),
+            "node_ids": [node.node_id for node in nodes],
+            "chunk_hashes": [node.metadata["chunk_hash"] for node in nodes],
+        }
+
+    source_names = {source.name for source in sources}
+    for name in list(known):
+        if name not in source_names:
+            report["removed"].append(name)
+            stale_ref_docs.extend(known.pop(name)["ref_doc_ids"])
+    for name, legacy in legacy_docs.items():
+        if name not in source_names and name not in report["removed"]:
+            report["removed"].append(name)
+            stale_ref_docs.extend(legacy)
+
+    report_summary: Dict[str, Any] = {key: sorted(value) for key, value in report.items()}
+    report_summary["chunks_to_index"] = len(pending_nodes)
+    if dry_run:
+        return report_summary
+
+    cache = EmbeddingCache(cache_path)
+    texts = {
+        node.metadata["chunk_hash"]: node.get_content(metadata_mode="embed")
+        for node in pending_nodes
+    }
+    report_summary["chunks_embedded"] = embed_missing(
+        texts, embed_model, cache, model_name, batch_size=batch_size, workers=workers
+    )
+    report_summary["chunks_from_cache"] = len(texts) - report_summary["chunks_embedded"]
+
+    for node in pending_nodes:
+        node.embedding = cache.get(EmbeddingCache.make_key(model_name, node.metadata["chunk_hash"]))
+
+    for ref_doc_id in dict.fromkeys(stale_ref_docs):
+        index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+    if pending_nodes:
+        index.insert_nodes(pending_nodes)
+
+    index.storage_context.persist(persist_dir=str(persist_dir))
+    save_manifest(manifest, manifest_path)
+    return report_summary
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command-line entry point for incremental ingestion."""
+    parser = argparse.ArgumentParser(description="Incrementally update the persisted knowledge index.")
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR, help="Directory containing the sources")
+    parser.add_argument("--persist-dir", type=Path, default=STORAGE_DIR, help="Index persist directory")
+    parser.add_argument("--full", action="store_true", help="Re-parse every source")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Chunks per embedding request")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS, help="Concurrent embedding requests")
+    args = parser.parse_args(argv)
+
+    report = run_ingestion(
+        data_dir=args.data_dir,
+        persist_dir=args.persist_dir,
+        full=args.full,
+        dry_run=args.dry_run,
+        batch_size=args.batch_size,
+        workers=args.workers
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,566 @@
+"""
+Local classifier for ingredients missing from the dataset.
+
+Most unknown ingredients are variants of known ones ("sunflower lecithin",
+"modified tapioca starch"), so a small linear model over character n-grams
+of the name can classify them on the CPU in microseconds. It is trained on
+the dataset names (and chemical names, which carry the meaning of e-number
+rows) plus verdicts the LLM gave earlier, and its probabilities are
+calibrated by temperature scaling on a held-out split. Unknowns predicted
+with at least LOCAL_CLASSIFIER_MIN_CONFIDENCE are answered locally; only the
+rest are sent to the LLM.
+
+Predictions explain unknown ingredients, like the LLM answer they replace;
+they do not change the product verdict, which comes from the dataset alone.
+
+Usage:
+    python -m src.utils.ingredient_classifier train [--verdicts FILE] [--no-history]
+    python -m src.utils.ingredient_classifier predict "sunflower lecithin" ...
+"""
+import argparse
+import csv
+import hashlib
+import json
+import math
+import random
+import re
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config.settings import (
+    HISTORY_DB, INGREDIENTS_DATASET, LOCAL_CLASSIFIER_MIN_CONFIDENCE, LOCAL_CLASSIFIER_MODEL
+)
+from src.utils.ingredient_parser import STATUS_LABELS, normalise_enumber, normalise_status_code
+
+FORMAT_VERSION = 1
+CLASSES = [STATUS_LABELS[code] for code in sorted(STATUS_LABELS)]
+NGRAM_RANGE = (2, 4)
+EPOCHS = 40
+LEARNING_RATE = 0.5
+L2 = 1e-4
+HOLDOUT = 0.2
+
+_TOKEN_RE = re.compile(r"[a-z]+")
+_CHEM_NOISE_RE = re.compile(r"\(c\.i\.[^)]*\)|\*")
+
+# Keywords in an LLM answer about a single unknown ingredient, most severe first
+_VERDICT_PATTERNS = [
+    ("Non-Halal", re.compile(r"\b(non-halal|not halal|haram)\b", re.IGNORECASE)),
+    ("Doubtful", re.compile(r"\b(doubtful|mushbooh|mashbooh|questionable|depends on)\b", re.IGNORECASE)),
+    ("Halal", re.compile(r"\bhalal\b", re.IGNORECASE)),
+]
+
+
+def features(text: str) -> Dict[str, float]:
+    """
+    L2-normalised feature vector of an ingredient name.
+
+    Character n-grams of each word (with boundary markers), the words
+    themselves and the last word, which is usually the head noun ("lecithin"
+    in "sunflower lecithin").
+
+    Args:
+        text (str): Ingredient name
+
+    Returns:
+        Dict[str, float]: Feature name to weight
+    """
+    words = _TOKEN_RE.findall(text.lower())
+    counts: Counter = Counter()
+    for word in words:
+        counts[f"w:{word}"] += 1
+        padded = f"<{word}>"
+        for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1):
+            for i in range(len(padded) - n + 1):
+                counts[f"c:{padded[i:i + n]}"] += 1
+    if words:
+        counts[f"l:{words[-1]}"] += 2
+    norm = math.sqrt(sum(value * value for value in counts.values())) or 1.0
+    return {feature: value / norm for feature, value in counts.items()}
+
+
+def _softmax(scores: Sequence[float], temperature: float = 1.0) -> List[float]:
+    top = max(scores)
+    exps = [math.exp((score - top) / temperature) for score in scores]
+    total = sum(exps)
+    return [value / total for value in exps]
+
+
+class IngredientClassifier:
+    """
+    Multinomial logistic regression over sparse name features.
+    """
+
+    def __init__(
+        self,
+        weights: Optional[Dict[str, List[float]]] = None,
+        bias: Optional[List[float]] = None,
+        temperature: float = 1.0,
+        metadata: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Args:
+            weights (Optional[Dict[str, List[float]]]): Per-feature weights, one per class
+            bias (Optional[List[float]]): Per-class bias
+            temperature (float): Calibration temperature applied to the scores
+            metadata (Optional[Dict[str, Any]]): Version, training data and evaluation
+        """
+        self.weights = weights or {}
+        self.bias = bias or [0.0] * len(CLASSES)
+        self.temperature = temperature
+        self.metadata = metadata or {}
+
+    @property
+    def version(self) -> str:
+        return self.metadata.get("version", "")
+
+    def scores(self, feature_vector: Dict[str, float]) -> List[float]:
+        totals = list(self.bias)
+        for feature, value in feature_vector.items():
+            row = self.weights.get(feature)
+            if row is not None:
+                for k in range(len(totals)):
+                    totals[k] += row[k] * value
+        return totals
+
+    def predict_proba(self, name: str) -> Dict[str, float]:
+        """
+        Calibrated class probabilities for an ingredient name.
+
+        Args:
+            name (str): Ingredient name
+
+        Returns:
+            Dict[str, float]: Status label to probability
+        """
+        return dict(zip(CLASSES, _softmax(self.scores(features(name)), self.temperature)))
+
+    def predict(self, name: str) -> Tuple[str, float]:
+        """
+        Most likely status of an ingredient name.
+
+        Args:
+            name (str): Ingredient name
+
+        Returns:
+            Tuple[str, float]: Status label and its calibrated probability
+        """
+        probabilities = self.predict_proba(name)
+        status = max(probabilities, key=probabilities.get)
+        return status, probabilities[status]
+
+    def triage(
+        self, names: List[str], min_confidence: float = LOCAL_CLASSIFIER_MIN_CONFIDENCE
+    ) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Split unknown ingredients into confident local predictions and the rest.
+
+        E-numbers are never predicted: their names carry no meaning.
+
+        Args:
+            names (List[str]): Unknown ingredients
+            min_confidence (float): Probability needed to answer locally
+
+        Returns:
+            Tuple[List[Dict[str, Any]], List[str]]: Predictions
+                ({"ingredient", "status", "confidence"}) and the ingredients
+                still to send to the LLM
+        """
+        predicted, escalate = [], []
+        for name in names:
+            status, confidence = self.predict(name) if normalise_enumber(name) is None else ("", 0.0)
+            if confidence >= min_confidence:
+                predicted.append({"ingredient": name, "status": status, "confidence": round(confidence, 3)})
+            else:
+                escalate.append(name)
+        return predicted, escalate
+
+    def fit(self, examples: List[Tuple[str, str]], seed: int = 0) -> "IngredientClassifier":
+        """
+        Train on (name, status) examples with class-balanced SGD.
+
+        Args:
+            examples (List[Tuple[str, str]]): Training names and status labels
+            seed (int): Shuffling seed
+
+        Returns:
+            IngredientClassifier: self
+        """
+        rng = random.Random(seed)
+        data = [(features(name), CLASSES.index(status)) for name, status in examples]
+        counts = Counter(label for _, label in data)
+        class_weight = {label: len(data) / (len(CLASSES) * count) for label, count in counts.items()}
+        weights: Dict[str, List[float]] = {}
+        bias = [0.0] * len(CLASSES)
+        for epoch in range(EPOCHS):
+            rate = LEARNING_RATE / (1 + epoch * 0.1)
+            rng.shuffle(data)
+            for vector, label in data:
+                probabilities = _softmax(self._scores_with(weights, bias, vector))
+                scale = class_weight[label]
+                for k in range(len(CLASSES)):
+                    gradient = (probabilities[k] - (1.0 if k == label else 0.0)) * scale
+                    bias[k] -= rate * gradient
+                    for feature, value in vector.items():
+                        row = weights.setdefault(feature, [0.0] * len(CLASSES))
+                        row[k] -= rate * (gradient * value + L2 * row[k])
+        self.weights = {
+            feature: [round(w, 5) for w in row] for feature, row in weights.items() if max(map(abs, row)) > 1e-4
+        }
+        self.bias = [round(b, 5) for b in bias]
+        self.temperature = 1.0
+        return self
+
+    @staticmethod
+    def _scores_with(weights: Dict[str, List[float]], bias: List[float], vector: Dict[str, float]) -> List[float]:
+        totals = list(bias)
+        for feature, value in vector.items():
+            row = weights.get(feature)
+            if row is not None:
+                for k in range(len(totals)):
+                    totals[k] += row[k] * value
+        return totals
+
+    def calibrate(self, examples: List[Tuple[str, str]]) -> float:
+        """
+        Fit the temperature that minimises log loss on held-out examples.
+
+        Args:
+            examples (List[Tuple[str, str]]): Held-out names and status labels
+
+        Returns:
+            float: The fitted temperature
+        """
+        scored = [(self.scores(features(name)), CLASSES.index(status)) for name, status in examples]
+
+        def log_loss(temperature: float) -> float:
+            return -sum(math.log(max(_softmax(s, temperature)[label], 1e-12)) for s, label in scored) / len(scored)
+
+        candidates = [0.25 + 0.05 * i for i in range(96)]  # 0.25 to 5.0
+        self.temperature = round(min(candidates, key=log_loss), 2)
+        return self.temperature
+
+    def evaluate(
+        self, examples: List[Tuple[str, str]], min_confidence: float = LOCAL_CLASSIFIER_MIN_CONFIDENCE
+    ) -> Dict[str, Any]:
+        """
+        Accuracy, per-class precision and recall, calibration error and the
+        share of examples that would be answered locally.
+
+        Args:
+            examples (List[Tuple[str, str]]): Held-out names and status labels
+            min_confidence (float): Threshold for answering locally
+
+        Returns:
+            Dict[str, Any]: Evaluation report
+        """
+        predictions = [(self.predict(name), status) for name, status in examples]
+        correct = sum(predicted == status for (predicted, _), status in predictions)
+        per_class = {}
+        for label in CLASSES:
+            true_positive = sum(p == label and s == label for (p, _), s in predictions)
+            predicted_count = sum(p == label for (p, _), _s in predictions)
+            actual_count = sum(s == label for _p, s in predictions)
+            per_class[label] = {
+                "support": actual_count,
+                "precision": round(true_positive / predicted_count, 3) if predicted_count else 0.0,
+                "recall": round(true_positive / actual_count, 3) if actual_count else 0.0,
+            }
+
+        bins: Dict[int, List[Tuple[float, bool]]] = {}
+        for (predicted, confidence), status in predictions:
+            bins.setdefault(min(int(confidence * 10), 9), []).append((confidence, predicted == status))
+        calibration_error = sum(
+            abs(sum(c for c, _ in items) / len(items) - sum(ok for _, ok in items) / len(items)) * len(items)
+            for items in bins.values()
+        ) / max(len(predictions), 1)
+
+        confident = [(p, s) for (p, c), s in predictions if c >= min_confidence]
+        return {
+            "examples": len(predictions),
+            "accuracy": round(correct / len(predictions), 3) if predictions else 0.0,
+            "per_class": per_class,
+            "expected_calibration_error": round(calibration_error, 3),
+            "min_confidence": min_confidence,
+            "answered_locally": round(len(confident) / len(predictions), 3) if predictions else 0.0,
+            "accuracy_when_local": (
+                round(sum(p == s for p, s in confident) / len(confident), 3) if confident else 0.0
+            ),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "format": FORMAT_VERSION,
+            **self.metadata,
+            "classes": CLASSES,
+            "temperature": self.temperature,
+            "bias": self.bias,
+            "weights": self.weights,
+        }
+
+    @classmethod
+    def load(cls, path: Path) -> "IngredientClassifier":
+        """
+        Load a model artifact written by save().
+
+        Args:
+            path (Path): Model file
+
+        Returns:
+            IngredientClassifier: The model
+
+        Raises:
+            ValueError: If the file is not a model of this format or its classes differ
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format") != FORMAT_VERSION or data.get("classes") != CLASSES:
+            raise ValueError(f"{path} is not an ingredient classifier of format {FORMAT_VERSION}")
+        metadata = {key: value for key, value in data.items()
+                    if key not in ("format", "classes", "temperature", "bias", "weights")}
+        return cls(data["weights"], data["bias"], data["temperature"], metadata)
+
+    def save(self, path: Path) -> Path:
+        """
+        Write the model as the current artifact and as a copy named by its version.
+
+        Args:
+            path (Path): Current model file, e.g. storage/models/ingredient_classifier.json
+
+        Returns:
+            Path: The versioned copy
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        versioned = path.with_name(f"{path.stem}-{self.version}{path.suffix}")
+        data = json.dumps(self.to_dict(), separators=(",", ":"))
+        for target in (versioned, path):
+            tmp_path = target.with_name(f".{target.name}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            tmp_path.replace(target)
+        return versioned
+
+
+def dataset_examples(csv_path: Path) -> List[Tuple[str, str]]:
+    """
+    Training examples from the ingredients dataset.
+
+    Names that are e-numbers are replaced by their chemical names; other rows
+    contribute their chemical names as extra variants.
+
+    Args:
+        csv_path (Path): Ingredients dataset
+
+    Returns:
+        List[Tuple[str, str]]: (name, status) pairs; rows without a status are skipped
+    """
+    examples = []
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            status = normalise_status_code((row.get("halal_non_halal_doubtful") or "").strip())
+            if status is None:
+                continue
+            name = " ".join((row.get("ingred_name") or "").split()).lower()
+            if name and normalise_enumber(name) is None:
+                examples.append((name, status))
+            chem_name = _CHEM_NOISE_RE.sub(" ", (row.get("chem_name") or "").lower())
+            for variant in chem_name.split("/"):
+                variant = " ".join(variant.split())
+                if variant and variant != name:
+                    examples.append((variant, status))
+    return examples
+
+
+def history_verdicts(db_path: Path) -> List[Tuple[str, str]]:
+    """
+    Verdicts the LLM gave on unknown ingredients, from the analysis history.
+
+    Only analyses with a single unknown ingredient are used, so that the
+    answer can be attributed to it; the verdict is the most severe status
+    named in the answer.
+
+    Args:
+        db_path (Path): History database
+
+    Returns:
+        List[Tuple[str, str]]: (ingredient, status) pairs, one per ingredient
+    """
+    if not Path(db_path).exists():
+        return []
+    query = """
+        SELECT i.ingredient, a.halal_status_response FROM analyses a
+        JOIN analysis_ingredients i ON i.analysis_id = a.id AND i.is_unknown = 1
+        WHERE a.halal_status_response != ''
+          AND (SELECT COUNT(*) FROM analysis_ingredients u WHERE u.analysis_id = a.id AND u.is_unknown = 1) = 1
+        ORDER BY a.recorded_at
+    """
+    verdicts: Dict[str, str] = {}
+    try:
+        with sqlite3.connect(str(db_path)) as connection:
+            for ingredient, response in connection.execute(query):
+                for status, pattern in _VERDICT_PATTERNS:
+                    if pattern.search(response):
+                        verdicts[ingredient] = status
+                        break
+    except sqlite3.Error as e:
+        print(f"Error reading LLM verdicts from history: {e}")
+    return list(verdicts.items())
+
+
+def file_verdicts(path: Path) -> List[Tuple[str, str]]:
+    """
+    Reviewed verdicts from a CSV file with "ingredient" and "status" columns.
+
+    Args:
+        path (Path): Verdicts file
+
+    Returns:
+        List[Tuple[str, str]]: (ingredient, status) pairs with a valid status
+    """
+    examples = []
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            status = normalise_status_code((row.get("status") or "").strip())
+            name = " ".join((row.get("ingredient") or "").split()).lower()
+            if name and status:
+                examples.append((name, status))
+    return examples
+
+
+def train(
+    examples: List[Tuple[str, str]],
+    dataset_version: str = "",
+    min_confidence: float = LOCAL_CLASSIFIER_MIN_CONFIDENCE,
+    seed: int = 0
+) -> IngredientClassifier:
+    """
+    Train, calibrate and evaluate a classifier.
+
+    A stratified hold-out split is used to fit the temperature and produce
+    the evaluation report; the final model is then trained on all examples
+    and keeps that temperature.
+
+    Args:
+        examples (List[Tuple[str, str]]): (name, status) pairs
+        dataset_version (str): Version of the dataset the examples came from
+        min_confidence (float): Threshold reported in the evaluation
+        seed (int): Split and shuffling seed
+
+    Returns:
+        IngredientClassifier: Model with version, training data summary and evaluation in its metadata
+    """
+    examples = sorted(set(examples))
+    rng = random.Random(seed)
+    train_set, holdout = [], []
+    for label in CLASSES:
+        group = [example for example in examples if example[1] == label]
+        rng.shuffle(group)
+        cut = int(round(len(group) * HOLDOUT))
+        holdout += group[:cut]
+        train_set += group[cut:]
+
+    candidate = IngredientClassifier().fit(train_set, seed)
+    uncalibrated = candidate.evaluate(holdout, min_confidence)
+    temperature = candidate.calibrate(holdout)
+    evaluation = candidate.evaluate(holdout, min_confidence)
+    evaluation["expected_calibration_error_uncalibrated"] = uncalibrated["expected_calibration_error"]
+
+    model = IngredientClassifier().fit(examples, seed)
+    model.temperature = temperature
+    fingerprint = hashlib.sha256(json.dumps(
+        [examples, NGRAM_RANGE, EPOCHS, LEARNING_RATE, L2, seed]
+    ).encode("utf-8")).hexdigest()[:12]
+    model.metadata = {
+        "version": fingerprint,
+        "trained_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "dataset_version": dataset_version,
+        "examples": len(examples),
+        "class_counts": dict(Counter(status for _, status in examples)),
+        "features": len(model.weights),
+        "temperature": temperature,
+        "evaluation": evaluation,
+    }
+    return model
+
+
+_classifier: Optional[IngredientClassifier] = None
+_classifier_loaded = False
+_classifier_lock = threading.Lock()
+
+
+def get_local_classifier(path: Path = LOCAL_CLASSIFIER_MODEL) -> Optional[IngredientClassifier]:
+    """
+    Return the process-wide classifier, loaded once from the model file.
+
+    Args:
+        path (Path): Model file
+
+    Returns:
+        Optional[IngredientClassifier]: The model, or None if it hasn't been trained
+    """
+    global _classifier, _classifier_loaded
+    with _classifier_lock:
+        if not _classifier_loaded:
+            _classifier_loaded = True
+            if Path(path).exists():
+                try:
+                    _classifier = IngredientClassifier.load(path)
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Error loading ingredient classifier: {e}")
+        return _classifier
+
+
+def main() -> None:
+    """Command-line entry point for training the classifier and trying it out."""
+    from src.utils.knowledge_base import dataset_version
+
+    parser = argparse.ArgumentParser(description="Train or query the local ingredient classifier.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="Train, calibrate, evaluate and save the model")
+    train_parser.add_argument("--csv", type=Path, default=INGREDIENTS_DATASET, help="Ingredients dataset")
+    train_parser.add_argument("--verdicts", type=Path, help="CSV of reviewed verdicts (ingredient,status)")
+    train_parser.add_argument("--no-history", action="store_true", help="Don't use LLM verdicts from the history")
+    train_parser.add_argument("--out", type=Path, default=LOCAL_CLASSIFIER_MODEL, help="Model file")
+    train_parser.add_argument("--min-confidence", type=float, default=LOCAL_CLASSIFIER_MIN_CONFIDENCE,
+                              help="Threshold to report coverage and accuracy at")
+    predict_parser = subparsers.add_parser("predict", help="Classify ingredient names")
+    predict_parser.add_argument("names", nargs="+", help="Ingredient names")
+    predict_parser.add_argument("--model", type=Path, default=LOCAL_CLASSIFIER_MODEL, help="Model file")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        examples = dataset_examples(args.csv)
+        sources = {"dataset": len(examples)}
+        if not args.no_history:
+            verdicts = history_verdicts(HISTORY_DB)
+            sources["history_verdicts"] = len(verdicts)
+            examples += verdicts
+        if args.verdicts:
+            reviewed = file_verdicts(args.verdicts)
+            sources["reviewed_verdicts"] = len(reviewed)
+            examples += reviewed
+        model = train(examples, dataset_version(str(args.csv)), args.min_confidence)
+        model.metadata["sources"] = sources
+        versioned = model.save(args.out)
+        print(json.dumps(model.metadata, indent=2))
+        print(f"Saved model {model.version} to {args.out} and {versioned}")
+    else:
+        try:
+            model = IngredientClassifier.load(args.model)
+        except OSError:
+            raise SystemExit(f"No model at {args.model}; run: python -m src.utils.ingredient_classifier train")
+        for name in args.names:
+            probabilities = model.predict_proba(name)
+            status = max(probabilities, key=probabilities.get)
+            details = ", ".join(f"{label} {p:.2f}" for label, p in probabilities.items())
+            verdict = "local" if probabilities[status] >= LOCAL_CLASSIFIER_MIN_CONFIDENCE else "ask the LLM"
+            print(f"{name}: {status} ({details}) -> {verdict}")
+
+
+if __name__ == "__main__":
+    main()
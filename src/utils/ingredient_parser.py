@@ -2,17 +2,103 @@
 Module for parsing and processing ingredient text extracted from images.
 """
 import re
-from typing import List, Tuple, Dict, Optional
+from functools import lru_cache
+from typing import Any, Iterator, List, Tuple, Dict, Optional
 
-def parse_ingredients(ingredients_text: str) -> List[str]:
+# Dataset status codes in the halal_non_halal_doubtful column
+STATUS_LABELS = {0: "Halal", 1: "Non-Halal", 2: "Doubtful"}
+
+# "E471", "e 471", "471", "E150a", "INS 471"
+_ENUMBER_RE = re.compile(r"^(?:ins\s*)?e?\s*(\d{3,4}[a-z]?)$")
+
+# Characters that structure an ingredients list
+_DELIMITER_RE = re.compile(r"[(),]")
+
+# Statuses that make the whole product Non-Halal, whatever else it contains
+DECISIVE_STATUSES = ("Non-Halal", "Doubtful")
+
+# How strongly each status taints a compound ingredient
+_SEVERITY = {"Halal": 0, "Unknown": 1, "Doubtful": 2, "Non-Halal": 3}
+
+
+def normalise_status_code(value: Any) -> Optional[str]:
     """
-    Parse a string of ingredients text into a list of individual ingredients.
+    Convert a dataset status code to its label.
+    
+    pandas reads the status column as floats because of blank entries, so
+    0.0, "0" and 0 are all accepted. Labels are passed through unchanged.
     
     Args:
-        ingredients_text (str): Raw text containing ingredients list
+        value: Status code or label from the dataset
         
     Returns:
-        List[str]: List of parsed individual ingredients
+        Optional[str]: 'Halal', 'Non-Halal' or 'Doubtful', or None if the status is blank
+    """
+    if isinstance(value, str):
+        value = value.strip()
+        for label in STATUS_LABELS.values():
+            if value.lower() == label.lower():
+                return label
+    try:
+        return STATUS_LABELS.get(int(float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def normalise_enumber(code: str) -> Optional[str]:
+    """
+    Normalise an e-number query to its bare digits and optional letter.
+
+    Args:
+        code (str): Code as typed, e.g. "E471", "e 471" or "471"
+
+    Returns:
+        Optional[str]: Bare code such as "471", or None if it isn't an e-number
+    """
+    match = _ENUMBER_RE.match(code.strip().lower())
+    return match.group(1) if match else None
+
+
+class IngredientNode:
+    """
+    One entry of an ingredients list, with its bracketed sub-ingredients.
+
+    For "emulsifier (e322)" the text is "emulsifier (e322)", the name is
+    "emulsifier" and there is one child, "e322".
+    """
+
+    __slots__ = ("text", "name", "children")
+
+    def __init__(self, text: str, name: str, children: Optional[List["IngredientNode"]] = None):
+        """
+        Args:
+            text (str): Entry as written, sub-ingredients included
+            name (str): Entry without its bracketed parts
+            children (Optional[List[IngredientNode]]): Sub-ingredients
+        """
+        self.text = text
+        self.name = name
+        self.children = children or []
+
+    def __repr__(self) -> str:
+        return f"IngredientNode({self.text!r})"
+
+    def walk(self) -> Iterator["IngredientNode"]:
+        """Yield this node and all its sub-ingredients, depth first."""
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+def _clean_ingredients_text(ingredients_text: str) -> str:
+    """
+    Strip labels, allergen statements and model preamble from ingredients text.
+
+    Args:
+        ingredients_text (str): Raw text containing ingredients list
+
+    Returns:
+        str: Lower-cased list with commas as the only separators
     """
     # Normalize the text
     ingredients_text = ingredients_text.lower().replace("[", "(").replace("]", ")")
@@ -68,14 +154,157 @@ def parse_ingredients(ingredients_text: str) -> List[str]:
     ingredients_text = ingredients_text.replace("-", "")
     
     # Remove any periods ('.')
-    ingredients_text = ingredients_text.replace('.', '')
-    
-    # Split based on commas not within parentheses
-    ingredients = re.split(r',\s*(?![^()]*\))', ingredients_text)
+    return ingredients_text.replace('.', '')
+
+
+def _finish_entry(frame: List[Any], text: str) -> None:
+    # frame: [siblings, start offset, name parts, children] of the entry being read
+    name = " ".join("".join(frame[2]).split())
+    if name or frame[3]:
+        frame[0].append(IngredientNode(" ".join(text.split()), name, frame[3]))
+    frame[2] = []
+    frame[3] = []
+
+
+def parse_ingredient_tree(ingredients_text: str) -> List[IngredientNode]:
+    """
+    Parse ingredients text into top-level entries with nested sub-ingredients.
+
+    A single left-to-right pass over the commas and brackets tracks the
+    nesting depth, so "chocolate (sugar, cocoa butter, emulsifier (e322))"
+    stays one entry with three sub-ingredients, one of them compound itself.
+    Unbalanced brackets are tolerated: stray closing brackets are ignored and
+    unclosed ones end with the text.
+
+    Args:
+        ingredients_text (str): Raw text containing ingredients list
+
+    Returns:
+        List[IngredientNode]: Top-level entries in label order
+    """
+    text = _clean_ingredients_text(ingredients_text)
+    if "(" not in text and ")" not in text:
+        entries = (" ".join(entry.split()) for entry in text.split(","))
+        return [IngredientNode(entry, entry) for entry in entries if entry]
+
+    stack = [[[], 0, [], []]]
+    position = 0
+    for match in _DELIMITER_RE.finditer(text):
+        index = match.start()
+        frame = stack[-1]
+        frame[2].append(text[position:index])
+        position = index + 1
+        delimiter = text[index]
+        if delimiter == "(":
+            stack.append([[], position, [], []])
+        elif delimiter == ",":
+            _finish_entry(frame, text[frame[1]:index])
+            frame[1] = position
+        elif len(stack) > 1:
+            _finish_entry(frame, text[frame[1]:index])
+            stack.pop()
+            stack[-1][3].extend(frame[0])
+            stack[-1][2].append(" ")
+        else:
+            frame[2].append(" ")
+
+    stack[-1][2].append(text[position:])
+    while len(stack) > 1:
+        frame = stack.pop()
+        _finish_entry(frame, text[frame[1]:])
+        stack[-1][3].extend(frame[0])
+    _finish_entry(stack[0], text[stack[0][1]:])
+    return stack[0][0]
+
+
+def parse_ingredients(ingredients_text: str) -> List[str]:
+    """
+    Parse a string of ingredients text into a list of individual ingredients.
+
+    Flat view of parse_ingredient_tree(): compound entries are returned whole,
+    sub-ingredients included, e.g. "chocolate (sugar, emulsifier (e322))".
     
-    # Strip whitespace from each ingredient
-    parsed_ingredients = [ingredient.strip() for ingredient in ingredients if ingredient.strip()]
-    return parsed_ingredients
+    Args:
+        ingredients_text (str): Raw text containing ingredients list
+        
+    Returns:
+        List[str]: List of parsed individual ingredients
+    """
+    return [node.text for node in parse_ingredient_tree(ingredients_text)]
+
+
+# Characters that would change the structure if the tree were written out and parsed again
+_STRUCTURE_CHARS_RE = re.compile(r"[(),;\[\]\n]")
+MAX_STRUCTURED_DEPTH = 4
+
+
+def _structured_name(value: Any, field: str) -> str:
+    if not isinstance(value, str):
+        raise ValueError(f"'{field}' must be a string, got {type(value).__name__}")
+    # Hyphens and full stops are dropped as in _clean_ingredients_text, so lookups match the text path
+    value = value.lower().replace("-", "").replace(".", "")
+    return " ".join(_STRUCTURE_CHARS_RE.sub(" ", value).split())
+
+
+def ingredient_tree_from_json(data: Any, depth: int = 0) -> List[IngredientNode]:
+    """
+    Build entries from a structured (JSON schema) extraction of a label.
+
+    Each ingredient is {"name": str, "e_code": str or null, "sub_ingredients": [...]};
+    an E-code that isn't already the name or a sub-ingredient becomes a
+    sub-ingredient, as it would be in "emulsifier (e322)". Entries are
+    lower-cased like parsed text, so the tree formats to text that
+    parse_ingredient_tree() reads back unchanged.
+
+    Args:
+        data (Any): Decoded response, {"ingredients": [...]}, or a list of ingredients
+        depth (int): Nesting level of data (used in recursion)
+
+    Returns:
+        List[IngredientNode]: Top-level entries in label order
+
+    Raises:
+        ValueError: If the data doesn't match the schema or is nested too deeply
+    """
+    if depth == 0:
+        if not isinstance(data, dict) or not isinstance(data.get("ingredients"), list):
+            raise ValueError("Expected an object with an 'ingredients' array")
+        data = data["ingredients"]
+    elif depth > MAX_STRUCTURED_DEPTH:
+        raise ValueError(f"Sub-ingredients nested more than {MAX_STRUCTURED_DEPTH} levels deep")
+    if not isinstance(data, list):
+        raise ValueError("'sub_ingredients' must be an array")
+
+    nodes = []
+    for item in data:
+        if not isinstance(item, dict):
+            raise ValueError("Each ingredient must be an object")
+        name = _structured_name(item.get("name"), "name")
+        children = ingredient_tree_from_json(item.get("sub_ingredients") or [], depth + 1)
+        if item.get("e_code") is not None:
+            code = normalise_enumber(_structured_name(item["e_code"], "e_code"))
+            if code is not None and code != normalise_enumber(name) and all(
+                normalise_enumber(child.name) != code for child in children
+            ):
+                children.append(IngredientNode(f"e{code}", f"e{code}"))
+        if not name and not children:
+            continue
+        text = f"{name} ({', '.join(child.text for child in children)})" if children else name
+        nodes.append(IngredientNode(text.strip(), name, children))
+    return nodes
+
+
+def format_ingredient_tree(nodes: List[IngredientNode]) -> str:
+    """
+    Write entries back out as an ingredients list, e.g. "sugar, emulsifier (e322)".
+
+    Args:
+        nodes (List[IngredientNode]): Top-level entries
+
+    Returns:
+        str: Comma-separated ingredients text
+    """
+    return ", ".join(node.text for node in nodes)
 
 
 def create_lookup_table(df) -> Dict[str, str]:
@@ -87,37 +316,117 @@ def create_lookup_table(df) -> Dict[str, str]:
         
     Returns:
         Dict[str, str]: Dictionary mapping ingredient names to halal status
+            ('Halal', 'Non-Halal' or 'Doubtful'). Rows with a blank status are left out.
     """
     # Use only required columns and create a dictionary for lookup
-    lookup_table = df.set_index('ingred_name')['halal_non_halal_doubtful'].to_dict()
+    raw_table = df.set_index('ingred_name')['halal_non_halal_doubtful'].to_dict()
+    lookup_table = {}
+    for name, code in raw_table.items():
+        status = normalise_status_code(code)
+        if status is not None:
+            lookup_table[str(name).strip().lower()] = status
     return lookup_table
 
 
-def check_halal_status(ingredients: List[str], lookup_table: Dict[str, str]) -> Tuple[str, List[str]]:
+def check_halal_status(
+    ingredients: List[str], lookup_table: Dict[str, str], stop_at_decisive: bool = False
+) -> Tuple[str, List[str]]:
     """
     Check the halal status of a list of ingredients against a lookup table.
     
     Args:
         ingredients (List[str]): List of ingredient names
         lookup_table (Dict[str, str]): Dictionary mapping ingredient names to halal status
+        stop_at_decisive (bool): Stop at the first Non-Halal or Doubtful
+            ingredient, which decides the product; the unknown ingredients are
+            then only those listed before it
         
     Returns:
         Tuple[str, List[str]]: Tuple containing (product_halal_status, list of unknown ingredients)
     """
-    product_halal_status = 'Halal'  # Default status
+    statuses = []
     unknown_ingredients = []
-
     for ingredient in ingredients:
-        ingredient_lower = ingredient.lower()
+        status = lookup_table.get(ingredient.lower(), "Unknown")
+        statuses.append(status)
+        if status == "Unknown":
+            unknown_ingredients.append(ingredient)
+        elif stop_at_decisive and status in DECISIVE_STATUSES:
+            break
+
+    # Return a tuple: product status and list of unknown ingredients
+    return product_status(statuses), unknown_ingredients
+
+
+def product_status(statuses: List[str]) -> str:
+    """
+    Combine ingredient statuses into the product verdict.
 
-        # Check the Halal status from the lookup table
-        status = lookup_table.get(ingredient_lower, "Unknown")
+    Args:
+        statuses (List[str]): Status of each top-level ingredient, in label order
 
-        if status == 'Non-Halal' or status == 'Doubtful':  # Non-halal or doubtful
-            product_halal_status = 'Non-Halal'
-        elif status == "Unknown":
+    Returns:
+        str: 'Halal', 'Non-Halal' or 'Doubtful'
+    """
+    product_halal_status = 'Halal'  # Default status
+    for status in statuses:
+        if status in DECISIVE_STATUSES:
+            return 'Non-Halal'  # Nothing listed after it can change the verdict
+        if status == "Unknown":
             product_halal_status = 'Doubtful'
-            unknown_ingredients.append(ingredient)
+    return product_halal_status
 
-    # Return a tuple: product status and list of unknown ingredients
-    return product_halal_status, unknown_ingredients
\ No newline at end of file
+
+@lru_cache(maxsize=8192)
+def _lookup_keys(name: str) -> Tuple[str, ...]:
+    # The dataset lists some additives as "e100" and others as bare "296"
+    bare = normalise_enumber(name)
+    return (name, f"e{bare}", bare) if bare else (name,)
+
+
+def classify_ingredient_tree(
+    nodes: List[IngredientNode], lookup_table: Dict[str, str]
+) -> Tuple[str, List[str], Dict[str, str]]:
+    """
+    Classify parsed entries, rolling sub-ingredient statuses up to each compound.
+
+    An entry listed whole in the lookup table (e.g. "soy lecithin (ins 322)")
+    takes that status. Otherwise a compound takes the most severe status of
+    its own name and its sub-ingredients; a compound name missing from the
+    table (such as "chocolate" or "emulsifier") is not itself reported as
+    unknown when its sub-ingredients are known. Each distinct name is looked
+    up once per call.
+
+    Args:
+        nodes (List[IngredientNode]): Entries from parse_ingredient_tree()
+        lookup_table (Dict[str, str]): Dictionary mapping ingredient names to halal status
+
+    Returns:
+        Tuple[str, List[str], Dict[str, str]]: Product status, unknown
+            (sub-)ingredients without duplicates, and the status of each top-level entry
+    """
+    memo: Dict[str, str] = {}
+    unknown: Dict[str, None] = {}
+
+    def lookup(name: str) -> str:
+        status = memo.get(name)
+        if status is None:
+            status = next((lookup_table[key] for key in _lookup_keys(name) if key in lookup_table), "Unknown")
+            memo[name] = status
+        return status
+
+    def rollup(node: IngredientNode) -> str:
+        status = lookup(node.text)
+        if status != "Unknown":
+            return status
+        if not node.children:
+            unknown[node.text] = None
+            return status
+        statuses = [rollup(child) for child in node.children]
+        own = lookup(node.name) if node.name else "Unknown"
+        if own != "Unknown":
+            statuses.append(own)
+        return max(statuses, key=_SEVERITY.__getitem__)
+
+    top_level = {node.text: rollup(node) for node in nodes}
+    return product_status([top_level[node.text] for node in nodes]), list(unknown), top_level
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Hot reload of the ingredients knowledge base without restarts or request stalls.
+
+A background thread polls the dataset file and the compiled snapshot. When
+the CSV changes (and has stopped changing for one poll interval) the new
+knowledge base is compiled and mapped on that thread, then published by
+replacing a single reference. A snapshot recompiled by another process (the
+compile command or another worker) is picked up from its generation counter.
+
+Readers take current() once per request and use that knowledge base for the
+whole analysis, so in-flight analyses finish on the version they started
+with; an old knowledge base is released when the last request holding it
+finishes. A dataset that fails validation is reported and the current
+version is kept.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from config.settings import KB_RELOAD_INTERVAL
+from src.utils.kb_snapshot import read_header, snapshot_path_for
+from src.utils.knowledge_base import KnowledgeBase, dataset_version, load_knowledge_base
+
+# Reload failures happen on a background thread of the service, so they go to
+# its logs rather than to a request
+logger = logging.getLogger(__name__)
+
+
+def _file_state(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class KnowledgeBaseReloader:
+    """
+    Holder of the current knowledge base, swapped atomically when the dataset changes.
+    """
+
+    def __init__(
+        self,
+        dataset_path: Optional[str] = None,
+        interval: float = KB_RELOAD_INTERVAL,
+        kb: Optional[KnowledgeBase] = None
+    ):
+        """
+        Args:
+            dataset_path (Optional[str]): Ingredients dataset to load and watch;
+                None serves kb as given and never reloads
+            interval (float): Seconds between polls; 0 disables watching
+            kb (Optional[KnowledgeBase]): Initial knowledge base (loaded from
+                the dataset if omitted)
+        """
+        self.dataset_path = Path(dataset_path) if dataset_path else None
+        self.interval = interval
+        self._seen_state = _file_state(self.dataset_path) if self.dataset_path else None
+        self._loaded_state = self._seen_state  # File state the current version was loaded from
+        self._current = kb if kb is not None else load_knowledge_base(str(self.dataset_path))
+        self._lock = threading.Lock()  # Serialises reloads, never taken by readers
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.reloads = 0
+        self.loaded_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self.last_error: Optional[str] = None
+
+    def current(self) -> KnowledgeBase:
+        """
+        The knowledge base to use for one request.
+
+        Returns:
+            KnowledgeBase: Current version; keep using the returned object for
+                the whole request rather than calling this again
+        """
+        return self._current
+
+    def check(self) -> bool:
+        """
+        Poll once and swap in a new knowledge base if the dataset or its snapshot changed.
+
+        Returns:
+            bool: Whether a new version was published
+        """
+        if self.dataset_path is None:
+            return False
+        with self._lock:
+            state = _file_state(self.dataset_path)
+            if state != self._seen_state:
+                # Changed since the last poll: wait for the write to finish
+                self._seen_state = state
+                return False
+            kb = self._current
+            csv_changed = state is not None and state != self._loaded_state
+            header = read_header(snapshot_path_for(self.dataset_path))
+            recompiled = (
+                kb.generation is not None and header is not None and header["generation"] != kb.generation
+            )
+            if not csv_changed and not recompiled:
+                return False
+            try:
+                if not recompiled and dataset_version(str(self.dataset_path)) == kb.version:
+                    self._loaded_state = state  # Touched, same content
+                    return False
+                new_kb = load_knowledge_base(str(self.dataset_path))
+            except (OSError, ValueError) as e:
+                self._loaded_state = state  # Not retried until the file changes again
+                self.last_error = str(e)
+                logger.error("Error reloading ingredients dataset, keeping version %s: %s", kb.version, e)
+                return False
+            self._loaded_state = state
+            self._current = new_kb
+            self.reloads += 1
+            self.loaded_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+            self.last_error = None
+            return True
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Error checking ingredients dataset")
+
+    def start(self) -> "KnowledgeBaseReloader":
+        """Start watching in a daemon thread (no-op without a dataset or with interval 0)."""
+        if self.dataset_path is not None and self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="kb-reloader", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop watching."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Current version, size, generation, reload count and last error
+        """
+        kb = self._current
+        return {
+            "version": kb.version,
+            "ingredients": len(kb),
+            "generation": kb.generation,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
+
+
+_reloaders: Dict[str, KnowledgeBaseReloader] = {}
+_reloaders_lock = threading.Lock()
+
+
+def get_kb_reloader(dataset_path: str) -> KnowledgeBaseReloader:
+    """
+    Return the process-wide, started reloader for a dataset, loading it on first use.
+
+    Args:
+        dataset_path (str): Ingredients dataset
+
+    Returns:
+        KnowledgeBaseReloader: Shared reloader
+    """
+    key = str(dataset_path)
+    with _reloaders_lock:
+        if key not in _reloaders:
+            _reloaders[key] = KnowledgeBaseReloader(key).start()
+        return _reloaders[key]
@@ -0,0 +1,422 @@
+"""
+Compiled binary snapshot of the ingredients dataset.
+
+The CSV is validated and normalised once (BOM'd header, multi-line quoted
+fields, blank status codes, lower-cased names) into a packed file: a header,
+one fixed-size record per ingredient sorted by name, a hash table over the
+names and a UTF-8 string table. At runtime the file is memory-mapped and
+looked up in place, without pandas and without decoding records that are
+never asked for.
+
+Layout (little-endian):
+    header   magic "HKBS", format version, record count, statuses count,
+             dataset version (16 bytes, ASCII), hash table size, generation,
+             and the offsets of the records, hash table and strings
+    records  per ingredient: name, chem_name and description as
+             (offset, length) into the string table, then the status code
+    hash     open-addressing table of record index + 1 (0 = empty), keyed
+             by the CRC-32 of the name, linear probing
+    strings  UTF-8 text
+
+Usage:
+    python -m src.utils.kb_snapshot compile [--csv PATH] [--out PATH]
+    python -m src.utils.kb_snapshot info [--out PATH]
+
+The knowledge base compiles the snapshot itself whenever it is missing or
+older than the CSV, so the compile command is only needed ahead of deploys.
+
+Every process maps the same file, so the operating system keeps one copy of
+its pages however many workers run. A new snapshot is written alongside and
+renamed over the old one, which stays valid for processes still mapping it;
+the generation in the header goes up by one on every compile so those
+processes can tell that a newer snapshot exists.
+"""
+import argparse
+import csv
+import mmap
+import os
+import struct
+import time
+import zlib
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from config.settings import INGREDIENTS_DATASET, KB_SNAPSHOT_DIR
+from src.utils.ingredient_parser import STATUS_LABELS, normalise_status_code
+
+MAGIC = b"HKBS"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHxxII16sIIQQQ")
+RECORD = struct.Struct("<6IB3x")
+SLOT = struct.Struct("<I")
+REQUIRED_COLUMNS = ("ingred_name", "chem_name", "description", "halal_non_halal_doubtful")
+
+_STATUS_CODES = {label: code for code, label in STATUS_LABELS.items()}
+_NO_STATUS = 255
+
+
+def _collapse(value: Optional[str]) -> str:
+    return " ".join((value or "").split())
+
+
+def snapshot_path_for(csv_path: Path) -> Path:
+    """
+    Snapshot file that belongs to a dataset file.
+
+    Args:
+        csv_path (Path): Ingredients dataset
+
+    Returns:
+        Path: e.g. storage/snapshots/halal_non_halal_ingred.kbsnap
+    """
+    return KB_SNAPSHOT_DIR / f"{Path(csv_path).stem}.kbsnap"
+
+
+def build_snapshot(csv_path: Path, version: str, generation: int = 0) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Validate and normalise the ingredients CSV into snapshot bytes.
+
+    Args:
+        csv_path (Path): Ingredients dataset
+        version (str): Dataset version recorded in the header (at most 16 ASCII characters)
+        generation (int): Generation recorded in the header
+
+    Returns:
+        Tuple[bytes, Dict[str, Any]]: The snapshot, and a report of records
+            written, duplicate names (the last row wins, as in the DataFrame
+            loader) and rows with a blank status
+
+    Raises:
+        ValueError: If a column is missing or a status code is not 0, 1, 2 or blank
+    """
+    records: Dict[str, Dict[str, Any]] = {}
+    duplicates, blank_status, errors = [], 0, []
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"{csv_path} is missing columns: {', '.join(missing)}")
+        for row in reader:
+            name = _collapse(row["ingred_name"]).lower()
+            if not name:
+                continue
+            raw_status = (row["halal_non_halal_doubtful"] or "").strip()
+            status = normalise_status_code(raw_status)
+            if status is None and raw_status:
+                errors.append(f"line {reader.line_num}: invalid status {raw_status!r} for {name!r}")
+                continue
+            blank_status += status is None
+            if name in records:
+                duplicates.append(name)
+            records[name] = {
+                "chem_name": _collapse(row["chem_name"]),
+                "description": _collapse(row["description"]),
+                "status": _STATUS_CODES[status] if status else _NO_STATUS,
+            }
+    if errors:
+        raise ValueError("Invalid ingredients dataset:\n" + "\n".join(errors))
+
+    strings = bytearray()
+    offsets: Dict[str, int] = {}
+
+    def intern(text: str) -> Tuple[int, int]:
+        data = text.encode("utf-8")
+        if text not in offsets:
+            offsets[text] = len(strings)
+            strings.extend(data)
+        return offsets[text], len(data)
+
+    packed = bytearray()
+    names = sorted(records, key=lambda key: key.encode("utf-8"))
+    for name in names:
+        record = records[name]
+        packed += RECORD.pack(
+            *intern(name), *intern(record["chem_name"]), *intern(record["description"]), record["status"]
+        )
+
+    # Hash table at most half full, so probes stay short
+    table_size = 1
+    while table_size < 2 * max(len(names), 1):
+        table_size *= 2
+    slots = [0] * table_size
+    for index, name in enumerate(names):
+        slot = zlib.crc32(name.encode("utf-8")) & (table_size - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (table_size - 1)
+        slots[slot] = index + 1
+    table = struct.pack(f"<{table_size}I", *slots)
+
+    with_status = sum(1 for record in records.values() if record["status"] != _NO_STATUS)
+    records_at = HEADER.size
+    table_at = records_at + len(packed)
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(records), with_status, version.encode("ascii")[:16],
+        table_size, generation, records_at, table_at, table_at + len(table)
+    )
+    data = bytes(header + packed + table + strings)
+    return data, {
+        "records": len(records),
+        "duplicates": sorted(set(duplicates)),
+        "blank_status": blank_status,
+        "bytes": len(data),
+        "generation": generation,
+    }
+
+
+def compile_snapshot(csv_path: Path, snapshot_path: Path, version: str) -> Dict[str, Any]:
+    """
+    Validate the ingredients CSV and write it as a binary snapshot.
+
+    The snapshot is written to a temporary file and renamed into place, so
+    processes that have the previous snapshot mapped keep a consistent view.
+    Its generation is one more than the snapshot it replaces.
+
+    Args:
+        csv_path (Path): Ingredients dataset
+        snapshot_path (Path): Snapshot file to write
+        version (str): Dataset version recorded in the header
+
+    Returns:
+        Dict[str, Any]: Report from build_snapshot()
+
+    Raises:
+        ValueError: If the dataset fails validation
+        OSError: If the snapshot cannot be written
+    """
+    snapshot_path = Path(snapshot_path)
+    previous = read_header(snapshot_path)
+    data, report = build_snapshot(csv_path, version, previous["generation"] + 1 if previous else 1)
+    snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = snapshot_path.with_name(f".{snapshot_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, snapshot_path)
+    return report
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot in any buffer (mmap, shared memory, bytes).
+    """
+
+    def __init__(self, buffer: Any):
+        """
+        Args:
+            buffer: Object supporting the buffer protocol holding the snapshot
+
+        Raises:
+            ValueError: If the buffer is not a snapshot of this format version
+        """
+        self.buffer = buffer
+        self._view = memoryview(buffer)
+        if len(self._view) < HEADER.size:
+            raise ValueError("Not an ingredients snapshot (too short)")
+        (magic, fmt, count, with_status, version, table_size, generation,
+         records_at, table_at, strings_at) = HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError(f"Not an ingredients snapshot of format {FORMAT_VERSION}")
+        self.count = count
+        self.with_status = with_status
+        self.version = version.rstrip(b"\0").decode("ascii")
+        self.generation = generation
+        self._table_mask = table_size - 1
+        self._records_at = records_at
+        self._table_at = table_at
+        self._strings_at = strings_at
+
+    def _record(self, index: int) -> tuple:
+        return RECORD.unpack_from(self._view, self._records_at + index * RECORD.size)
+
+    def _text(self, offset: int, length: int) -> str:
+        start = self._strings_at + offset
+        return str(self._view[start:start + length], "utf-8")
+
+    def find(self, name: str) -> int:
+        """
+        Look up a (normalised) ingredient name in the hash table.
+
+        Args:
+            name (str): Lower-cased ingredient name
+
+        Returns:
+            int: Record index, or -1 if absent
+        """
+        key = name.encode("utf-8")
+        view, mask = self._view, self._table_mask
+        slot = zlib.crc32(key) & mask
+        while True:
+            entry = SLOT.unpack_from(view, self._table_at + 4 * slot)[0]
+            if not entry:
+                return -1
+            offset, length = RECORD.unpack_from(view, self._records_at + (entry - 1) * RECORD.size)[:2]
+            start = self._strings_at + offset
+            if length == len(key) and view[start:start + length] == key:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def name(self, index: int) -> str:
+        """Name of the record at an index."""
+        record = self._record(index)
+        return self._text(record[0], record[1])
+
+    def status(self, index: int) -> Optional[str]:
+        """Status label of the record at an index, None if blank."""
+        return STATUS_LABELS.get(self._record(index)[6])
+
+    def record(self, index: int) -> Dict[str, Any]:
+        """
+        Decode the record at an index.
+
+        Args:
+            index (int): Record index
+
+        Returns:
+            Dict[str, Any]: name, chem_name, description and status, as in KnowledgeBase.records
+        """
+        name_at, name_len, chem_at, chem_len, desc_at, desc_len, status = self._record(index)
+        return {
+            "name": self._text(name_at, name_len),
+            "chem_name": self._text(chem_at, chem_len),
+            "description": self._text(desc_at, desc_len),
+            "status": STATUS_LABELS.get(status),
+        }
+
+    def release(self) -> None:
+        """Drop this view's reference to the buffer so it can be closed or unmapped."""
+        self._view.release()
+
+
+class SnapshotRecords(Mapping):
+    """Name to record mapping backed by a snapshot; records are decoded on access."""
+
+    def __init__(self, snapshot: Snapshot):
+        self._snapshot = snapshot
+
+    def __getitem__(self, name: str) -> Dict[str, Any]:
+        index = self._snapshot.find(name)
+        if index < 0:
+            raise KeyError(name)
+        return self._snapshot.record(index)
+
+    def __len__(self) -> int:
+        return self._snapshot.count
+
+    def __iter__(self) -> Iterator[str]:
+        return (self._snapshot.name(index) for index in range(self._snapshot.count))
+
+
+class SnapshotLookupTable(Mapping):
+    """Name to status mapping backed by a snapshot; names with a blank status are absent."""
+
+    def __init__(self, snapshot: Snapshot):
+        self._snapshot = snapshot
+
+    def __getitem__(self, name: str) -> str:
+        index = self._snapshot.find(name)
+        status = self._snapshot.status(index) if index >= 0 else None
+        if status is None:
+            raise KeyError(name)
+        return status
+
+    def __contains__(self, name: object) -> bool:
+        if not isinstance(name, str):
+            return False
+        index = self._snapshot.find(name)
+        return index >= 0 and self._snapshot.status(index) is not None
+
+    def __len__(self) -> int:
+        return self._snapshot.with_status
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(self._snapshot.count):
+            if self._snapshot.status(index) is not None:
+                yield self._snapshot.name(index)
+
+
+def map_snapshot(snapshot_path: Path) -> Snapshot:
+    """
+    Memory-map a snapshot file read-only.
+
+    Pages are shared with every other process mapping the same file and are
+    only read from disk when touched.
+
+    Args:
+        snapshot_path (Path): Snapshot file
+
+    Returns:
+        Snapshot: View over the mapping
+
+    Raises:
+        ValueError: If the file is not a snapshot of this format version
+    """
+    with open(snapshot_path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return Snapshot(mapping)
+
+
+def read_header(snapshot_path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Read a snapshot's header without mapping it.
+
+    Args:
+        snapshot_path (Path): Snapshot file
+
+    Returns:
+        Optional[Dict[str, Any]]: format, records, version and generation, or
+            None if the file is missing or not a snapshot of this format
+    """
+    try:
+        with open(snapshot_path, "rb") as f:
+            magic, fmt, count, _, version, _, generation = HEADER.unpack(f.read(HEADER.size))[:7]
+    except (OSError, struct.error):
+        return None
+    if magic != MAGIC or fmt != FORMAT_VERSION:
+        return None
+    return {
+        "format": fmt,
+        "records": count,
+        "version": version.rstrip(b"\0").decode("ascii"),
+        "generation": generation,
+    }
+
+
+def main() -> None:
+    """Command-line entry point for compiling and inspecting the snapshot."""
+    from src.utils.knowledge_base import dataset_version
+
+    parser = argparse.ArgumentParser(description="Compile the ingredients dataset into a binary snapshot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compile_parser = subparsers.add_parser("compile", help="Validate the CSV and write the snapshot")
+    compile_parser.add_argument("--csv", default=str(INGREDIENTS_DATASET), help="Ingredients dataset")
+    compile_parser.add_argument("--out", help="Snapshot file (default: storage/snapshots/<csv name>.kbsnap)")
+    info_parser = subparsers.add_parser("info", help="Show the snapshot header")
+    info_parser.add_argument("--out", default=str(snapshot_path_for(INGREDIENTS_DATASET)), help="Snapshot file")
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        args.out = args.out or str(snapshot_path_for(Path(args.csv)))
+        start = time.perf_counter()
+        try:
+            report = compile_snapshot(Path(args.csv), Path(args.out), dataset_version(args.csv))
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print(f"Wrote {report['records']} records ({report['bytes']} bytes) to {args.out} as generation "
+              f"{report['generation']} in {(time.perf_counter() - start) * 1000:.1f} ms")
+        if report["duplicates"]:
+            print(f"{len(report['duplicates'])} duplicate names (last row kept): {', '.join(report['duplicates'])}")
+        if report["blank_status"]:
+            print(f"{report['blank_status']} rows have no status")
+    else:
+        header = read_header(Path(args.out))
+        if header is None:
+            raise SystemExit(f"{args.out} is not a compiled snapshot")
+        start = time.perf_counter()
+        snapshot = map_snapshot(Path(args.out))
+        print(f"{args.out}: format {header['format']}, {header['records']} records, dataset version "
+              f"{header['version']}, generation {header['generation']}, mapped in {(time.perf_counter() - start) * 1000:.2f} ms")
+        snapshot.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Ingredient knowledge base built once from the ingredients dataset.
+"""
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional
+
+from src.utils.ingredient_parser import normalise_enumber, normalise_status_code
+from src.utils.kb_snapshot import (
+    Snapshot, SnapshotLookupTable, SnapshotRecords, build_snapshot, compile_snapshot, map_snapshot,
+    read_header, snapshot_path_for
+)
+
+
+class KnowledgeBase:
+    """
+    Ingredient records and the status lookup table derived from them.
+    """
+
+    def __init__(
+        self,
+        records: Mapping[str, Dict[str, Any]],
+        version: str = "",
+        lookup_table: Optional[Mapping[str, str]] = None,
+        generation: Optional[int] = None
+    ):
+        """
+        Args:
+            records (Mapping[str, Dict[str, Any]]): Mapping of lowercase ingredient
+                name to its record (chem_name, description, status)
+            version (str): Identifier of the dataset the records came from
+            lookup_table (Optional[Mapping[str, str]]): Name to status mapping;
+                derived from the records if not given
+            generation (Optional[int]): Generation of the snapshot the records
+                are mapped from, if any
+        """
+        self.records = records
+        self.version = version
+        self.generation = generation
+        if lookup_table is None:
+            lookup_table = {
+                name: record["status"] for name, record in records.items() if record["status"] is not None
+            }
+        self.lookup_table = lookup_table
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Snapshot) -> "KnowledgeBase":
+        """
+        Build a knowledge base over a compiled snapshot; records are decoded on access.
+
+        Args:
+            snapshot (Snapshot): Mapped snapshot
+
+        Returns:
+            KnowledgeBase: The knowledge base, versioned as the snapshot
+        """
+        return cls(SnapshotRecords(snapshot), snapshot.version, SnapshotLookupTable(snapshot), snapshot.generation)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    @classmethod
+    def from_dataframe(cls, df: Any, version: str = "") -> "KnowledgeBase":
+        """
+        Build a knowledge base from the preprocessed ingredients DataFrame.
+
+        Args:
+            df: DataFrame returned by data_handler.load_ingredients_data
+            version (str): Identifier of the dataset the DataFrame came from
+
+        Returns:
+            KnowledgeBase: The knowledge base
+        """
+        records = {}
+        for row in df.to_dict(orient="records"):
+            name = str(row.get("ingred_name", "")).strip().lower()
+            if not name:
+                continue
+            records[name] = {
+                "name": name,
+                "chem_name": _clean(row.get("chem_name")),
+                "description": _clean(row.get("description")),
+                "status": normalise_status_code(row.get("halal_non_halal_doubtful")),
+            }
+        return cls(records, version)
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up an ingredient record by name.
+
+        Args:
+            name (str): Ingredient name (case-insensitive)
+
+        Returns:
+            Optional[Dict[str, Any]]: The record, or None if not in the dataset
+        """
+        return self.records.get(name.strip().lower())
+
+    def lookup_enumber(self, code: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up an e-number, accepting it with or without the "E" prefix.
+
+        The dataset lists some additives as "e100" and others as bare "296",
+        so both spellings are tried.
+
+        Args:
+            code (str): E-number as typed
+
+        Returns:
+            Optional[Dict[str, Any]]: The record, or None if unknown
+        """
+        bare = normalise_enumber(code)
+        if bare is None:
+            return None
+        return self.records.get(f"e{bare}") or self.records.get(bare)
+
+
+def _clean(value: Any) -> str:
+    """Collapse whitespace in a text field, treating missing values as empty."""
+    if value is None or value != value:  # NaN from pandas
+        return ""
+    return " ".join(str(value).split())
+
+
+def dataset_version(file_path: str) -> str:
+    """
+    Content hash identifying a version of the ingredients dataset.
+
+    Args:
+        file_path (str): Path to the dataset file
+
+    Returns:
+        str: First 12 hex digits of the file's SHA-256
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def load_knowledge_base(file_path: str) -> KnowledgeBase:
+    """
+    Load the ingredients dataset into a knowledge base, versioned by its content hash.
+
+    The compiled snapshot of the dataset is memory-mapped; it is (re)compiled
+    first if it is missing or was compiled from a different version of the
+    CSV. If the snapshot directory is not writable the snapshot is built in
+    memory instead.
+
+    Args:
+        file_path (str): Path to the CSV file containing ingredient data
+
+    Returns:
+        KnowledgeBase: The knowledge base
+
+    Raises:
+        FileNotFoundError: If the ingredients dataset file doesn't exist
+        ValueError: If the dataset fails validation
+    """
+    if not Path(file_path).exists():
+        raise FileNotFoundError(f"Ingredients dataset file not found: {file_path}")
+    version = dataset_version(file_path)
+    snapshot_path = snapshot_path_for(Path(file_path))
+    header = read_header(snapshot_path)
+    if header is None or header["version"] != version:
+        try:
+            compile_snapshot(Path(file_path), snapshot_path, version)
+        except OSError as e:
+            print(f"Error writing ingredients snapshot, keeping it in memory: {e}")
+            return KnowledgeBase.from_snapshot(Snapshot(build_snapshot(Path(file_path), version)[0]))
+    return KnowledgeBase.from_snapshot(map_snapshot(snapshot_path))
@@ -0,0 +1,261 @@
+"""
+Local OCR first pass for label photos, before the vision model.
+
+Clean, high-contrast labels can be read on the CPU by Tesseract in well under
+a second. The "Ingredients:" block is located in Tesseract's word layout and
+its text is only used when both the OCR confidence and the share of
+ingredients found in the dataset clear their thresholds; anything else goes
+to the vision model as before. Outcomes are counted so the share of scans
+served locally can be reported.
+"""
+import re
+import threading
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, ImageOps
+
+from config.settings import (
+    LOCAL_OCR_LANG, LOCAL_OCR_MIN_CONFIDENCE, LOCAL_OCR_MIN_MATCH_RATE, LOCAL_OCR_MIN_INGREDIENTS
+)
+from src.utils.ingredient_parser import classify_ingredient_tree, parse_ingredient_tree, parse_ingredients
+
+# Try to import pytesseract, but make it optional (it also needs the tesseract binary)
+try:
+    import pytesseract
+    PYTESSERACT_AVAILABLE = True
+except ImportError:
+    pytesseract = None
+    PYTESSERACT_AVAILABLE = False
+
+_HEADER_RE = re.compile(r"^(ingredients?|ingredientes|ingrédients|bahan|komposisi)\b:?", re.IGNORECASE)
+# Statements that follow the list; "contains"/"may contain" clauses are left to the parser,
+# since "contains 2% or less of:" can be part of the list itself
+_STOP_RE = re.compile(r"^(allergens?|allergy|nutrition|nutritional|storage|manufactured|produced|net)\b", re.IGNORECASE)
+_MIN_WIDTH = 1600  # Small photos are upscaled; Tesseract wants ~30px high characters
+
+# Outcomes of a local OCR attempt; only SERVED skips the vision model
+SERVED = "served"
+UNAVAILABLE = "unavailable"
+NO_HEADER = "no_header"
+TOO_FEW = "too_few_ingredients"
+LOW_CONFIDENCE = "low_confidence"
+LOW_MATCH_RATE = "low_match_rate"
+ERROR = "error"
+
+
+class LocalOcrStats:
+    """
+    Thread-safe counts of local OCR outcomes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._outcomes: Dict[str, int] = {}
+
+    def record(self, outcome: str) -> None:
+        """
+        Count one scan.
+
+        Args:
+            outcome (str): SERVED or the reason the vision model was needed
+        """
+        with self._lock:
+            self._outcomes[outcome] = self._outcomes.get(outcome, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Scans, scans served locally, their fraction and the
+                reasons the others went to the vision model
+        """
+        with self._lock:
+            outcomes = dict(self._outcomes)
+        scans = sum(outcomes.values())
+        served = outcomes.pop(SERVED, 0)
+        return {
+            "scans": scans,
+            "served_locally": served,
+            "served_fraction": round(served / scans, 3) if scans else 0.0,
+            "fallbacks": outcomes,
+        }
+
+
+ocr_stats = LocalOcrStats()
+_tesseract_ready: Optional[bool] = None
+
+
+def tesseract_available() -> bool:
+    """Whether pytesseract and the tesseract binary are both installed (checked once)."""
+    global _tesseract_ready
+    if _tesseract_ready is None:
+        try:
+            _tesseract_ready = PYTESSERACT_AVAILABLE and bool(pytesseract.get_tesseract_version())
+        except Exception:
+            _tesseract_ready = False
+    return _tesseract_ready
+
+
+def _prepare(image_bytes: bytes) -> Image.Image:
+    image = ImageOps.exif_transpose(Image.open(BytesIO(image_bytes))).convert("L")
+    if image.width < _MIN_WIDTH:
+        scale = _MIN_WIDTH / image.width
+        image = image.resize((_MIN_WIDTH, round(image.height * scale)), Image.LANCZOS)
+    return ImageOps.autocontrast(image)
+
+
+def _read_words(image_bytes: bytes) -> Dict[str, List[Any]]:
+    return pytesseract.image_to_data(_prepare(image_bytes), lang=LOCAL_OCR_LANG, output_type=pytesseract.Output.DICT)
+
+
+def locate_ingredients_block(words: Dict[str, List[Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Find the ingredients list in Tesseract's word layout.
+
+    The list starts after the first "Ingredients" header word and runs to the
+    end of its block (or of the next block, when the header stands on its
+    own), stopping early at allergen, nutrition or storage statements.
+
+    Args:
+        words (Dict[str, List[Any]]): pytesseract.image_to_data output as a dict
+
+    Returns:
+        Optional[Dict[str, Any]]: {"text", "confidence"} (mean word confidence,
+            0-100), or None if there is no header
+    """
+    entries = [
+        (str(text).strip(), float(conf), words["block_num"][i], words["par_num"][i], words["line_num"][i])
+        for i, (text, conf) in enumerate(zip(words["text"], words["conf"]))
+        if str(text).strip() and float(conf) >= 0
+    ]
+    start = next((i for i, entry in enumerate(entries) if _HEADER_RE.match(entry[0])), None)
+    if start is None:
+        return None
+
+    header_block = entries[start][2]
+    remainder = _HEADER_RE.sub("", entries[start][0]).strip()
+    lines: List[List[str]] = [[remainder]] if remainder else []
+    confidences: List[float] = []
+    current_line = entries[start][2:]
+    block = header_block
+    for text, conf, block_num, par_num, line_num in entries[start + 1:]:
+        if block_num != block:
+            # A header standing alone is followed by the list in the next block
+            if block != header_block or lines:
+                break
+            block = block_num
+        if _STOP_RE.match(text):
+            break
+        if not confidences and text == ":":
+            continue  # Colon read as its own word after the header
+        if (block_num, par_num, line_num) != current_line:
+            lines.append([])
+            current_line = (block_num, par_num, line_num)
+        if not lines:
+            lines.append([])
+        lines[-1].append(text)
+        confidences.append(conf)
+
+    if not confidences:
+        return None
+    text = ""
+    for line in lines:
+        joined = " ".join(line)
+        # Words hyphenated across a line break are joined back together
+        text = text[:-1] + joined if text.endswith("-") else (f"{text} {joined}" if text else joined)
+    return {"text": text.strip(), "confidence": sum(confidences) / len(confidences)}
+
+
+def match_rate(ingredients_text: str, lookup_table: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Share of the (sub-)ingredients in a text that the dataset knows.
+
+    Args:
+        ingredients_text (str): Ingredients text
+        lookup_table (Dict[str, str]): Dictionary mapping ingredient names to halal status
+
+    Returns:
+        Dict[str, Any]: {"ingredients": leaf ingredient count, "match_rate": 0-1}
+    """
+    tree = parse_ingredient_tree(ingredients_text)
+    leaves = sum(1 for node in tree for item in node.walk() if not item.children)
+    _, unknown, _ = classify_ingredient_tree(tree, lookup_table)
+    return {"ingredients": leaves, "match_rate": 1 - len(unknown) / leaves if leaves else 0.0}
+
+
+def read_ingredients_locally(image_bytes: bytes, lookup_table: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """
+    Read the ingredients with local OCR if the result can be trusted.
+
+    Args:
+        image_bytes (bytes): Raw image bytes
+        lookup_table (Dict[str, str]): Dictionary mapping ingredient names to halal status
+
+    Returns:
+        Optional[Dict[str, Any]]: {"ingredients_text", "confidence", "match_rate"}
+            when served locally, or None if the vision model is needed
+    """
+    if not tesseract_available():
+        ocr_stats.record(UNAVAILABLE)
+        return None
+    try:
+        words = _read_words(image_bytes)
+    except Exception as e:
+        print(f"Error running local OCR: {e}")
+        ocr_stats.record(ERROR)
+        return None
+
+    block = locate_ingredients_block(words)
+    if block is None:
+        ocr_stats.record(NO_HEADER)
+        return None
+    matched = match_rate(block["text"], lookup_table)
+    if matched["ingredients"] < LOCAL_OCR_MIN_INGREDIENTS:
+        outcome = TOO_FEW
+    elif block["confidence"] < LOCAL_OCR_MIN_CONFIDENCE:
+        outcome = LOW_CONFIDENCE
+    elif matched["match_rate"] < LOCAL_OCR_MIN_MATCH_RATE:
+        outcome = LOW_MATCH_RATE
+    else:
+        outcome = SERVED
+    ocr_stats.record(outcome)
+    if outcome != SERVED:
+        return None
+    return {
+        "ingredients_text": block["text"],
+        "confidence": round(block["confidence"], 1),
+        "match_rate": round(matched["match_rate"], 3),
+    }
+
+
+def reads_same_ingredients(image_bytes: bytes, ingredients_text: str) -> bool:
+    """
+    Whether local OCR reads exactly the given ingredients list from a photo.
+
+    Used to confirm that a near-duplicate photo shows the same label before
+    its stored extraction is reused: labels that differ in one word hash
+    almost identically. Not counted in ocr_stats.
+
+    Args:
+        image_bytes (bytes): Raw image bytes
+        ingredients_text (str): Ingredients extracted from the earlier photo
+
+    Returns:
+        bool: True only if the ingredients block was read and lists the same
+            ingredients, ignoring case and spacing
+    """
+    if not tesseract_available():
+        return False
+    try:
+        block = locate_ingredients_block(_read_words(image_bytes))
+    except Exception as e:
+        print(f"Error running local OCR: {e}")
+        return False
+    if block is None:
+        return False
+
+    def normalised(text: str) -> List[str]:
+        return [" ".join(name.lower().split()) for name in parse_ingredients(text)]
+
+    read = normalised(block["text"])
+    return bool(read) and read == normalised(ingredients_text)
@@ -0,0 +1,221 @@
+"""
+Opt-in profiling of individual analyses and chat turns.
+
+With PROFILE_SAMPLE_RATE above 0, that share of calls to the decorated
+entry points (image and text analysis, chat turns) is profiled and written
+to PROFILE_DIR:
+
+    sampling  <name>.collapsed   stacks of the profiled thread sampled every
+                                 PROFILE_INTERVAL, one "a;b;c count" line per
+                                 stack, for flamegraph.pl or speedscope
+    cprofile  <name>.prof        deterministic profile, for pstats or snakeviz
+
+plus <name>.txt, a summary of the wall time and the top PROFILE_TOP_N
+functions. With the rate at 0 (the default) the decorator returns the
+function unchanged, so there is no overhead at all.
+
+Usage:
+    python -m src.utils.profiling "water, sugar, e471" [--mode MODE] [--repeat N]
+"""
+import argparse
+import cProfile
+import functools
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from config.settings import PROFILE_DIR, PROFILE_INTERVAL, PROFILE_MODE, PROFILE_SAMPLE_RATE, PROFILE_TOP_N
+
+_state = threading.local()
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Samples one thread's stack at a fixed interval from a background thread.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        """
+        Args:
+            thread_id (int): Identifier of the thread to sample
+            interval (float): Seconds between samples
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        """Samples in collapsed-stack format, one "frame;frame;frame count" line per stack."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Functions with the most samples.
+
+        Args:
+            limit (int): Number of functions
+
+        Returns:
+            List[Dict[str, Any]]: function, self and total samples and total share, by total samples
+        """
+        own: Counter = Counter()
+        total: Counter = Counter()
+        samples = sum(self.stacks.values())
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [
+            {"function": frame, "self": own[frame], "total": count, "share": count / samples}
+            for frame, count in total.most_common(limit)
+        ]
+
+
+def _write_summary(path: Path, name: str, wall_s: float, body: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"{name}: {wall_s * 1000:.1f} ms wall\n\n{body}")
+
+
+@contextmanager
+def profile_block(
+    name: str,
+    mode: str = PROFILE_MODE,
+    out_dir: Path = PROFILE_DIR,
+    top_n: int = PROFILE_TOP_N
+) -> Iterator[None]:
+    """
+    Profile the enclosed code on the current thread and write the results.
+
+    Args:
+        name (str): Label used in the file names
+        mode (str): "sampling" or "cprofile"
+        out_dir (Path): Directory the files are written to
+        top_n (int): Functions listed in the summary
+    """
+    stem = f"{datetime.now().strftime('%Y%m%dT%H%M%S.%f')}-{name}-{os.getpid()}-{threading.get_ident()}"
+    sampler, profiler = None, None
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+    else:
+        sampler = StackSampler(threading.get_ident())
+    _state.active = True
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    else:
+        sampler.start()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        else:
+            sampler.stop()
+        wall_s = time.perf_counter() - start
+        _state.active = False
+        try:
+            out_dir = Path(out_dir)
+            out_dir.mkdir(parents=True, exist_ok=True)
+            if profiler is not None:
+                profiler.dump_stats(str(out_dir / f"{stem}.prof"))
+                report = io.StringIO()
+                pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(top_n)
+                _write_summary(out_dir / f"{stem}.txt", name, wall_s, report.getvalue())
+            else:
+                with open(out_dir / f"{stem}.collapsed", "w", encoding="utf-8") as f:
+                    f.write(sampler.collapsed())
+                lines = [f"{sum(sampler.stacks.values())} samples every {sampler.interval * 1000:g} ms", ""]
+                lines += [
+                    f"{row['share']:6.1%} {row['total']:6d} total {row['self']:6d} self  {row['function']}"
+                    for row in sampler.top(top_n)
+                ]
+                _write_summary(out_dir / f"{stem}.txt", name, wall_s, "\n".join(lines) + "\n")
+        except OSError as e:
+            print(f"Error writing profile {stem}: {e}")
+
+
+def profiled(name: str, sample_rate: float = PROFILE_SAMPLE_RATE) -> Callable[[Callable], Callable]:
+    """
+    Decorator profiling a share of calls to a function.
+
+    Calls made while another profile is running on the same thread (e.g. the
+    text analysis inside an image analysis) are part of that profile.
+
+    Args:
+        name (str): Label used in the file names
+        sample_rate (float): Share of calls profiled; 0 returns the function unchanged
+
+    Returns:
+        Callable[[Callable], Callable]: The decorator
+    """
+    def decorate(function: Callable) -> Callable:
+        if sample_rate <= 0:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if getattr(_state, "active", False) or random.random() >= sample_rate:
+                return function(*args, **kwargs)
+            with profile_block(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Command-line entry point profiling text analyses against the local dataset."""
+    from config.settings import INGREDIENTS_DATASET
+    from src.utils.analysis import analyze_ingredients_text
+    from src.utils.call_planner import DETAIL_VERDICT
+    from src.utils.knowledge_base import load_knowledge_base
+
+    parser = argparse.ArgumentParser(description="Profile ingredient analyses (dataset lookups only, no OpenAI).")
+    parser.add_argument("ingredients", help="Ingredients text to analyse")
+    parser.add_argument("--mode", choices=("sampling", "cprofile"), default=PROFILE_MODE, help="Profiler")
+    parser.add_argument("--repeat", type=int, default=1000, help="Analyses in the profile")
+    parser.add_argument("--out-dir", type=Path, default=PROFILE_DIR, help="Directory for the profile files")
+    args = parser.parse_args(argv)
+
+    kb = load_knowledge_base(str(INGREDIENTS_DATASET))
+    with profile_block("cli", mode=args.mode, out_dir=args.out_dir):
+        for _ in range(args.repeat):
+            analyze_ingredients_text(args.ingredients, kb.lookup_table, detail=DETAIL_VERDICT)
+    print(f"Profile written to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Append-only log of analysis results.
+
+Results are buffered in memory and appended in batches by a background thread
+to JSON Lines segments, which rotate by size. Each process writes its own
+segments (the file name carries the pid), so several app or service workers
+never contend for a file. Segments still being written end in ".jsonl.open"
+and are renamed to ".jsonl" when rotated or closed.
+
+The compaction command merges closed segments into one Parquet file (when
+pyarrow is installed) or one JSON Lines file:
+
+Usage:
+    python -m src.utils.results_sink compact [--dir DIR] [--format parquet|jsonl]
+    python -m src.utils.results_sink export OUTPUT.csv [--dir DIR]
+"""
+import argparse
+import atexit
+import csv
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from config.settings import RESULTS_DIR, RESULTS_SEGMENT_BYTES, RESULTS_FLUSH_INTERVAL, RESULTS_BUFFER_SIZE
+
+# Try to import pyarrow, but make it optional
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pa = None
+    pq = None
+    PYARROW_AVAILABLE = False
+
+OPEN_SUFFIX = ".jsonl.open"
+
+# Columns of a result record, in export order
+RECORD_FIELDS = [
+    "recorded_at", "source", "product_name", "product_status", "ingredients", "statuses",
+    "unknown_ingredients", "halal_status_response", "ingredients_text", "kb_version",
+]
+
+
+def analysis_record(results: Dict[str, Any], source: str = "app", product_name: str = "") -> Dict[str, Any]:
+    """
+    Flatten analysis results into a log record.
+
+    Ingredient statuses are stored as a list aligned with the ingredients so
+    every column has a fixed type in columnar formats.
+
+    Args:
+        results (Dict[str, Any]): Results from the analysis pipeline
+        source (str): Where the analysis ran ("app", "service", ...)
+        product_name (str): Optional product name
+
+    Returns:
+        Dict[str, Any]: Record with the RECORD_FIELDS keys
+    """
+    ingredients = list(results.get("ingredients_list", []))
+    statuses = results.get("ingredient_statuses", {})
+    return {
+        "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "source": source,
+        "product_name": product_name or "",
+        "product_status": results.get("product_status", "Unknown"),
+        "ingredients": ingredients,
+        "statuses": [statuses.get(name.lower(), "Unknown") for name in ingredients],
+        "unknown_ingredients": list(results.get("unknown_ingredients", [])),
+        "halal_status_response": results.get("halal_status_response") or "",
+        "ingredients_text": results.get("ingredients_text", ""),
+        "kb_version": results.get("kb_version", ""),
+    }
+
+
+def export_summary(record: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Item/value summary of one record for a CSV download.
+
+    Args:
+        record (Dict[str, Any]): Record from analysis_record
+
+    Returns:
+        Dict[str, str]: Summary items in display order
+    """
+    return {
+        "Product Status": record["product_status"],
+        "Ingredients": ", ".join(record["ingredients"]),
+        "Unknown Ingredients": ", ".join(record["unknown_ingredients"]) or "None",
+        "Analysis": record["halal_status_response"] or "No detailed analysis available",
+    }
+
+
+def rows_to_csv(rows: List[List[Any]]) -> bytes:
+    """
+    Serialise rows to CSV bytes with the csv module.
+
+    Args:
+        rows (List[List[Any]]): Rows including the header
+
+    Returns:
+        bytes: UTF-8 encoded CSV
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+class ResultsSink:
+    """
+    Buffered, batch-appending writer of result records.
+    """
+
+    def __init__(
+        self,
+        directory: Path,
+        segment_bytes: int = RESULTS_SEGMENT_BYTES,
+        flush_interval: float = RESULTS_FLUSH_INTERVAL,
+        buffer_size: int = RESULTS_BUFFER_SIZE
+    ):
+        """
+        Args:
+            directory (Path): Directory holding the segments
+            segment_bytes (int): Size at which a segment is rotated
+            flush_interval (float): Seconds between background flushes
+            buffer_size (int): Buffered records that trigger an early flush
+        """
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self._buffer: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._segment: Optional[Path] = None
+        self._handle: Optional[Any] = None
+        self.records_written = 0
+        self._thread = threading.Thread(target=self._run, name="results-sink", daemon=True)
+        self._thread.start()
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """
+        Queue a record for writing; returns without touching the disk.
+
+        Args:
+            record (Dict[str, Any]): Record from analysis_record
+        """
+        with self._lock:
+            self._buffer.append(record)
+            full = len(self._buffer) >= self.buffer_size
+        if full:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """
+        Write all buffered records now.
+
+        Returns:
+            int: Number of records written
+        """
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch:
+            return 0
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch).encode("utf-8")
+        with self._write_lock:
+            try:
+                handle = self._current_handle()
+                handle.write(data)
+                handle.flush()
+            except OSError:
+                # Keep the records for the next attempt
+                with self._lock:
+                    self._buffer[:0] = batch
+                raise
+            self.records_written += len(batch)
+            if handle.tell() >= self.segment_bytes:
+                self._close_segment()
+        return len(batch)
+
+    def close(self) -> None:
+        """Flush remaining records and seal the open segment."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+        with self._write_lock:
+            self._close_segment()
+
+    @property
+    def segment(self) -> Optional[Path]:
+        """Path of the segment currently being written, if any."""
+        return self._segment
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error writing analysis results: {e}")
+
+    def _current_handle(self) -> Any:
+        if self._handle is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+            self._segment = self.directory / f"results-{stamp}-{os.getpid()}{OPEN_SUFFIX}"
+            self._handle = open(self._segment, "ab")
+        return self._handle
+
+    def _close_segment(self) -> None:
+        if self._handle is None:
+            return
+        self._handle.close()
+        sealed = self._segment.with_name(self._segment.name[:-len(".open")])
+        os.replace(self._segment, sealed)
+        self._handle = None
+        self._segment = None
+
+
+_sinks: Dict[str, ResultsSink] = {}
+_sinks_lock = threading.Lock()
+
+
+def get_results_sink(directory: Path = RESULTS_DIR) -> ResultsSink:
+    """
+    Return the process-wide sink for a directory, closed automatically at exit.
+
+    Args:
+        directory (Path): Directory holding the segments
+
+    Returns:
+        ResultsSink: Shared sink
+    """
+    key = str(Path(directory).resolve())
+    with _sinks_lock:
+        sink = _sinks.get(key)
+        if sink is None:
+            sink = ResultsSink(directory)
+            _sinks[key] = sink
+            atexit.register(sink.close)
+        return sink
+
+
+def list_segments(directory: Path, include_open: bool = False) -> List[Path]:
+    """
+    Segments and compacted files in a directory, oldest first.
+
+    Args:
+        directory (Path): Directory holding the segments
+        include_open (bool): Include segments that are still being written
+
+    Returns:
+        List[Path]: Segment paths
+    """
+    directory = Path(directory)
+    if not directory.exists():
+        return []
+    paths = [
+        path for path in directory.iterdir()
+        if path.name.endswith((".jsonl", ".parquet")) or (include_open and path.name.endswith(OPEN_SUFFIX))
+    ]
+    # Both "results-<opened>-<pid>" and "compacted-<last merged>-<created>" sort by their first stamp
+    return sorted(paths, key=lambda path: (path.name.split("-")[1], path.name))
+
+
+def _read_segment(path: Path) -> Iterator[Dict[str, Any]]:
+    if path.suffix == ".parquet":
+        if not PYARROW_AVAILABLE:
+            raise ImportError(
+                "pyarrow is required to read compacted results. "
+                "Please install it with: pip install pyarrow"
+            )
+        yield from pq.read_table(path).to_pylist()
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            # A crashed writer can leave a truncated last line
+            if line.endswith("\n"):
+                yield json.loads(line)
+
+
+def iter_records(directory: Path = RESULTS_DIR, include_open: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    Read every record in the log, oldest segment first.
+
+    Args:
+        directory (Path): Directory holding the segments
+        include_open (bool): Include segments that are still being written
+
+    Yields:
+        Dict[str, Any]: Result records
+    """
+    for path in list_segments(directory, include_open=include_open):
+        yield from _read_segment(path)
+
+
+def compact(directory: Path = RESULTS_DIR, output_format: str = "parquet") -> Optional[Path]:
+    """
+    Merge all closed segments into one file and delete the originals.
+
+    Args:
+        directory (Path): Directory holding the segments
+        output_format (str): "parquet" (requires pyarrow) or "jsonl"
+
+    Returns:
+        Optional[Path]: The compacted file, or None if there was nothing to merge
+
+    Raises:
+        ImportError: If Parquet output is requested without pyarrow
+    """
+    if output_format == "parquet" and not PYARROW_AVAILABLE:
+        raise ImportError(
+            "pyarrow is required for Parquet compaction. "
+            "Please install it with: pip install pyarrow, or use --format jsonl"
+        )
+    sources = list_segments(directory)
+    if len(sources) < 2 and all(path.suffix == f".{output_format}" for path in sources):
+        return None
+
+    # Only the listed segments: one sealed meanwhile is neither merged nor deleted
+    records = [record for path in sources for record in _read_segment(path)]
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    # Named after the newest merged segment so it sorts before segments opened later
+    last = sources[-1].name.split("-")[1]
+    target = Path(directory) / f"compacted-{last}-{stamp}.{output_format}"
+    tmp = target.with_name(target.name + ".tmp")
+    if output_format == "parquet":
+        pq.write_table(pa.Table.from_pylist(records), tmp, compression="zstd")
+    else:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp, target)
+    for path in sources:
+        path.unlink()
+    return target
+
+
+def export_csv(output_path: Path, directory: Path = RESULTS_DIR) -> int:
+    """
+    Stream the whole log to a CSV file without loading it into a DataFrame.
+
+    Args:
+        output_path (Path): CSV file to write
+        directory (Path): Directory holding the segments
+
+    Returns:
+        int: Number of records exported
+    """
+    count = 0
+    with open(output_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(RECORD_FIELDS)
+        for record in iter_records(directory):
+            writer.writerow([
+                "; ".join(value) if isinstance(value, list) else value
+                for value in (record.get(field, "") for field in RECORD_FIELDS)
+            ])
+            count += 1
+    return count
+
+
+def main() -> None:
+    """Command-line entry point for compacting and exporting the results log."""
+    parser = argparse.ArgumentParser(description="Manage the analysis results log.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="Merge closed segments into one file")
+    compact_parser.add_argument("--dir", default=str(RESULTS_DIR), help="Results directory")
+    compact_parser.add_argument("--format", choices=["parquet", "jsonl"], default="parquet")
+    export_parser = subparsers.add_parser("export", help="Export the log to CSV")
+    export_parser.add_argument("output", help="CSV file to write")
+    export_parser.add_argument("--dir", default=str(RESULTS_DIR), help="Results directory")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "compact":
+        target = compact(Path(args.dir), args.format)
+        print(f"Compacted into {target}" if target else "Nothing to compact")
+    else:
+        count = export_csv(Path(args.output), Path(args.dir))
+        print(f"Exported {count} records to {args.output}")
+    print(f"Done in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
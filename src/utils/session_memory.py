@@ -0,0 +1,79 @@
+"""
+Per-session memory accounting for the Streamlit app.
+"""
+import sys
+from typing import Any, Dict, List, Mapping, Optional, Set
+
+
+def deep_sizeof(obj: Any, seen: Optional[Set[int]] = None) -> int:
+    """
+    Approximate the memory held by an object and everything it references.
+
+    Containers, object attributes and slots are followed; objects already
+    counted (shared references) are counted once.
+
+    Args:
+        obj: Object to measure
+        seen (Optional[Set[int]]): Ids of objects already counted
+
+    Returns:
+        int: Approximate size in bytes
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj, 0)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, Mapping):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    if hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    for slot in getattr(type(obj), "__slots__", ()):
+        if isinstance(slot, str) and hasattr(obj, slot):
+            size += deep_sizeof(getattr(obj, slot), seen)
+    return size
+
+
+def session_memory_report(state: Mapping[str, Any], shared: Optional[List[Any]] = None) -> Dict[str, Any]:
+    """
+    Report how much memory each session-state key holds.
+
+    Args:
+        state (Mapping[str, Any]): Session state, e.g. dict(st.session_state)
+        shared (Optional[List[Any]]): Process-wide objects (knowledge base,
+            indexes) that sessions may reference; they are excluded from the
+            per-session totals
+
+    Returns:
+        Dict[str, Any]: {"total_bytes": int, "keys": {key: bytes}}, keys largest first
+    """
+    seen: Set[int] = set()
+    for obj in shared or []:
+        deep_sizeof(obj, seen)
+
+    sizes = {str(key): deep_sizeof(value, seen) for key, value in state.items()}
+    ordered = dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+    return {"total_bytes": sum(sizes.values()), "keys": ordered}
+
+
+def format_bytes(size: int) -> str:
+    """
+    Format a byte count for display.
+
+    Args:
+        size (int): Size in bytes
+
+    Returns:
+        str: Size such as "512 B", "12.3 KB" or "4.0 MB"
+    """
+    if size < 1024:
+        return f"{size} B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
@@ -0,0 +1,447 @@
+"""
+Retrieval embeddings compiled into a memory-mapped file shared by all workers.
+
+LlamaIndex's SimpleVectorStore keeps every embedding as a Python list of
+floats, roughly 32 bytes per dimension, in every process that loads the
+index. Here the persisted vector store is compiled once into packed,
+L2-normalised float32 rows that each worker maps read-only, so the operating
+system keeps a single copy of the embeddings however many workers run on the
+node, and cosine similarity is a single matrix-vector product.
+
+Layout (little-endian):
+    header   magic "HVEC", format version, row count, dimensions, generation,
+             source version (16 bytes, ASCII), and the offsets of the id
+             index, the strings and the (16-byte aligned) vectors
+    ids      per row: node id as (offset, length) into the string table
+    strings  UTF-8 node ids
+    vectors  count x dimensions float32, each row L2-normalised
+
+As with the ingredient snapshot, a recompiled file replaces the old one by
+rename and its generation goes up by one, so "info" shows which compile is
+in place. Unlike the ingredient snapshot it is not remapped while running:
+the node texts come from the docstore each worker loaded at start, so
+workers pick up a recompiled file (after ingestion) when they restart.
+
+Usage:
+    python -m src.utils.shared_vectors compile [--persist-dir DIR] [--out PATH]
+    python -m src.utils.shared_vectors info [--out PATH]
+"""
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config.settings import STORAGE_DIR, VECTOR_SNAPSHOT_FILE
+
+# Try to import numpy, but make it optional (rows are scored in Python without it)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+# Try to import llama_index, but make it optional
+try:
+    from llama_index.vector_stores.types import VectorStore, VectorStoreQueryResult
+    LLAMA_INDEX_AVAILABLE = True
+except ImportError:
+    LLAMA_INDEX_AVAILABLE = False
+
+    class VectorStore:
+        pass
+
+MAGIC = b"HVEC"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHxxIII16sQQQ")
+ID_ENTRY = struct.Struct("<II")
+VECTOR_STORE_FILES = ("default__vector_store.json", "vector_store.json")
+
+
+def persisted_vector_store(persist_dir: Path) -> Optional[Path]:
+    """
+    Find the SimpleVectorStore file LlamaIndex persisted in a directory.
+
+    Args:
+        persist_dir (Path): Index persist directory
+
+    Returns:
+        Optional[Path]: The vector store file, or None if it was never persisted
+    """
+    for name in VECTOR_STORE_FILES:
+        path = Path(persist_dir) / name
+        if path.exists():
+            return path
+    return None
+
+
+def build_vectors(embeddings: Dict[str, Sequence[float]], version: str, generation: int = 0) -> bytes:
+    """
+    Pack embeddings into the shared vector file format.
+
+    Args:
+        embeddings (Dict[str, Sequence[float]]): Node id to embedding
+        version (str): Source version recorded in the header (at most 16 ASCII characters)
+        generation (int): Generation recorded in the header
+
+    Returns:
+        bytes: The packed file
+
+    Raises:
+        ValueError: If the embeddings do not all have the same number of dimensions
+    """
+    ids = sorted(embeddings)
+    dimensions = len(embeddings[ids[0]]) if ids else 0
+    strings, index = bytearray(), bytearray()
+    for node_id in ids:
+        if len(embeddings[node_id]) != dimensions:
+            raise ValueError(
+                f"Embedding of {node_id} has {len(embeddings[node_id])} dimensions, expected {dimensions}"
+            )
+        data = node_id.encode("utf-8")
+        index += ID_ENTRY.pack(len(strings), len(data))
+        strings += data
+
+    ids_at = HEADER.size
+    strings_at = ids_at + len(index)
+    vectors_at = (strings_at + len(strings) + 15) // 16 * 16
+    vectors = bytearray()
+    for node_id in ids:
+        vector = embeddings[node_id]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        vectors += struct.pack(f"<{dimensions}f", *(value / norm for value in vector))
+
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(ids), dimensions, generation, version.encode("ascii")[:16],
+        ids_at, strings_at, vectors_at
+    )
+    padding = bytes(vectors_at - strings_at - len(strings))
+    return bytes(header + index + strings + padding + vectors)
+
+
+def read_header(path: Path) -> Optional[Dict[str, Any]]:
+    """
+    Read a shared vector file's header without mapping it.
+
+    Args:
+        path (Path): Shared vector file
+
+    Returns:
+        Optional[Dict[str, Any]]: format, rows, dimensions, version and
+            generation, or None if the file is missing or not of this format
+    """
+    try:
+        with open(path, "rb") as f:
+            magic, fmt, count, dimensions, generation, version = HEADER.unpack(f.read(HEADER.size))[:6]
+    except (OSError, struct.error):
+        return None
+    if magic != MAGIC or fmt != FORMAT_VERSION:
+        return None
+    return {
+        "format": fmt,
+        "rows": count,
+        "dimensions": dimensions,
+        "version": version.rstrip(b"\0").decode("ascii"),
+        "generation": generation,
+    }
+
+
+def compile_vectors(source_path: Path, out_path: Path, version: str) -> Dict[str, Any]:
+    """
+    Compile a persisted SimpleVectorStore into a shared vector file.
+
+    The file is written to a temporary file and renamed into place, so
+    workers that have the previous file mapped keep a consistent view until
+    they restart. Its generation is one more than the file it replaces.
+
+    Args:
+        source_path (Path): Persisted vector store JSON
+        out_path (Path): Shared vector file to write
+        version (str): Source version recorded in the header
+
+    Returns:
+        Dict[str, Any]: Rows, dimensions, bytes written and generation
+
+    Raises:
+        ValueError: If the embeddings do not all have the same number of dimensions
+        OSError: If the file cannot be written
+    """
+    with open(source_path, "r", encoding="utf-8") as f:
+        embeddings = json.load(f).get("embedding_dict", {})
+    out_path = Path(out_path)
+    previous = read_header(out_path)
+    generation = previous["generation"] + 1 if previous else 1
+    data = build_vectors(embeddings, version, generation)
+    del embeddings
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(f".{out_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, out_path)
+    _, _, rows, dimensions = HEADER.unpack_from(data)[:4]
+    return {
+        "rows": rows,
+        "dimensions": dimensions,
+        "bytes": len(data),
+        "generation": generation,
+    }
+
+
+class SharedVectors:
+    """
+    Read-only view of a shared vector file in any buffer (mmap, shared memory, bytes).
+    """
+
+    def __init__(self, buffer: Any):
+        """
+        Args:
+            buffer: Object supporting the buffer protocol holding the file
+
+        Raises:
+            ValueError: If the buffer is not a shared vector file of this format version
+        """
+        self.buffer = buffer
+        self._view = memoryview(buffer)
+        if len(self._view) < HEADER.size:
+            raise ValueError("Not a shared vector file (too short)")
+        (magic, fmt, count, dimensions, generation, version,
+         ids_at, strings_at, vectors_at) = HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError(f"Not a shared vector file of format {FORMAT_VERSION}")
+        self.count = count
+        self.dimensions = dimensions
+        self.generation = generation
+        self.version = version.rstrip(b"\0").decode("ascii")
+        self._ids_at = ids_at
+        self._strings_at = strings_at
+        self._vectors_at = vectors_at
+        self._ids: Optional[List[str]] = None
+        self._rows_by_id: Optional[Dict[str, int]] = None
+        vectors = self._view[vectors_at:vectors_at + 4 * count * dimensions]
+        if NUMPY_AVAILABLE:
+            # A view onto the mapping, not a copy; read-only since the mapping is
+            self.matrix = np.frombuffer(vectors, dtype="<f4").reshape(count, dimensions)
+        else:
+            self.matrix = vectors.cast("f")
+
+    @property
+    def ids(self) -> List[str]:
+        """Node id of each row, decoded on first use."""
+        if self._ids is None:
+            ids = []
+            for row in range(self.count):
+                offset, length = ID_ENTRY.unpack_from(self._view, self._ids_at + row * ID_ENTRY.size)
+                start = self._strings_at + offset
+                ids.append(str(self._view[start:start + length], "utf-8"))
+            self._ids = ids
+        return self._ids
+
+    def row(self, node_id: str) -> int:
+        """Row of a node id, or -1 if it has no embedding."""
+        if self._rows_by_id is None:
+            self._rows_by_id = {node_id: row for row, node_id in enumerate(self.ids)}
+        return self._rows_by_id.get(node_id, -1)
+
+    def vector(self, row: int) -> List[float]:
+        """Normalised embedding of a row."""
+        if NUMPY_AVAILABLE:
+            return self.matrix[row].tolist()
+        start = row * self.dimensions
+        return list(self.matrix[start:start + self.dimensions])
+
+    def search(
+        self,
+        query: Sequence[float],
+        top_k: int,
+        node_ids: Optional[Sequence[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Rows most similar to a query embedding by cosine similarity.
+
+        Args:
+            query (Sequence[float]): Query embedding
+            top_k (int): Number of results
+            node_ids (Optional[Sequence[str]]): Only consider these nodes
+
+        Returns:
+            List[Tuple[str, float]]: (node id, similarity), most similar first
+        """
+        if len(query) != self.dimensions:
+            raise ValueError(f"Query has {len(query)} dimensions, expected {self.dimensions}")
+        norm = math.sqrt(sum(value * value for value in query)) or 1.0
+        if node_ids is not None:
+            rows = [row for row in (self.row(node_id) for node_id in node_ids) if row >= 0]
+        else:
+            rows = None
+
+        if NUMPY_AVAILABLE:
+            query_vector = np.asarray(query, dtype=np.float32) / norm
+            matrix = self.matrix if rows is None else self.matrix[rows]
+            scores = matrix @ query_vector
+            top_k = min(top_k, len(scores))
+            if not top_k:
+                return []
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best])]
+            ids = self.ids if rows is None else [self.ids[row] for row in rows]
+            return [(ids[i], float(scores[i])) for i in best]
+
+        query_vector = [value / norm for value in query]
+        scored = []
+        for row in (range(self.count) if rows is None else rows):
+            start = row * self.dimensions
+            vector = self.matrix[start:start + self.dimensions]
+            scored.append((self.ids[row], sum(a * b for a, b in zip(vector, query_vector))))
+        scored.sort(key=lambda item: item[1], reverse=True)
+        return scored[:top_k]
+
+    def release(self) -> None:
+        """Drop this view's references to the buffer so it can be closed or unmapped."""
+        self.matrix = None
+        self._view.release()
+
+
+def map_vectors(path: Path) -> SharedVectors:
+    """
+    Memory-map a shared vector file read-only.
+
+    Args:
+        path (Path): Shared vector file
+
+    Returns:
+        SharedVectors: View over the mapping
+
+    Raises:
+        ValueError: If the file is not a shared vector file of this format version
+    """
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return SharedVectors(mapping)
+
+
+class SharedVectorStore(VectorStore):
+    """
+    Read-only LlamaIndex vector store over shared, memory-mapped embeddings.
+
+    Node texts stay in the docstore, as with SimpleVectorStore. Inserting or
+    deleting nodes is done by the ingestion command against the persisted
+    store, which is then recompiled.
+    """
+
+    stores_text: bool = False
+    is_embedding_query: bool = True
+
+    def __init__(self, vectors: SharedVectors):
+        """
+        Args:
+            vectors (SharedVectors): Mapped embeddings
+        """
+        self.vectors = vectors
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def add(self, nodes: List[Any], **add_kwargs: Any) -> List[str]:
+        raise NotImplementedError("The shared vector store is read-only; run python -m src.utils.ingestion")
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        raise NotImplementedError("The shared vector store is read-only; run python -m src.utils.ingestion")
+
+    def get(self, text_id: str) -> Optional[List[float]]:
+        """Normalised embedding of a node, or None."""
+        row = self.vectors.row(text_id)
+        return self.vectors.vector(row) if row >= 0 else None
+
+    def query(self, query: Any, **kwargs: Any) -> Any:
+        """
+        Answer a LlamaIndex VectorStoreQuery by cosine similarity.
+
+        Args:
+            query: VectorStoreQuery with query_embedding, similarity_top_k and optional node_ids
+
+        Returns:
+            VectorStoreQueryResult: Matching node ids and similarities
+        """
+        if getattr(query, "filters", None) is not None:
+            raise ValueError("Metadata filters are not supported by the shared vector store")
+        results = self.vectors.search(query.query_embedding, query.similarity_top_k, query.node_ids)
+        return VectorStoreQueryResult(
+            similarities=[score for _, score in results], ids=[node_id for node_id, _ in results]
+        )
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        # The persisted SimpleVectorStore stays the source of truth
+        return None
+
+
+def load_shared_vector_store(persist_dir: Path, out_path: Path = VECTOR_SNAPSHOT_FILE) -> Optional[SharedVectorStore]:
+    """
+    Map the shared embeddings of an index, compiling them first if they are
+    missing or were compiled from a different version of the vector store.
+
+    Args:
+        persist_dir (Path): Index persist directory
+        out_path (Path): Shared vector file
+
+    Returns:
+        Optional[SharedVectorStore]: The store, or None if the index has no
+            persisted vector store or the file could not be compiled (LlamaIndex
+            then loads its own copy)
+    """
+    from src.utils.knowledge_base import dataset_version
+
+    source = persisted_vector_store(persist_dir)
+    if source is None:
+        return None
+    try:
+        version = dataset_version(str(source))
+        header = read_header(out_path)
+        if header is None or header["version"] != version:
+            compile_vectors(source, out_path, version)
+        return SharedVectorStore(map_vectors(out_path))
+    except (OSError, ValueError) as e:
+        print(f"Error loading shared vector store: {e}")
+        return None
+
+
+def main() -> None:
+    """Command-line entry point for compiling and inspecting the shared vector file."""
+    from src.utils.knowledge_base import dataset_version
+
+    parser = argparse.ArgumentParser(description="Compile the index embeddings into a shared vector file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compile_parser = subparsers.add_parser("compile", help="Compile the persisted vector store")
+    compile_parser.add_argument("--persist-dir", type=Path, default=STORAGE_DIR, help="Index persist directory")
+    compile_parser.add_argument("--out", type=Path, default=VECTOR_SNAPSHOT_FILE, help="Shared vector file")
+    info_parser = subparsers.add_parser("info", help="Show the shared vector file header")
+    info_parser.add_argument("--out", type=Path, default=VECTOR_SNAPSHOT_FILE, help="Shared vector file")
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        source = persisted_vector_store(args.persist_dir)
+        if source is None:
+            raise SystemExit(f"No persisted vector store in {args.persist_dir}; run python -m src.utils.ingestion")
+        start = time.perf_counter()
+        try:
+            report = compile_vectors(source, args.out, dataset_version(str(source)))
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print(f"Wrote {report['rows']} x {report['dimensions']} embeddings ({report['bytes']} bytes) to "
+              f"{args.out} as generation {report['generation']} in {(time.perf_counter() - start) * 1000:.1f} ms")
+    else:
+        header = read_header(args.out)
+        if header is None:
+            raise SystemExit(f"{args.out} is not a compiled shared vector file")
+        print(f"{args.out}: format {header['format']}, {header['rows']} x {header['dimensions']} embeddings, "
+              f"source version {header['version']}, generation {header['generation']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Local token counting for prompt and chunk budgeting.
+"""
+import math
+import re
+from functools import lru_cache
+from typing import Any, Optional
+
+# Try to import tiktoken, but make it optional
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# Words, numbers and individual punctuation marks, roughly how BPE splits text
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(encoding_name: str) -> Optional[Any]:
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(encoding_name)
+    except Exception:
+        # The encoding files may not be downloadable (e.g. offline)
+        return None
+
+
+def count_tokens(text: str, encoding_name: str = DEFAULT_ENCODING) -> int:
+    """
+    Count the tokens in a piece of text without calling any API.
+
+    Uses tiktoken when it is installed and otherwise falls back to an estimate
+    that counts words and punctuation, charging long words one token per four
+    characters.
+
+    Args:
+        text (str): Text to count
+        encoding_name (str): tiktoken encoding name
+
+    Returns:
+        int: Number of tokens
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(encoding_name)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _PIECE_RE.findall(text))
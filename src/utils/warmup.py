@@ -0,0 +1,229 @@
+"""
+Background warm-up of slow resources at process start.
+
+Loading the retrieval index and chat model context takes a minute or two,
+which used to fall on the first user to ask a question. Components are now
+loaded one after another by a background thread as soon as the process
+starts, while everything that doesn't need them keeps working. Their state
+is reported for health checks:
+
+    live   the process is running and no required component failed to load
+    ready  every required component (WARMUP_READY_COMPONENTS) is loaded
+
+The Streamlit app can't serve extra endpoints, so its status is also written
+to WARMUP_STATUS_FILE for an exec probe:
+
+    python -m src.utils.warmup probe --ready   # exit status 0 once ready
+    python -m src.utils.warmup probe --live
+    python -m src.utils.warmup status
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from config.settings import WARMUP_READY_COMPONENTS, WARMUP_STATUS_FILE
+
+# States of a component
+PENDING = "pending"
+WARMING = "warming"
+READY = "ready"
+FAILED = "failed"
+
+
+class Warmup:
+    """
+    Loads registered components in a background thread and tracks their state.
+    """
+
+    def __init__(
+        self, ready_components: Sequence[str] = WARMUP_READY_COMPONENTS, status_file: Optional[Path] = None
+    ):
+        """
+        Args:
+            ready_components (Sequence[str]): Components that must be loaded for
+                the process to be ready; names this process doesn't register are ignored
+            status_file (Optional[Path]): File the status is written to on every change
+        """
+        self.ready_components = list(ready_components)
+        self.status_file = Path(status_file) if status_file else None
+        self._lock = threading.Lock()
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._components: Dict[str, Dict[str, Any]] = {}
+        self._done: Dict[str, threading.Event] = {}
+        self._thread: Optional[threading.Thread] = None
+        self.started_at: Optional[str] = None
+
+    def add(self, name: str, loader: Callable[[], Any]) -> "Warmup":
+        """
+        Register a component; components are loaded in the order they were added.
+
+        Args:
+            name (str): Component name, as used in WARMUP_READY_COMPONENTS
+            loader (Callable[[], Any]): Loads the component, typically a cached
+                getter that later callers share
+
+        Returns:
+            Warmup: self
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._components[name] = {"state": PENDING, "seconds": None, "error": None}
+            self._done[name] = threading.Event()
+        return self
+
+    def start(self) -> "Warmup":
+        """Start loading the components in a background thread (once)."""
+        with self._lock:
+            if self._thread is not None:
+                return self
+            self.started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._write_status()
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        for name, loader in list(self._loaders.items()):
+            self._update(name, state=WARMING)
+            start = time.perf_counter()
+            try:
+                loader()
+                self._update(name, state=READY, seconds=round(time.perf_counter() - start, 3))
+            except Exception as e:
+                print(f"Error warming up {name}: {e}")
+                self._update(name, state=FAILED, seconds=round(time.perf_counter() - start, 3),
+                             error=f"{type(e).__name__}: {e}")
+            self._done[name].set()
+
+    def _update(self, name: str, **changes: Any) -> None:
+        with self._lock:
+            self._components[name].update(changes)
+        self._write_status()
+
+    def _required(self) -> List[str]:
+        return [name for name in self.ready_components if name in self._components]
+
+    def state(self, name: str) -> Optional[str]:
+        """State of one component, or None if it isn't registered."""
+        with self._lock:
+            return self._components[name]["state"] if name in self._components else None
+
+    def is_ready(self, name: Optional[str] = None) -> bool:
+        """
+        Args:
+            name (Optional[str]): Component to check; None checks every required component
+
+        Returns:
+            bool: Whether it is loaded
+        """
+        names = [name] if name else self._required()
+        return all(self.state(component) == READY for component in names)
+
+    def is_live(self) -> bool:
+        """Whether no required component has failed to load."""
+        return all(self.state(component) != FAILED for component in self._required())
+
+    def wait(self, name: str, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for a component to finish loading.
+
+        Args:
+            name (str): Component name
+            timeout (Optional[float]): Seconds to wait at most; None waits for good
+
+        Returns:
+            bool: True if it loaded, False if it failed, isn't registered or the wait timed out
+        """
+        done = self._done.get(name)
+        return done is not None and done.wait(timeout) and self.state(name) == READY
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: Readiness, liveness, start time, process id and the
+                state, load time and error of each component
+        """
+        with self._lock:
+            components = {name: dict(info) for name, info in self._components.items()}
+        return {
+            "ready": self.is_ready(),
+            "live": self.is_live(),
+            "required": self._required(),
+            "started_at": self.started_at,
+            "pid": os.getpid(),
+            "components": components,
+        }
+
+    def _write_status(self) -> None:
+        if self.status_file is None:
+            return
+        try:
+            self.status_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.status_file.with_name(f".{self.status_file.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.status(), f, indent=2)
+            tmp_path.replace(self.status_file)
+        except OSError as e:
+            print(f"Error writing warm-up status: {e}")
+
+
+def _process_running(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def read_status(status_file: Path = WARMUP_STATUS_FILE) -> Optional[Dict[str, Any]]:
+    """
+    Read the status written by a running process.
+
+    Args:
+        status_file (Path): Status file
+
+    Returns:
+        Optional[Dict[str, Any]]: The status, with "live" and "ready" false if its
+            process has exited, or None if there is no readable status file
+    """
+    try:
+        with open(status_file, "r", encoding="utf-8") as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not _process_running(int(status.get("pid", 0))):
+        status["live"] = status["ready"] = False
+    return status
+
+
+def main() -> None:
+    """Command-line entry point for health probes."""
+    parser = argparse.ArgumentParser(description="Report the warm-up status of the running app.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    probe_parser = subparsers.add_parser("probe", help="Exit with status 0 if the check passes, 1 otherwise")
+    check = probe_parser.add_mutually_exclusive_group(required=True)
+    check.add_argument("--ready", action="store_true", help="Every required component is loaded")
+    check.add_argument("--live", action="store_true", help="The app is running and nothing required failed")
+    for subparser in (probe_parser, subparsers.add_parser("status", help="Print the status")):
+        subparser.add_argument("--status-file", type=Path, default=WARMUP_STATUS_FILE, help="Status file")
+    args = parser.parse_args()
+
+    status = read_status(args.status_file)
+    if args.command == "status":
+        print(json.dumps(status, indent=2) if status else f"No warm-up status at {args.status_file}")
+        return
+    sys.exit(0 if status and status["ready" if args.ready else "live"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import json
+
+from src.utils.bm25 import BM25Index, load_or_build_bm25, reciprocal_rank_fusion, tokenize
+
+TEXTS = {
+    "e471": "E471 | Mono- and diglycerides of fatty acids | Emulsifier | Doubtful",
+    "e120": "E120 | Cochineal | Colour | Non-Halal",
+    "gelatin": "Gelatin from pork skin is not halal; gelatin from halal-slaughtered cattle is halal",
+    "muis": "MUIS issues halal certificates for products sold in Singapore",
+}
+
+
+def write_docstore(persist_dir, texts):
+    persist_dir.mkdir(exist_ok=True)
+    nodes = {
+        node_id: {"__data__": {"text": text, "hash": str(hash(text))}} for node_id, text in texts.items()
+    }
+    (persist_dir / "docstore.json").write_text(json.dumps({"docstore/data": nodes}), encoding="utf-8")
+
+
+def test_e_numbers_are_indexed_with_and_without_prefix():
+    assert tokenize("Is E471 (mono-glycerides) halal?") == ["e471", "471", "mono", "glycerides", "halal"]
+    assert tokenize("e150(a-d) and INS 322") == ["e150", "150", "ins", "e322", "322"]
+
+
+def test_exact_e_number_ranks_first():
+    index = BM25Index().build(TEXTS)
+    assert index.search("Is E471 halal?")[0][0] == "e471"
+    assert index.search("what is 120")[0][0] == "e120"
+    assert [node_id for node_id, _ in index.search("gelatin")] == ["gelatin"]
+    assert index.search("curcumin") == []
+
+
+def test_rrf_prefers_nodes_both_retrievers_found():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "d"]], k=60)
+    assert [node_id for node_id, _ in fused] == ["b", "a", "d", "c"]
+    assert fused[0][1] == 1 / 62 + 1 / 61
+
+
+def test_index_is_rebuilt_only_when_the_docstore_changes(tmp_path):
+    persist_dir, index_path = tmp_path / "storage", tmp_path / "bm25_index.json"
+    write_docstore(persist_dir, TEXTS)
+    built = load_or_build_bm25(persist_dir, index_path)
+    assert index_path.exists()
+
+    loaded = load_or_build_bm25(persist_dir, index_path)
+    assert loaded.fingerprint == built.fingerprint
+    assert loaded.search("E471") == built.search("E471")
+
+    write_docstore(persist_dir, dict(TEXTS, curcumin="E100 | Curcumin | Colour | Halal"))
+    assert load_or_build_bm25(persist_dir, index_path).search("curcumin")[0][0] == "curcumin"
+    assert BM25Index.load(index_path).fingerprint != built.fingerprint
@@ -0,0 +1,125 @@
+import pytest
+
+from src.utils import analysis, call_planner
+from src.utils.analysis import analyze_ingredients_text, explain_deferred
+from src.utils.call_planner import (
+    DECIDED, DETAIL_FULL, DETAIL_VERDICT, NEEDED, NO_API, NO_UNKNOWNS, VERDICT_ONLY, CallPlanStats, plan_calls
+)
+
+LOOKUP = {"sugar": "Halal", "salt": "Halal", "gelatin": "Non-Halal"}
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    fresh = CallPlanStats()
+    monkeypatch.setattr(call_planner, "call_stats", fresh)
+    monkeypatch.setattr(analysis, "call_stats", fresh)
+    return fresh
+
+
+@pytest.fixture
+def openai_calls(monkeypatch):
+    calls = []
+
+    def query(ingredients, api_key, endpoint, priority):
+        calls.append(list(ingredients))
+        return f"explained {', '.join(ingredients)}"
+
+    monkeypatch.setattr(analysis, "query_openai_about_ingredients", query)
+    return calls
+
+
+@pytest.mark.parametrize("status, unknowns, detail, api, reason", [
+    ("Halal", [], DETAIL_FULL, True, NO_UNKNOWNS),
+    ("Doubtful", ["x"], DETAIL_VERDICT, True, VERDICT_ONLY),
+    ("Doubtful", ["x"], DETAIL_FULL, False, NO_API),
+    ("Non-Halal", ["x"], DETAIL_FULL, True, DECIDED),
+    ("Doubtful", ["x"], DETAIL_FULL, True, NEEDED),
+])
+def test_plan_reasons(stats, status, unknowns, detail, api, reason):
+    plan = plan_calls(status, unknowns, detail, api_available=api)
+    assert plan.reason == reason
+    assert plan.explain_unknowns == (reason == NEEDED)
+    assert plan.deferred == (reason == DECIDED)
+    assert stats.stats()["plans_by_reason"] == {reason: 1}
+
+
+def test_unknown_detail_level_is_rejected(stats):
+    with pytest.raises(ValueError):
+        plan_calls("Doubtful", ["x"], "everything")
+
+
+def test_unrecorded_plan_is_not_counted(stats):
+    plan_calls("Doubtful", ["x"], record=False)
+    assert stats.stats()["analyses"] == 0
+
+
+def test_stats_count_made_and_avoided_calls(stats):
+    for status in ("Doubtful", "Non-Halal", "Non-Halal", "Non-Halal"):
+        plan_calls(status, ["x"])
+    stats.record_deferred_call()
+    summary = stats.stats()
+    assert (summary["calls_made"], summary["calls_avoided"]) == (2, 2)
+    assert summary["avoided_fraction"] == 0.5
+
+
+def test_open_verdict_explains_unknowns(stats, openai_calls):
+    results = analyze_ingredients_text("sugar, yeast extract", LOOKUP, "key", "http://openai")
+    assert results["product_status"] == "Doubtful"
+    assert openai_calls == [["yeast extract"]]
+    assert results["call_plan"] == {"explain_unknowns": True, "reason": NEEDED}
+    assert results["deferred_unknowns"] == []
+
+
+def test_decided_product_defers_until_explain_deferred(stats, openai_calls):
+    results = analyze_ingredients_text("gelatin, yeast extract", LOOKUP, "key", "http://openai")
+    assert results["product_status"] == "Non-Halal"
+    assert results["call_plan"]["reason"] == DECIDED
+    assert results["deferred_unknowns"] == ["yeast extract"]
+    assert openai_calls == []
+
+    explain_deferred(results, "key", "http://openai")
+    assert results["halal_status_response"] == "explained yeast extract"
+    assert results["deferred_unknowns"] == []
+    # Already explained: asking again makes no call
+    explain_deferred(results, "key", "http://openai")
+    assert openai_calls == [["yeast extract"]]
+    assert stats.stats()["deferred_made_on_request"] == 1
+
+
+def test_verdict_only_never_calls_openai(stats, openai_calls):
+    results = analyze_ingredients_text("sugar, yeast extract", LOOKUP, "key", "http://openai", detail=DETAIL_VERDICT)
+    assert results["call_plan"]["reason"] == VERDICT_ONLY
+    assert results["deferred_unknowns"] == []
+    assert openai_calls == []
+
+
+def test_reused_history_result_is_planned_and_counted(stats, openai_calls):
+    previous = {
+        "ingredients_text": "gelatin, yeast extract",
+        "product_status": "Non-Halal",
+        "unknown_ingredients": ["yeast extract"],
+        "halal_status_response": None,
+    }
+    results = analyze_ingredients_text(
+        "gelatin, yeast extract", LOOKUP, "key", "http://openai", previous_lookup=lambda text: dict(previous)
+    )
+    assert results["call_plan"]["reason"] == DECIDED
+    assert results["deferred_unknowns"] == ["yeast extract"]
+    assert openai_calls == []
+    assert stats.stats()["plans_by_reason"] == {DECIDED: 1}
+
+
+def test_unexplained_open_history_result_is_analysed_again(stats, openai_calls):
+    previous = {
+        "ingredients_text": "sugar, yeast extract",
+        "product_status": "Doubtful",
+        "unknown_ingredients": ["yeast extract"],
+        "halal_status_response": None,
+    }
+    results = analyze_ingredients_text(
+        "sugar, yeast extract", LOOKUP, "key", "http://openai", previous_lookup=lambda text: dict(previous)
+    )
+    assert results["halal_status_response"] == "explained yeast extract"
+    # Planned once, by the fresh analysis
+    assert stats.stats()["plans_by_reason"] == {NEEDED: 1}
@@ -0,0 +1,73 @@
+import pytest
+
+from src.utils.chat_memory import SummarizingMemory, adds_context, looks_standalone
+
+
+@pytest.mark.parametrize("question", [
+    "What is the Halal status of Dicalcium Ferrocyanide (ingredient 540)?",
+    "Is gelatin halal?",
+])
+def test_questions_naming_their_subject_are_standalone(question):
+    assert looks_standalone(question)
+
+
+@pytest.mark.parametrize("question", [
+    "Is it halal?",
+    "What about E472?",
+    "and gelatin?",
+    "Are those from pork?",
+    "halal?",
+])
+def test_follow_ups_are_not_standalone(question):
+    assert not looks_standalone(question)
+
+
+def test_adds_context_only_for_new_terms():
+    assert adds_context("Is E471 from pork?", "Is it from pork?")
+    assert not adds_context("Is gelatin halal?", "is gelatin halal")
+
+
+def turn(number):
+    return (f"Is ingredient {number} halal?", f"Ingredient {number} is listed as doubtful in the knowledge base.")
+
+
+def test_old_turns_are_folded_into_one_summary():
+    prompts = []
+
+    def summarize(prompt):
+        prompts.append(prompt)
+        return f"summary {len(prompts)}"
+
+    memory = SummarizingMemory(summarize, token_limit=60)
+    for number in range(5):
+        memory.add_turn(*turn(number))
+    assert memory.needs_folding()
+    assert memory.fold() is True
+    assert len(prompts) == 1
+    assert "(none)" in prompts[0] and "Is ingredient 0 halal?" in prompts[0]
+    # Folded down to half the budget, always keeping the latest turn verbatim
+    assert memory.turns == [turn(4)]
+    assert len(memory) == 5
+    assert memory.stats()["summarised_turns"] == 4
+    assert memory.history_text().startswith("Summary of the earlier conversation: summary 1\nHuman: ")
+    assert memory.fold() is False
+
+
+def test_next_fold_builds_on_the_previous_summary():
+    prompts = []
+    memory = SummarizingMemory(lambda prompt: prompts.append(prompt) or "E471 is doubtful", token_limit=60)
+    for number in range(10):
+        memory.add_turn(*turn(number))
+        memory.fold()
+    assert len(prompts) > 1
+    assert "Previous summary:\nE471 is doubtful" in prompts[-1]
+    assert len(memory) == 10
+
+
+def test_unfolded_turns_are_capped_without_summarising():
+    memory = SummarizingMemory(lambda prompt: pytest.fail("should not summarise"), token_limit=20)
+    for number in range(20):
+        memory.add_turn(*turn(number))
+    assert memory.turns_tokens() <= 80
+    assert memory.turns[-1] == turn(19)
+    assert memory.summary == ""
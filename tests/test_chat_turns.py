@@ -0,0 +1,49 @@
+from src.utils.chat_turns import DONE, FAILED, PENDING, ChatTurnLog
+
+
+def test_submit_ignores_empty_questions():
+    log = ChatTurnLog()
+    assert log.submit("   ") is None
+    assert len(log) == 0
+
+
+def test_duplicate_of_pending_question_is_not_added():
+    log = ChatTurnLog()
+    first = log.submit("Is E471 halal?")
+    # Same question after whitespace and case normalisation, e.g. Enter pressed twice
+    assert log.submit("  is  e471 HALAL? ") == first
+    assert len(log) == 1
+    assert log.duplicates_ignored == 1
+
+
+def test_question_asked_again_after_its_answer_is_a_new_turn():
+    log = ChatTurnLog()
+    first = log.submit("Is E471 halal?")
+    log.complete(first, "It depends on the source.", ["note", ""])
+    second = log.submit("Is E471 halal?")
+    assert second != first
+    assert [turn["status"] for turn in log] == [DONE, PENDING]
+    assert next(iter(log))["notes"] == ["note"]
+
+
+def test_finished_turn_is_executed_once():
+    log = ChatTurnLog()
+    turn_id = log.submit("Is gelatin halal?")
+    log.fail(turn_id, "Error")
+    log.complete(turn_id, "Only if it is from a halal source.")
+    turn = next(iter(log))
+    assert turn["status"] == FAILED
+    assert turn["answer"] == "Error"
+    assert log.executed == 1
+    assert log.pending() == []
+
+
+def test_trim_drops_oldest_finished_turns_and_keeps_pending_ones():
+    log = ChatTurnLog(limit=2)
+    first = log.submit("one?")
+    log.submit("two?")
+    log.submit("three?")
+    # Nothing finished yet, so nothing can be dropped
+    assert len(log) == 3
+    log.complete(first, "1")
+    assert [turn["question"] for turn in log] == ["two?", "three?"]
@@ -0,0 +1,48 @@
+from src.utils.context_packer import ContextPacker, format_pack_report, split_sentences
+from src.utils.tokens import count_tokens
+
+E471 = "E471 is an emulsifier. It is doubtful unless the fat source is declared. It is used in bread."
+E120 = "E120 is cochineal. It is made from insects and is not halal."
+
+
+def test_each_line_is_its_own_sentence():
+    assert split_sentences("E471 | Doubtful\nE120 | Non-Halal. Made from insects!  Red.") == [
+        "E471 | Doubtful", "E120 | Non-Halal.", "Made from insects!", "Red.",
+    ]
+
+
+def test_duplicate_passages_are_dropped():
+    packer = ContextPacker(1000)
+    packed, report = packer.pack("Is E471 halal?", [("a", E471), ("b", E471 + " "), ("c", E120)])
+    assert [passage_id for passage_id, _ in packed] == ["a", "c"]
+    assert report["duplicates_dropped"] == 1
+
+
+def test_most_relevant_sentences_are_kept_within_the_budget():
+    question = "Is the fat source of E471 declared?"
+    packer = ContextPacker(1000, template_tokens=0, response_tokens=0)
+    budget = count_tokens(question) + count_tokens("It is doubtful unless the fat source is declared.") + 1
+    packer.context_window = budget
+    packed, report = packer.pack(question, [("a", E471), ("c", E120)])
+    assert packed == [("a", "It is doubtful unless the fat source is declared.")]
+    assert report["context_tokens"] <= report["allocation"]["context"]
+    assert report["sentences_dropped"] == 4
+
+
+def test_kept_sentences_stay_in_passage_order():
+    packer = ContextPacker(1000)
+    packed, _ = packer.pack("Is cochineal from insects?", [("c", E120)])
+    assert packed == [("c", "E120 is cochineal.\nIt is made from insects and is not halal.")]
+
+
+def test_long_questions_are_cut_to_their_cap():
+    packer = ContextPacker(1000, max_question_tokens=10)
+    question = "Is " + " and ".join(f"E{code}" for code in range(400, 420)) + " halal?"
+    fitted, cut = packer.fit_question(question)
+    assert question.startswith(fitted)
+    assert count_tokens(fitted) <= 10
+    assert cut == count_tokens(question) - count_tokens(fitted)
+    assert packer.fit_question("Is E471 halal?") == ("Is E471 halal?", 0)
+
+    _, report = packer.pack(fitted, [("a", E471)], question_tokens_cut=cut)
+    assert format_pack_report(report).endswith(f"; question cut by {cut} tokens")
@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+from src.utils.analysis import analyze_ingredients_text
+from src.utils.history_store import HistoryStore
+from src.utils.results_sink import analysis_record
+
+LOOKUP = {"sugar": "Halal", "e471": "Doubtful"}
+LABEL = "sugar, emulsifier (e471), chocolate (cocoa, zzqflavour)"
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(tmp_path / "history.db", flush_interval=0.01)
+    yield store
+    store.close()
+
+
+def record(store, ingredients_text, product_name="", kb_version="v1"):
+    results = analyze_ingredients_text(ingredients_text, LOOKUP)
+    store.record(analysis_record(dict(results, kb_version=kb_version), product_name=product_name))
+    store.flush()
+    return results
+
+
+def test_e_numbers_inside_compound_ingredients_are_indexed(store):
+    record(store, LABEL, product_name="Biscuits")
+    for query in ("E471", "471", "emulsifier", "chocolate", "cocoa"):
+        assert [row["product_name"] for row in store.products_with_ingredient(query)] == ["Biscuits"]
+    assert store.products_with_ingredient("gelatin") == []
+
+
+def test_unknowns_come_from_the_analysis(store):
+    record(store, LABEL)
+    record(store, "zzqflavour, sugar")
+    assert store.top_unknown_ingredients() == [
+        {"ingredient": "zzqflavour", "count": 2},
+        {"ingredient": "cocoa", "count": 1},
+    ]
+
+
+def test_find_previous_returns_the_stored_analysis(store):
+    results = record(store, LABEL)
+    previous = store.find_previous(" Sugar,  emulsifier (E471), chocolate (cocoa, zzqflavour)", "v1")
+    assert previous["ingredients_list"] == results["ingredients_list"]
+    assert previous["ingredient_statuses"] == results["ingredient_statuses"]
+    assert previous["unknown_ingredients"] == ["cocoa", "zzqflavour"]
+    assert previous["product_status"] == "Non-Halal"
+    assert store.find_previous(LABEL, "v2") is None
+
+
+def test_databases_without_sub_ingredient_rows_are_upgraded(tmp_path):
+    path = tmp_path / "history.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE analysis_ingredients (analysis_id INTEGER NOT NULL, position INTEGER NOT NULL, "
+            "ingredient TEXT NOT NULL, name TEXT NOT NULL, status TEXT NOT NULL, is_unknown INTEGER NOT NULL, "
+            "PRIMARY KEY (analysis_id, position)) WITHOUT ROWID"
+        )
+    store = HistoryStore(path, flush_interval=0.01)
+    try:
+        record(store, LABEL, product_name="Biscuits")
+        assert store.products_with_ingredient("E471")
+    finally:
+        store.close()
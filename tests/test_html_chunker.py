@@ -0,0 +1,55 @@
+import pytest
+
+from src.utils.html_chunker import ROW_HEADER, chunk_html, dedupe_chunks, extract_compact_lines, normalise_status
+
+PAGE = """<html><head><style>.x {}</style><script>var menu = 1;</script></head><body>
+<div class="navbar"><a>Home</a><ul><li>Menu item</li></ul></div>
+<h1>E-numbers</h1>
+<table>
+<tr><th>Code</th><th>Name</th><th>Type</th><th>Status</th></tr>
+<tr><td>E471</td><td>Mono- and diglycerides</td><td>Emulsifier</td><td>Mushbooh, Halal if from plant fat</td></tr>
+<tr><td>e120</td><td>Cochineal</td><td>Colour</td><td>Haram</td></tr>
+</table>
+<h3>e100 - Halal</h3><p>Curcumin</p><p>Colour: from turmeric</p>
+<p>Read the label&nbsp;carefully.</p>
+<footer>Copyright</footer>
+</body></html>"""
+
+
+def test_tables_and_cards_become_compact_rows():
+    rows, prose = extract_compact_lines(PAGE)
+    assert rows == [
+        "E471 | Mono- and diglycerides | Emulsifier | Doubtful | note: Mushbooh, Halal if from plant fat",
+        "E120 | Cochineal | Colour | Non-Halal",
+        "E100 | Curcumin | Colour | Halal | note: from turmeric",
+    ]
+    # Scripts, styles, menus and footers are dropped
+    assert prose == ["E-numbers", "Code | Name | Type | Status", "Read the label carefully."]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Halal", ("Halal", "")),
+    ("Haram.", ("Non-Halal", "")),
+    ("Mushbooh, Halal if obtained from plant fat", ("Doubtful", "Mushbooh, Halal if obtained from plant fat")),
+    ("Not stated", ("Unknown", "Not stated")),
+])
+def test_normalise_status(text, expected):
+    assert normalise_status(text) == expected
+
+
+def test_rows_are_packed_under_a_repeated_header():
+    (single,) = [chunk for chunk in chunk_html(PAGE, "enumbers.html", max_tokens=1000) if ROW_HEADER in chunk]
+    assert single.split("\n")[:2] == ["enumbers", ROW_HEADER]
+    assert len(single.split("\n")) == 5
+
+    # A budget too small for two rows gives one row per chunk, each with the header
+    row_chunks = [chunk for chunk in chunk_html(PAGE, "enumbers.html", max_tokens=40) if ROW_HEADER in chunk]
+    assert [chunk.split("\n")[2].split(" | ")[0] for chunk in row_chunks] == ["E471", "E120", "E100"]
+    assert all(chunk.startswith(f"enumbers\n{ROW_HEADER}\n") for chunk in row_chunks)
+
+
+def test_near_identical_chunks_are_dropped():
+    banner = "Halal certification is issued by MUIS for products sold in Singapore"
+    kept, dropped = dedupe_chunks([banner, banner + ".", "E471 | Mono- and diglycerides | Emulsifier | Doubtful"])
+    assert kept == [banner, "E471 | Mono- and diglycerides | Emulsifier | Doubtful"]
+    assert dropped == 1
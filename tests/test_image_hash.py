@@ -0,0 +1,67 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from src.utils.image_hash import NearDuplicateIndex, image_hashes, similarity
+
+MODEL = "gpt-4o"
+
+
+def label(flavouring, image_format="PNG", quality=95):
+    image = Image.new("L", (800, 600), 255)
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=28)
+    except TypeError:  # Pillow < 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    lines = [
+        "INGREDIENTS: sugar, wheat flour, palm oil,",
+        "cocoa butter, skimmed milk powder,",
+        "emulsifier (soy lecithin), salt,",
+        f"flavouring ({flavouring}), raising agent",
+        "(sodium bicarbonate), glucose syrup.",
+    ]
+    for row, line in enumerate(lines):
+        draw.text((30, 40 + row * 60), line, fill=0, font=font)
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def index():
+    index = NearDuplicateIndex()
+    index.add(image_hashes(label("vanillin")), MODEL, "sugar, flavouring (vanillin)")
+    return index
+
+
+def test_labels_differing_by_one_word_are_not_reused(index):
+    hashes = image_hashes(label("alcohol"))
+    # The hashes cannot tell the two labels apart...
+    assert similarity(hashes, index._entries[0]["hashes"]) >= index.min_similarity
+    # ...so similarity alone never reuses an extraction
+    assert index.lookup(hashes, MODEL) is None
+    assert index.lookup(hashes, MODEL, verify=lambda text: "alcohol" in text) is None
+    assert index.stats() == {"entries": 1, "hits": 0, "misses": 2, "unconfirmed": 2}
+
+
+def test_identical_photo_is_reused(index):
+    match = index.lookup(image_hashes(label("vanillin")), MODEL)
+    assert match["ingredients_text"] == "sugar, flavouring (vanillin)"
+    assert match["confirmed_by"] == "content_hash"
+    assert index.lookup(image_hashes(label("vanillin")), "another-model") is None
+
+
+def test_near_identical_photo_is_reused_once_verified(index):
+    recompressed = image_hashes(label("vanillin", image_format="JPEG", quality=70))
+    assert index.lookup(recompressed, MODEL) is None
+    match = index.lookup(recompressed, MODEL, verify=lambda text: "vanillin" in text)
+    assert match["confirmed_by"] == "verified"
+    assert match["similarity"] >= index.min_similarity
+
+
+def test_persisted_entries_keep_their_content_hash(tmp_path):
+    path = tmp_path / "image_index.jsonl"
+    NearDuplicateIndex(path).add(image_hashes(label("vanillin")), MODEL, "sugar, flavouring (vanillin)")
+    assert NearDuplicateIndex(path).lookup(image_hashes(label("vanillin")), MODEL)["confirmed_by"] == "content_hash"
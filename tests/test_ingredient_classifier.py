@@ -0,0 +1,99 @@
+import sqlite3
+
+import pytest
+
+from src.utils.ingredient_classifier import (
+    IngredientClassifier, dataset_examples, features, file_verdicts, history_verdicts, train
+)
+
+EXAMPLES = (
+    [(f"{plant} lecithin", "Halal") for plant in ("soy", "soya", "rapeseed", "canola", "corn")]
+    + [(f"{plant} starch", "Halal") for plant in ("tapioca", "potato", "corn", "rice", "wheat")]
+    + [(f"pork {part}", "Non-Halal") for part in ("gelatin", "fat", "lard", "rind", "extract")]
+    + [(f"{drink} wine", "Non-Halal") for drink in ("red", "white", "rice", "cooking", "sweet")]
+    + [(f"{kind} glycerides", "Doubtful") for kind in ("mono", "di", "mixed", "fatty", "acetic")]
+    + [(f"{kind} emulsifier", "Doubtful") for kind in ("animal", "mixed", "unspecified", "fatty", "blend")]
+)
+
+
+@pytest.fixture(scope="module")
+def model():
+    return train(EXAMPLES, dataset_version="v1", min_confidence=0.6)
+
+
+def test_features_favour_the_head_noun():
+    vector = features("Sunflower Lecithin")
+    assert vector["l:lecithin"] > vector["w:lecithin"] > 0
+    assert "c:<su" in vector and "l:sunflower" not in vector
+    assert sum(value * value for value in vector.values()) == pytest.approx(1.0)
+    assert features("123") == {}
+
+
+def test_unseen_variants_follow_their_head_noun(model):
+    assert model.predict("sunflower lecithin")[0] == "Halal"
+    assert model.predict("pea starch")[0] == "Halal"
+    assert model.predict("rose wine")[0] == "Non-Halal"
+    assert sum(model.predict_proba("pea starch").values()) == pytest.approx(1.0)
+    assert model.metadata["examples"] == len(EXAMPLES)
+    assert model.metadata["evaluation"]["examples"] > 0
+
+
+def test_triage_never_predicts_e_numbers(model):
+    predicted, escalate = model.triage(["sunflower lecithin", "E471", "xyz"], min_confidence=0.9)
+    assert [item["ingredient"] for item in predicted] == ["sunflower lecithin"]
+    assert escalate == ["E471", "xyz"]
+    assert model.triage(["sunflower lecithin"], min_confidence=1.01) == ([], ["sunflower lecithin"])
+
+
+def test_calibration_sharpens_or_softens_the_scores(model):
+    calibrated = IngredientClassifier(model.weights, model.bias, temperature=1.0)
+    assert calibrated.calibrate(EXAMPLES) == calibrated.temperature
+    assert 0.25 <= calibrated.temperature <= 5.0
+
+
+def test_saved_model_round_trips(model, tmp_path):
+    path = tmp_path / "models" / "ingredient_classifier.json"
+    versioned = model.save(path)
+    assert versioned.name == f"ingredient_classifier-{model.version}.json"
+    loaded = IngredientClassifier.load(path)
+    assert loaded.version == model.version
+    assert loaded.predict_proba("rose wine") == model.predict_proba("rose wine")
+
+    path.write_text('{"format": 0}', encoding="utf-8")
+    with pytest.raises(ValueError):
+        IngredientClassifier.load(path)
+
+
+def test_dataset_examples_use_chemical_names(tmp_path):
+    path = tmp_path / "ingredients.csv"
+    path.write_text(
+        "ingred_name,chem_name,description,halal_non_halal_doubtful\n"
+        "E120,Cochineal / Carminic acid (C.I. 75470),,1\n"
+        "Soy Lecithin,,,0\n"
+        "water,,,\n",
+        encoding="utf-8",
+    )
+    assert dataset_examples(path) == [("cochineal", "Non-Halal"), ("carminic acid", "Non-Halal"), ("soy lecithin", "Halal")]
+
+
+def test_reviewed_verdicts_need_a_valid_status(tmp_path):
+    path = tmp_path / "verdicts.csv"
+    path.write_text("ingredient,status\nRose  Wine,Non-Halal\npea starch,0\nmystery,maybe\n", encoding="utf-8")
+    assert file_verdicts(path) == [("rose wine", "Non-Halal"), ("pea starch", "Halal")]
+
+
+def test_history_verdicts_come_from_single_unknown_answers(tmp_path):
+    db_path = tmp_path / "history.db"
+    with sqlite3.connect(str(db_path)) as connection:
+        connection.executescript("""
+            CREATE TABLE analyses (id INTEGER PRIMARY KEY, recorded_at TEXT, halal_status_response TEXT);
+            CREATE TABLE analysis_ingredients (analysis_id INTEGER, ingredient TEXT, is_unknown INTEGER);
+            INSERT INTO analyses VALUES (1, '2024-01-01', 'Carmine is not halal as it comes from insects.');
+            INSERT INTO analysis_ingredients VALUES (1, 'carmine', 1), (1, 'sugar', 0);
+            INSERT INTO analyses VALUES (2, '2024-01-02', 'Both are halal.');
+            INSERT INTO analysis_ingredients VALUES (2, 'agar', 1), (2, 'pectin', 1);
+            INSERT INTO analyses VALUES (3, '2024-01-03', 'Shellac is generally considered halal.');
+            INSERT INTO analysis_ingredients VALUES (3, 'shellac', 1);
+        """)
+    assert history_verdicts(db_path) == [("carmine", "Non-Halal"), ("shellac", "Halal")]
+    assert history_verdicts(tmp_path / "missing.db") == []
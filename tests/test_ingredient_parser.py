@@ -0,0 +1,79 @@
+from src.utils.ingredient_parser import (
+    check_halal_status, classify_ingredient_tree, parse_ingredient_tree, parse_ingredients, product_status
+)
+
+
+def outline(nodes):
+    return [(node.text, node.name, outline(node.children)) for node in nodes]
+
+
+def test_flat_list():
+    assert parse_ingredients("Ingredients: Sugar, Wheat Flour; Salt.") == ["sugar", "wheat flour", "salt"]
+
+
+def test_nested_brackets_stay_one_entry():
+    tree = parse_ingredient_tree("chocolate (sugar, cocoa butter, emulsifier (e322)), salt")
+    assert outline(tree) == [
+        ("chocolate (sugar, cocoa butter, emulsifier (e322))", "chocolate", [
+            ("sugar", "sugar", []),
+            ("cocoa butter", "cocoa butter", []),
+            ("emulsifier (e322)", "emulsifier", [("e322", "e322", [])]),
+        ]),
+        ("salt", "salt", []),
+    ]
+
+
+def test_square_brackets_nest_like_round_ones():
+    tree = parse_ingredient_tree("flour [wheat, barley], salt")
+    assert outline(tree) == [
+        ("flour (wheat, barley)", "flour", [("wheat", "wheat", []), ("barley", "barley", [])]),
+        ("salt", "salt", []),
+    ]
+
+
+def test_deep_nesting():
+    tree = parse_ingredient_tree("a (b (c (d)))")
+    assert [node.text for node in tree[0].walk()] == ["a (b (c (d)))", "b (c (d))", "c (d)", "d"]
+
+
+def test_unclosed_bracket_ends_with_the_text():
+    assert outline(parse_ingredient_tree("a (b, c")) == [
+        ("a (b, c", "a", [("b", "b", []), ("c", "c", [])]),
+    ]
+
+
+def test_stray_closing_bracket_is_ignored():
+    assert outline(parse_ingredient_tree("a), b")) == [("a)", "a", []), ("b", "b", [])]
+
+
+def test_compound_takes_most_severe_status_of_its_parts():
+    tree = parse_ingredient_tree("chocolate (sugar, emulsifier (e471)), salt")
+    lookup = {"sugar": "Halal", "e471": "Doubtful", "salt": "Halal"}
+    status, unknown, statuses = classify_ingredient_tree(tree, lookup)
+    # "chocolate" and "emulsifier" aren't in the table but their parts are
+    assert unknown == []
+    assert statuses == {"chocolate (sugar, emulsifier (e471))": "Doubtful", "salt": "Halal"}
+    assert status == "Non-Halal"
+
+
+def test_bare_e_numbers_match_either_dataset_spelling():
+    tree = parse_ingredient_tree("e296, ins 322, 100")
+    status, unknown, _ = classify_ingredient_tree(tree, {"296": "Halal", "e322": "Halal"})
+    assert unknown == ["100"]
+    assert status == "Doubtful"
+
+
+def test_decisive_ingredient_decides_regardless_of_later_unknowns():
+    assert product_status(["Halal", "Non-Halal", "Unknown"]) == "Non-Halal"
+    assert product_status(["Unknown", "Doubtful"]) == "Non-Halal"
+    assert product_status(["Halal", "Unknown"]) == "Doubtful"
+    assert product_status([]) == "Halal"
+
+
+def test_scan_stops_at_decisive_ingredient_only_when_asked():
+    lookup = {"sugar": "Halal", "gelatin": "Non-Halal"}
+    ingredients = ["yeast extract", "sugar", "gelatin", "rice starch"]
+    assert check_halal_status(ingredients, lookup) == ("Non-Halal", ["yeast extract", "rice starch"])
+    assert check_halal_status(ingredients, lookup, stop_at_decisive=True) == ("Non-Halal", ["yeast extract"])
+    # Without a decisive ingredient both scans cover every ingredient
+    assert check_halal_status(["sugar", "rice starch"], lookup, stop_at_decisive=True) == ("Doubtful", ["rice starch"])
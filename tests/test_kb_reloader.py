@@ -0,0 +1,72 @@
+import logging
+import os
+
+import pytest
+
+from src.utils import kb_snapshot
+from src.utils.kb_reloader import KnowledgeBaseReloader
+from src.utils.kb_snapshot import compile_snapshot, snapshot_path_for
+from src.utils.knowledge_base import dataset_version
+
+HEADER = "ingred_name,chem_name,description,halal_non_halal_doubtful\n"
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    monkeypatch.setattr(kb_snapshot, "KB_SNAPSHOT_DIR", tmp_path / "snapshots")
+    path = tmp_path / "ingredients.csv"
+    path.write_text(HEADER + "gelatin,,,1\n", encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def reloader(dataset):
+    return KnowledgeBaseReloader(str(dataset), interval=0)
+
+
+def test_change_is_loaded_once_the_file_stops_changing(reloader, dataset):
+    first = reloader.current()
+    dataset.write_text(HEADER + "gelatin,,,1\ne471,,,2\n", encoding="utf-8")
+    # Still being written as far as the first poll can tell
+    assert reloader.check() is False
+    assert reloader.current() is first
+    assert reloader.check() is True
+    assert reloader.current().version == dataset_version(str(dataset))
+    assert reloader.current().lookup_table["e471"] == "Doubtful"
+    # The request that started before the reload keeps its version
+    assert "e471" not in first.lookup_table
+    assert reloader.stats()["reloads"] == 1
+
+
+def test_touched_file_with_the_same_content_is_not_reloaded(reloader, dataset):
+    first = reloader.current()
+    stat = os.stat(dataset)
+    os.utime(dataset, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert reloader.check() is False
+    assert reloader.check() is False
+    assert reloader.current() is first
+    assert reloader.reloads == 0
+
+
+def test_snapshot_recompiled_elsewhere_is_picked_up(reloader, dataset):
+    first = reloader.current()
+    # e.g. the compile command, or another worker that saw the change first
+    compile_snapshot(dataset, snapshot_path_for(dataset), first.version)
+    assert reloader.check() is True
+    assert reloader.current().generation == first.generation + 1
+    assert reloader.check() is False
+
+
+def test_invalid_dataset_keeps_the_current_version(reloader, dataset, caplog):
+    first = reloader.current()
+    dataset.write_text("name,status\ngelatin,1\n", encoding="utf-8")
+    reloader.check()
+    with caplog.at_level(logging.ERROR, logger="src.utils.kb_reloader"):
+        assert reloader.check() is False
+    assert reloader.current() is first
+    assert "missing columns" in reloader.stats()["last_error"]
+    assert f"keeping version {first.version}" in caplog.text
+    # Not retried until the file changes again
+    caplog.clear()
+    assert reloader.check() is False
+    assert caplog.text == ""
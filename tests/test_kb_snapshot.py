@@ -0,0 +1,96 @@
+import pytest
+
+from src.utils.kb_snapshot import (
+    Snapshot, SnapshotLookupTable, SnapshotRecords, build_snapshot, compile_snapshot, map_snapshot, read_header
+)
+
+HEADER = "ingred_name,chem_name,description,halal_non_halal_doubtful\n"
+
+
+def write_csv(path, rows):
+    # BOM'd header, as exported by Excel
+    path.write_text("﻿" + HEADER + rows, encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    return write_csv(tmp_path / "ingredients.csv", (
+        "E100,Curcumin ,Colouring,0\n"
+        'Gelatin,,"Protein from\n  animal skin",1\n'
+        "e471,Mono- and diglycerides,Emulsifier,2\n"
+        "water,,,\n"
+        "gelatin,,Repeated row,1\n"
+    ))
+
+
+def test_lookup_of_normalised_names(dataset):
+    data, report = build_snapshot(dataset, "v1")
+    snapshot = Snapshot(data)
+    assert report["records"] == 4
+    assert report["duplicates"] == ["gelatin"]
+    assert report["blank_status"] == 1
+    assert snapshot.version == "v1"
+
+    index = snapshot.find("e100")
+    assert snapshot.record(index) == {
+        "name": "e100", "chem_name": "Curcumin", "description": "Colouring", "status": "Halal"
+    }
+    assert snapshot.find("E100") == -1  # Callers look up lower-cased names
+    assert snapshot.find("pork") == -1
+
+
+def test_last_duplicate_wins_and_multiline_fields_are_collapsed(dataset):
+    records = SnapshotRecords(Snapshot(build_snapshot(dataset, "v1")[0]))
+    assert records["gelatin"]["description"] == "Repeated row"
+    assert len(records) == 4
+    assert sorted(records) == ["e100", "e471", "gelatin", "water"]
+
+
+def test_lookup_table_leaves_out_blank_statuses(dataset):
+    table = SnapshotLookupTable(Snapshot(build_snapshot(dataset, "v1")[0]))
+    assert dict(table) == {"e100": "Halal", "e471": "Doubtful", "gelatin": "Non-Halal"}
+    assert "water" not in table
+    assert table.get("water") is None
+    assert 471 not in table
+
+
+def test_every_name_is_found_despite_hash_collisions(tmp_path):
+    names = [f"ingredient {i}" for i in range(500)]
+    path = write_csv(tmp_path / "many.csv", "".join(f"{name},,,0\n" for name in names))
+    snapshot = Snapshot(build_snapshot(path, "v1")[0])
+    assert [snapshot.name(snapshot.find(name)) for name in names] == names
+
+
+def test_invalid_dataset_is_rejected(tmp_path):
+    with pytest.raises(ValueError, match="invalid status"):
+        build_snapshot(write_csv(tmp_path / "bad.csv", "pork,,,3\n"), "v1")
+    missing = tmp_path / "missing.csv"
+    missing.write_text("ingred_name,description\npork,meat\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="missing columns"):
+        build_snapshot(missing, "v1")
+
+
+def test_recompiling_increments_the_generation(dataset, tmp_path):
+    path = tmp_path / "snapshots" / "ingredients.kbsnap"
+    compile_snapshot(dataset, path, "v1")
+    compile_snapshot(dataset, path, "v2")
+    header = read_header(path)
+    assert (header["version"], header["generation"]) == ("v2", 2)
+
+    snapshot = map_snapshot(path)
+    try:
+        assert snapshot.generation == 2
+        assert SnapshotLookupTable(snapshot)["e471"] == "Doubtful"
+    finally:
+        snapshot.release()
+        snapshot.buffer.close()
+
+
+def test_read_header_rejects_other_files(tmp_path):
+    other = tmp_path / "other.bin"
+    other.write_bytes(b"not a snapshot")
+    assert read_header(other) is None
+    assert read_header(tmp_path / "absent.kbsnap") is None
+    with pytest.raises(ValueError):
+        Snapshot(b"HKBS")
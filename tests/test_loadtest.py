@@ -0,0 +1,131 @@
+import asyncio
+import json
+import random
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from loadtest import pipeline
+from loadtest.http_service import SAMPLE_LABELS, percentile, run_load
+from loadtest.stub_openai import Latency, StubProfile, create_stub_app, parse_latency
+from src.api import service
+from src.utils.knowledge_base import KnowledgeBase
+
+INSTANT = StubProfile(vision_latency=Latency(0, 0), text_latency=Latency(0, 0))
+VISION = {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,AAAA"}}
+
+
+def stub_calls(profile, payloads):
+    """Post each payload to a fresh stub; return [(status, headers, body)] and its /stats."""
+    async def run():
+        async with TestClient(TestServer(create_stub_app(profile))) as client:
+            results = []
+            for payload in payloads:
+                response = await client.post("/v1/chat/completions", json=payload)
+                results.append((response.status, response.headers, await response.json()))
+            stats = await (await client.get("/stats")).json()
+            return results, stats
+    return asyncio.run(run())
+
+
+def test_percentile_is_nearest_rank():
+    samples = [float(value) for value in range(1, 101)]
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 99) == 99.0
+    assert percentile([3.0, 1.0, 2.0], 100) == 3.0
+    assert percentile([], 95) == 0.0
+
+
+def test_parse_latency():
+    assert parse_latency("2.5,0.4") == Latency(2.5, 0.4)
+    assert parse_latency("1") == Latency(1.0, 0.0)
+    assert Latency(0, 0.5).sample(random.Random(0)) == 0.0
+
+
+def test_stub_answers_like_the_completions_endpoint():
+    (vision, structured, text), stats = stub_calls(INSTANT, [
+        {"model": "gpt-4o", "messages": [{"role": "user", "content": [VISION]}]},
+        {"model": "gpt-4o", "messages": [{"role": "user", "content": [VISION]}],
+         "response_format": {"type": "json_schema"}},
+        {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "What is e471?"}]},
+    ])
+    assert vision[0] == 200
+    assert vision[2]["choices"][0]["message"]["content"] in SAMPLE_LABELS
+    assert vision[2]["usage"]["total_tokens"] > 100
+    ingredients = json.loads(structured[2]["choices"][0]["message"]["content"])["ingredients"]
+    assert all(set(item) == {"name", "e_code", "sub_ingredients"} for item in ingredients)
+    assert "stub response" in text[2]["choices"][0]["message"]["content"]
+    assert stats == {"vision_ok": 2, "text_ok": 1}
+
+
+def test_stub_rate_limits_and_fails_on_request():
+    message = {"messages": [{"role": "user", "content": "hi"}]}
+    ((status, headers, _),), stats = stub_calls(INSTANT._replace(rate_limit_rate=1.0, retry_after=2.0), [message])
+    assert (status, headers["Retry-After"]) == (429, "2.0")
+    assert stats == {"text_rate_limited": 1}
+    ((status, _, _),), stats = stub_calls(INSTANT._replace(error_rate=1.0), [message])
+    assert status == 500
+    assert stats == {"text_error": 1}
+
+
+def test_http_profile_reports_each_endpoint(monkeypatch):
+    monkeypatch.setattr(service, "WARMUP_ENABLED", False)
+    monkeypatch.setattr(service, "log_result", lambda results, kb, product_name="": None)
+    monkeypatch.setattr(service, "previous_lookup", lambda kb: None)
+    monkeypatch.setattr(service, "local_classifier", lambda: None)
+    records = {
+        name: {"name": name, "chem_name": "", "description": "", "status": "Halal"}
+        for name in ("sugar", "salt", "e471", "e120", "e322")
+    }
+
+    async def run():
+        app = service.create_app(kb=KnowledgeBase(records, "v1"), api_key="", workers=1)
+        async with TestServer(app) as server:
+            base_url = str(server.make_url("")).rstrip("/")
+            return await run_load(base_url, concurrency=2, duration=0.3, mix={"text": 0.0, "enumber": 1.0})
+
+    report = asyncio.run(run())
+    assert set(report["endpoints"]) == {"enumber"}
+    enumber = report["endpoints"]["enumber"]
+    # Unknown codes get a 404, which is not a server error
+    assert enumber["requests"] > 0 and enumber["errors"] == 0
+    assert enumber["p50_ms"] <= enumber["p99_ms"]
+
+
+def test_instrumented_stages_are_timed_and_restored():
+    class Module:
+        @staticmethod
+        def parse_ingredients(text):
+            return text.split(", ")
+
+    timings = {}
+    original = Module.parse_ingredients
+    restore = pipeline._instrument(Module, timings)
+    assert Module.parse_ingredients("sugar, salt") == ["sugar", "salt"]
+    assert len(timings["parse"]) == 1
+    restore()
+    assert Module.parse_ingredients is original
+
+
+def test_worker_results_are_merged():
+    def worker(number, text_totals, errors):
+        return {"worker": number, "sessions": 2, "elapsed_s": 2.0, "cpu_s": 1.0,
+                "timings": {"text_total": text_totals, "parse": [0.001] * len(text_totals)}, "errors": errors}
+
+    report = pipeline.summarise([
+        worker(0, [0.1, 0.2], {"text": {"HTTPError": 1}, "image": {}}),
+        worker(1, [0.3, 0.4], {"text": {"HTTPError": 2}, "image": {}}),
+    ])
+    assert report["sessions"] == 4 and report["processes"] == 2
+    assert report["analyses_per_s"] == 2.0
+    assert report["stages"]["text_total"]["calls"] == 4
+    assert report["stages"]["text_total"]["p50_ms"] == 200.0
+    assert "image_total" not in report["stages"]
+    assert report["errors"]["text"] == {"HTTPError": 3}
+    assert report["workers"][0] == {"worker": 0, "sessions": 2, "cpu_s": 1.0}
+
+
+def test_synthetic_labels_differ():
+    rng = random.Random(0)
+    assert pipeline.synthetic_label(rng) != pipeline.synthetic_label(rng)
+    assert pipeline.synthetic_label(random.Random(1)) == pipeline.synthetic_label(random.Random(1))
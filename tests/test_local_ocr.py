@@ -0,0 +1,90 @@
+import pytest
+
+from src.utils import local_ocr
+from src.utils.local_ocr import locate_ingredients_block, match_rate, read_ingredients_locally, reads_same_ingredients
+
+LOOKUP = {"sugar": "Halal", "wheat flour": "Halal", "palm oil": "Halal", "salt": "Halal", "gelatin": "Doubtful"}
+
+
+def layout(*lines, conf=95):
+    """pytesseract.image_to_data-style dict; each line is (block, text)."""
+    words = {"text": [], "conf": [], "block_num": [], "par_num": [], "line_num": []}
+    for line_num, (block, text) in enumerate(lines, start=1):
+        for word in text.split():
+            words["text"].append(word)
+            words["conf"].append(conf)
+            words["block_num"].append(block)
+            words["par_num"].append(1)
+            words["line_num"].append(line_num)
+    # Tesseract reports layout-only rows with conf -1
+    words["text"].append("")
+    words["conf"].append(-1)
+    for key in ("block_num", "par_num", "line_num"):
+        words[key].append(0)
+    return words
+
+
+@pytest.fixture
+def ocr(monkeypatch):
+    """Serve a canned word layout in place of Tesseract."""
+    monkeypatch.setattr(local_ocr, "tesseract_available", lambda: True)
+    monkeypatch.setattr(local_ocr, "ocr_stats", local_ocr.LocalOcrStats())
+
+    def serve(words):
+        monkeypatch.setattr(local_ocr, "_read_words", lambda image_bytes: words)
+
+    return serve
+
+
+def test_block_runs_from_the_header_to_the_stop_statement():
+    block = locate_ingredients_block(layout(
+        (1, "Crunchy Biscuits"),
+        (2, "INGREDIENTS: sugar, wheat"),
+        (2, "flour, palm oil, sa-"),
+        (2, "lt. Allergens: wheat"),
+    ))
+    assert block == {"text": "sugar, wheat flour, palm oil, salt.", "confidence": 95.0}
+
+
+def test_header_on_its_own_is_followed_by_the_next_block():
+    block = locate_ingredients_block(layout((1, "Ingredients"), (1, ":"), (2, "sugar, salt"), (3, "Best before")))
+    assert block["text"] == "sugar, salt"
+    assert locate_ingredients_block(layout((1, "sugar, salt"))) is None
+
+
+def test_match_rate_counts_sub_ingredients():
+    assert match_rate("sugar, filling (gelatin, e999), salt", LOOKUP) == {"ingredients": 4, "match_rate": 0.75}
+
+
+@pytest.mark.parametrize("lines, conf, outcome", [
+    ([(1, "Ingredients: sugar, wheat flour, palm oil, salt")], 95, local_ocr.SERVED),
+    ([(1, "Ingredients: sugar, salt")], 95, local_ocr.TOO_FEW),
+    ([(1, "Ingredients: sugar, wheat flour, palm oil, salt")], 60, local_ocr.LOW_CONFIDENCE),
+    ([(1, "Ingredients: sugar, e999, e998, salt")], 95, local_ocr.LOW_MATCH_RATE),
+    ([(1, "sugar, wheat flour, palm oil, salt")], 95, local_ocr.NO_HEADER),
+])
+def test_only_trusted_reads_are_served(ocr, lines, conf, outcome):
+    ocr(layout(*lines, conf=conf))
+    result = read_ingredients_locally(b"photo", LOOKUP)
+    assert (result is not None) == (outcome == local_ocr.SERVED)
+    assert local_ocr.ocr_stats.stats()["scans"] == 1
+    if result:
+        assert result == {"ingredients_text": "sugar, wheat flour, palm oil, salt", "confidence": 95.0, "match_rate": 1.0}
+        assert local_ocr.ocr_stats.stats()["served_fraction"] == 1.0
+    else:
+        assert local_ocr.ocr_stats.stats()["fallbacks"] == {outcome: 1}
+
+
+def test_missing_tesseract_falls_back_to_the_vision_model(monkeypatch):
+    monkeypatch.setattr(local_ocr, "tesseract_available", lambda: False)
+    monkeypatch.setattr(local_ocr, "ocr_stats", local_ocr.LocalOcrStats())
+    assert read_ingredients_locally(b"photo", LOOKUP) is None
+    assert local_ocr.ocr_stats.stats()["fallbacks"] == {local_ocr.UNAVAILABLE: 1}
+    assert reads_same_ingredients(b"photo", "sugar, salt") is False
+
+
+def test_same_ingredients_ignore_case_and_spacing(ocr):
+    ocr(layout((1, "INGREDIENTS: Sugar,  Wheat Flour, salt")))
+    assert reads_same_ingredients(b"photo", "sugar, wheat flour, salt")
+    assert not reads_same_ingredients(b"photo", "sugar, wheat flour, alcohol")
+    assert local_ocr.ocr_stats.stats()["scans"] == 0
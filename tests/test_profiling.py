@@ -0,0 +1,68 @@
+import functools
+import time
+from collections import Counter
+
+import pytest
+
+from src.utils import profiling
+from src.utils.profiling import StackSampler, profile_block, profiled
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "profile_block", functools.partial(profile_block, mode="cprofile", out_dir=tmp_path))
+    return tmp_path
+
+
+def test_collapsed_stacks_and_top_functions():
+    sampler = StackSampler(0)
+    sampler.stacks = Counter({"main;analyze;parse": 3, "main;analyze": 1})
+    assert sampler.collapsed() == "main;analyze;parse 3\nmain;analyze 1\n"
+    top = sorted(sampler.top(2), key=lambda row: row["function"])
+    assert top == [
+        {"function": "analyze", "self": 1, "total": 4, "share": 1.0},
+        {"function": "main", "self": 0, "total": 4, "share": 1.0},
+    ]
+    assert sampler.top(3)[2] == {"function": "parse", "self": 3, "total": 3, "share": 0.75}
+
+
+def test_sampling_profile_shows_the_busy_function(tmp_path):
+    with profile_block("busy", mode="sampling", out_dir=tmp_path):
+        busy_loop(0.1)
+    (collapsed,) = tmp_path.glob("*-busy-*.collapsed")
+    assert "busy_loop (test_profiling.py:" in collapsed.read_text(encoding="utf-8")
+    (summary,) = tmp_path.glob("*-busy-*.txt")
+    assert summary.read_text(encoding="utf-8").startswith("busy: ")
+
+
+def test_cprofile_profile_is_written(tmp_path):
+    with profile_block("busy", mode="cprofile", out_dir=tmp_path):
+        busy_loop(0.01)
+    assert len(list(tmp_path.glob("*-busy-*.prof"))) == 1
+    (summary,) = tmp_path.glob("*-busy-*.txt")
+    assert "busy_loop" in summary.read_text(encoding="utf-8")
+
+
+def test_unsampled_function_is_returned_unchanged():
+    assert profiled("analysis", sample_rate=0)(busy_loop) is busy_loop
+
+
+def test_nested_calls_are_part_of_the_outer_profile(profiles):
+    @profiled("inner", sample_rate=1.0)
+    def inner():
+        return "inner"
+
+    @profiled("outer", sample_rate=1.0)
+    def outer():
+        return inner()
+
+    assert outer() == "inner"
+    assert [path.name.split("-")[1] for path in profiles.glob("*.prof")] == ["outer"]
+    assert inner() == "inner"
+    assert len(list(profiles.glob("*-inner-*.prof"))) == 1
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from src.api import openai_handler
+from src.api.rate_limiter import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, OpenAIScheduler, SchedulerTimeout
+
+
+def response(status, body=b"{}", headers=None):
+    result = requests.Response()
+    result.status_code = status
+    result._content = body
+    result.headers.update(headers or {})
+    return result
+
+
+def wait_for_queue(scheduler, depth):
+    deadline = time.monotonic() + 2
+    while scheduler.metrics()["queue_depth"] < depth:
+        assert time.monotonic() < deadline, "request never queued"
+        time.sleep(0.001)
+
+
+def test_interactive_requests_overtake_queued_background_requests():
+    # 1200 requests a minute: one every 50 ms once the bucket is drained
+    scheduler = OpenAIScheduler(1200, 10**6)
+    scheduler.acquire(0, requests=1200)
+    order = []
+
+    def dispatch(priority):
+        scheduler.acquire(0, priority=priority)
+        order.append(priority)
+
+    threads = [threading.Thread(target=dispatch, args=(PRIORITY_BACKGROUND,))]
+    threads[0].start()
+    wait_for_queue(scheduler, 1)
+    threads.append(threading.Thread(target=dispatch, args=(PRIORITY_INTERACTIVE,)))
+    threads[1].start()
+    for thread in threads:
+        thread.join(2)
+    assert order == [PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND]
+    assert scheduler.metrics()["dispatched"] == {"interactive": 2, "background": 1}
+
+
+def test_penalize_pauses_every_caller():
+    scheduler = OpenAIScheduler(1000, 10**6)
+    scheduler.penalize(0.2)
+    assert scheduler.metrics()["rate_limited"] == 1
+    assert scheduler.acquire(10).waited >= 0.15
+    scheduler.penalize(5)
+    with pytest.raises(SchedulerTimeout):
+        scheduler.acquire(10, timeout=0.05)
+    assert scheduler.metrics()["timeouts"] == 1
+
+
+def test_reconcile_corrects_the_estimate_to_the_reported_usage():
+    scheduler = OpenAIScheduler(1000, 60000)
+    ticket = scheduler.acquire(5000)
+    assert scheduler.metrics()["tokens_available"] == pytest.approx(55000, abs=100)
+    scheduler.reconcile(ticket, 1000)
+    assert scheduler.metrics()["tokens_available"] == pytest.approx(59000, abs=100)
+    scheduler.refund(scheduler.acquire(5000))
+    assert scheduler.metrics()["tokens_available"] == pytest.approx(59000, abs=100)
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    fresh = OpenAIScheduler(1000, 60000)
+    monkeypatch.setattr(openai_handler, "get_scheduler", lambda: fresh)
+    return fresh
+
+
+def test_retried_429_attempts_are_refunded(scheduler, monkeypatch):
+    answers = [
+        response(429, headers={"Retry-After": "0"}),
+        response(200, b'{"usage": {"total_tokens": 1000}}'),
+    ]
+    monkeypatch.setattr(openai_handler.requests, "post", lambda *args, **kwargs: answers.pop(0))
+    data = openai_handler.post_chat_completion("https://api.test", {}, {}, estimated_tokens=5000)
+    assert data["usage"]["total_tokens"] == 1000
+    metrics = scheduler.metrics()
+    assert metrics["rate_limited"] == 1
+    # Only the successful attempt's reported usage is charged
+    assert metrics["tokens_available"] == pytest.approx(59000, abs=100)
+
+
+def test_failed_requests_are_refunded(scheduler, monkeypatch):
+    monkeypatch.setattr(openai_handler.requests, "post", lambda *args, **kwargs: response(500))
+    with pytest.raises(requests.exceptions.HTTPError):
+        openai_handler.post_chat_completion("https://api.test", {}, {}, estimated_tokens=5000)
+
+    def unreachable(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("connection refused")
+
+    monkeypatch.setattr(openai_handler.requests, "post", unreachable)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        openai_handler.post_chat_completion("https://api.test", {}, {}, estimated_tokens=5000)
+    assert scheduler.metrics()["tokens_available"] == pytest.approx(60000, abs=100)
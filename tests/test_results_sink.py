@@ -0,0 +1,95 @@
+import csv
+
+import pytest
+
+from src.utils.results_sink import (
+    OPEN_SUFFIX, ResultsSink, analysis_record, compact, export_csv, iter_records, list_segments
+)
+
+
+def record(name):
+    return analysis_record({
+        "ingredients_list": [name, "Sugar"],
+        "ingredient_statuses": {name.lower(): "Doubtful", "sugar": "Halal"},
+        "unknown_ingredients": [],
+        "product_status": "Non-Halal",
+        "ingredients_text": f"{name}, sugar",
+    }, product_name=name)
+
+
+@pytest.fixture
+def sink(tmp_path):
+    sink = ResultsSink(tmp_path, flush_interval=60)
+    yield sink
+    sink.close()
+
+
+def test_round_trip(sink, tmp_path):
+    sink.append(record("E471"))
+    assert list(iter_records(tmp_path)) == []
+    assert sink.flush() == 1
+    assert sink.segment.name.endswith(OPEN_SUFFIX)
+    sink.close()
+
+    assert [path.suffix for path in list_segments(tmp_path)] == [".jsonl"]
+    (stored,) = iter_records(tmp_path)
+    assert stored["product_name"] == "E471"
+    assert stored["statuses"] == ["Doubtful", "Halal"]
+
+
+def test_open_segment_is_only_read_when_asked(sink, tmp_path):
+    sink.append(record("E471"))
+    sink.flush()
+    assert len(list(iter_records(tmp_path))) == 1
+    assert list(iter_records(tmp_path, include_open=False)) == []
+
+
+def test_truncated_last_line_is_skipped(sink, tmp_path):
+    sink.append(record("E471"))
+    sink.close()
+    (segment,) = list_segments(tmp_path)
+    with open(segment, "a", encoding="utf-8") as f:
+        f.write('{"product_name": "cut')
+    assert [stored["product_name"] for stored in iter_records(tmp_path)] == ["E471"]
+
+
+def test_segments_roll_over_by_size(tmp_path):
+    sink = ResultsSink(tmp_path, segment_bytes=1, flush_interval=60)
+    for name in ("E471", "E422", "E120"):
+        sink.append(record(name))
+        sink.flush()
+    sink.close()
+    assert len(list_segments(tmp_path)) == 3
+    assert [stored["product_name"] for stored in iter_records(tmp_path)] == ["E471", "E422", "E120"]
+
+
+@pytest.mark.parametrize("output_format", ["jsonl", "parquet"])
+def test_compaction_merges_sealed_segments_only(tmp_path, output_format):
+    if output_format == "parquet":
+        pytest.importorskip("pyarrow")
+    sink = ResultsSink(tmp_path, segment_bytes=1, flush_interval=60)
+    for name in ("E471", "E422"):
+        sink.append(record(name))
+        sink.flush()
+    # Still being written: left alone by the compaction
+    sink.segment_bytes = 10**6
+    sink.append(record("E120"))
+    sink.flush()
+
+    target = compact(tmp_path, output_format)
+    assert target.suffix == f".{output_format}"
+    assert list_segments(tmp_path) == [target]
+    assert compact(tmp_path, output_format) is None
+    sink.close()
+    assert [stored["product_name"] for stored in iter_records(tmp_path)] == ["E471", "E422", "E120"]
+
+
+def test_export_csv(sink, tmp_path):
+    sink.append(record("E471"))
+    sink.close()
+    output = tmp_path / "export.csv"
+    assert export_csv(output, tmp_path) == 1
+    with open(output, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert rows[0]["ingredients"] == "E471; Sugar"
+    assert rows[0]["statuses"] == "Doubtful; Halal"
@@ -0,0 +1,124 @@
+import asyncio
+from io import BytesIO
+
+import pytest
+import requests
+from aiohttp import FormData
+from aiohttp.test_utils import TestClient, TestServer
+from PIL import Image
+
+from src.api import service
+from src.utils.knowledge_base import KnowledgeBase
+
+RECORDS = {
+    name: {"name": name, "chem_name": "", "description": "", "status": status}
+    for name, status in {"sugar": "Halal", "gelatin": "Non-Halal", "e471": "Doubtful"}.items()
+}
+
+
+@pytest.fixture
+def logged(monkeypatch):
+    records = []
+    monkeypatch.setattr(service, "WARMUP_ENABLED", False)
+    monkeypatch.setattr(service, "log_result", lambda results, kb, product_name="": records.append(results))
+    monkeypatch.setattr(service, "previous_lookup", lambda kb: None)
+    monkeypatch.setattr(service, "local_classifier", lambda: None)
+    return records
+
+
+def call(method, path, api_key="sk-test", **kwargs):
+    """Send one request to a fresh app and return (status, JSON body)."""
+    async def run():
+        app = service.create_app(kb=KnowledgeBase(RECORDS, "v1"), api_key=api_key, workers=1)
+        async with TestClient(TestServer(app)) as client:
+            files = kwargs.pop("files", None)
+            if files:
+                kwargs["data"] = FormData()
+                for name, content in files.items():
+                    kwargs["data"].add_field(name, content, filename=f"{name}.png")
+            response = await client.request(method, path, **kwargs)
+            return response.status, await response.json()
+    return asyncio.run(run())
+
+
+def png_bytes():
+    buffer = BytesIO()
+    Image.new("RGB", (8, 8), "white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_text_lookup(logged):
+    status, body = call("POST", "/v1/classify/text", json={"ingredients": "sugar, gelatin"})
+    assert status == 200
+    assert body["product_status"] == "Non-Halal"
+    assert body["kb_version"] == "v1"
+    assert len(logged) == 1
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"data": "sugar, gelatin"},
+    {"json": ["sugar"]},
+    {"json": {"ingredients": "  "}},
+    {"json": {"text": "sugar"}},
+])
+def test_bad_text_request_is_400(logged, kwargs):
+    status, body = call("POST", "/v1/classify/text", **kwargs)
+    assert status == 400
+    assert "error" in body
+    assert logged == []
+
+
+def test_upstream_failure_is_502(logged, monkeypatch):
+    def fail(*args, **kwargs):
+        raise requests.exceptions.ConnectionError("connection reset")
+
+    monkeypatch.setattr(service, "analyze_ingredients_text", fail)
+    status, body = call("POST", "/v1/classify/text", json={"ingredients": "sugar, yeast", "explain_unknowns": True})
+    assert status == 502
+    assert "connection reset" in body["error"]
+
+
+def test_exhausted_budget_is_503(logged, monkeypatch):
+    def wait(*args, **kwargs):
+        raise service.SchedulerTimeout("Waited 1.0s for OpenAI rate-limit budget")
+
+    monkeypatch.setattr(service, "analyze_ingredients_text", wait)
+    status, _ = call("POST", "/v1/classify/text", json={"ingredients": "sugar, yeast", "explain_unknowns": True})
+    assert status == 503
+
+
+def test_missing_api_key_is_503_only_when_openai_is_needed(logged):
+    assert call("POST", "/v1/classify/text", api_key="", json={"ingredients": "sugar"})[0] == 200
+    assert call(
+        "POST", "/v1/classify/text", api_key="", json={"ingredients": "sugar", "explain_unknowns": True}
+    )[0] == 503
+
+
+@pytest.mark.parametrize("kwargs, expected", [
+    ({"data": b"", "headers": {"Content-Type": "image/png"}}, 400),
+    ({"data": b"not an image", "headers": {"Content-Type": "image/png"}}, 400),
+    ({"files": {"photo": b"x"}}, 400),
+    ({"data": b"sugar", "headers": {"Content-Type": "text/plain"}}, 415),
+])
+def test_bad_image_request_is_rejected_before_any_upstream_call(logged, monkeypatch, kwargs, expected):
+    monkeypatch.setattr(service, "analyze_image", lambda *args, **kwargs: pytest.fail("analysis must not run"))
+    status, body = call("POST", "/v1/classify/image", **kwargs)
+    assert status == expected
+    assert "error" in body
+
+
+def test_image_upstream_failure_is_502(logged, monkeypatch):
+    def fail(*args, **kwargs):
+        raise requests.exceptions.HTTPError("500 Server Error")
+
+    monkeypatch.setattr(service, "analyze_image", fail)
+    status, _ = call("POST", "/v1/classify/image", data=png_bytes(), headers={"Content-Type": "image/png"})
+    assert status == 502
+
+
+def test_enumber_lookup(logged):
+    status, body = call("GET", "/v1/enumbers/e471")
+    assert status == 200
+    assert (body["code"], body["status"]) == ("E471", "Doubtful")
+    assert call("GET", "/v1/enumbers/e999")[0] == 404
+    assert call("GET", "/v1/enumbers/gelatin")[0] == 400
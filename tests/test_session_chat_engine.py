@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("streamlit")
+
+from src.api.llama_index_handler import SessionChatEngine  # noqa: E402
+
+
+class Packing:
+    def fit_question(self, question):
+        return question[:10]
+
+
+class QueryEngine:
+    def __init__(self):
+        self.context_packing = Packing()
+        self.queries = []
+
+    def query(self, query):
+        self.queries.append(("query", query))
+        return SimpleNamespace(response="answer")
+
+    def retrieve(self, query_bundle):
+        self.queries.append(("retrieve", query_bundle.query_str))
+        return []
+
+    def synthesize(self, query_bundle, nodes):
+        self.queries.append(("synthesize", query_bundle.query_str))
+        return SimpleNamespace(response="answer")
+
+
+class LLM:
+    def __init__(self, answer):
+        self.answer = answer
+
+    def complete(self, prompt):
+        return SimpleNamespace(text=self.answer)
+
+
+def test_speculative_retrieval_fits_the_question():
+    query_engine = QueryEngine()
+    engine = SessionChatEngine(query_engine, LLM("Is it halal, really?"))
+    engine.memory.add_turn("Is gelatin halal?", "No.")
+    engine.chat("Is it halal, really?")
+    assert engine.last_turn_report["condense"] == "condensed (speculative retrieval kept)"
+    assert query_engine.queries == [("retrieve", "Is it hala"), ("synthesize", "Is it hala")]
+
+
+def test_engine_without_context_packing_sends_the_question_as_is():
+    query_engine = QueryEngine()
+    query_engine.context_packing = None
+    engine = SessionChatEngine(query_engine, LLM("Is it halal, really?"))
+    engine.memory.add_turn("Is gelatin halal?", "No.")
+    engine.chat("Is it halal, really?")
+    assert query_engine.queries[0] == ("retrieve", "Is it halal, really?")
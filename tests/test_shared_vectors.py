@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from src.utils import shared_vectors
+from src.utils.shared_vectors import (
+    SharedVectors, build_vectors, compile_vectors, load_shared_vector_store, map_vectors, read_header
+)
+
+EMBEDDINGS = {
+    "gelatin": [1.0, 0.0, 0.0],
+    "e471": [3.0, 4.0, 0.0],
+    "e120": [0.0, 0.0, 2.0],
+}
+
+
+def write_store(persist_dir, embeddings):
+    persist_dir.mkdir(exist_ok=True)
+    path = persist_dir / "default__vector_store.json"
+    path.write_text(json.dumps({"embedding_dict": embeddings}), encoding="utf-8")
+    return path
+
+
+@pytest.fixture(params=[True, False], ids=["numpy", "python"])
+def numpy_available(request, monkeypatch):
+    if request.param and not shared_vectors.NUMPY_AVAILABLE:
+        pytest.skip("numpy is not installed")
+    monkeypatch.setattr(shared_vectors, "NUMPY_AVAILABLE", request.param)
+    return request.param
+
+
+def test_rows_are_normalised_and_searched_by_cosine(numpy_available):
+    vectors = SharedVectors(build_vectors(EMBEDDINGS, "v1", generation=3))
+    assert (vectors.count, vectors.dimensions, vectors.version, vectors.generation) == (3, 3, "v1", 3)
+    assert vectors.ids == ["e120", "e471", "gelatin"]
+    assert vectors.vector(vectors.row("e471")) == pytest.approx([0.6, 0.8, 0.0])
+    assert vectors.row("curcumin") == -1
+
+    results = vectors.search([2.0, 0.0, 0.0], top_k=2)
+    assert [node_id for node_id, _ in results] == ["gelatin", "e471"]
+    assert [score for _, score in results] == pytest.approx([1.0, 0.6])
+    assert [node_id for node_id, _ in vectors.search([1.0, 0.0, 0.0], 5, node_ids=["e120", "e471"])] == [
+        "e471", "e120"
+    ]
+    with pytest.raises(ValueError):
+        vectors.search([1.0, 0.0], top_k=1)
+
+
+def test_mismatched_dimensions_are_rejected():
+    with pytest.raises(ValueError, match="dimensions, expected"):
+        build_vectors(dict(EMBEDDINGS, curcumin=[1.0, 0.0]), "v1")
+    with pytest.raises(ValueError):
+        SharedVectors(b"HVEC")
+
+
+def test_recompiling_bumps_the_generation(tmp_path):
+    source, out = write_store(tmp_path / "storage", EMBEDDINGS), tmp_path / "vectors.bin"
+    assert read_header(out) is None
+    assert compile_vectors(source, out, "v1")["generation"] == 1
+    report = compile_vectors(source, out, "v2")
+    assert report == {"rows": 3, "dimensions": 3, "bytes": out.stat().st_size, "generation": 2}
+    assert read_header(out) == {"format": 1, "rows": 3, "dimensions": 3, "version": "v2", "generation": 2}
+    mapped = map_vectors(out)
+    assert mapped.search([0.0, 0.0, 1.0], 1)[0][0] == "e120"
+    mapped.release()
+
+
+def test_store_is_recompiled_only_when_the_source_changes(tmp_path):
+    persist_dir, out = tmp_path / "storage", tmp_path / "vectors.bin"
+    assert load_shared_vector_store(persist_dir, out) is None
+
+    write_store(persist_dir, EMBEDDINGS)
+    store = load_shared_vector_store(persist_dir, out)
+    assert store.get("gelatin") == pytest.approx([1.0, 0.0, 0.0])
+    assert store.get("curcumin") is None
+    assert load_shared_vector_store(persist_dir, out).vectors.generation == 1
+
+    write_store(persist_dir, dict(EMBEDDINGS, curcumin=[0.0, 1.0, 0.0]))
+    store = load_shared_vector_store(persist_dir, out)
+    assert store.vectors.generation == 2
+    assert store.get("curcumin") == pytest.approx([0.0, 1.0, 0.0])
+    with pytest.raises(NotImplementedError):
+        store.add([])
@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.api import openai_handler
+from src.api.single_flight import AsyncSingleFlight, SingleFlight
+
+CALLERS = 5
+
+
+def run_threaded(flight, fn):
+    """Call the same key from CALLERS threads and collect each result or exception."""
+    outcomes = []
+
+    def call():
+        try:
+            outcomes.append(flight.do("key", fn))
+        except Exception as e:
+            outcomes.append(e)
+
+    with ThreadPoolExecutor(CALLERS) as pool:
+        for _ in range(CALLERS):
+            pool.submit(call)
+    return outcomes
+
+
+def blocking(release, calls, result):
+    def fn():
+        calls.append(1)
+        release.wait(2)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return fn
+
+
+def release_when_joined(flight, release):
+    def wait():
+        deadline = time.monotonic() + 2
+        while flight.stats()["coalesced"] < CALLERS - 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        release.set()
+    threading.Thread(target=wait).start()
+
+
+def test_threaded_callers_share_one_call():
+    flight, release, calls = SingleFlight(), threading.Event(), []
+    release_when_joined(flight, release)
+    assert run_threaded(flight, blocking(release, calls, "result")) == ["result"] * CALLERS
+    assert len(calls) == 1
+    assert flight.stats() == {"executed": 1, "coalesced": CALLERS - 1, "in_flight": 0}
+
+
+def test_threaded_error_reaches_every_waiter():
+    flight, release, calls = SingleFlight(), threading.Event(), []
+    error = ValueError("upstream failed")
+    release_when_joined(flight, release)
+    assert run_threaded(flight, blocking(release, calls, error)) == [error] * CALLERS
+    assert len(calls) == 1
+    # Nothing is cached: the next call runs again
+    assert flight.do("key", lambda: "fresh") == "fresh"
+
+
+def run_async(factory):
+    async def main():
+        flight, calls = AsyncSingleFlight(), []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return await factory()
+
+        outcomes = await asyncio.gather(
+            *(flight.do("key", call) for _ in range(CALLERS)), return_exceptions=True
+        )
+        return outcomes, calls, flight.stats()
+    return asyncio.run(main())
+
+
+def test_async_callers_share_one_call():
+    async def answer():
+        return "result"
+
+    outcomes, calls, stats = run_async(answer)
+    assert outcomes == ["result"] * CALLERS
+    assert len(calls) == 1
+    assert stats == {"executed": 1, "coalesced": CALLERS - 1, "in_flight": 0}
+
+
+def test_async_error_reaches_every_waiter():
+    error = ValueError("upstream failed")
+
+    async def fail():
+        raise error
+
+    outcomes, calls, _ = run_async(fail)
+    assert outcomes == [error] * CALLERS
+    assert len(calls) == 1
+
+
+class RecordingFlight:
+    def __init__(self):
+        self.keys = []
+
+    def do(self, key, fn):
+        self.keys.append(key)
+        return "answer"
+
+
+def test_callers_with_other_credentials_do_not_share_a_flight(monkeypatch):
+    flight = RecordingFlight()
+    monkeypatch.setattr(openai_handler, "openai_flights", flight)
+    for api_key, endpoint in [("sk-a", "https://a.test"), ("sk-b", "https://a.test"), ("sk-a", "https://b.test")]:
+        openai_handler.query_openai_about_ingredients(["yeast"], api_key, endpoint)
+    assert len(set(flight.keys)) == 3
+    # Only a digest of the credentials is kept
+    assert not any("sk-a" in str(key) for key in flight.keys)
@@ -0,0 +1,124 @@
+import json
+
+import pytest
+
+import src.utils.analysis as analysis
+from src.api import openai_handler
+from src.api.single_flight import SingleFlight
+from src.utils.call_planner import DETAIL_VERDICT
+from src.utils.ingredient_parser import format_ingredient_tree, ingredient_tree_from_json, parse_ingredient_tree
+
+LABEL = {"ingredients": [
+    {"name": "Sugar", "e_code": None, "sub_ingredients": []},
+    {"name": "Emulsifier", "e_code": "E322", "sub_ingredients": []},
+    {"name": "Chocolate", "e_code": None, "sub_ingredients": [
+        {"name": "cocoa butter", "e_code": None, "sub_ingredients": []},
+        {"name": "E-471", "e_code": "e471", "sub_ingredients": []},
+    ]},
+]}
+LOOKUP = {"sugar": "Halal", "e322": "Halal", "cocoa butter": "Halal", "e471": "Doubtful"}
+
+
+def outline(nodes):
+    return [(node.text, node.name, outline(node.children)) for node in nodes]
+
+
+@pytest.fixture
+def completion(monkeypatch):
+    """Answer OpenAI calls with a canned choice and record the payloads sent."""
+    payloads = []
+    monkeypatch.setattr(openai_handler, "openai_flights", SingleFlight())
+
+    def answer(choice):
+        def post(endpoint, headers, payload, estimated_tokens, priority):
+            payloads.append(payload)
+            return {"choices": [choice]}
+        monkeypatch.setattr(openai_handler, "post_chat_completion", post)
+        return payloads
+
+    return answer
+
+
+def extract():
+    return openai_handler.extract_ingredients_structured(b"photo", "sk-test", "https://api.test", "gpt-4o", 500)
+
+
+def test_e_codes_become_sub_ingredients_once():
+    tree = ingredient_tree_from_json(LABEL)
+    assert outline(tree) == [
+        ("sugar", "sugar", []),
+        ("emulsifier (e322)", "emulsifier", [("e322", "e322", [])]),
+        ("chocolate (cocoa butter, e471)", "chocolate", [
+            ("cocoa butter", "cocoa butter", []),
+            ("e471", "e471", []),
+        ]),
+    ]
+    # The formatted text parses back to the same entries
+    assert outline(parse_ingredient_tree(format_ingredient_tree(tree))) == outline(tree)
+
+
+@pytest.mark.parametrize("data", [
+    [],
+    {"ingredients": "sugar, salt"},
+    {"ingredients": ["sugar"]},
+    {"ingredients": [{"name": 3, "e_code": None, "sub_ingredients": []}]},
+    {"ingredients": [{"name": "sugar", "e_code": None, "sub_ingredients": "salt"}]},
+])
+def test_answers_not_matching_the_schema_are_rejected(data):
+    with pytest.raises(ValueError):
+        ingredient_tree_from_json(data)
+
+
+def test_deep_nesting_is_rejected():
+    item = {"name": "salt", "e_code": None, "sub_ingredients": []}
+    for _ in range(6):
+        item = {"name": "mix", "e_code": None, "sub_ingredients": [item]}
+    with pytest.raises(ValueError, match="nested"):
+        ingredient_tree_from_json({"ingredients": [item]})
+
+
+def test_structured_extraction_asks_for_the_schema(completion):
+    payloads = completion({"message": {"content": json.dumps(LABEL)}, "finish_reason": "stop"})
+    assert [node.name for node in extract()] == ["sugar", "emulsifier", "chocolate"]
+    assert payloads[0]["response_format"] == openai_handler.INGREDIENTS_RESPONSE_FORMAT
+    assert payloads[0]["messages"][0]["content"][0]["text"] == openai_handler.STRUCTURED_EXTRACTION_PROMPT
+
+
+@pytest.mark.parametrize("choice, message", [
+    ({"message": {"content": '{"ingredients": [{"na'}, "finish_reason": "length"}, "cut off at 500"),
+    ({"message": {"content": None, "refusal": "I can't help with that."}, "finish_reason": "stop"}, "refused"),
+    ({"message": {"content": "sugar, salt"}, "finish_reason": "stop"}, "Expecting value"),
+])
+def test_unusable_answers_raise_value_error(completion, choice, message):
+    completion(choice)
+    # json.JSONDecodeError is a ValueError too
+    with pytest.raises(ValueError, match=message):
+        extract()
+
+
+def test_image_analysis_uses_the_tree_without_reparsing(monkeypatch):
+    monkeypatch.setattr(analysis, "extract_ingredients_structured", lambda *args, **kwargs: ingredient_tree_from_json(LABEL))
+    monkeypatch.setattr(analysis, "extract_ingredients_from_image", lambda *args, **kwargs: pytest.fail("text extraction"))
+    monkeypatch.setattr(analysis, "parse_ingredient_tree", lambda text: pytest.fail("reparsed"))
+    monkeypatch.setattr(analysis, "NESTED_INGREDIENTS", True)
+    results = analysis.analyze_image(
+        b"photo", LOOKUP, "", "", "gpt-4o", 300, detail=DETAIL_VERDICT, structured=True
+    )
+    assert results["structured_extraction"] is True
+    assert results["ingredients_text"] == "sugar, emulsifier (e322), chocolate (cocoa butter, e471)"
+    assert results["ingredient_statuses"]["chocolate (cocoa butter, e471)"] == "Doubtful"
+    assert results["product_status"] == "Non-Halal"
+
+
+def test_image_analysis_falls_back_to_text_extraction(monkeypatch):
+    def invalid(*args, **kwargs):
+        raise ValueError("Expected an object with an 'ingredients' array")
+
+    monkeypatch.setattr(analysis, "extract_ingredients_structured", invalid)
+    monkeypatch.setattr(analysis, "extract_ingredients_from_image", lambda *args, **kwargs: "sugar, e322")
+    results = analysis.analyze_image(
+        b"photo", LOOKUP, "", "", "gpt-4o", 300, detail=DETAIL_VERDICT, structured=True
+    )
+    assert results["structured_extraction"] is False
+    assert results["ingredients_text"] == "sugar, e322"
+    assert results["product_status"] == "Halal"
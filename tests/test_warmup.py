@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from src.utils.warmup import FAILED, PENDING, READY, Warmup, read_status
+
+
+def failing():
+    raise RuntimeError("index missing")
+
+
+def test_required_components_gate_readiness():
+    release = threading.Event()
+    warmup = Warmup(ready_components=["knowledge_base", "query_engine", "not_registered"])
+    warmup.add("knowledge_base", lambda: None).add("query_engine", release.wait)
+    assert warmup.state("query_engine") == PENDING
+    warmup.start()
+    assert warmup.wait("knowledge_base", timeout=5)
+    assert not warmup.wait("query_engine", timeout=0.05)
+    assert warmup.is_ready("knowledge_base")
+    assert not warmup.is_ready()
+    assert warmup.is_live()
+
+    release.set()
+    assert warmup.wait("query_engine", timeout=5)
+    # Components this process doesn't register don't hold readiness back
+    assert warmup.is_ready()
+    assert warmup.status()["required"] == ["knowledge_base", "query_engine"]
+    assert warmup.state("not_registered") is None
+
+
+def test_failed_component_is_reported(capsys):
+    warmup = Warmup(ready_components=["knowledge_base"])
+    warmup.add("classifier", failing).add("knowledge_base", failing).start()
+    assert not warmup.wait("knowledge_base", timeout=5)
+    components = warmup.status()["components"]
+    assert components["knowledge_base"]["state"] == FAILED
+    assert components["knowledge_base"]["error"] == "RuntimeError: index missing"
+    assert not warmup.is_live()
+    assert "Error warming up knowledge_base: index missing" in capsys.readouterr().out
+
+
+def test_optional_failure_keeps_the_process_live():
+    warmup = Warmup(ready_components=["knowledge_base"])
+    warmup.add("knowledge_base", lambda: None).add("classifier", failing).start()
+    warmup.wait("classifier", timeout=5)
+    assert warmup.state("classifier") == FAILED
+    assert warmup.is_live() and warmup.is_ready()
+
+
+def test_status_file_follows_the_components(tmp_path):
+    path = tmp_path / "warmup_status.json"
+    warmup = Warmup(ready_components=["knowledge_base"], status_file=path)
+    warmup.add("knowledge_base", lambda: None).start()
+    warmup.wait("knowledge_base", timeout=5)
+    status = read_status(path)
+    assert status["ready"] and status["live"]
+    assert status["pid"] == os.getpid()
+    assert status["components"]["knowledge_base"]["state"] == READY
+    assert read_status(tmp_path / "missing.json") is None
+
+
+def test_status_of_an_exited_process_is_not_live(tmp_path):
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    path = tmp_path / "warmup_status.json"
+    path.write_text(json.dumps({"ready": True, "live": True, "pid": exited.pid}), encoding="utf-8")
+    status = read_status(path)
+    assert status["ready"] is False and status["live"] is False
+
+
+@pytest.mark.parametrize("check, expected", [("--ready", 1), ("--live", 0)])
+def test_probe_exit_status(tmp_path, check, expected):
+    path = tmp_path / "warmup_status.json"
+    path.write_text(json.dumps({"ready": False, "live": True, "pid": os.getpid()}), encoding="utf-8")
+    probe = subprocess.run(
+        [sys.executable, "-m", "src.utils.warmup", "probe", check, "--status-file", str(path)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    assert probe.returncode == expected